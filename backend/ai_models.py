@@ -6,7 +6,8 @@ from transformers import (
     pipeline, BartTokenizer, BartForConditionalGeneration,
     T5Tokenizer, T5ForConditionalGeneration,
     GPT2LMHeadModel, GPT2Tokenizer,
-    AutoModelForSeq2SeqLM
+    AutoModelForSeq2SeqLM,
+    StoppingCriteria, StoppingCriteriaList
 )
 from diffusers import StableDiffusionPipeline, DiffusionPipeline, AutoPipelineForText2Image
 import matplotlib.pyplot as plt
@@ -19,26 +20,51 @@ import base64
 import json
 import re
 import requests
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, List, Optional, Any
 import warnings
 import time
 import os
+import logging
 from datetime import datetime
 import tempfile
+from query_analyzer import KEYWORD_ENGINE
+from profiling import PROFILER
+from model_memory import resolve_model_dtypes, rss_bytes, module_memory
+from visual_router import VisualRouter
+from cancellation import CANCELLATION, CancelToken
+from load_governor import FULL, SKIP_ELABORATION, KEYWORD_CLASSIFICATION, GREEDY_DECODING, DEFER_VISUALS, level_name
+from structured_logging import get_logger, log_event
 warnings.filterwarnings('ignore')
 
+# Per-request events; startup progress still goes to stdout
+logger = get_logger("ai_models")
+
+class CancelStoppingCriteria(StoppingCriteria):
+    """Ends generate() at the next step once the request's cancel token trips"""
+    
+    def __init__(self, cancel_token: CancelToken):
+        self.cancel_token = cancel_token
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        return self.cancel_token.cancelled
+
 class AdvancedClassroomAI:
     """
     Advanced AI Assistant for Classrooms using high-quality pre-trained models
     Optimized for CPU inference with better model choices
     """
     
-    def __init__(self, device='cpu', save_images=True, display_images=True):
+    def __init__(self, device='cpu', save_images=True, display_images=True, conversation_store=None,
+                 model_dtypes: Optional[Dict[str, str]] = None, num_threads: int = 2):
         self.device = device
         self.conversation_history = []
+        self.conversation_store = conversation_store  # Optional durable log (see conversation_store.py)
         self.save_images = save_images
         self.display_images = display_images
         self.models_ready = False  # Initialize as False
+        self.model_dtypes = model_dtypes or resolve_model_dtypes()  # Weight precision per model key
+        self.model_memory = {}  # Per-model parameter/buffer bytes and RSS delta at load
+        self.visual_router = VisualRouter()  # Exact plots/charts/geometry without diffusion
         
         # Create directories for saving images
         if self.save_images:
@@ -50,7 +76,7 @@ class AdvancedClassroomAI:
         print("🚀 Loading state-of-the-art models...")
         
         if self.device == 'cpu':
-            torch.set_num_threads(2)  
+            torch.set_num_threads(num_threads)  # Replicas pass the size of their core set
             torch.set_grad_enabled(False)  
         
         # Initialize models with error handling
@@ -79,14 +105,16 @@ class AdvancedClassroomAI:
         
         try:
             print("📝 Loading advanced text generation model...")
+            rss_before = rss_bytes()
             self.text_tokenizer = T5Tokenizer.from_pretrained('google/flan-t5-base')
             self.text_model = T5ForConditionalGeneration.from_pretrained(
                 'google/flan-t5-base',
-                torch_dtype=torch.float32,
+                torch_dtype=self._torch_dtype('text'),
                 device_map=None
             )
             self.text_model.to(self.device)
             self.text_model.eval()
+            self._record_model_memory('text', self.text_model, rss_before)
             print("✅ Text generation model loaded")
             
         except Exception as e:
@@ -95,10 +123,11 @@ class AdvancedClassroomAI:
         
         try:
             print("🧠 Loading conversational AI model...")
+            rss_before = rss_bytes()
             self.chat_tokenizer = AutoTokenizer.from_pretrained('microsoft/DialoGPT-medium')
             self.chat_model = AutoModelForCausalLM.from_pretrained(
                 'microsoft/DialoGPT-medium',
-                torch_dtype=torch.float32,
+                torch_dtype=self._torch_dtype('chat'),
                 device_map=None
             )
             self.chat_model.to(self.device)
@@ -106,6 +135,7 @@ class AdvancedClassroomAI:
             
             if self.chat_tokenizer.pad_token is None:
                 self.chat_tokenizer.pad_token = self.chat_tokenizer.eos_token
+            self._record_model_memory('chat', self.chat_model, rss_before)
             print("✅ Conversational AI model loaded")
             
         except Exception as e:
@@ -113,12 +143,14 @@ class AdvancedClassroomAI:
         
         try:
             print("🔍 Loading subject classification model...")
+            rss_before = rss_bytes()
             self.subject_classifier = pipeline(
                 "zero-shot-classification",
                 model="microsoft/deberta-v3-base",
                 device=-1,
-                torch_dtype=torch.float32
+                torch_dtype=self._torch_dtype('classifier')
             )
+            self._record_model_memory('classifier', self.subject_classifier, rss_before)
             print("✅ Subject classifier loaded")
             
         except Exception as e:
@@ -126,12 +158,14 @@ class AdvancedClassroomAI:
         
         try:
             print("❓ Loading question-answering model...")
+            rss_before = rss_bytes()
             self.qa_pipeline = pipeline(
                 "question-answering",
                 model="deepset/roberta-base-squad2",
                 device=-1,
-                torch_dtype=torch.float32
+                torch_dtype=self._torch_dtype('qa')
             )
+            self._record_model_memory('qa', self.qa_pipeline, rss_before)
             print("✅ QA pipeline loaded")
             
         except Exception as e:
@@ -139,12 +173,14 @@ class AdvancedClassroomAI:
         
         try:
             print("📊 Loading text summarization model...")
+            rss_before = rss_bytes()
             self.summarizer = pipeline(
                 "summarization",
                 model="facebook/bart-base",
                 device=-1,
-                torch_dtype=torch.float32
+                torch_dtype=self._torch_dtype('summarizer')
             )
+            self._record_model_memory('summarizer', self.summarizer, rss_before)
             print("✅ Summarizer loaded")
             
         except Exception as e:
@@ -152,13 +188,15 @@ class AdvancedClassroomAI:
         
         try:
             print("🎨 Loading image generation model...")
+            rss_before = rss_bytes()
             self.image_pipeline = AutoPipelineForText2Image.from_pretrained(
                 "runwayml/stable-diffusion-v1-5",
-                torch_dtype=torch.float32,
+                torch_dtype=self._torch_dtype('image'),
                 use_safetensors=True,
                 variant=None
             )
             self.image_pipeline = self.image_pipeline.to(self.device)
+            self._record_model_memory('image', self.image_pipeline, rss_before)
             print("✅ Image generation model loaded")
             
         except Exception as e:
@@ -166,13 +204,15 @@ class AdvancedClassroomAI:
         
         try:
             print("🖼 Loading image captioning model...")
+            rss_before = rss_bytes()
             self.image_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
             self.image_caption_model = BlipForConditionalGeneration.from_pretrained(
                 "Salesforce/blip-image-captioning-base",
-                torch_dtype=torch.float32
+                torch_dtype=self._torch_dtype('caption')
             )
             self.image_caption_model.to(self.device)
             self.image_caption_model.eval()
+            self._record_model_memory('caption', self.image_caption_model, rss_before)
             print("✅ Image captioning model loaded")
             
         except Exception as e:
@@ -189,160 +229,178 @@ class AdvancedClassroomAI:
         
         print("✅ Model setup completed!")
     
-    def analyze_educational_query(self, query: str) -> Dict[str, Any]:
+    def _torch_dtype(self, model_key: str) -> torch.dtype:
+        """Configured weight precision for a model (see model_memory.resolve_model_dtypes)"""
+        return getattr(torch, self.model_dtypes.get(model_key, 'float32'))
+    
+    def _record_model_memory(self, model_key: str, model, rss_before: int):
+        """Parameter/buffer bytes of a freshly loaded model and how much RSS it added"""
+        try:
+            self.model_memory[model_key] = {
+                **module_memory(model),
+                'rss_delta_bytes': rss_bytes() - rss_before,
+                'configured_dtype': self.model_dtypes.get(model_key, 'float32')
+            }
+        except Exception as e:
+            print(f"⚠️ Could not measure {model_key} model memory: {e}")
+    
+    def analyze_educational_query(self, query: str, use_classifier: bool = True,
+                                  cancel_token: Optional[CancelToken] = None) -> Dict[str, Any]:
         """Advanced query analysis using AI models with fallback"""
         
-        print(f"🔍 Analyzing query: {query}")
+        log_event(logger, "query.analyzing", logging.DEBUG, query=query, use_classifier=use_classifier)
         
         try:
+            # One keyword pass yields every rule-based feature
+            features = KEYWORD_ENGINE.scan(query)
+            
             # Use AI classification if available
-            if self.subject_classifier is not None:
-                subjects = [
-                    'mathematics', 'physics', 'chemistry', 'biology', 'history', 
-                    'geography', 'literature', 'computer science', 'economics',
-                    'psychology', 'philosophy', 'art', 'music', 'environmental science'
-                ]
-                
-                classification_result = self.subject_classifier(query, subjects)
+            if use_classifier and self.subject_classifier is not None:
+                with PROFILER.section("subject_classifier"), CANCELLATION.stage("subject_classifier", cancel_token):
+                    classification_result = self.subject_classifier(query, self.SUBJECT_LABELS)
                 subject = classification_result['labels'][0]
                 confidence = classification_result['scores'][0]
             else:
                 # Fallback to keyword-based classification
-                subject, confidence = self._fallback_subject_classification(query)
-            
-            # Query type analysis
-            query_lower = query.lower()
-            
-            if any(word in query_lower for word in ['explain', 'what is', 'define', 'describe', 'tell me about']):
-                query_type = 'explanation'
-            elif any(word in query_lower for word in ['solve', 'calculate', 'find', 'compute']):
-                query_type = 'problem_solving'
-            elif any(word in query_lower for word in ['compare', 'difference', 'versus', 'vs', 'contrast']):
-                query_type = 'comparison'
-            elif any(word in query_lower for word in ['show', 'draw', 'create', 'generate', 'visualize']):
-                query_type = 'visualization'
-            elif any(word in query_lower for word in ['how to', 'steps', 'procedure', 'process']):
-                query_type = 'tutorial'
-            else:
-                query_type = 'general'
-            
-            needs_visual = any(word in query_lower for word in [
-                'show', 'draw', 'diagram', 'chart', 'graph', 'visual', 'picture', 
-                'image', 'illustrate', 'create image', 'generate picture'
-            ])
-            
-            analysis = {
-                'subject': subject,
-                'confidence': confidence,
-                'query_type': query_type,
-                'needs_visual': needs_visual,
-                'complexity': self._assess_complexity(query),
-                'educational_level': self._determine_educational_level(query)
-            }
+                subject, confidence = features['subject'], features['subject_confidence']
+            
+            analysis = self._analysis_from_features(features, subject, confidence)
             
-            print(f"✅ Analysis completed: {analysis}")
+            log_event(logger, "query.analyzed", logging.DEBUG, **analysis)
             return analysis
             
         except Exception as e:
-            print(f"⚠️ Analysis error: {e}, using fallback analysis")
-            return self._fallback_analysis(query)
+            log_event(logger, "query.analysis_failed", logging.WARNING, error=str(e), fallback="keywords")
+            return self.fallback_analysis(query)
     
-    def _fallback_subject_classification(self, query: str) -> Tuple[str, float]:
-        """Fallback subject classification using keywords"""
-        query_lower = query.lower()
-        
-        subject_keywords = {
-            'mathematics': ['math', 'equation', 'number', 'calculate', 'algebra', 'geometry', 'calculus'],
-            'physics': ['force', 'energy', 'motion', 'wave', 'particle', 'gravity', 'physics'],
-            'chemistry': ['chemical', 'molecule', 'atom', 'reaction', 'compound', 'element'],
-            'biology': ['cell', 'organism', 'dna', 'genetics', 'evolution', 'biology'],
-            'history': ['historical', 'past', 'ancient', 'war', 'civilization', 'century'],
-            'geography': ['country', 'continent', 'climate', 'map', 'location', 'geography'],
-            'literature': ['poem', 'story', 'novel', 'author', 'literature', 'writing'],
-            'computer science': ['code', 'program', 'algorithm', 'computer', 'software', 'data']
-        }
-        
-        scores = {}
-        for subject, keywords in subject_keywords.items():
-            score = sum(1 for keyword in keywords if keyword in query_lower)
-            if score > 0:
-                scores[subject] = score / len(keywords)
-        
-        if scores:
-            best_subject = max(scores, key=scores.get)
-            return best_subject, scores[best_subject]
-        else:
-            return 'general', 0.5
+    # Candidate labels for the zero-shot subject classifier
+    SUBJECT_LABELS = [
+        'mathematics', 'physics', 'chemistry', 'biology', 'history', 
+        'geography', 'literature', 'computer science', 'economics',
+        'psychology', 'philosophy', 'art', 'music', 'environmental science'
+    ]
     
-    def _assess_complexity(self, query: str) -> str:
-        """Assess query complexity"""
-        query_lower = query.lower()
-        
-        advanced_terms = ['theorem', 'hypothesis', 'methodology', 'analysis', 'synthesis', 'evaluation']
-        intermediate_terms = ['process', 'relationship', 'comparison', 'function', 'structure']
-        basic_terms = ['what', 'who', 'when', 'where', 'simple', 'basic']
-        
-        if any(term in query_lower for term in advanced_terms):
-            return 'advanced'
-        elif any(term in query_lower for term in intermediate_terms):
-            return 'intermediate'
-        else:
-            return 'basic'
-    
-    def _determine_educational_level(self, query: str) -> str:
-        """Determine appropriate educational level"""
-        query_lower = query.lower()
-        
-        if any(term in query_lower for term in ['university', 'college', 'advanced', 'research']):
-            return 'university'
-        elif any(term in query_lower for term in ['high school', 'secondary', 'algebra', 'calculus']):
-            return 'high_school'
-        elif any(term in query_lower for term in ['middle school', 'junior', 'basic']):
-            return 'middle_school'
-        else:
-            return 'general'
-    
-    def _fallback_analysis(self, query: str) -> Dict[str, Any]:
-        """Fallback analysis when AI models fail"""
-        subject, confidence = self._fallback_subject_classification(query)
-        
+    def _analysis_from_features(self, features: Dict[str, Any], subject: str, confidence: float) -> Dict[str, Any]:
+        """Assemble the analysis dict from keyword features and the chosen subject"""
         return {
             'subject': subject,
             'confidence': confidence,
+            'query_type': features['query_type'],
+            'needs_visual': features['needs_visual'],
+            'complexity': features['complexity'],
+            'educational_level': features['educational_level']
+        }
+    
+    def fallback_analysis(self, query: str) -> Dict[str, Any]:
+        """Keyword-only analysis, used when the models fail or are unavailable"""
+        features = KEYWORD_ENGINE.scan(query)
+        
+        return {
+            'subject': features['subject'],
+            'confidence': features['subject_confidence'],
             'query_type': 'explanation',
-            'needs_visual': 'visual' in query.lower() or 'show' in query.lower(),
-            'complexity': self._assess_complexity(query),
-            'educational_level': self._determine_educational_level(query)
+            'needs_visual': features['fallback_needs_visual'],
+            'complexity': features['complexity'],
+            'educational_level': features['educational_level']
         }
     
-    def generate_educational_response(self, query: str, analysis: Dict[str, Any]) -> str:
+    def generate_educational_response(self, query: str, analysis: Dict[str, Any], degradation: int = FULL,
+                                      cancel_token: Optional[CancelToken] = None) -> str:
         """Generate educational response with fallback options"""
         
         try:
             # Try to use AI models if available
             if self.text_tokenizer is not None and self.text_model is not None:
-                return self._generate_ai_response(query, analysis)
+                return self._generate_ai_response(query, analysis, degradation, cancel_token)
             else:
-                print("⚠️ AI models not available, using fallback response")
+                log_event(logger, "response.fallback", logging.WARNING, reason="text model not loaded")
                 return self._generate_fallback_response(query, analysis)
                 
         except Exception as e:
-            print(f"❌ Response generation error: {e}")
+            log_event(logger, "response.failed", logging.ERROR, error=str(e), exc_info=True)
             return self._generate_fallback_response(query, analysis)
     
-    def _generate_ai_response(self, query: str, analysis: Dict[str, Any]) -> str:
+    # Prompt template per query type; queries sharing a template are batched together
+    PROMPT_TEMPLATES = {
+        'explanation': "Explain in detail for {educational_level} students: {query}",
+        'problem_solving': "Solve this {subject} problem step by step: {query}",
+        'comparison': "Compare and contrast the following for students: {query}",
+        'tutorial': "Provide a step-by-step tutorial for: {query}",
+        'general': "Provide a comprehensive educational answer about: {query}"
+    }
+    
+    def _prompt_template_key(self, analysis: Dict[str, Any]) -> str:
+        """Template used for a query type (visualization and unknown types use 'general')"""
+        query_type = analysis.get('query_type', 'general')
+        return query_type if query_type in self.PROMPT_TEMPLATES else 'general'
+    
+    def _build_prompt(self, query: str, analysis: Dict[str, Any]) -> str:
+        """Fill in the prompt template for this query"""
+        template = self.PROMPT_TEMPLATES[self._prompt_template_key(analysis)]
+        return template.format(
+            query=query,
+            subject=analysis.get('subject', 'general'),
+            educational_level=analysis.get('educational_level', 'general')
+        )
+    
+    def _text_generation_kwargs(self, greedy: bool = False) -> Dict[str, Any]:
+        """Decoding settings for the text model (greedy under heavy load)"""
+        if greedy:
+            return dict(
+                max_length=300,
+                min_length=50,
+                num_beams=1,
+                do_sample=False,
+                repetition_penalty=2.0,
+                pad_token_id=self.text_tokenizer.eos_token_id
+            )
+        return dict(
+            max_length=300,
+            min_length=50,
+            num_beams=4,
+            temperature=0.7,
+            do_sample=True,
+            top_p=0.9,
+            repetition_penalty=2.0,
+            early_stopping=True,
+            pad_token_id=self.text_tokenizer.eos_token_id
+        )
+    
+    def generation_params(self) -> Dict[str, Any]:
+        """Everything besides the query that shapes an answer (keys coalesced requests)"""
+        params = {
+            'model_dtypes': self.model_dtypes,
+            'text_model': self.text_model is not None,
+            'chat_model': self.chat_model is not None,
+            'image_pipeline': self.image_pipeline is not None
+        }
+        if self.text_tokenizer is not None:
+            params['decoding'] = self._text_generation_kwargs()
+        return params
+    
+    def _finalize_response(self, query: str, prompt: str, response: str, elaborate: bool = True,
+                           cancel_token: Optional[CancelToken] = None) -> str:
+        """Clean up a decoded answer and elaborate on it if it is too short"""
+        # Remove repetitive phrases and clean up
+        response = response.replace(prompt, "").strip()
+        response = self._remove_repetition(response)
+        
+        if elaborate and len(response) < 100:
+            response = self._enhance_with_conversational_model(query, response, cancel_token)
+        
+        return response
+    
+    def _stopping_criteria(self, cancel_token: Optional[CancelToken]) -> Optional[StoppingCriteriaList]:
+        """Stop generate() at the next step once the request is cancelled"""
+        if cancel_token is None:
+            return None
+        return StoppingCriteriaList([CancelStoppingCriteria(cancel_token)])
+    
+    def _generate_ai_response(self, query: str, analysis: Dict[str, Any], degradation: int = FULL,
+                              cancel_token: Optional[CancelToken] = None) -> str:
         """Generate response using AI models"""
         
-        if analysis['query_type'] == 'explanation':
-            prompt = f"Explain in detail for {analysis['educational_level']} students: {query}"
-        elif analysis['query_type'] == 'problem_solving':
-            prompt = f"Solve this {analysis['subject']} problem step by step: {query}"
-        elif analysis['query_type'] == 'comparison':
-            prompt = f"Compare and contrast the following for students: {query}"
-        elif analysis['query_type'] == 'tutorial':
-            prompt = f"Provide a step-by-step tutorial for: {query}"
-        else:
-            prompt = f"Provide a comprehensive educational answer about: {query}"
+        prompt = self._build_prompt(query, analysis)
         
         tokenized = self.text_tokenizer(
             prompt,
@@ -356,30 +414,88 @@ class AdvancedClassroomAI:
         inputs = tokenized['input_ids'].to(self.device)
         attention_mask = tokenized['attention_mask'].to(self.device)
         
-        with torch.no_grad():
+        with torch.no_grad(), PROFILER.section("text_model.generate"), CANCELLATION.stage("text_model.generate", cancel_token):
             outputs = self.text_model.generate(
                 inputs,
                 attention_mask=attention_mask,  # Pass attention mask
-                max_length=300,
-                min_length=50,
-                num_beams=4,
-                temperature=0.7,
-                do_sample=True,
-                top_p=0.9,
-                repetition_penalty=2.0,
-                early_stopping=True,
-                pad_token_id=self.text_tokenizer.eos_token_id
+                stopping_criteria=self._stopping_criteria(cancel_token),
+                **self._text_generation_kwargs(greedy=degradation >= GREEDY_DECODING)
             )
         
         response = self.text_tokenizer.decode(outputs[0], skip_special_tokens=True)
-        # Remove repetitive phrases and clean up
-        response = response.replace(prompt, "").strip()
-        response = self._remove_repetition(response)
+        return self._finalize_response(query, prompt, response, degradation < SKIP_ELABORATION, cancel_token)
+    
+    def analyze_educational_queries(self, queries: List[str]) -> List[Dict[str, Any]]:
+        """Analyze many queries at once: one keyword pass and one batched classifier call"""
         
-        if len(response) < 100:
-            response = self._enhance_with_conversational_model(query, response)
+        features = KEYWORD_ENGINE.scan_many(queries)
+        subjects = [(f['subject'], f['subject_confidence']) for f in features]
         
-        return response
+        if self.subject_classifier is not None and queries:
+            try:
+                with PROFILER.section("subject_classifier.batch"):
+                    results = self.subject_classifier(queries, self.SUBJECT_LABELS, batch_size=8)
+                if isinstance(results, dict):
+                    results = [results]
+                subjects = [(r['labels'][0], r['scores'][0]) for r in results]
+            except Exception as e:
+                log_event(logger, "batch.classification_failed", logging.WARNING, error=str(e), fallback="keywords")
+        
+        return [
+            self._analysis_from_features(f, subject, confidence)
+            for f, (subject, confidence) in zip(features, subjects)
+        ]
+    
+    def generate_educational_responses(self, queries: List[str], analyses: List[Dict[str, Any]],
+                                       batch_size: int = 8, degradation: int = FULL):
+        """
+        Generate answers for many queries in padded batches.
+        Queries are grouped by prompt template and sorted by length within a
+        group to keep padding low. Yields (index, response) as each batch finishes.
+        `degradation` applies the load governor's decoding and elaboration cuts.
+        """
+        
+        if self.text_tokenizer is None or self.text_model is None:
+            for i, (query, analysis) in enumerate(zip(queries, analyses)):
+                yield i, self._generate_fallback_response(query, analysis)
+            return
+        
+        prompts = [self._build_prompt(q, a) for q, a in zip(queries, analyses)]
+        
+        groups: Dict[str, List[int]] = {}
+        for i, analysis in enumerate(analyses):
+            groups.setdefault(self._prompt_template_key(analysis), []).append(i)
+        
+        for indices in groups.values():
+            indices.sort(key=lambda i: len(prompts[i]))
+            for start in range(0, len(indices), batch_size):
+                batch = indices[start:start + batch_size]
+                try:
+                    tokenized = self.text_tokenizer(
+                        [prompts[i] for i in batch],
+                        return_tensors='pt',
+                        max_length=512,
+                        truncation=True,
+                        padding=True,
+                        return_attention_mask=True
+                    )
+                    
+                    with torch.no_grad(), PROFILER.section("text_model.generate_batch"):
+                        outputs = self.text_model.generate(
+                            tokenized['input_ids'].to(self.device),
+                            attention_mask=tokenized['attention_mask'].to(self.device),
+                            **self._text_generation_kwargs(greedy=degradation >= GREEDY_DECODING)
+                        )
+                    
+                    decoded = self.text_tokenizer.batch_decode(outputs, skip_special_tokens=True)
+                    for i, response in zip(batch, decoded):
+                        yield i, self._finalize_response(queries[i], prompts[i], response,
+                                                         degradation < SKIP_ELABORATION)
+                        
+                except Exception as e:
+                    log_event(logger, "batch.generation_failed", logging.ERROR, error=str(e), batch_size=len(batch))
+                    for i in batch:
+                        yield i, self._generate_fallback_response(queries[i], analyses[i])
     
     def _remove_repetition(self, text: str) -> str:
         """Remove repetitive phrases from generated text"""
@@ -395,7 +511,8 @@ class AdvancedClassroomAI:
         
         return '. '.join(unique_sentences)
     
-    def _enhance_with_conversational_model(self, query: str, base_response: str) -> str:
+    def _enhance_with_conversational_model(self, query: str, base_response: str,
+                                           cancel_token: Optional[CancelToken] = None) -> str:
         """Enhance response using conversational model"""
         try:
             if self.chat_tokenizer is None or self.chat_model is None:
@@ -415,10 +532,11 @@ class AdvancedClassroomAI:
             inputs = tokenized['input_ids'].to(self.device)
             attention_mask = tokenized['attention_mask'].to(self.device)
             
-            with torch.no_grad():
+            with torch.no_grad(), PROFILER.section("chat_model.generate"), CANCELLATION.stage("chat_model.generate", cancel_token):
                 outputs = self.chat_model.generate(
                     inputs,
                     attention_mask=attention_mask,  # Pass attention mask
+                    stopping_criteria=self._stopping_criteria(cancel_token),
                     max_length=inputs.shape[1] + 100,
                     num_beams=3,
                     temperature=0.8,
@@ -433,7 +551,7 @@ class AdvancedClassroomAI:
             return f"{base_response}\n\n{enhanced.strip()}"
             
         except Exception as e:
-            print(f"⚠️ Enhancement failed: {e}")
+            log_event(logger, "response.elaboration_failed", logging.WARNING, error=str(e))
             return base_response
     
     def _generate_fallback_response(self, query: str, analysis: Dict[str, Any]) -> str:
@@ -459,39 +577,103 @@ class AdvancedClassroomAI:
         else:
             return f"I understand you're asking about {subject}. This is a {complexity}-level question that I'll help you understand. Let me provide you with a comprehensive explanation that covers the key concepts and helps you grasp the fundamental principles involved."
     
-    def generate_educational_visual(self, query: str, analysis: Dict[str, Any]) -> Optional[Image.Image]:
+    def answer_from_passages(self, question: str, passages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Extract an answer span from retrieved passages with one batched QA pipeline call"""
+        
+        if not passages:
+            return {'answer': None, 'score': 0.0, 'source': None}
+        
+        if self.qa_pipeline is None:
+            # No QA model: fall back to the opening of the best passage
+            best = passages[0]
+            return {'answer': ' '.join(best['text'].split()[:60]), 'score': best.get('score', 0.0), 'source': best}
+        
+        try:
+            with PROFILER.section("qa_pipeline"):
+                results = self.qa_pipeline(
+                    question=[question] * len(passages),
+                    context=[p['text'] for p in passages],
+                    batch_size=len(passages),
+                    handle_impossible_answer=True
+                )
+            if isinstance(results, dict):
+                results = [results]
+            
+            best_index = max(range(len(results)), key=lambda i: results[i]['score'])
+            best = results[best_index]
+            return {'answer': best['answer'] or None, 'score': float(best['score']), 'source': passages[best_index]}
+            
+        except Exception as e:
+            log_event(logger, "qa.extraction_failed", logging.WARNING, error=str(e))
+            best = passages[0]
+            return {'answer': ' '.join(best['text'].split()[:60]), 'score': best.get('score', 0.0), 'source': best}
+    
+    def caption_preprocess_config(self) -> Dict[str, Any]:
+        """Resize and normalization settings the captioning model expects"""
+        config = self.image_processor.image_processor
+        size = config.size
+        return {
+            'image_size': size['height'] if isinstance(size, dict) else size,
+            'mean': config.image_mean,
+            'std': config.image_std
+        }
+    
+    def caption_images(self, pixel_values: np.ndarray) -> List[str]:
+        """Caption a preprocessed (n, 3, H, W) batch in one generate call"""
+        if self.image_caption_model is None:
+            raise RuntimeError("Image captioning model not loaded")
+        
+        pixels = torch.from_numpy(pixel_values).to(self.device, dtype=self.image_caption_model.dtype)
+        with torch.no_grad(), PROFILER.section("caption_model.generate"):
+            outputs = self.image_caption_model.generate(pixel_values=pixels, max_new_tokens=30, num_beams=1)
+        return self.image_processor.batch_decode(outputs, skip_special_tokens=True)
+    
+    def generate_educational_visual(self, query: str, analysis: Dict[str, Any],
+                                    cancel_token: Optional[CancelToken] = None) -> Optional[Image.Image]:
         """Generate educational visuals with fallback"""
         
         if not analysis['needs_visual']:
             return None
         
         try:
+            # Function plots, charts and geometry have an exact answer; draw them directly
+            image = self.visual_router.render(query, analysis)
+            if image is not None:
+                log_event(logger, "visual.rendered", route=image.info['visual_route'],
+                          render_ms=round(image.info['render_ms'], 1))
+                self._save_image(image, query, analysis)
+                return image
+            
             if self.image_pipeline is not None:
-                print("🎨 Generating educational visual with AI...")
-                return self._generate_ai_visual(query, analysis)
+                return self._generate_ai_visual(query, analysis, cancel_token)
             else:
-                print("🎨 Generating fallback visual...")
+                log_event(logger, "visual.fallback", logging.WARNING, reason="image pipeline not loaded")
                 return self._generate_fallback_visual(query, analysis)
                 
         except Exception as e:
-            print(f"❌ Visual generation error: {e}")
+            log_event(logger, "visual.failed", logging.ERROR, error=str(e), exc_info=True)
             return self._generate_fallback_visual(query, analysis)
     
-    def _generate_ai_visual(self, query: str, analysis: Dict[str, Any]) -> Optional[Image.Image]:
+    def _generate_ai_visual(self, query: str, analysis: Dict[str, Any],
+                            cancel_token: Optional[CancelToken] = None) -> Optional[Image.Image]:
         """Generate visual using AI models"""
         
         visual_prompt = self._construct_visual_prompt(query, analysis)
-        print(f"🖼️ Visual prompt: {visual_prompt}")
+        log_event(logger, "visual.diffusion_started", logging.DEBUG, prompt=visual_prompt)
         
-        with torch.no_grad():
+        start_time = time.perf_counter()
+        with torch.no_grad(), PROFILER.section("image_pipeline"), CANCELLATION.stage("image_pipeline", cancel_token):
             image = self.image_pipeline(
                 prompt=visual_prompt,
                 num_inference_steps=20,
                 guidance_scale=7.5,
                 height=512,
                 width=512,
-                generator=torch.Generator(device=self.device).manual_seed(42)
+                generator=torch.Generator(device=self.device).manual_seed(42),
+                callback_on_step_end=cancel_token.diffusion_callback if cancel_token is not None else None
             ).images[0]
+        diffusion_seconds = time.perf_counter() - start_time
+        self.visual_router.record_diffusion(diffusion_seconds)
         
         enhanced_image = self._enhance_educational_image(image, query)
         
@@ -499,7 +681,7 @@ class AdvancedClassroomAI:
         image_path = self._save_image(enhanced_image, query, analysis)
         self._display_image(enhanced_image, image_path)
         
-        print("✅ Educational visual generated successfully!")
+        log_event(logger, "visual.generated", route="diffusion", seconds=round(diffusion_seconds, 2))
         return enhanced_image
     
     def _construct_visual_prompt(self, query: str, analysis: Dict[str, Any]) -> str:
@@ -558,7 +740,7 @@ class AdvancedClassroomAI:
             return bordered_image
             
         except Exception as e:
-            print(f"⚠️ Image enhancement failed: {e}")
+            log_event(logger, "visual.enhancement_failed", logging.WARNING, error=str(e))
             return image
     
     def _generate_fallback_visual(self, query: str, analysis: Dict[str, Any]) -> Optional[Image.Image]:
@@ -602,7 +784,7 @@ class AdvancedClassroomAI:
             return img
             
         except Exception as e:
-            print(f"❌ Fallback visual generation failed: {e}")
+            log_event(logger, "visual.fallback_failed", logging.ERROR, error=str(e))
             return None
     
     def _save_image(self, image: Image.Image, query: str, analysis: Dict[str, Any], is_fallback: bool = False) -> str:
@@ -625,12 +807,13 @@ class AdvancedClassroomAI:
             image_path = os.path.join(self.images_dir, filename)
             
             image.save(image_path, "PNG", quality=95)
-            print(f"💾 Image saved: {image_path}")
+            image.info['saved_path'] = image_path  # Lets callers serve exactly this file
+            log_event(logger, "image.saved", logging.DEBUG, path=image_path)
             
             return image_path
             
         except Exception as e:
-            print(f"❌ Failed to save image: {e}")
+            log_event(logger, "image.save_failed", logging.ERROR, error=str(e))
             return ""
     
     def _display_image(self, image: Image.Image, image_path: str):
@@ -679,60 +862,71 @@ class AdvancedClassroomAI:
         
         return lines
     
-    def process_educational_query(self, query: str) -> Dict[str, Any]:
-        """Main method to process educational queries with comprehensive error handling"""
-        
-        print(f"\n🎓 Processing Educational Query: {query}")
-        print("=" * 80)
+    def record_conversation(self, query: str, response: str, analysis: Dict[str, Any],
+                            processing_time: float, has_visual: bool):
+        """Append to the in-memory history and the durable log, if configured"""
+        entry = {
+            'query': query,
+            'response': response,
+            'analysis': analysis,
+            'timestamp': time.time(),
+            'processing_time': processing_time,
+            'has_visual': has_visual
+        }
+        self.conversation_history.append(entry)
+        if self.conversation_store is not None:
+            self.conversation_store.record(entry)
+    
+    def process_educational_query(self, query: str, context: Optional[str] = None,
+                                  degradation: int = FULL, cancel_token: Optional[CancelToken] = None,
+                                  defer_visuals: bool = False) -> Dict[str, Any]:
+        """
+        Main method to process educational queries with comprehensive error handling.
+        `degradation` (see load_governor.py) trades answer quality for latency under load;
+        a cancelled `cancel_token` stops model work early by raising RequestCancelled.
+        `defer_visuals` leaves the visual to the caller (split deployments run it on visual workers).
+        """
+        
+        log_event(logger, "query.processing", logging.DEBUG, query=query, degradation=level_name(degradation))
         
         start_time = time.time()
         
         try:
             # Analyze the query
-            analysis = self.analyze_educational_query(query)
-            
-            print(f"📊 Analysis Results:")
-            print(f"   Subject: {analysis['subject']} (confidence: {analysis['confidence']:.2f})")
-            print(f"   Type: {analysis['query_type']}")
-            print(f"   Complexity: {analysis['complexity']}")
-            print(f"   Level: {analysis['educational_level']}")
-            print(f"   Needs Visual: {analysis['needs_visual']}")
+            analysis = self.analyze_educational_query(query, degradation < KEYWORD_CLASSIFICATION, cancel_token)
             
             # Generate text response
-            print("\n📝 Generating educational response...")
-            text_response = self.generate_educational_response(query, analysis)
+            # Extra context (e.g. a caption of an attached image) informs the answer, not the analysis
+            prompt_query = f"{query} (Context: {context})" if context else query
+            text_response = self.generate_educational_response(prompt_query, analysis, degradation, cancel_token)
             
-            # Generate visual if needed
+            # Generate visual if needed (under the heaviest load, or when asked, the caller queues it instead)
             visual_image = None
-            if analysis['needs_visual']:
-                print("\n🎨 Generating educational visual...")
-                visual_image = self.generate_educational_visual(query, analysis)
+            visual_deferred = analysis['needs_visual'] and (defer_visuals or degradation >= DEFER_VISUALS)
+            if analysis['needs_visual'] and not visual_deferred:
+                visual_image = self.generate_educational_visual(query, analysis, cancel_token)
             
             processing_time = time.time() - start_time
             
             # Add to conversation history
-            self.conversation_history.append({
-                'query': query,
-                'response': text_response,
-                'analysis': analysis,
-                'timestamp': time.time(),
-                'processing_time': processing_time,
-                'has_visual': visual_image is not None
-            })
+            self.record_conversation(query, text_response, analysis, processing_time, visual_image is not None)
             
-            print(f"\n✅ Processing completed in {processing_time:.2f} seconds")
-            print("=" * 80)
+            log_event(logger, "query.processed", **analysis, visual_deferred=visual_deferred,
+                      has_visual=visual_image is not None, degradation=level_name(degradation),
+                      processing_time=round(processing_time, 3))
             
             return {
                 'text_response': text_response,
                 'visual_image': visual_image,
+                'visual_deferred': visual_deferred,
                 'analysis': analysis,
                 'processing_time': processing_time,
+                'degradation': level_name(degradation),
                 'success': True
             }
             
         except Exception as e:
-            print(f"❌ Error processing query: {e}")
+            log_event(logger, "query.failed", logging.ERROR, error=str(e), exc_info=True)
             processing_time = time.time() - start_time
             
             # Return error response
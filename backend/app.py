@@ -1,10 +1,12 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile, BackgroundTasks
+from fastapi import FastAPI, HTTPException, File, Form, UploadFile, BackgroundTasks, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import asyncio
+import anyio
 import uvicorn
 import os
 import json
@@ -13,7 +15,28 @@ from datetime import datetime
 import threading
 import time
 import tempfile
-from ai_models import AdvancedClassroomAI
+import uuid
+import hmac
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from query_analyzer import KEYWORD_ENGINE
+from conversation_store import ConversationStore
+from rate_limiter import RateLimiter
+from visual_jobs import VisualJobQueue, VisualQueueFull
+from course_material import CourseMaterialIndex
+from embeddings import load_embedder, DEFAULT_EMBEDDING_MODEL
+from summarization import DocumentSummarizer
+from captioning import ImageCaptioner
+from profiling import PROFILER
+from single_flight import SingleFlight, query_key
+from model_memory import MemoryMonitor, rss_bytes, cpu_supports_bf16
+from speech import StreamingTranscriber, iter_audio_chunks, pcm16_to_float, load_recognizer, SAMPLE_RATE
+from load_governor import LoadGovernor, FULL, DEFER_VISUALS, level_name
+from cancellation import CANCELLATION, CancelToken, RequestCancelled
+from semantic_cache import SemanticCache
+from engagement import EngagementHub, ClassroomLimitReached
+from scheduler import CostScheduler, REQUEST_CLASS, parse_priority_classes
+from structured_logging import setup_logging, parse_sample_rates, get_logger, log_event, RequestIdMiddleware
+import logging
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -31,12 +54,323 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request logs are JSON events written by a background thread (see structured_logging.py).
+# LOG_SAMPLE_RATES keeps a fraction of a chatty event's requests; warnings and errors are always kept.
+# The writer wakes at most every LOG_FLUSH_INTERVAL_MS under load, so it rarely holds up request threads.
+log_pipeline = setup_logging(
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    fmt=os.environ.get("LOG_FORMAT", "json"),
+    sample_rates=parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", "query.processed=0.1,visual.rendered=0.1")),
+    queue_size=int(os.environ.get("LOG_QUEUE_SIZE", 10000)),
+    flush_interval=float(os.environ.get("LOG_FLUSH_INTERVAL_MS", 50)) / 1000
+)
+logger = get_logger("api")
+app.add_middleware(RequestIdMiddleware)
+
 # Global AI instance and status tracking
 ai_assistant = None
+course_index = None
+semantic_cache = None
+document_summarizer = None
+image_captioner = None
+speech_recognizer = None
+speech_recognizer_lock = threading.Lock()
 initialization_status = "starting"
 initialization_start_time = None
 initialization_error = None
 
+# Durable conversation log (survives restarts; written off the request path)
+conversation_store = ConversationStore(
+    db_path=os.environ.get(
+        "CONVERSATION_DB_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "conversations.db")
+    ),
+    retention_days=float(os.environ.get("CONVERSATION_RETENTION_DAYS", 30)),
+    max_rows=int(os.environ.get("CONVERSATION_MAX_ROWS", 100000))
+)
+
+# Per-client / per-classroom admission control for the inference endpoints
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+VISUAL_REQUEST_COST = float(os.environ.get("RATE_LIMIT_VISUAL_COST", 5))
+VOICE_REQUEST_COST = float(os.environ.get("RATE_LIMIT_VOICE_COST", 2))
+rate_limiter = RateLimiter(
+    client_rate=float(os.environ.get("RATE_LIMIT_CLIENT_RATE", 0.5)),
+    client_burst=float(os.environ.get("RATE_LIMIT_CLIENT_BURST", 10)),
+    classroom_rate=float(os.environ.get("RATE_LIMIT_CLASSROOM_RATE", 5)),
+    classroom_burst=float(os.environ.get("RATE_LIMIT_CLASSROOM_BURST", 60))
+)
+
+# Behind a reverse proxy every peer is the proxy: set RATE_LIMIT_TRUSTED_PROXIES to the number of
+# proxies in front of the app, and the caller's address is read from X-Forwarded-For instead
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", 0))
+
+def client_address(http_request: Request) -> str:
+    """The caller's address as seen by the outermost trusted proxy (or the peer itself)"""
+    if RATE_LIMIT_TRUSTED_PROXIES:
+        forwarded = [a.strip() for a in http_request.headers.get("X-Forwarded-For", "").split(",") if a.strip()]
+        if len(forwarded) >= RATE_LIMIT_TRUSTED_PROXIES:
+            return forwarded[-RATE_LIMIT_TRUSTED_PROXIES]
+    return http_request.client.host if http_request.client else "unknown"
+
+def enforce_rate_limit(http_request: Request, cost: float, endpoint: str):
+    """Reject with a fast 429 before any model work if the caller is over budget"""
+    if not RATE_LIMIT_ENABLED:
+        return
+    
+    # Budgets are keyed on the network address, which callers can't choose: a classroom (or school)
+    # shares one address, and X-Client-ID only splits that budget fairly between its devices
+    address = client_address(http_request)
+    client_id = f"{address}/{http_request.headers.get('X-Client-ID', '')}"
+    
+    admitted, retry_after, scope = rate_limiter.admit(client_id, address, cost, endpoint)
+    if not admitted:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many requests for this {scope}. Please retry in {retry_after:.1f} seconds.",
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+        )
+
+# Peak activation memory per request type (see /debug/memory)
+memory_monitor = MemoryMonitor()
+
+def tracked(request_type: str, fn, *args):
+    """Run model work under the memory monitor and profiler; used via run_in_threadpool"""
+    with memory_monitor.track(request_type), PROFILER.request(request_type):
+        return fn(*args)
+
+# Identical questions arriving together (e.g. a whole class typing the board question) share one run
+query_flights = SingleFlight()
+
+def coalescing_key(query: str, context: Optional[str] = None) -> str:
+    return query_key(query, {**ai_assistant.generation_params(), "context": context})
+
+def record_shared_answer(query: str, result: Dict[str, Any], waited: float):
+    """Followers skip the model but still belong in the conversation log"""
+    if result.get('success'):
+        ai_assistant.record_conversation(
+            query, result['text_response'], result['analysis'], waited, result.get('visual_image') is not None
+        )
+
+# Steps answers down to cheaper settings while the backlog is high (see /debug/load)
+load_governor = LoadGovernor(
+    queue_target=int(os.environ.get("LOAD_QUEUE_TARGET", 8)),
+    p95_target_seconds=float(os.environ.get("LOAD_P95_TARGET_SECONDS", 15)),
+    step_up_seconds=float(os.environ.get("LOAD_STEP_UP_SECONDS", 5)),
+    recover_seconds=float(os.environ.get("LOAD_RECOVER_SECONDS", 30)),
+    enabled=os.environ.get("LOAD_GOVERNOR_ENABLED", "true").lower() == "true"
+)
+
+# Model work stops once nobody waits for it: client gone, or past REQUEST_TIMEOUT_SECONDS (0 = no limit)
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("REQUEST_TIMEOUT_SECONDS", 0)) or None
+DISCONNECT_POLL_SECONDS = float(os.environ.get("DISCONNECT_POLL_SECONDS", 0.5))
+
+# Paraphrases of an answered question ("explain photosynthesis" after "What is photosynthesis?") reuse its answer
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+
+def cache_namespace(context: Optional[str] = None) -> str:
+    """Cached answers are only shared between queries with the same generation settings and context"""
+    return query_key(context or "", ai_assistant.generation_params())
+
+def cached_answer(query: str, context: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """The cached answer to a paraphrase of `query`, logged to the conversation history like a fresh one"""
+    if semantic_cache is None:
+        return None
+    start_time = time.time()
+    hit = semantic_cache.lookup(query, cache_namespace(context))
+    if hit is None:
+        return None
+    result = {
+        **hit['result'],
+        'processing_time': time.time() - start_time,
+        'cached': True,
+        'cached_query': hit['query'],
+        'similarity': round(hit['similarity'], 3)
+    }
+    ai_assistant.record_conversation(query, result['text_response'], result['analysis'], result['processing_time'], False)
+    log_event(logger, "semantic_cache.hit", similarity=result['similarity'], subject=hit['subject'],
+              educational_level=hit['educational_level'], query_type=hit['query_type'])
+    return result
+
+def cache_answer(query: str, context: Optional[str], result: Dict[str, Any]):
+    """Only full-quality text answers are cached; rendered images stay out of memory"""
+    if (semantic_cache is not None and result.get('success') and result.get('degradation') == level_name(FULL)
+            and result.get('visual_image') is None):
+        semantic_cache.store(query, result, cache_namespace(context))
+
+def governed_answer(query: str, context: Optional[str] = None,
+                    cancel_token: Optional[CancelToken] = None) -> Dict[str, Any]:
+    """One model run at the current degradation level, or a cached answer; deferred visuals go to the job queue"""
+    if cancel_token is not None and cancel_token.cancelled:
+        # Abandoned while waiting for a worker thread
+        CANCELLATION.skip("request")
+        raise RequestCancelled(cancel_token.reason)
+    result = cached_answer(query, context)
+    if result is None:
+        features = KEYWORD_ENGINE.scan(query)
+        # Queued runs count as in flight, so the governor still sees the backlog
+        with load_governor.track() as level:
+            kind = request_kind(query, features, level)
+            with scheduler.slot(features, kind, REQUEST_CLASS.get(), cancel_token):
+                wall_start, cpu_start = time.perf_counter(), time.thread_time()
+                result = ai_assistant.process_educational_query(query, context, level, cancel_token)
+        CANCELLATION.observe("request", time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+        cache_answer(query, context, result)
+    if result.get('visual_deferred'):
+        try:
+            result['visual_job_id'] = visual_jobs.submit(query, result['analysis'])
+        except VisualQueueFull as e:
+            # The text answer still goes out; the client can ask for the visual again later
+            log_event(logger, "visual_job.rejected", logging.WARNING, error=str(e))
+    return result
+
+async def until_disconnected(http_request: Request):
+    """Returns once the client has gone (closed tab, frontend timeout)"""
+    while not await http_request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+async def answer_query(query: str, request_type: str, context: Optional[str] = None,
+                       http_request: Optional[Request] = None):
+    """
+    process_educational_query off the event loop, coalesced with identical in-flight queries.
+    Raises RequestCancelled if the client disconnects or the request times out; the model
+    work itself is cancelled only when no other request is waiting on it.
+    """
+    start_time = time.time()
+    key = coalescing_key(query, context)
+    # This request's own deadline; a coalesced run may outlive it for later waiters
+    deadline = time.monotonic() + REQUEST_TIMEOUT_SECONDS if REQUEST_TIMEOUT_SECONDS else None
+    while True:
+        remaining = max(deadline - time.monotonic(), 0.0) if deadline is not None else None
+        token = CANCELLATION.join(key, remaining)
+        watcher = None
+        # Anything but a finished answer (disconnect, timeout, the handler itself cancelled) abandons the run
+        abandoned, reason = True, "client disconnected"
+        try:
+            answer = asyncio.ensure_future(query_flights.do_async(
+                key, lambda: run_in_threadpool(tracked, request_type, governed_answer, query, context, token)
+            ))
+            # Nobody may be left to await an abandoned run; retrieve its outcome so it isn't logged
+            answer.add_done_callback(lambda future: future.cancelled() or future.exception())
+            
+            waiting = [answer]
+            if http_request is not None:
+                watcher = asyncio.ensure_future(until_disconnected(http_request))
+                waiting.append(watcher)
+            await asyncio.wait(waiting, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not answer.done():
+                if watcher is None or not watcher.done():
+                    reason = "timeout"
+                raise RequestCancelled(reason)
+            abandoned = False
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            CANCELLATION.leave(key, token, abandoned=abandoned, reason=reason)
+        
+        try:
+            result, shared = answer.result()
+            break
+        except RequestCancelled as e:
+            # Joined a run that its own clients had just abandoned: start a fresh one
+            if str(e) != "client disconnected" or token.cancelled:
+                raise
+    if shared:
+        record_shared_answer(query, result, time.time() - start_time)
+    return result, shared
+
+def cancelled_request_error(e: RequestCancelled) -> HTTPException:
+    """499 (client closed request, nobody reads it) or 504 when the request ran out of time"""
+    if str(e) == "timeout":
+        return HTTPException(status_code=504, detail="Request timed out; model work was cancelled")
+    return HTTPException(status_code=499, detail=f"Request cancelled: {e}")
+
+def estimate_chat_cost(request: "ChatRequest") -> float:
+    """Visual requests run diffusion, so they are charged more than text-only ones"""
+    if request.message_type == "visual" or KEYWORD_ENGINE.needs_visual(request.message):
+        return VISUAL_REQUEST_COST
+    return 1.0
+
+def scheduled_visual(query: str, analysis: Dict[str, Any], cancel_token: CancelToken):
+    """Background visuals wait for a model slot like any other run, in the submitting request's class"""
+    kind = visual_kind(query, analysis) or 'diffusion'
+    with scheduler.slot(analysis, kind, REQUEST_CLASS.get(), cancel_token, label="image_pipeline"):
+        return ai_assistant.generate_educational_visual(query, analysis, cancel_token)
+
+# Visuals for batch requests are generated in the background and polled by job id
+# (with DEPLOY_MODE=api, raise VISUAL_JOB_CONCURRENCY to the number of visual workers);
+# past VISUAL_JOB_MAX_QUEUED waiting visuals, batches asking for visuals get a 429
+VISUAL_JOB_RETRY_AFTER = int(os.environ.get("VISUAL_JOB_RETRY_AFTER", 30))
+visual_jobs = VisualJobQueue(scheduled_visual, workers=int(os.environ.get("VISUAL_JOB_CONCURRENCY", 1)),
+                             max_queued=int(os.environ.get("VISUAL_JOB_MAX_QUEUED", 100)))
+
+# AI_BACKEND=fake swaps in a model-free stand-in (load tests, development without torch)
+AI_BACKEND = os.environ.get("AI_BACKEND", "models")
+
+# INFERENCE_REPLICAS > 0 runs the models in that many core-pinned worker processes (see replicas.py)
+INFERENCE_REPLICAS = int(os.environ.get("INFERENCE_REPLICAS", 0))
+REPLICA_THREADS = int(os.environ.get("REPLICA_THREADS", 0)) or None  # Default: cores split evenly
+
+# DEPLOY_MODE=api: this node loads no models; jobs go through BROKER_URL to worker.py nodes (see work_queue.py)
+DEPLOY_MODE = os.environ.get("DEPLOY_MODE", "all")
+BROKER_URL = os.environ.get(
+    "BROKER_URL",
+    "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "work_queue.db")
+)
+
+# Model runs go SCHEDULER_SLOTS at a time; the queue orders them by priority class (X-Priority-Class),
+# then shortest expected job, with aging (see scheduler.py and /debug/scheduler).
+# With DEPLOY_MODE=api it is off unless SCHEDULER_SLOTS is set (to the number of inference workers).
+SCHEDULER_SLOTS = int(os.environ.get("SCHEDULER_SLOTS", 0))
+scheduler = CostScheduler(
+    slots=SCHEDULER_SLOTS or max(1, INFERENCE_REPLICAS),
+    aging=float(os.environ.get("SCHEDULER_AGING", 0.5)),
+    classes=parse_priority_classes(os.environ.get("SCHEDULER_CLASSES", "teacher=0,student=20")),
+    policy=os.environ.get("SCHEDULER_POLICY", "sjf"),
+    enabled=os.environ.get("SCHEDULER_ENABLED", "true").lower() == "true" and (DEPLOY_MODE != "api" or SCHEDULER_SLOTS > 0)
+)
+# Classes above the default need X-Priority-Token when PRIORITY_CLASS_TOKEN is set
+PRIORITY_CLASS_TOKEN = os.environ.get("PRIORITY_CLASS_TOKEN")
+# Requests waiting for a slot hold a threadpool thread, so the pool needs room for the queue
+THREADPOOL_SIZE = int(os.environ.get("THREADPOOL_SIZE", 200))
+
+def priority_class(http_request: Request) -> str:
+    requested = scheduler.resolve_class(http_request.headers.get("X-Priority-Class"))
+    if requested != scheduler.default_class and PRIORITY_CLASS_TOKEN:
+        token = http_request.headers.get("X-Priority-Token", "")
+        if not hmac.compare_digest(token.encode(), PRIORITY_CLASS_TOKEN.encode()):
+            return scheduler.default_class
+    return requested
+
+def set_request_class(connection) -> str:
+    """Priority class for this request's scheduler slots, seen by the threadpool work it starts"""
+    request_class = priority_class(connection)
+    REQUEST_CLASS.set(request_class)
+    return request_class
+
+def visual_kind(query: str, analysis: Dict[str, Any]) -> Optional[str]:
+    """'plot' when the Agg fast path will draw it, else 'diffusion' (None if no visual is needed)"""
+    if not analysis.get('needs_visual'):
+        return None
+    router = getattr(ai_assistant, 'visual_router', None)
+    if hasattr(router, 'route') and router.route(query, analysis.get('subject', '')) is not None:
+        return 'plot'
+    return 'diffusion'
+
+def request_kind(query: str, analysis: Dict[str, Any], level: int) -> str:
+    """What a process_educational_query run will include, for its cost estimate"""
+    if level >= DEFER_VISUALS or getattr(ai_assistant, 'always_defer_visuals', False):
+        return 'text'
+    visual = visual_kind(query, analysis)
+    return f"text+{visual}" if visual else 'text'
+
+def load_ai_backend():
+    """Import the assistant class lazily so the fake backend never imports torch"""
+    if AI_BACKEND == "fake":
+        from fake_ai import FakeClassroomAI
+        return FakeClassroomAI
+    from ai_models import AdvancedClassroomAI
+    return AdvancedClassroomAI
+
 # Initialize AI models in background
 def initialize_ai():
     global ai_assistant, initialization_status, initialization_start_time, initialization_error
@@ -48,11 +382,24 @@ def initialize_ai():
         print("🚀 Initializing AI models...")
         print("📝 This may take a few minutes on first run...")
         
-        ai_assistant = AdvancedClassroomAI(
-            device='cpu',
-            save_images=True,
-            display_images=False  # Don't display in API mode
-        )
+        if DEPLOY_MODE == "api":
+            from work_queue import QueueClient, open_broker
+            ai_assistant = QueueClient(open_broker(BROKER_URL), conversation_store=conversation_store)
+        elif INFERENCE_REPLICAS > 0:
+            from replicas import ReplicaPool
+            ai_assistant = ReplicaPool(
+                INFERENCE_REPLICAS,
+                REPLICA_THREADS,
+                backend="fake" if AI_BACKEND == "fake" else "models",
+                conversation_store=conversation_store
+            )
+        else:
+            ai_assistant = load_ai_backend()(
+                device='cpu',
+                save_images=True,
+                display_images=False,  # Don't display in API mode
+                conversation_store=conversation_store
+            )
         
         # Verify models are actually ready
         if hasattr(ai_assistant, 'models_ready') and ai_assistant.models_ready:
@@ -70,9 +417,49 @@ def initialize_ai():
         print(f"❌ Failed to initialize AI models: {e}")
         ai_assistant = None
 
+# Retrieval needs only the small embedding model, so it starts alongside the big models instead of after them
+def initialize_retrieval():
+    embedder = load_embedder(os.environ.get("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL))
+    initialize_course_index(embedder)
+    initialize_semantic_cache(embedder)
+
+# Course material index (retrieval for /materials/ask)
+def initialize_course_index(embedder):
+    global course_index
+    
+    try:
+        course_index = CourseMaterialIndex(
+            os.environ.get(
+                "COURSE_INDEX_DIR",
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "course_index")
+            ),
+            embedder
+        )
+        print(f"✅ Course material index ready: {course_index.stats()}")
+    except Exception as e:
+        print(f"❌ Failed to initialize course material index: {e}")
+        course_index = None
+
+# Semantic answer cache (shares the course index's embedding model)
+def initialize_semantic_cache(embedder):
+    global semantic_cache
+    
+    if not SEMANTIC_CACHE_ENABLED:
+        return
+    semantic_cache = SemanticCache(
+        embedder,
+        # Unset: the threshold tuned for this embedder (semantic_cache.DEFAULT_THRESHOLDS)
+        threshold=float(os.environ["SEMANTIC_CACHE_THRESHOLD"]) if os.environ.get("SEMANTIC_CACHE_THRESHOLD") else None,
+        max_entries=int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 10000)),
+        ttl_seconds=float(os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", 86400)),
+        ann_min_entries=int(os.environ.get("SEMANTIC_CACHE_ANN_MIN_ENTRIES", 4096))
+    )
+    print(f"✅ Semantic answer cache ready ({embedder.name}, threshold {semantic_cache.threshold})")
+
 # Start AI initialization in background thread
 print("🚀 Starting AI model initialization in background...")
 threading.Thread(target=initialize_ai, daemon=True).start()
+threading.Thread(target=initialize_retrieval, daemon=True).start()
 
 # Serve generated images
 os.makedirs(os.path.join(tempfile.gettempdir(), "generated_images"), exist_ok=True)
@@ -92,6 +479,29 @@ class ChatResponse(BaseModel):
     processing_time: float
     success: bool
     error: Optional[str] = None
+    coalesced: bool = False
+    cached: bool = False
+    degradation: Optional[str] = None
+    visual_job_id: Optional[str] = None
+    transcript: Optional[str] = None
+    speech_metrics: Optional[Dict[str, Any]] = None
+
+class BatchChatRequest(BaseModel):
+    messages: List[str]
+    subject: str = "General"
+    generate_visuals: bool = True
+
+class MaterialRequest(BaseModel):
+    title: str
+    text: str
+
+class MaterialQuestion(BaseModel):
+    question: str
+    top_k: int = 5
+
+class SummarizeRequest(BaseModel):
+    text: str
+    stream: bool = True
 
 class HealthResponse(BaseModel):
     status: str
@@ -130,14 +540,18 @@ async def health_check():
         initialization_time=init_time
     )
     
-    print(f"Health check: {response.dict()}")
+    log_event(logger, "health.check", logging.DEBUG, status=response.status,
+              initialization_status=initialization_status)
     return response
 
 # Main chat endpoint
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     global ai_assistant, initialization_status
     
+    set_request_class(http_request)
+    enforce_rate_limit(http_request, estimate_chat_cost(request), "chat")
+    
     try:
         # Check if AI is ready with detailed status
         if ai_assistant is None:
@@ -159,17 +573,20 @@ async def chat(request: ChatRequest):
             )
         
         # Process the query using your AI models
-        print(f"Processing query: {request.message[:100]}...")
-        
         start_time = time.time()
-        result = ai_assistant.process_educational_query(request.message)
+        # Run model work off the event loop so health checks and 429s stay fast
+        result, shared = await answer_query(request.message, "chat", http_request=http_request)
         processing_time = time.time() - start_time
-        
-        print(f"Query processed in {processing_time:.2f} seconds")
+        log_event(logger, "chat.answered", query_chars=len(request.message), processing_time=round(processing_time, 3),
+                  coalesced=shared, cached=result.get('cached', False), degradation=result.get('degradation'),
+                  success=result['success'])
         
         # Handle image URL if visual was generated
         image_url = None
-        if result.get('visual_image'):
+        saved_path = result['visual_image'].info.get('saved_path') if result.get('visual_image') else None
+        if saved_path:
+            image_url = f"/images/{os.path.basename(saved_path)}"
+        elif result.get('visual_image'):
             # Get the most recent image from the directory
             images_dir = os.path.join(tempfile.gettempdir(), "generated_images")
             if os.path.exists(images_dir):
@@ -184,11 +601,17 @@ async def chat(request: ChatRequest):
             analysis=result['analysis'],
             image_url=image_url,
             processing_time=processing_time,
-            success=result['success']
+            success=result['success'],
+            coalesced=shared,
+            cached=result.get('cached', False),
+            degradation=result.get('degradation'),
+            visual_job_id=result.get('visual_job_id')
         )
-        
+    
+    except RequestCancelled as e:
+        raise cancelled_request_error(e)
     except Exception as e:
-        print(f"❌ Error in chat endpoint: {e}")
+        log_event(logger, "chat.failed", logging.ERROR, error=str(e), exc_info=True)
         return ChatResponse(
             response=f"I encountered an error processing your request: {str(e)}",
             analysis={"subject": request.subject, "error": str(e)},
@@ -197,12 +620,397 @@ async def chat(request: ChatRequest):
             error=str(e)
         )
 
-# Voice processing endpoint
+# Batch chat endpoint for teacher-prepared question sets
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 50))
+BATCH_GENERATION_SIZE = int(os.environ.get("BATCH_GENERATION_SIZE", 8))
+# Scheduler shapes of the batch analysis and of one model batch (learned separately from single questions)
+BATCH_ANALYSIS_FEATURES = {'query_type': 'batch_analysis', 'complexity': 'basic'}
+BATCH_FEATURES = {'query_type': 'batch', 'complexity': 'basic'}
+
+@app.post("/chat/batch")
+async def chat_batch(request: BatchChatRequest, http_request: Request):
+    """Answer a list of questions; results stream back as NDJSON lines as they finish"""
+    global ai_assistant
+    
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="messages must not be empty")
+    if len(request.messages) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} messages per batch")
+    
+    batch_cost = sum(
+        estimate_chat_cost(ChatRequest(message=message, subject=request.subject))
+        for message in request.messages
+    )
+    request_class = set_request_class(http_request)
+    enforce_rate_limit(http_request, batch_cost, "chat_batch")
+    
+    if ai_assistant is None or not getattr(ai_assistant, 'models_ready', False):
+        raise HTTPException(status_code=503, detail="AI models not ready")
+    if request.generate_visuals and visual_jobs.full():
+        raise HTTPException(
+            status_code=429,
+            detail="Too many visuals are waiting to be generated. Please retry later or ask without visuals.",
+            headers={"Retry-After": str(VISUAL_JOB_RETRY_AFTER)}
+        )
+    
+    batch_id = uuid.uuid4().hex
+    messages = list(request.messages)
+    
+    # Model batches wait for scheduler slots like single questions; up to `slots` of them run at once
+    cancel_token = CancelToken()
+    
+    def generate_batch(indices, analyses):
+        # Queued batches count as in flight like single questions; each decodes at the level current when it starts
+        with load_governor.track(), scheduler.slot(BATCH_FEATURES, 'text', request_class, cancel_token, label="batch"):
+            level = load_governor.level
+            started_at = time.perf_counter()
+            responses = list(ai_assistant.generate_educational_responses(
+                [messages[i] for i in indices], [analyses[i] for i in indices], batch_size=len(indices),
+                degradation=level
+            ))
+            return [(indices[j], response) for j, response in responses], time.perf_counter() - started_at, level
+    
+    # Runs in the threadpool (sync generator), one model batch per iteration
+    def stream_results():
+        with memory_monitor.track("chat_batch"):
+            start_time = time.time()
+            yield json.dumps({"type": "batch", "batch_id": batch_id, "count": len(messages)}) + "\n"
+        
+            try:
+                with scheduler.slot(BATCH_ANALYSIS_FEATURES, 'text', request_class, cancel_token, label="batch_analysis"):
+                    analyses = ai_assistant.analyze_educational_queries(messages)
+            except Exception as e:
+                log_event(logger, "batch.analysis_failed", logging.WARNING, error=str(e), fallback="keywords")
+                analyses = [ai_assistant.fallback_analysis(message) for message in messages]
+        
+            # Analysis runs once for the whole batch, so each item carries an equal share of it
+            analysis_share = (time.time() - start_time) / len(messages)
+        
+            # Visuals are queued separately so they never hold up the text answers
+            visual_job_ids = {}
+            visual_errors = {}
+            if request.generate_visuals:
+                for i, analysis in enumerate(analyses):
+                    if analysis.get('needs_visual'):
+                        try:
+                            visual_job_ids[i] = visual_jobs.submit(messages[i], analysis, batch_id)
+                        except VisualQueueFull as e:
+                            visual_errors[i] = str(e)
+        
+            # Same prompt template and similar lengths in each model batch keeps padding low
+            order = sorted(range(len(messages)), key=lambda i: (analyses[i].get('query_type', 'general'), len(messages[i])))
+            chunks = [order[start:start + BATCH_GENERATION_SIZE] for start in range(0, len(order), BATCH_GENERATION_SIZE)]
+            # Every batch is handed over at once: the scheduler queues them (without it, replicas / workers
+            # share them), and the governor sees the whole batch as backlog
+            executor = ThreadPoolExecutor(max_workers=len(chunks), thread_name_prefix="batch")
+            batches = [executor.submit(generate_batch, chunk, analyses) for chunk in chunks]
+            completed = 0
+            try:
+                for batch in as_completed(batches):
+                    responses, generation_time, level = batch.result()
+                    # Each item's time is its analysis share plus its own model batch,
+                    # not the time since the request started
+                    item_time = analysis_share + generation_time
+                    for i, response in responses:
+                        completed += 1
+                        ai_assistant.record_conversation(messages[i], response, analyses[i], item_time, i in visual_job_ids)
+                        yield json.dumps({
+                            "type": "item",
+                            "index": i,
+                            "query": messages[i],
+                            "response": response,
+                            "analysis": analyses[i],
+                            "visual_job_id": visual_job_ids.get(i),
+                            "visual_error": visual_errors.get(i),
+                            "processing_time": item_time,
+                            "degradation": level_name(level),
+                            "success": True
+                        }, default=str) + "\n"
+            except GeneratorExit:
+                # Client went away mid-stream: queued model batches give up their place,
+                # and nobody will poll this batch's visuals
+                cancel_token.cancel("client disconnected")
+                cancelled = visual_jobs.cancel_batch(batch_id)
+                log_event(logger, "batch.abandoned", batch_id=batch_id, completed=completed,
+                          count=len(messages), visuals_cancelled=cancelled)
+                raise
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+        
+            yield json.dumps({
+                "type": "done",
+                "batch_id": batch_id,
+                "completed": completed,
+                "visual_jobs": len(visual_job_ids),
+                "processing_time": time.time() - start_time
+            }) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+# Poll a queued visual
+@app.get("/visuals/{job_id}")
+async def get_visual_job(job_id: str):
+    job = visual_jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown visual job")
+    return job
+
+@app.delete("/visuals/{job_id}")
+async def cancel_visual_job(job_id: str):
+    """Drop a queued visual or abort it between diffusion steps"""
+    if visual_jobs.status(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown visual job")
+    return {"job_id": job_id, "cancelled": visual_jobs.cancel(job_id)}
+
+# Course material: upload notes and chapters, then ask questions answered from them
+def require_course_index():
+    if course_index is None:
+        raise HTTPException(status_code=503, detail="Course material index not ready")
+    return course_index
+
+@app.post("/materials")
+async def add_material(request: MaterialRequest):
+    index = require_course_index()
+    try:
+        return await run_in_threadpool(index.add_document, request.title, request.text)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/materials/upload")
+async def upload_material(file: UploadFile = File(...), title: Optional[str] = None):
+    index = require_course_index()
+    try:
+        text = (await file.read()).decode("utf-8", errors="ignore")
+        return await run_in_threadpool(index.add_document, title or file.filename, text, {"filename": file.filename})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/materials")
+async def list_materials():
+    index = require_course_index()
+    return {"documents": index.documents(), "stats": index.stats()}
+
+@app.delete("/materials/{doc_id}")
+async def delete_material(doc_id: str):
+    index = require_course_index()
+    if not await run_in_threadpool(index.remove_document, doc_id):
+        raise HTTPException(status_code=404, detail="Unknown document")
+    return {"message": "Document removed"}
+
+@app.post("/materials/ask")
+async def ask_materials(request: MaterialQuestion, http_request: Request):
+    request_class = set_request_class(http_request)
+    enforce_rate_limit(http_request, 1.0, "materials_ask")
+    index = require_course_index()
+    
+    def answer():
+        start_time = time.time()
+        passages = index.search(request.question, top_k=max(1, min(request.top_k, 20)))
+        retrieval_time = time.time() - start_time
+        
+        if ai_assistant is not None and ai_assistant.models_ready:
+            with scheduler.slot({}, 'reader', request_class, label="reader"):
+                result = ai_assistant.answer_from_passages(request.question, passages)
+        else:
+            result = {'answer': None, 'score': 0.0, 'source': passages[0] if passages else None}
+        
+        return {
+            "question": request.question,
+            "answer": result['answer'],
+            "score": result['score'],
+            "source": result['source'],
+            "passages": passages,
+            "retrieval_time": retrieval_time,
+            "processing_time": time.time() - start_time,
+            "success": result['answer'] is not None
+        }
+    
+    return await run_in_threadpool(tracked, "materials_ask", answer)
+
+# Long-document summarization (map-reduce over the BART summarizer)
+def get_document_summarizer() -> DocumentSummarizer:
+    global document_summarizer
+    
+    if document_summarizer is None:
+        if ai_assistant is None or getattr(ai_assistant, 'summarizer', None) is None:
+            raise HTTPException(status_code=503, detail="Summarization model not ready")
+        document_summarizer = DocumentSummarizer(
+            ai_assistant.summarizer,
+            workers=int(os.environ.get("SUMMARIZER_WORKERS", 2)),
+            batch_size=int(os.environ.get("SUMMARIZER_BATCH_SIZE", 4))
+        )
+    return document_summarizer
+
+@app.post("/summarize")
+async def summarize(request: SummarizeRequest, http_request: Request):
+    """Summarize a long text; partial summaries stream back as NDJSON when stream=true"""
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="text must not be empty")
+    
+    summarizer = get_document_summarizer()
+    request_class = set_request_class(http_request)
+    # Charge roughly one unit per summarizer chunk
+    enforce_rate_limit(http_request, max(1.0, len(request.text.split()) / 600), "summarize")
+    
+    # The whole map-reduce holds one model slot; its own workers batch the chunks
+    def summarize_text():
+        with scheduler.slot({}, 'summary', request_class, label="summary"):
+            return summarizer.summarize(request.text)
+    
+    if not request.stream:
+        return await run_in_threadpool(tracked, "summarize", summarize_text)
+    
+    def stream_events():
+        with memory_monitor.track("summarize"), scheduler.slot({}, 'summary', request_class, label="summary"):
+            for event in summarizer.summarize_stream(request.text):
+                yield json.dumps(event) + "\n"
+    
+    return StreamingResponse(stream_events(), media_type="application/x-ndjson")
+
+@app.get("/debug/summarization")
+async def summarization_stats():
+    """Chunk summary cache entries, hits and misses"""
+    return document_summarizer.stats() if document_summarizer is not None else {"loaded": False}
+
+# Image captioning (BLIP), micro-batched across concurrent requests
+MAX_CAPTION_IMAGES = int(os.environ.get("MAX_CAPTION_IMAGES", 16))
+
+def scheduled_captions(pixels):
+    """One micro-batch in a model slot, in the class of the request that opened the batch"""
+    with scheduler.slot({}, 'caption', REQUEST_CLASS.get(), label="caption"):
+        return ai_assistant.caption_images(pixels)
+
+def get_image_captioner() -> ImageCaptioner:
+    global image_captioner
+    
+    if image_captioner is None:
+        if ai_assistant is None or getattr(ai_assistant, 'image_caption_model', None) is None:
+            raise HTTPException(status_code=503, detail="Image captioning model not ready")
+        image_captioner = ImageCaptioner(
+            scheduled_captions,
+            max_batch_size=int(os.environ.get("CAPTION_BATCH_SIZE", 8)),
+            max_wait_ms=float(os.environ.get("CAPTION_BATCH_WAIT_MS", 25)),
+            preprocess_workers=int(os.environ.get("CAPTION_PREPROCESS_WORKERS", 2)),
+            **ai_assistant.caption_preprocess_config()
+        )
+    return image_captioner
+
+@app.post("/caption")
+async def caption_images(
+    http_request: Request,
+    images: List[UploadFile] = File(...),
+    question: Optional[str] = Form(None)
+):
+    """Caption whiteboard photos / worksheet scans; with a question, answer it using the captions as context"""
+    if len(images) > MAX_CAPTION_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_CAPTION_IMAGES} images per request")
+    
+    captioner = get_image_captioner()
+    set_request_class(http_request)
+    enforce_rate_limit(http_request, len(images) + (1 if question else 0), "caption")
+    
+    start_time = time.time()
+    data = [await image.read() for image in images]
+    try:
+        results = await run_in_threadpool(tracked, "caption", captioner.caption, data)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not caption images: {e}")
+    
+    for image, result in zip(images, results):
+        result['filename'] = image.filename
+    
+    answer = None
+    if question:
+        context = "; ".join(result['caption'] for result in results)
+        try:
+            result, shared = await answer_query(question, "chat", context, http_request)
+        except RequestCancelled as e:
+            raise cancelled_request_error(e)
+        answer = {
+            "response": result['text_response'],
+            "analysis": result['analysis'],
+            "processing_time": result['processing_time'],
+            "success": result['success'],
+            "coalesced": shared,
+            "cached": result.get('cached', False),
+            "degradation": result.get('degradation')
+        }
+    
+    return {
+        "captions": results,
+        "answer": answer,
+        "processing_time": time.time() - start_time
+    }
+
+@app.get("/debug/captioning")
+async def captioning_stats():
+    return image_captioner.stats() if image_captioner is not None else {"loaded": False}
+
+# Voice processing: streaming speech-to-text, then the normal query pipeline.
+# A /voice/ws stream is closed past VOICE_MAX_STREAM_SECONDS of audio, VOICE_MAX_SESSION_SECONDS
+# of wall time, or VOICE_IDLE_TIMEOUT_SECONDS without a frame.
+VOICE_MAX_STREAM_SECONDS = float(os.environ.get("VOICE_MAX_STREAM_SECONDS", 120))
+VOICE_MAX_SESSION_SECONDS = float(os.environ.get("VOICE_MAX_SESSION_SECONDS", 300))
+VOICE_IDLE_TIMEOUT_SECONDS = float(os.environ.get("VOICE_IDLE_TIMEOUT_SECONDS", 15))
+# Scheduler shape of one streamed chunk (learned separately from whole uploads)
+VOICE_STREAM_FEATURES = {'query_type': 'stream', 'complexity': 'basic'}
+
+def get_speech_recognizer():
+    global speech_recognizer
+    
+    with speech_recognizer_lock:
+        if speech_recognizer is None:
+            speech_recognizer = load_recognizer()
+    return speech_recognizer
+
+def answer_transcript(transcriber: StreamingTranscriber, subject: str) -> ChatResponse:
+    """Hand a finished transcript to the educational pipeline and attach speech metrics"""
+    transcript = transcriber.transcript if transcriber.finished_at is not None else transcriber.finish()
+    if not transcript:
+        return ChatResponse(
+            response="I couldn't hear a question in that recording. Please try again.",
+            analysis={"subject": subject, "message_type": "voice"},
+            processing_time=0,
+            success=False,
+            error="No speech detected",
+            transcript="",
+            speech_metrics=transcriber.metrics()
+        )
+    
+    start_time = time.time()
+    result, shared = query_flights.do(coalescing_key(transcript), governed_answer, transcript)
+    response_ready_at = time.time()
+    if shared:
+        record_shared_answer(transcript, result, response_ready_at - start_time)
+    
+    image_url = None
+    saved_path = result['visual_image'].info.get('saved_path') if result.get('visual_image') else None
+    if saved_path:
+        image_url = f"/images/{os.path.basename(saved_path)}"
+    
+    return ChatResponse(
+        response=result['text_response'],
+        analysis={**result['analysis'], "message_type": "voice"},
+        image_url=image_url,
+        processing_time=response_ready_at - start_time,
+        success=result['success'],
+        coalesced=shared,
+        cached=result.get('cached', False),
+        degradation=result.get('degradation'),
+        visual_job_id=result.get('visual_job_id'),
+        transcript=transcript,
+        speech_metrics=transcriber.metrics(response_ready_at)
+    )
+
 @app.post("/voice", response_model=ChatResponse)
 async def process_voice(
+    http_request: Request,
     audio: UploadFile = File(...),
     subject: str = "General"
 ):
+    request_class = set_request_class(http_request)
+    enforce_rate_limit(http_request, VOICE_REQUEST_COST, "voice")
+    
     try:
         if ai_assistant is None or not ai_assistant.models_ready:
             return ChatResponse(
@@ -213,21 +1021,22 @@ async def process_voice(
                 error="AI models not ready"
             )
         
-        # For now, return a placeholder response
-        # In a full implementation, you would:
-        # 1. Save the audio file
-        # 2. Use speech-to-text to convert audio to text
-        # 3. Process the text with your AI models
+        def transcribe_and_answer():
+            # Decode and transcribe chunk by chunk; the upload is never read whole
+            transcriber = StreamingTranscriber(get_speech_recognizer())
+            # Released before the answer, which waits for its own slot
+            with scheduler.slot({}, 'speech', request_class, label="speech"):
+                for chunk in iter_audio_chunks(audio.file):
+                    transcriber.feed(chunk)
+                transcriber.finish()
+            return answer_transcript(transcriber, subject)
         
-        return ChatResponse(
-            response="Voice processing is not fully implemented yet. Please use text input.",
-            analysis={"subject": subject, "message_type": "voice"},
-            processing_time=0,
-            success=False,
-            error="Voice processing not implemented"
-        )
+        response = await run_in_threadpool(tracked, "voice", transcribe_and_answer)
+        log_event(logger, "voice.answered", **response.speech_metrics)
+        return response
         
     except Exception as e:
+        log_event(logger, "voice.failed", logging.ERROR, error=str(e), exc_info=True)
         return ChatResponse(
             response="Error processing voice input.",
             analysis={"subject": subject, "error": str(e)},
@@ -236,6 +1045,86 @@ async def process_voice(
             error=str(e)
         )
 
+@app.websocket("/voice/ws")
+async def voice_stream(websocket: WebSocket):
+    """
+    Live voice queries. Client sends an optional JSON config ({"subject": ...}),
+    then binary frames of 16 kHz mono PCM16, then {"type": "end"}. The server
+    sends {"type": "partial"} events as segments are transcribed and a final
+    {"type": "response"} event with the answer and speech metrics.
+    """
+    await websocket.accept()
+    
+    if ai_assistant is None or not ai_assistant.models_ready:
+        await websocket.send_json({"type": "error", "error": "AI models not ready"})
+        await websocket.close()
+        return
+    
+    try:
+        # WebSocket shares the HTTP connection interface (headers, client)
+        set_request_class(websocket)
+        enforce_rate_limit(websocket, VOICE_REQUEST_COST, "voice_ws")
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "error": e.detail})
+        await websocket.close(code=1008)
+        return
+    
+    request_class = REQUEST_CLASS.get()
+    
+    def transcribe(fn, *args):
+        """Each chunk (and the final flush) waits for a model slot, released before the answer takes its own"""
+        with scheduler.slot(VOICE_STREAM_FEATURES, 'speech', request_class, label="speech"):
+            return fn(*args)
+    
+    async def close_with_error(error: str):
+        log_event(logger, "voice_stream.closed", logging.WARNING, reason=error)
+        await websocket.send_json({"type": "error", "error": error})
+        await websocket.close(code=1008)
+    
+    subject = "General"
+    session_deadline = time.monotonic() + VOICE_MAX_SESSION_SECONDS
+    try:
+        transcriber = StreamingTranscriber(await run_in_threadpool(get_speech_recognizer))
+        while True:
+            session_left = session_deadline - time.monotonic()
+            try:
+                message = await asyncio.wait_for(websocket.receive(),
+                                                 max(min(VOICE_IDLE_TIMEOUT_SECONDS, session_left), 0))
+            except asyncio.TimeoutError:
+                if session_left <= VOICE_IDLE_TIMEOUT_SECONDS:
+                    await close_with_error(f"Voice sessions are limited to {VOICE_MAX_SESSION_SECONDS:g} seconds")
+                else:
+                    await close_with_error(f"No audio for {VOICE_IDLE_TIMEOUT_SECONDS:g} seconds")
+                return
+            if message.get("type") == "websocket.disconnect":
+                return
+            if message.get("bytes") is not None:
+                audio = pcm16_to_float(message["bytes"])
+                if transcriber.audio_seconds + len(audio) / SAMPLE_RATE > VOICE_MAX_STREAM_SECONDS:
+                    await close_with_error(f"Voice streams are limited to {VOICE_MAX_STREAM_SECONDS:g} seconds of audio")
+                    return
+                texts = await run_in_threadpool(transcribe, transcriber.feed, audio)
+                for text in texts:
+                    await websocket.send_json({"type": "partial", "text": text, "transcript": transcriber.transcript})
+                continue
+            
+            event = json.loads(message.get("text") or "{}")
+            if event.get("type") == "end":
+                break
+            subject = event.get("subject", subject)
+        
+        await run_in_threadpool(transcribe, transcriber.finish)
+        response = await run_in_threadpool(tracked, "voice", answer_transcript, transcriber, subject)
+        await websocket.send_json({"type": "response", **response.dict()})
+        await websocket.close()
+        
+    except WebSocketDisconnect:
+        return
+    except Exception as e:
+        log_event(logger, "voice_stream.failed", logging.ERROR, error=str(e), exc_info=True)
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close()
+
 # Subject-specific endpoints
 @app.get("/subjects")
 async def get_subjects():
@@ -256,44 +1145,330 @@ async def get_subjects():
 
 # Get conversation analytics
 @app.get("/analytics")
-async def get_analytics():
+async def get_analytics(since_seconds: Optional[float] = None, subject: Optional[str] = None):
     try:
-        if ai_assistant is None:
-            return {"error": "AI assistant not initialized"}
-        
-        history = getattr(ai_assistant, 'conversation_history', [])
-        
-        # Calculate some basic analytics
-        total_queries = len(history)
-        subjects = {}
-        query_types = {}
-        
-        for conversation in history:
-            subject = conversation.get('analysis', {}).get('subject', 'unknown')
-            query_type = conversation.get('analysis', {}).get('query_type', 'unknown')
-            
-            subjects[subject] = subjects.get(subject, 0) + 1
-            query_types[query_type] = query_types.get(query_type, 0) + 1
+        # Served from the durable log, so analytics survive restarts (SQLite runs off the event loop)
+        since = time.time() - since_seconds if since_seconds is not None else None
+        analytics = await run_in_threadpool(conversation_store.summarize, since=since, subject=subject)
+        analytics["window_seconds"] = since_seconds
+        analytics["subject_filter"] = subject
+        return analytics
         
+    except Exception as e:
+        return {"error": str(e)}
+
+# Engagement telemetry from the browsers' face-api.js monitors, aggregated per classroom for teacher
+# dashboards. Each classroom keeps its last ENGAGEMENT_CAPACITY samples in a ring buffer, for at most
+# ENGAGEMENT_MAX_CLASSROOMS classrooms, so memory is bounded (see /debug/engagement); a classroom that
+# sent samples within the longest window is never dropped for a new one, which gets a 429 instead.
+# State lives in this process: with several API nodes, route each classroom to one node.
+engagement_hub = EngagementHub(
+    capacity=int(os.environ.get("ENGAGEMENT_CAPACITY", 32768)),
+    max_classrooms=int(os.environ.get("ENGAGEMENT_MAX_CLASSROOMS", 200)),
+    max_students=int(os.environ.get("ENGAGEMENT_MAX_STUDENTS", 1024)),
+    windows=tuple(float(w) for w in os.environ.get("ENGAGEMENT_WINDOWS", "30,120,600").split(",")),
+    attention_threshold=float(os.environ.get("ENGAGEMENT_ATTENTION_THRESHOLD", 60)),
+    bucket_seconds=float(os.environ.get("ENGAGEMENT_TREND_BUCKET_SECONDS", 30))
+)
+ENGAGEMENT_MAX_BATCH = int(os.environ.get("ENGAGEMENT_MAX_BATCH", 5000))
+ENGAGEMENT_PUSH_SECONDS = float(os.environ.get("ENGAGEMENT_PUSH_SECONDS", 2))
+ENGAGEMENT_RETRY_AFTER = int(os.environ.get("ENGAGEMENT_RETRY_AFTER", 60))
+# Each batch (a browser sends one every 2 s) is charged against the sender's rate limit budget
+ENGAGEMENT_BATCH_COST = float(os.environ.get("RATE_LIMIT_ENGAGEMENT_COST", 0.25))
+# With ENGAGEMENT_INGEST_TOKEN set, sample senders must present it (X-Engagement-Token or ?token=);
+# with ENGAGEMENT_DASHBOARD_TOKEN set, so must dashboards, which show per-student data (X-Dashboard-Token or ?token=)
+ENGAGEMENT_INGEST_TOKEN = os.environ.get("ENGAGEMENT_INGEST_TOKEN")
+ENGAGEMENT_DASHBOARD_TOKEN = os.environ.get("ENGAGEMENT_DASHBOARD_TOKEN")
+
+def ingest_engagement(batch: Any, classroom_id: Optional[str] = None) -> Dict[str, int]:
+    """One batch of rows ("samples") or columns ("columns"); raises ValueError if malformed"""
+    if not isinstance(batch, dict):
+        raise ValueError("expected a JSON object")
+    classroom_id = str(batch.get("classroom_id") or classroom_id or "")
+    samples, columns = batch.get("samples"), batch.get("columns")
+    if samples is not None:
+        if not isinstance(samples, list):
+            raise ValueError("'samples' must be a list of rows")
+        count = len(samples)
+    elif isinstance(columns, dict) and all(isinstance(values, list) for values in columns.values()):
+        count = len(columns.get("student_id") or [])
+    else:
+        raise ValueError("expected 'samples' (a list of rows) or 'columns' (a list per field)")
+    if count > ENGAGEMENT_MAX_BATCH:
+        raise ValueError(f"At most {ENGAGEMENT_MAX_BATCH} samples per batch")
+    if samples is not None:
+        return engagement_hub.ingest(classroom_id, samples)
+    return engagement_hub.ingest_columns(classroom_id, columns)
+
+def presents_token(connection, expected: Optional[str], header: str) -> bool:
+    """True if no token is configured, or the connection sends it in `header` or as ?token="""
+    if not expected:
+        return True
+    # Browsers can't set headers on a WebSocket, hence the query parameter
+    token = connection.headers.get(header) or connection.query_params.get("token", "")
+    return hmac.compare_digest(token.encode(), expected.encode())
+
+def is_teacher(connection) -> bool:
+    """Dashboards show per-student data, so they need ENGAGEMENT_DASHBOARD_TOKEN when it is set"""
+    return presents_token(connection, ENGAGEMENT_DASHBOARD_TOKEN, "X-Dashboard-Token")
+
+def admit_engagement_sender(connection):
+    """403 without the ingest token, 429 when over the rate limit budget"""
+    if not presents_token(connection, ENGAGEMENT_INGEST_TOKEN, "X-Engagement-Token"):
+        raise HTTPException(status_code=403, detail="Engagement token required")
+    enforce_rate_limit(connection, ENGAGEMENT_BATCH_COST, "engagement_samples")
+
+def classroom_limit_error(e: ClassroomLimitReached) -> HTTPException:
+    return HTTPException(status_code=429, detail=f"{e}. Please retry later.",
+                         headers={"Retry-After": str(ENGAGEMENT_RETRY_AFTER)})
+
+@app.post("/engagement/samples")
+async def ingest_engagement_samples(http_request: Request):
+    """
+    A batch of engagement samples from one classroom:
+    {"classroom_id", "samples": [{"student_id", "score", "attention", ...}]} or the same as
+    {"classroom_id", "columns": {"student_id": [...], "score": [...], ...}}. The body is parsed
+    directly rather than through a pydantic model, which would validate every sample.
+    """
+    admit_engagement_sender(http_request)
+    try:
+        batch = json.loads(await http_request.body())
+        return ingest_engagement(batch, http_request.headers.get("X-Classroom-ID"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ClassroomLimitReached as e:
+        raise classroom_limit_error(e)
+
+@app.websocket("/engagement/samples/ws")
+async def engagement_stream(websocket: WebSocket):
+    """
+    Streamed ingest: each text frame is one batch as for POST /engagement/samples
+    (classroom_id may instead be given once as ?classroom_id=), acknowledged with
+    {"type": "ack", "accepted", "dropped"} or {"type": "error"}.
+    """
+    await websocket.accept()
+    if not presents_token(websocket, ENGAGEMENT_INGEST_TOKEN, "X-Engagement-Token"):
+        await websocket.send_json({"type": "error", "error": "Engagement token required"})
+        await websocket.close(code=1008)
+        return
+    classroom_id = websocket.query_params.get("classroom_id") or websocket.headers.get("X-Classroom-ID")
+    try:
+        while True:
+            message = await websocket.receive()
+            if message.get("type") == "websocket.disconnect":
+                return
+            try:
+                admit_engagement_sender(websocket)
+                result = ingest_engagement(json.loads(message.get("text") or "{}"), classroom_id)
+                await websocket.send_json({"type": "ack", **result})
+            except ValueError as e:
+                await websocket.send_json({"type": "error", "error": str(e)})
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "error": e.detail})
+            except ClassroomLimitReached as e:
+                await websocket.send_json({"type": "error", "error": str(e), "retry_after": ENGAGEMENT_RETRY_AFTER})
+    except WebSocketDisconnect:
+        return
+
+@app.get("/engagement/classrooms")
+async def engagement_classrooms(http_request: Request):
+    if not is_teacher(http_request):
+        raise HTTPException(status_code=403, detail="Dashboard token required")
+    return {"classrooms": engagement_hub.classrooms()}
+
+@app.get("/engagement/classrooms/{classroom_id}")
+async def engagement_aggregate(classroom_id: str, http_request: Request):
+    """Rolling-window attention and engagement, the trend, and students whose attention is low"""
+    if not is_teacher(http_request):
+        raise HTTPException(status_code=403, detail="Dashboard token required")
+    aggregate = engagement_hub.aggregate(classroom_id)
+    if aggregate is None:
+        raise HTTPException(status_code=404, detail="No engagement samples for this classroom")
+    return aggregate
+
+@app.websocket("/engagement/classrooms/{classroom_id}/ws")
+async def engagement_dashboard(websocket: WebSocket, classroom_id: str):
+    """Teacher dashboard: the classroom's aggregates every ENGAGEMENT_PUSH_SECONDS ({"type": "aggregate"})"""
+    await websocket.accept()
+    if not is_teacher(websocket):
+        await websocket.send_json({"type": "error", "error": "Dashboard token required"})
+        await websocket.close(code=1008)
+        return
+    
+    try:
+        while True:
+            aggregate = engagement_hub.aggregate(classroom_id)
+            if aggregate is None:
+                await websocket.send_json({"type": "waiting", "classroom_id": classroom_id})
+            else:
+                await websocket.send_json({"type": "aggregate", **aggregate})
+            # Wait out the interval, noticing if the dashboard closes meanwhile
+            try:
+                message = await asyncio.wait_for(websocket.receive(), ENGAGEMENT_PUSH_SECONDS)
+                if message.get("type") == "websocket.disconnect":
+                    return
+            except asyncio.TimeoutError:
+                pass
+    except WebSocketDisconnect:
+        return
+
+# The log holds students' raw questions: with HISTORY_TOKEN set, reading, compacting and clearing
+# it need the token (X-History-Token)
+HISTORY_TOKEN = os.environ.get("HISTORY_TOKEN")
+if not HISTORY_TOKEN:
+    print("⚠️ HISTORY_TOKEN is not set: /history, /history/compact and /clear-history are open to anyone")
+
+def require_history_token(http_request: Request):
+    if not presents_token(http_request, HISTORY_TOKEN, "X-History-Token"):
+        raise HTTPException(status_code=401, detail="History token required")
+
+# Recent conversations from the durable log
+@app.get("/history")
+async def get_history(http_request: Request, since_seconds: Optional[float] = None, subject: Optional[str] = None,
+                      query_type: Optional[str] = None, limit: int = 100):
+    require_history_token(http_request)
+    try:
+        since = time.time() - since_seconds if since_seconds is not None else None
         return {
-            "total_queries": total_queries,
-            "subjects": subjects,
-            "query_types": query_types,
-            "average_processing_time": sum(c.get('processing_time', 0) for c in history) / max(total_queries, 1)
+            "conversations": await run_in_threadpool(
+                conversation_store.query,
+                since=since, subject=subject, query_type=query_type, limit=min(limit, 1000)
+            )
         }
-        
+    except Exception as e:
+        return {"error": str(e)}
+
+# Admission control counters
+@app.get("/debug/rate-limits")
+async def rate_limit_stats():
+    return {"enabled": RATE_LIMIT_ENABLED, **rate_limiter.stats()}
+
+# On-demand profiling of live traffic; disabled unless DEBUG_TOKEN is set
+DEBUG_TOKEN = os.environ.get("DEBUG_TOKEN")
+MAX_PROFILE_SECONDS = float(os.environ.get("MAX_PROFILE_SECONDS", 60))
+
+def require_debug_token(http_request: Request):
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (set DEBUG_TOKEN)")
+    token = http_request.headers.get("X-Debug-Token", "")
+    if not hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid debug token")
+
+@app.get("/debug/profile")
+async def capture_profile(http_request: Request, seconds: float = 10, sample_interval_ms: float = 10):
+    """Profile live traffic for `seconds` and download a Chrome trace (chrome://tracing, Perfetto)"""
+    require_debug_token(http_request)
+    seconds = min(max(seconds, 0.5), MAX_PROFILE_SECONDS)
+    sample_interval_ms = min(max(sample_interval_ms, 1), 1000)
+    
+    try:
+        trace = await run_in_threadpool(PROFILER.capture, seconds, sample_interval_ms)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    return Response(
+        content=json.dumps(trace, default=str),
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/debug/coalescing")
+async def coalescing_stats():
+    return query_flights.stats()
+
+@app.get("/debug/scheduler")
+async def scheduler_stats():
+    """Per-class waits (p50/p95/max), queue by class, learned cost per request shape"""
+    return scheduler.stats()
+
+@app.get("/debug/engagement")
+async def engagement_stats():
+    """Samples accepted and dropped, classrooms, and buffer memory against its limit"""
+    return engagement_hub.stats()
+
+@app.get("/debug/semantic-cache")
+async def semantic_cache_stats():
+    """Entries, hit rate, answers gated out by labels and lookup latency"""
+    return semantic_cache.stats() if semantic_cache is not None else {"enabled": False}
+
+@app.get("/debug/cancellation")
+async def cancellation_stats():
+    """Requests and jobs cancelled, model calls aborted and estimated CPU time reclaimed (per calling thread)"""
+    return CANCELLATION.stats()
+
+@app.get("/debug/replicas")
+async def replica_stats():
+    """Per-replica cores, threads, queue and latency (replica mode only)"""
+    if not INFERENCE_REPLICAS:
+        return {"replicas": [], "mode": "in-process"}
+    if ai_assistant is None:
+        raise HTTPException(status_code=503, detail="AI models not ready")
+    return ai_assistant.stats()
+
+@app.get("/debug/queue")
+async def queue_stats():
+    """Broker queue depths, live workers and redeliveries (DEPLOY_MODE=api only)"""
+    if DEPLOY_MODE != "api":
+        return {"workers": [], "mode": DEPLOY_MODE}
+    if ai_assistant is None:
+        raise HTTPException(status_code=503, detail="No inference workers yet")
+    return await run_in_threadpool(ai_assistant.stats)
+
+@app.get("/debug/logging")
+async def logging_stats():
+    """Log queue backlog, records dropped on a full queue and events sampled out"""
+    return log_pipeline.stats()
+
+@app.get("/debug/load")
+async def load_stats():
+    """Degradation level, in-flight model runs and recent p95 latency"""
+    return {**load_governor.stats(), "visual_jobs_pending": visual_jobs.pending(),
+            "visual_jobs_rejected": visual_jobs.rejected}
+
+@app.get("/debug/visuals")
+async def visual_stats():
+    """Fast-path renderer hit rate and estimated diffusion latency saved"""
+    if ai_assistant is None:
+        raise HTTPException(status_code=503, detail="AI models not ready")
+    return ai_assistant.visual_router.stats()
+
+@app.get("/debug/memory")
+async def memory_stats():
+    """Per-model weight memory and peak activation memory per request type"""
+    models = getattr(ai_assistant, 'model_memory', {}) if ai_assistant is not None else {}
+    return {
+        "rss_bytes": rss_bytes(),
+        "cpu_supports_bf16": cpu_supports_bf16(),
+        "model_dtypes": getattr(ai_assistant, 'model_dtypes', None),
+        "models": models,
+        "total_parameter_bytes": sum(m['parameter_bytes'] for m in models.values()),
+        "total_model_rss_delta_bytes": sum(m['rss_delta_bytes'] for m in models.values()),
+        "activations": memory_monitor.stats()
+    }
+
+# Storage statistics and manual compaction
+@app.get("/history/stats")
+async def history_stats():
+    return conversation_store.stats()
+
+@app.post("/history/compact")
+async def compact_history(http_request: Request):
+    require_history_token(http_request)
+    try:
+        return await run_in_threadpool(conversation_store.compact)
     except Exception as e:
         return {"error": str(e)}
 
 # Clear conversation history
 @app.post("/clear-history")
-async def clear_history():
+async def clear_history(http_request: Request):
+    require_history_token(http_request)
     try:
-        if ai_assistant is not None:
-            if hasattr(ai_assistant, 'conversation_history'):
-                ai_assistant.conversation_history = []
-            return {"message": "Conversation history cleared successfully"}
-        return {"error": "AI assistant not initialized"}
+        await run_in_threadpool(conversation_store.clear)
+        if ai_assistant is not None and hasattr(ai_assistant, 'conversation_history'):
+            ai_assistant.conversation_history = []
+        return {"message": "Conversation history cleared successfully"}
     except Exception as e:
         return {"error": str(e)}
 
@@ -341,14 +1516,34 @@ async def root():
         "models_loaded": ai_assistant is not None,
         "endpoints": {
             "chat": "/chat",
+            "chat_batch": "/chat/batch",
+            "materials": "/materials",
+            "summarize": "/summarize",
+            "caption": "/caption",
             "voice": "/voice", 
+            "voice_ws": "/voice/ws",
             "health": "/health",
             "subjects": "/subjects",
             "analytics": "/analytics",
+            "engagement": "/engagement/samples",
+            "history": "/history",
             "images": "/images/list"
         }
     }
 
+# Requests waiting for a scheduler slot each hold a threadpool thread (THREADPOOL_SIZE)
+@app.on_event("startup")
+async def size_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+# Flush queued conversation writes before the process exits
+@app.on_event("shutdown")
+async def shutdown_event():
+    conversation_store.close()
+    log_pipeline.close()
+    if (INFERENCE_REPLICAS or DEPLOY_MODE == "api") and ai_assistant is not None:
+        ai_assistant.close()
+
 if __name__ == "__main__":
     print("🚀 Starting Advanced Classroom AI API...")
     port = int(os.environ.get("PORT", 8000))  # Use dynamic port from Render if available
@@ -0,0 +1,85 @@
+import argparse
+import random
+import shutil
+import tempfile
+import time
+import numpy as np
+from course_material import CourseMaterialIndex
+from embeddings import HashingEmbedder, load_embedder
+
+# Vocabulary for synthetic lesson text
+TOPICS = [
+    "photosynthesis chlorophyll light energy glucose oxygen leaves plants",
+    "newton force mass acceleration inertia motion momentum friction",
+    "cell nucleus mitochondria membrane ribosome protein organism",
+    "equation algebra variable linear quadratic solve coefficient graph",
+    "revolution empire treaty war century ancient civilization trade",
+    "atom electron proton neutron molecule bond reaction compound",
+    "climate continent ocean river mountain latitude weather map",
+    "algorithm program data loop function variable computer memory",
+]
+FILLER = "the student teacher lesson chapter example exercise notes page important study".split()
+
+
+def synthetic_document(rng: random.Random, words: int) -> str:
+    topic = rng.choice(TOPICS).split()
+    paragraphs = []
+    for _ in range(max(1, words // 80)):
+        paragraphs.append(' '.join(rng.choice(topic if rng.random() < 0.4 else FILLER) for _ in range(80)))
+    return '\n\n'.join(paragraphs)
+
+
+def percentile(values, q):
+    return float(np.percentile(np.array(values) * 1000, q))
+
+
+def run(chunks: int, queries: int, embedding_model: str, chunk_words: int = 200):
+    rng = random.Random(0)
+    embedder = HashingEmbedder() if embedding_model == "hashing" else load_embedder(embedding_model)
+    index_dir = tempfile.mkdtemp(prefix="course_index_bench_")
+
+    try:
+        index = CourseMaterialIndex(index_dir, embedder, chunk_words=chunk_words, overlap=0, max_segments=8)
+
+        # Bulk build: documents of ~50 chunks each until the target size is reached
+        start_time = time.perf_counter()
+        while index.stats()['chunks'] < chunks:
+            index.add_document(f"Chapter {index.stats()['documents'] + 1}", synthetic_document(rng, 50 * chunk_words))
+        build_time = time.perf_counter() - start_time
+        stats = index.stats()
+
+        # Incremental update: one more chapter on top of the built index
+        start_time = time.perf_counter()
+        index.add_document("New chapter", synthetic_document(rng, 10 * chunk_words))
+        update_time = time.perf_counter() - start_time
+
+        # Query latency (retrieval only; QA span extraction depends on the model)
+        questions = [' '.join(rng.sample(rng.choice(TOPICS).split(), 3)) + '?' for _ in range(queries)]
+        index.search(questions[0])  # Warm the memory maps
+        latencies = []
+        for question in questions:
+            start_time = time.perf_counter()
+            index.search(question, top_k=5)
+            latencies.append(time.perf_counter() - start_time)
+
+        print(f"📊 Course material index ({embedder.name}):")
+        print(f"   Chunks indexed: {stats['chunks']} in {stats['segments']} segments")
+        print(f"   Bulk build: {build_time:.2f} s ({stats['chunks'] / build_time:.0f} chunks/s)")
+        print(f"   Incremental update (10 chunks): {update_time * 1000:.1f} ms")
+        print(f"   Query latency: p50 {percentile(latencies, 50):.1f} ms, "
+              f"p95 {percentile(latencies, 95):.1f} ms, p99 {percentile(latencies, 99):.1f} ms")
+        target = "✅" if percentile(latencies, 95) < 100 else "❌"
+        print(f"   {target} p95 under 100 ms at {stats['chunks']} chunks")
+
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark course material index build, update and query")
+    parser.add_argument("--chunks", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--embedding-model", default="hashing",
+                        help="'hashing' for the model-free embedder, or a sentence-embedding model name")
+    args = parser.parse_args()
+    run(args.chunks, args.queries, args.embedding_model)
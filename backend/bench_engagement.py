@@ -0,0 +1,92 @@
+import argparse
+import json
+import random
+import time
+import numpy as np
+from engagement import EngagementHub, METRICS
+
+
+def make_batches(classrooms: int, students: int, columnar: bool, seed: int = 0):
+    """One JSON body per classroom per round, as the browsers would send every 2 s"""
+    rng = random.Random(seed)
+    bodies = []
+    for room in range(classrooms):
+        names = [f"student-{room}-{i}" for i in range(students)]
+        values = {name: [rng.randint(0, 100) for _ in names] for name in METRICS}
+        faces = [rng.random() > 0.1 for _ in names]
+        if columnar:
+            batch = {'classroom_id': f"room-{room}", 'columns': {'student_id': names, **values, 'face': faces}}
+        else:
+            batch = {'classroom_id': f"room-{room}", 'samples': [
+                {'student_id': name, **{metric: values[metric][i] for metric in METRICS}, 'face': faces[i],
+                 't': time.time() * 1000}
+                for i, name in enumerate(names)
+            ]}
+        bodies.append(json.dumps(batch).encode())
+    return bodies
+
+
+def measure_ingest(hub: EngagementHub, bodies, seconds: float):
+    """Parse and ingest request bodies round-robin for `seconds`: samples per second of wall and CPU time"""
+    samples = 0
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    while time.perf_counter() - wall_start < seconds:
+        for body in bodies:
+            batch = json.loads(body)
+            if 'samples' in batch:
+                samples += hub.ingest(batch['classroom_id'], batch['samples'])['accepted']
+            else:
+                samples += hub.ingest_columns(batch['classroom_id'], batch['columns'])['accepted']
+    return samples / (time.perf_counter() - wall_start), samples / (time.process_time() - cpu_start)
+
+
+def measure_aggregate(capacity: int, students: int, classrooms: int = 20, rounds: int = 5):
+    """Milliseconds per fresh aggregate (cache bypassed) over full buffers spanning the longest window, p50 and p99"""
+    hub = EngagementHub(capacity=capacity)
+    rng = np.random.default_rng(0)
+    now = time.time()
+    for room in range(classrooms):
+        columns = {name: rng.integers(0, 101, capacity).tolist() for name in METRICS}
+        hub.ingest_columns(f"room-{room}", {
+            'student_id': [f"student-{i % students}" for i in range(capacity)],
+            't': np.linspace(now - hub.windows[-1] + 1, now, capacity).tolist(),
+            **columns
+        })
+    latencies = []
+    for _ in range(rounds):
+        for classroom_id in hub.classrooms():
+            start_time = time.perf_counter()
+            hub.aggregate(classroom_id)
+            latencies.append(time.perf_counter() - start_time)
+            hub._classroom(classroom_id).cached = None
+    latencies = np.array(latencies) * 1000
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+
+def run(classrooms: int, students: int, seconds: float, capacity: int, max_classrooms: int):
+    print(f"📊 Engagement ingest: {classrooms} classrooms x {students} students, "
+          f"ring buffers of {capacity} samples, at most {max_classrooms} classrooms")
+    for columnar in (False, True):
+        hub = EngagementHub(capacity=capacity, max_classrooms=max_classrooms)
+        wall_rate, cpu_rate = measure_ingest(hub, make_batches(classrooms, students, columnar), seconds)
+        stats = hub.stats()
+        print(f"   {'columns' if columnar else 'rows':>7}: {wall_rate:>9,.0f} samples/s "
+              f"({cpu_rate:,.0f} per CPU second), {stats['buffered_samples']:,} buffered, "
+              f"{stats['memory_bytes'] / 2**20:.1f} MiB of {stats['memory_limit_bytes'] / 2**20:.1f} MiB limit, "
+              f"{stats['classrooms_evicted']} classrooms evicted")
+
+    p50, p99 = measure_aggregate(capacity, students)
+    print(f"📊 Aggregate (3 windows, trend, watchlist) over a full {capacity}-sample buffer: "
+          f"p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Engagement telemetry ingest throughput and aggregate latency")
+    parser.add_argument("--classrooms", type=int, default=200)
+    parser.add_argument("--students", type=int, default=40)
+    parser.add_argument("--seconds", type=float, default=5.0, help="Ingest duration per format")
+    parser.add_argument("--capacity", type=int, default=32768)
+    parser.add_argument("--max-classrooms", type=int, default=200,
+                        help="Below --classrooms, every batch evicts a classroom (worst case for memory churn)")
+    args = parser.parse_args()
+    run(args.classrooms, args.students, args.seconds, args.capacity, args.max_classrooms)
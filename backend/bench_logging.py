@@ -0,0 +1,147 @@
+import argparse
+import contextlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
+from structured_logging import REQUEST_ID, setup_logging, parse_sample_rates, get_logger, log_event
+
+QUERY = "Explain how photosynthesis turns light energy into glucose in plant leaves"
+ANALYSIS = {
+    'subject': 'biology', 'confidence': 0.87, 'query_type': 'explanation', 'needs_visual': False,
+    'complexity': 'intermediate', 'educational_level': 'high school'
+}
+HEALTH = {
+    'status': 'healthy', 'ai_models_ready': True, 'timestamp': '2025-01-01T09:00:00', 'initialization_status': 'ready',
+    'models_loaded': True, 'error_message': None, 'initialization_time': 312.4
+}
+
+logger = get_logger("bench")
+
+
+def request_with_prints():
+    """What one /chat request (plus the frontend's health poll) printed before structured logging"""
+    print(f"Health check: {HEALTH}")
+    print(f"Processing query: {QUERY[:100]}...")
+    print(f"\n🎓 Processing Educational Query: {QUERY}")
+    print("=" * 80)
+    print(f"🔍 Analyzing query: {QUERY}")
+    print(f"✅ Analysis completed: {ANALYSIS}")
+    print(f"📊 Analysis Results:")
+    print(f"   Subject: {ANALYSIS['subject']} (confidence: {ANALYSIS['confidence']:.2f})")
+    print(f"   Type: {ANALYSIS['query_type']}")
+    print(f"   Complexity: {ANALYSIS['complexity']}")
+    print(f"   Level: {ANALYSIS['educational_level']}")
+    print(f"   Needs Visual: {ANALYSIS['needs_visual']}")
+    print("\n📝 Generating educational response...")
+    print(f"\n✅ Processing completed in {1.234:.2f} seconds")
+    print("=" * 80)
+    print(f"Query processed in {1.25:.2f} seconds")
+
+
+def request_with_events():
+    """The same request's events now (app.py and ai_models.py)"""
+    REQUEST_ID.set(uuid.uuid4().hex)
+    log_event(logger, "health.check", logging.DEBUG, status=HEALTH['status'], initialization_status='ready')
+    log_event(logger, "query.processing", logging.DEBUG, query=QUERY, degradation='full')
+    log_event(logger, "query.analyzing", logging.DEBUG, query=QUERY, use_classifier=True)
+    log_event(logger, "query.analyzed", logging.DEBUG, **ANALYSIS)
+    log_event(logger, "query.processed", **ANALYSIS, visual_deferred=False, has_visual=False,
+              degradation='full', processing_time=1.234)
+    log_event(logger, "chat.answered", query_chars=len(QUERY), processing_time=1.25,
+              coalesced=False, degradation='full', success=True)
+
+
+class SlowSink:
+    """A log pipe that takes `delay` seconds per write, like a backed-up collector"""
+
+    def __init__(self, stream, delay: float):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text: str):
+        time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def measure(fn, requests: int, threads: int):
+    """Per request: caller wall time and caller CPU time, from `threads` threads logging at once; total CPU"""
+    walls = [[] for _ in range(threads)]
+    cpus = [[] for _ in range(threads)]
+
+    def run(wall_out, cpu_out):
+        for _ in range(requests // threads):
+            start_time, cpu_start = time.perf_counter(), time.thread_time()
+            fn()
+            cpu_out.append(time.thread_time() - cpu_start)
+            wall_out.append(time.perf_counter() - start_time)
+
+    workers = [threading.Thread(target=run, args=outs) for outs in zip(walls, cpus)]
+    cpu_start = time.process_time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return np.concatenate(walls), np.concatenate(cpus), cpu_start
+
+
+def run(requests: int, threads: int, sample_rates: str, sink_delay: float):
+    sink_dir = tempfile.mkdtemp(prefix="bench_logging_")
+    results = {}
+
+    # Before: synchronous prints to a line-buffered stdout, as in the container
+    path = os.path.join(sink_dir, "prints.log")
+    with open(path, "w", buffering=1) as sink, contextlib.redirect_stdout(SlowSink(sink, sink_delay) if sink_delay else sink):
+        walls, cpus, cpu_start = measure(request_with_prints, requests, threads)
+        total_cpu = time.process_time() - cpu_start
+    results['print (before)'] = (walls, cpus, total_cpu, os.path.getsize(path))
+
+    variants = [
+        ("json, INFO, sampled", "INFO", parse_sample_rates(sample_rates)),
+        ("json, INFO, unsampled", "INFO", {}),
+        ("json, DEBUG, unsampled", "DEBUG", {}),
+    ]
+    for name, level, rates in variants:
+        path = os.path.join(sink_dir, name.replace(", ", "_") + ".log")
+        with open(path, "w", buffering=1) as sink:
+            pipeline = setup_logging(level=level, fmt="json", sample_rates=rates, queue_size=1_000_000,
+                                     stream=SlowSink(sink, sink_delay) if sink_delay else sink)
+            walls, cpus, cpu_start = measure(request_with_events, requests, threads)
+            pipeline.close(timeout=600)  # The writer's formatting counts in total CPU, not on the request path
+            total_cpu = time.process_time() - cpu_start
+            stats = pipeline.stats()
+            dropped = stats['dropped_queue_full']
+        results[name] = (walls, cpus, total_cpu, os.path.getsize(path))
+        print(f"   {name}: writer woke {stats['writer_wakeups']} times for {stats['written']} records")
+        if dropped:
+            print(f"⚠️ {name}: {dropped} records dropped on a full queue")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request logging overhead: prints vs queued structured events")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=4, help="Request threads logging concurrently")
+    parser.add_argument("--sample-rates", default="query.processed=0.1,visual.rendered=0.1",
+                        help="LOG_SAMPLE_RATES for the sampled variant")
+    parser.add_argument("--sink-delay-ms", type=float, default=0.0,
+                        help="Simulate a slow log pipe: delay per write to the sink")
+    args = parser.parse_args()
+
+    results = run(args.requests, args.threads, args.sample_rates, args.sink_delay_ms / 1000)
+    print(f"📊 Logging overhead per request ({args.requests} requests, {args.threads} threads, "
+          f"sink delay {args.sink_delay_ms} ms)")
+    for name, (walls, cpus, total_cpu, size) in results.items():
+        print(f"   {name:<24} caller wall mean {np.mean(walls) * 1e6:8.1f} µs, p99 {np.percentile(walls, 99) * 1e6:8.1f} µs; "
+              f"caller CPU {np.mean(cpus) * 1e6:6.1f} µs; total CPU {total_cpu / len(walls) * 1e6:6.1f} µs; "
+              f"{size / len(walls):5.0f} B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import argparse
+import time
+from query_analyzer import KEYWORD_ENGINE
+from test_query_analyzer import QUERIES, legacy_analysis
+
+
+def run(repeats: int):
+    """Per-query cost of the legacy substring scans versus the single-pass keyword engine"""
+    queries = QUERIES * repeats
+
+    start_time = time.perf_counter()
+    for query in queries:
+        legacy_analysis(query)
+    legacy_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for query in queries:
+        KEYWORD_ENGINE.scan(query)
+    engine_time = time.perf_counter() - start_time
+
+    n = len(queries)
+    print(f"📊 Query analysis over {n} queries:")
+    print(f"   Legacy substring scans: {legacy_time / n * 1e6:.1f} µs/query")
+    print(f"   Keyword engine:         {engine_time / n * 1e6:.1f} µs/query")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keyword engine versus the legacy substring scans")
+    parser.add_argument("--repeats", type=int, default=200, help="Passes over the sample queries")
+    args = parser.parse_args()
+    run(args.repeats)
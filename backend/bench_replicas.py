@@ -0,0 +1,130 @@
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import numpy as np
+from loadtest import TEXT_QUESTIONS, VISUAL_QUESTIONS
+from replicas import ReplicaPool, available_cores
+
+
+def default_splits(cores: int):
+    """Every replicas x threads split that uses all the cores, from one wide replica to one per core"""
+    return [(replicas, cores // replicas) for replicas in range(1, cores + 1) if cores % replicas == 0]
+
+
+def parse_splits(text: str):
+    return [tuple(int(n) for n in split.lower().split('x')) for split in text.split(',')]
+
+
+def percentile(values, q):
+    return float(np.percentile(np.array(values) * 1000, q))
+
+
+def run_split(replicas: int, threads: int, cores, backend: str, requests: int, concurrency: int,
+              visual_ratio: float, warmup: int):
+    """Closed loop: `concurrency` clients send questions back to back until `requests` are answered"""
+    rng = random.Random(0)
+    questions = [
+        rng.choice(VISUAL_QUESTIONS if rng.random() < visual_ratio else TEXT_QUESTIONS)
+        for _ in range(warmup + requests)
+    ]
+    start_time = time.perf_counter()
+    pool = ReplicaPool(replicas, threads, backend=backend, cores=cores)
+    startup = time.perf_counter() - start_time
+
+    try:
+        # Warm-up: first calls pay for lazy initialization in every replica
+        for question in questions[:warmup]:
+            pool.process_educational_query(question)
+
+        remaining = iter(questions[warmup:])
+        lock = threading.Lock()
+        latencies, errors = [], 0
+
+        def client():
+            nonlocal errors
+            while True:
+                with lock:
+                    question = next(remaining, None)
+                if question is None:
+                    return
+                sent_at = time.perf_counter()
+                try:
+                    ok = pool.process_educational_query(question).get('success', False)
+                except Exception:
+                    ok = False
+                with lock:
+                    latencies.append(time.perf_counter() - sent_at)
+                    errors += not ok
+
+        start_time = time.perf_counter()
+        clients = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        wall = time.perf_counter() - start_time
+        served = [replica['served'] for replica in pool.stats()['replicas']]
+    finally:
+        pool.close()
+
+    return {
+        'replicas': replicas,
+        'threads_per_replica': threads,
+        'startup_seconds': startup,
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': requests / wall,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'served_per_replica': served
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare replicas x threads splits of the CPU for answer throughput and tail latency"
+    )
+    parser.add_argument("--cores", type=int, default=len(available_cores()), help="Cores to split (default: all usable)")
+    parser.add_argument("--splits", default=None, help="Comma-separated REPLICASxTHREADS, e.g. 1x16,2x8,4x4,8x2")
+    parser.add_argument("--backend", choices=("models", "fake"), default="models",
+                        help="'fake' burns one core per answer (FAKE_AI_MODE=cpu): checks routing, not thread scaling")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients (same for every split)")
+    parser.add_argument("--visual-ratio", type=float, default=0.0, help="Share of questions that need a visual")
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--output", default=None, help="Write the results as JSON here")
+    args = parser.parse_args()
+
+    splits = parse_splits(args.splits) if args.splits else default_splits(args.cores)
+    usable = available_cores()
+    if args.cores > len(usable):
+        print(f"⚠️ Only {len(usable)} usable cores: replicas will share cores, so the numbers are not representative")
+    cores = list(itertools.islice(itertools.cycle(usable), args.cores))
+    print(f"📊 Replica benchmark: {args.requests} requests, {args.concurrency} clients, backend {args.backend}")
+    results = []
+    for replicas, threads in splits:
+        result = run_split(replicas, threads, cores, args.backend, args.requests, args.concurrency,
+                           args.visual_ratio, args.warmup)
+        results.append(result)
+        print(f"   {replicas:3d} x {threads:2d} threads: {result['throughput_rps']:7.2f} req/s, "
+              f"p50 {result['p50_ms']:8.0f} ms, p99 {result['p99_ms']:8.0f} ms, "
+              f"errors {result['errors']}, load {result['served_per_replica']}")
+
+    best_throughput = max(results, key=lambda r: r['throughput_rps'])
+    best_p99 = min(results, key=lambda r: r['p99_ms'])
+    print(f"   ✅ Best throughput: {best_throughput['replicas']} x {best_throughput['threads_per_replica']} "
+          f"({best_throughput['throughput_rps']:.2f} req/s)")
+    print(f"   ✅ Best p99: {best_p99['replicas']} x {best_p99['threads_per_replica']} ({best_p99['p99_ms']:.0f} ms)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results,
+                       'best_throughput': best_throughput, 'best_p99': best_p99}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
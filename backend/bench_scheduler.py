@@ -0,0 +1,88 @@
+import argparse
+import random
+import threading
+import time
+import numpy as np
+from scheduler import CostModel, CostScheduler
+
+TEXT = {'query_type': 'explanation', 'complexity': 'basic'}
+
+
+def simulate(policy: str, requests: int, visual_ratio: float, teacher_ratio: float, text_seconds: float,
+             visual_seconds: float, interval: float, slots: int, aging: float, head_start: float, seed: int = 0):
+    """
+    Replay one classroom burst through the scheduler: sleeps stand in for
+    model runs. Returns every request's (kind, class, wait, latency).
+    """
+    rng = random.Random(seed)
+    model = CostModel()
+    # Learned from earlier traffic (the scheduler's cost model starts from stage history otherwise)
+    model.observe('text:explanation:basic', text_seconds)
+    model.observe('text+diffusion:explanation:basic', text_seconds + visual_seconds)
+    scheduler = CostScheduler(slots=slots, aging=aging, policy=policy, cost_model=model,
+                              classes={'teacher': 0.0, 'student': head_start})
+
+    # A visual arrives right behind the running request, then the rest of the class
+    specs = [('text', 'student'), ('text+diffusion', 'student')] + [
+        ('text+diffusion' if rng.random() < visual_ratio else 'text',
+         'teacher' if rng.random() < teacher_ratio else 'student')
+        for _ in range(requests - 2)
+    ]
+    results = []
+    lock = threading.Lock()
+
+    def request(kind, request_class):
+        arrived = time.perf_counter()
+        with scheduler.slot(TEXT, kind, request_class):
+            started = time.perf_counter()
+            time.sleep(text_seconds + (visual_seconds if kind != 'text' else 0.0))
+        with lock:
+            results.append((kind, request_class, started - arrived, time.perf_counter() - arrived))
+
+    threads = []
+    for kind, request_class in specs:
+        threads.append(threading.Thread(target=request, args=(kind, request_class)))
+        threads[-1].start()
+        time.sleep(interval)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(results, kind=None, request_class=None):
+    latencies = [r[3] for r in results if (kind is None or r[0] == kind) and (request_class is None or r[1] == request_class)]
+    if not latencies:
+        return "-"
+    return f"mean {np.mean(latencies):6.2f} s, p95 {np.percentile(latencies, 95):6.2f} s, max {max(latencies):6.2f} s (n={len(latencies)})"
+
+
+def run(requests: int, visual_ratio: float, teacher_ratio: float, text_seconds: float, visual_seconds: float,
+        interval: float, slots: int, aging: float, head_start: float):
+    print(f"📊 Scheduling {requests} requests, {slots} slot(s): text {text_seconds}s, "
+          f"visual +{visual_seconds}s, {visual_ratio:.0%} visual, {teacher_ratio:.0%} teacher, aging {aging}, "
+          f"teacher head start {head_start}s")
+    for policy in ("fifo", "sjf"):
+        results = simulate(policy, requests, visual_ratio, teacher_ratio, text_seconds, visual_seconds,
+                           interval, slots, aging, head_start)
+        print(f"   {policy}:")
+        print(f"      text-only latency  {summarize(results, kind='text')}")
+        print(f"      visual latency     {summarize(results, kind='text+diffusion')}")
+        print(f"      teacher latency    {summarize(results, request_class='teacher')}")
+        print(f"      student latency    {summarize(results, request_class='student')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FIFO vs shortest-expected-job-first with priority classes")
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--visual-ratio", type=float, default=0.1)
+    parser.add_argument("--teacher-ratio", type=float, default=0.1)
+    parser.add_argument("--text-seconds", type=float, default=0.05, help="Scaled-down text answer time")
+    parser.add_argument("--visual-seconds", type=float, default=1.0, help="Scaled-down diffusion time")
+    parser.add_argument("--interval", type=float, default=0.01, help="Seconds between arrivals")
+    parser.add_argument("--slots", type=int, default=1)
+    parser.add_argument("--aging", type=float, default=0.5)
+    parser.add_argument("--head-start", type=float, default=1.0,
+                        help="Teacher head start over students, in (scaled) seconds of expected work")
+    args = parser.parse_args()
+    run(args.requests, args.visual_ratio, args.teacher_ratio, args.text_seconds, args.visual_seconds,
+        args.interval, args.slots, args.aging, args.head_start)
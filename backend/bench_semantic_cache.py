@@ -0,0 +1,154 @@
+import argparse
+import random
+import time
+import numpy as np
+from typing import Optional
+from embeddings import HashingEmbedder, load_embedder
+from semantic_cache import SemanticCache, default_threshold
+
+# Labeled paraphrase set: the first question of each group is cached, the rest should hit it
+PARAPHRASES = [
+    ["What is photosynthesis?", "explain photosynthesis", "define photosynthesis",
+     "Can you explain what photosynthesis is?", "Tell me about photosynthesis"],
+    ["What is gravity?", "Explain gravity", "define gravity please", "what's gravity"],
+    ["What is an atom?", "Define an atom", "explain what an atom is", "Tell me about atoms"],
+    ["What is a prime number?", "Define a prime number", "Explain prime numbers", "what are prime numbers"],
+    ["What is the water cycle?", "Describe the water cycle", "explain the water cycle"],
+    ["What is DNA?", "Explain DNA", "tell me what DNA is", "Define DNA."],
+    ["What is an algorithm?", "Define algorithm", "Explain what an algorithm is", "what are algorithms"],
+    ["What is a chemical reaction?", "Explain chemical reactions", "define a chemical reaction"],
+    ["What is the French Revolution?", "Tell me about the French Revolution", "Explain the French Revolution"],
+    ["What is Newton's first law of motion?", "Explain Newton's first law of motion",
+     "Describe Newton's first law of motion"],
+    ["What is a cell?", "Define a cell", "Explain what a cell is"],
+    ["What is climate change?", "Explain climate change", "tell me about climate change"],
+    ["What is a metaphor in a poem?", "Explain metaphor in a poem", "define metaphor in a poem"],
+    ["How does photosynthesis work?", "How does photosynthesis work in plants?",
+     "Explain how photosynthesis works"],
+    ["What is the Pythagorean theorem?", "Explain the Pythagorean theorem", "State the Pythagorean theorem"],
+    ["Solve 2x + 3 = 7", "solve 2x+3=7", "Solve the equation 2x + 3 = 7"],
+    ["What causes the seasons?", "Why do we have seasons?", "What causes seasons on Earth?"],
+    ["What is kinetic energy?", "Define kinetic energy", "Explain kinetic energy"],
+]
+
+# Near misses: related questions that need a different answer, so must not hit any cached question
+NEGATIVES = [
+    "What are the products of photosynthesis?",
+    "What is cellular respiration?",
+    "What is gravity on the moon?",
+    "What is an atom made of in college chemistry?",
+    "What is a composite number?",
+    "What is the nitrogen cycle?",
+    "What is RNA?",
+    "What is a sorting algorithm?",
+    "What is a nuclear reaction?",
+    "What is the American Revolution?",
+    "What is Newton's second law of motion?",
+    "What is a cell membrane?",
+    "What is climate?",
+    "What is a simile in a poem?",
+    "How does respiration work?",
+    "What is the Pythagorean theorem for university research?",
+    "Solve 3x + 3 = 7",
+    "What causes earthquakes?",
+    "What is potential energy?",
+    "Explain photosynthesis at university level",
+    "Draw a diagram of photosynthesis",
+    "Who discovered gravity?",
+    "What is the history of the atom?",
+]
+
+FILLER_WORDS = ("force energy cell atom equation history climate poem algorithm reaction wave map river "
+                "planet protein number graph empire molecule circuit volcano").split()
+
+
+def evaluate(embedder, thresholds):
+    """Precision/recall of cache hits on the labeled set, one row per threshold"""
+    rows = []
+    for threshold in thresholds:
+        cache = SemanticCache(embedder, threshold=threshold)
+        for group, questions in enumerate(PARAPHRASES):
+            cache.store(questions[0], {'group': group})
+        correct = wrong = 0
+        positives = sum(len(questions) - 1 for questions in PARAPHRASES)
+        for group, questions in enumerate(PARAPHRASES):
+            for question in questions[1:]:
+                hit = cache.lookup(question)
+                if hit is not None:
+                    correct += hit['result']['group'] == group
+                    wrong += hit['result']['group'] != group
+        false_hits = sum(cache.lookup(question) is not None for question in NEGATIVES)
+        hits = correct + wrong + false_hits
+        rows.append({
+            'threshold': threshold,
+            'precision': correct / hits if hits else 1.0,
+            'recall': correct / positives,
+            'false_hits': wrong + false_hits,
+            'gated_out': cache.stats()['gated_out']
+        })
+    return rows
+
+
+def measure_latency(embedder, sizes, queries, ann_min_entries, threshold):
+    """Lookup latency at each cache size, brute force vs IVF, and how many brute-force hits IVF also finds"""
+    rng = random.Random(0)
+    questions = [q for group in PARAPHRASES for q in group[1:]]
+    rows = []
+    for size in sizes:
+        filler = [f"What is the {' '.join(rng.sample(FILLER_WORDS, 4))} {i}?" for i in range(size)]
+        results = {}
+        for mode, min_entries in (("brute_force", size + len(PARAPHRASES) + 1), ("ivf", min(ann_min_entries, size))):
+            cache = SemanticCache(embedder, threshold=threshold, max_entries=size + len(PARAPHRASES),
+                                  ann_min_entries=min_entries)
+            for question in filler:
+                cache.store(question, {'group': None})
+            for group, group_questions in enumerate(PARAPHRASES):
+                cache.store(group_questions[0], {'group': group})
+            latencies, answers = [], []
+            for i in range(queries):
+                question = questions[i % len(questions)]
+                start_time = time.perf_counter()
+                hit = cache.lookup(question)
+                latencies.append(time.perf_counter() - start_time)
+                answers.append(hit['query'] if hit else None)
+            results[mode] = (np.array(latencies) * 1000, answers, cache.stats()['index'])
+        found = [a == b for a, b in zip(results['brute_force'][1], results['ivf'][1]) if a is not None]
+        agreement = np.mean(found) if found else 1.0
+        rows.append({'size': size, 'agreement': agreement,
+                     **{mode: (float(np.percentile(lat, 50)), float(np.percentile(lat, 99)), index)
+                        for mode, (lat, _, index) in results.items()}})
+    return rows
+
+
+def run(embedding_model: str, thresholds, sizes, queries: int, ann_min_entries: int, threshold: Optional[float]):
+    embedder = HashingEmbedder() if embedding_model == "hashing" else load_embedder(embedding_model)
+    if threshold is None:
+        threshold = default_threshold(embedder.name)
+
+    print(f"📊 Semantic cache on the labeled paraphrase set ({embedder.name}): "
+          f"{len(PARAPHRASES)} cached questions, {sum(len(g) - 1 for g in PARAPHRASES)} paraphrases, "
+          f"{len(NEGATIVES)} near misses")
+    for row in evaluate(embedder, thresholds):
+        print(f"   threshold {row['threshold']:.2f}: precision {row['precision']:.3f}, recall {row['recall']:.3f}, "
+              f"false hits {row['false_hits']}, gated out by labels {row['gated_out']}")
+
+    print(f"📊 Lookup latency (embedding + search), p50 / p99, threshold {threshold}:")
+    for row in measure_latency(embedder, sizes, queries, ann_min_entries, threshold):
+        brute, ivf = row['brute_force'], row['ivf']
+        print(f"   {row['size']:>7} entries: brute force {brute[0]:.2f} / {brute[1]:.2f} ms, "
+              f"{ivf[2]} {ivf[0]:.2f} / {ivf[1]:.2f} ms, IVF finds {row['agreement']:.1%} of brute-force hits")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Semantic cache precision/recall and lookup latency")
+    parser.add_argument("--embedding-model", default="hashing",
+                        help="'hashing' for the model-free embedder, or a sentence-embedding model name")
+    parser.add_argument("--thresholds", default="0.6,0.7,0.8,0.85,0.9,0.95")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="Threshold for the latency runs (default: the embedder's tuned threshold)")
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--ann-min-entries", type=int, default=4096)
+    args = parser.parse_args()
+    run(args.embedding_model, [float(t) for t in args.thresholds.split(",")],
+        [int(s) for s in args.sizes.split(",")], args.queries, args.ann_min_entries, args.threshold)
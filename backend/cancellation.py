@@ -0,0 +1,199 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Any
+
+
+class RequestCancelled(BaseException):
+    """
+    Raised inside model work once nobody is waiting for the result. A
+    BaseException (like asyncio.CancelledError) so the pipeline's
+    `except Exception` fallbacks don't turn it into a canned answer.
+    """
+
+
+class CancelToken:
+    """
+    Cancellation flag for one unit of model work, shared by every request
+    waiting on it. Checked between generation steps (stopping criterion),
+    between diffusion steps (step callback) and before queued work starts.
+    """
+
+    def __init__(self, timeout_seconds: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout_seconds if timeout_seconds else None
+        self.reason: Optional[str] = None
+        self.waiters = 0
+        self._lock = threading.Lock()
+        self._events = []  # Set on cancel, so blocked threads wake at once instead of polling
+
+    def extend(self, timeout_seconds: Optional[float]):
+        """A new waiter's deadline: the work may run until the last waiter's time is up"""
+        if self.deadline is None:
+            return
+        if timeout_seconds is None:
+            self.deadline = None
+        else:
+            self.deadline = max(self.deadline, time.monotonic() + timeout_seconds)
+
+    def cancel(self, reason: str = "cancelled"):
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+            events = list(self._events)
+        for event in events:
+            event.set()
+
+    def watch(self, event: threading.Event):
+        """Set `event` when the token is cancelled (at once if it already is); a timeout sets nothing"""
+        with self._lock:
+            self._events.append(event)
+            if self.reason is None:
+                return
+        event.set()
+
+    def unwatch(self, event: threading.Event):
+        with self._lock:
+            if event in self._events:
+                self._events.remove(event)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the deadline (None without one)"""
+        return max(self.deadline - time.monotonic(), 0.0) if self.deadline is not None else None
+
+    @property
+    def cancelled(self) -> bool:
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.reason = "timeout"
+        return self.reason is not None
+
+    def check(self):
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+    def diffusion_callback(self, pipe, step: int, timestep, callback_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """callback_on_step_end for diffusers pipelines: abort between denoising steps"""
+        self.check()
+        return callback_kwargs
+
+
+class CancellationTracker:
+    """
+    Shares cancel tokens between coalesced requests and counts what
+    cancellation saved. A token is cancelled only when every request waiting
+    on the work has gone. Model calls run under `stage()`, which learns the
+    typical wall and CPU time of each call from completed runs; an aborted
+    call is credited with the CPU time it would still have used, and work
+    dropped before it started with a whole typical run. CPU time is the
+    calling thread's (time.thread_time), so concurrent requests aren't
+    credited with each other's work; threads a model library spins up
+    inside a call aren't counted, so the CPU figures are lower bounds.
+    """
+
+    def __init__(self, smoothing: float = 0.2):
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, CancelToken] = {}
+        self._typical: Dict[str, Dict[str, float]] = {}
+        self._counters = {
+            'cancelled_requests': 0,
+            'by_reason': {},
+            'aborted_calls': {},
+            'skipped': {},
+            'reclaimed_cpu_seconds': 0.0,
+            'reclaimed_wall_seconds': 0.0,
+            'wasted_cpu_seconds': 0.0
+        }
+
+    def join(self, key: str, timeout_seconds: Optional[float] = None) -> CancelToken:
+        """
+        Token for the work behind `key`; the caller counts as waiting on it. Joining
+        extends the token's deadline to the caller's own, so an earlier waiter's
+        timeout doesn't cut the newcomer short (each waiter enforces its own).
+        """
+        with self._lock:
+            token = self._tokens.get(key)
+            if token is None or token.cancelled:
+                token = self._tokens[key] = CancelToken(timeout_seconds)
+            else:
+                token.extend(timeout_seconds)
+            token.waiters += 1
+            return token
+
+    def leave(self, key: str, token: CancelToken, abandoned: bool = False, reason: str = "client disconnected"):
+        """Stop waiting; the last waiter to abandon the work cancels it"""
+        with self._lock:
+            token.waiters -= 1
+            if token.waiters > 0:
+                return
+            if self._tokens.get(key) is token:
+                del self._tokens[key]
+            if not abandoned:
+                return
+            token.cancel(reason)
+            self._counters['cancelled_requests'] += 1
+            by_reason = self._counters['by_reason']
+            by_reason[reason] = by_reason.get(reason, 0) + 1
+
+    def _learn(self, label: str, wall: float, cpu: float):
+        typical = self._typical.get(label)
+        if typical is None:
+            self._typical[label] = {'wall': wall, 'cpu': cpu, 'runs': 1}
+            return
+        typical['wall'] += self.smoothing * (wall - typical['wall'])
+        typical['cpu'] += self.smoothing * (cpu - typical['cpu'])
+        typical['runs'] += 1
+
+    @contextmanager
+    def stage(self, label: str, token: Optional[CancelToken] = None):
+        """
+        Time one model call. Raises RequestCancelled after the call if the
+        token tripped during it (generate() stops early rather than raising).
+        """
+        if token is not None and token.cancelled:
+            self.skip(label)
+            raise RequestCancelled(token.reason)
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+            if token is not None:
+                token.check()
+        except RequestCancelled:
+            wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+            with self._lock:
+                typical = self._typical.get(label, {'wall': 0.0, 'cpu': 0.0})
+                remaining = max(0.0, 1 - wall / typical['wall']) if typical['wall'] else 0.0
+                aborted = self._counters['aborted_calls']
+                aborted[label] = aborted.get(label, 0) + 1
+                self._counters['reclaimed_cpu_seconds'] += typical['cpu'] * remaining
+                self._counters['reclaimed_wall_seconds'] += typical['wall'] * remaining
+                self._counters['wasted_cpu_seconds'] += cpu
+            raise
+        wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+        with self._lock:
+            self._learn(label, wall, cpu)
+
+    def observe(self, label: str, wall: float, cpu: float):
+        """Record a completed run that skip() may later be credited with"""
+        with self._lock:
+            self._learn(label, wall, cpu)
+
+    def skip(self, label: str):
+        """Work dropped before it started (queued request or job)"""
+        with self._lock:
+            typical = self._typical.get(label, {'wall': 0.0, 'cpu': 0.0})
+            skipped = self._counters['skipped']
+            skipped[label] = skipped.get(label, 0) + 1
+            self._counters['reclaimed_cpu_seconds'] += typical['cpu']
+            self._counters['reclaimed_wall_seconds'] += typical['wall']
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **{k: (dict(v) if isinstance(v, dict) else v) for k, v in self._counters.items()},
+                'waiting_tokens': len(self._tokens),
+                'typical_seconds': {label: dict(t) for label, t in self._typical.items()}
+            }
+
+
+# Shared by the API and the model code
+CANCELLATION = CancellationTracker()
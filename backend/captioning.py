@@ -0,0 +1,175 @@
+import io
+import logging
+import hashlib
+import contextvars
+import threading
+import queue
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Optional, Any, Callable, Sequence
+import numpy as np
+from PIL import Image
+from structured_logging import get_logger, log_event
+
+logger = get_logger("captioning")
+
+# BLIP base preprocessing defaults (overridden by the loaded processor's config)
+BLIP_IMAGE_SIZE = 384
+BLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+BLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def preprocess_image(data: bytes, size: int = BLIP_IMAGE_SIZE, mean: Sequence[float] = BLIP_MEAN,
+                     std: Sequence[float] = BLIP_STD) -> np.ndarray:
+    """
+    Decode, resize and normalize one image into a (3, size, size) float32 array.
+    JPEGs are decoded at reduced scale (draft mode) when they are much larger
+    than the target, and the pixel data is converted to NumPy exactly once.
+    """
+    image = Image.open(io.BytesIO(data))
+    if image.format == 'JPEG':
+        # Let the decoder skip DCT detail we would throw away when resizing
+        image.draft('RGB', (size, size))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if image.size != (size, size):
+        image = image.resize((size, size), Image.BICUBIC, reducing_gap=3.0)
+
+    pixels = np.asarray(image, dtype=np.float32)  # The only PIL -> NumPy copy
+    scale = np.asarray(std, dtype=np.float32) * 255.0
+    pixels -= np.asarray(mean, dtype=np.float32) * 255.0
+    pixels /= scale
+    return np.ascontiguousarray(pixels.transpose(2, 0, 1))
+
+
+class ImageCaptioner:
+    """
+    Micro-batching captioner. Images from concurrent requests are decoded in a
+    thread pool, then a single worker gathers whatever is ready (up to
+    `max_batch_size`, waiting at most `max_wait_ms` for stragglers) into one
+    batched generate call. Captions are cached by image content hash, and
+    identical images already in flight share one result. A batch's generate
+    call runs in the context (contextvars) of the request that sent its
+    first image.
+    """
+
+    def __init__(self, caption_batch: Callable[[np.ndarray], List[str]], image_size: int = BLIP_IMAGE_SIZE,
+                 mean: Sequence[float] = BLIP_MEAN, std: Sequence[float] = BLIP_STD, max_batch_size: int = 8,
+                 max_wait_ms: float = 25, preprocess_workers: int = 2, cache_size: int = 1024):
+        self.caption_batch = caption_batch
+        self.image_size = image_size
+        self.mean = tuple(mean)
+        self.std = tuple(std)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+
+        self._preprocess = ThreadPoolExecutor(max_workers=preprocess_workers, thread_name_prefix="caption-preprocess")
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._counters = {
+            'images': 0,
+            'cache_hits': 0,
+            'coalesced': 0,
+            'batches': 0,
+            'batched_images': 0,
+            'preprocess_seconds': 0.0,
+            'generate_seconds': 0.0
+        }
+        self._worker = threading.Thread(target=self._worker_loop, name="captioner", daemon=True)
+        self._worker.start()
+
+    def caption(self, images: List[bytes], timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Caption raw image files; blocks until every caption is ready"""
+        entries = [self._submit(data) for data in images]
+        results = []
+        for key, cached, future in entries:
+            if future is None:
+                results.append({'caption': cached, 'image_hash': key, 'cached': True})
+            else:
+                results.append({'caption': future.result(timeout=timeout), 'image_hash': key, 'cached': False})
+        return results
+
+    def _submit(self, data: bytes):
+        key = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._counters['images'] += 1
+            caption = self._cache.get(key)
+            if caption is not None:
+                self._cache.move_to_end(key)
+                self._counters['cache_hits'] += 1
+                return key, caption, None
+            future = self._inflight.get(key)
+            if future is not None:
+                self._counters['coalesced'] += 1
+                return key, None, future
+            future = Future()
+            self._inflight[key] = future
+
+        self._preprocess.submit(self._prepare, key, data, future, contextvars.copy_context())
+        return key, None, future
+
+    def _prepare(self, key: str, data: bytes, future: Future, context: contextvars.Context):
+        start_time = time.perf_counter()
+        try:
+            pixels = preprocess_image(data, self.image_size, self.mean, self.std)
+        except Exception as e:
+            self._finish(key, future, error=e)
+            return
+        with self._lock:
+            self._counters['preprocess_seconds'] += time.perf_counter() - start_time
+        self._queue.put((key, pixels, future, context))
+
+    def _finish(self, key: str, future: Future, caption: Optional[str] = None, error: Optional[Exception] = None):
+        with self._lock:
+            self._inflight.pop(key, None)
+            if error is None:
+                self._cache[key] = caption
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        if error is None:
+            future.set_result(caption)
+        else:
+            future.set_exception(error)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker_loop(self):
+        while True:
+            batch = self._next_batch()
+            start_time = time.perf_counter()
+            try:
+                captions = batch[0][3].run(self.caption_batch, np.stack([pixels for _, pixels, _, _ in batch]))
+            except Exception as e:
+                log_event(logger, "caption.batch_failed", logging.ERROR, error=str(e), batch_size=len(batch))
+                for key, _, future, _ in batch:
+                    self._finish(key, future, error=e)
+                continue
+
+            with self._lock:
+                self._counters['batches'] += 1
+                self._counters['batched_images'] += len(batch)
+                self._counters['generate_seconds'] += time.perf_counter() - start_time
+            for (key, _, future, _), caption in zip(batch, captions):
+                self._finish(key, future, caption=caption.strip())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['cache_entries'] = len(self._cache)
+            stats['queued'] = self._queue.qsize()
+        stats['mean_batch_size'] = stats['batched_images'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
@@ -0,0 +1,333 @@
+import sqlite3
+import threading
+import queue
+import json
+import time
+import os
+from typing import Dict, List, Optional, Any
+
+
+class ConversationStore:
+    """
+    Durable conversation log backed by SQLite in WAL mode.
+    Writes are queued and flushed in batches by a background thread so the
+    request path never waits on disk I/O.
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 64, flush_interval: float = 0.5,
+                 retention_days: float = 30, max_rows: int = 100000,
+                 compaction_interval: float = 3600, max_pending: int = 10000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.max_rows = max_rows
+        self.compaction_interval = compaction_interval
+
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # 'rejected' rows never made it into the full queue; 'failed' ones were queued but their write failed
+        self._counters = {'enqueued': 0, 'written': 0, 'rejected': 0, 'failed': 0, 'batches': 0}
+        self._last_compaction = None
+        self._last_compaction_result = None
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            self._create_schema(conn)
+        finally:
+            conn.close()
+
+        self._writer = threading.Thread(target=self._writer_loop, name="conversation-store-writer", daemon=True)
+        self._writer.start()
+        print(f"🗄 Conversation log stored at: {self.db_path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the pragmas every reader and writer needs"""
+        conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # auto_vacuum only takes effect on a new database before anything else touches it,
+        # including the switch to WAL
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        """Create table and indexes used by the analytics range queries"""
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp REAL NOT NULL,
+                query TEXT NOT NULL,
+                response TEXT,
+                subject TEXT,
+                query_type TEXT,
+                complexity TEXT,
+                educational_level TEXT,
+                confidence REAL,
+                needs_visual INTEGER,
+                has_visual INTEGER,
+                processing_time REAL,
+                analysis TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_conversations_timestamp
+                ON conversations(timestamp);
+            CREATE INDEX IF NOT EXISTS idx_conversations_subject_timestamp
+                ON conversations(subject, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_conversations_query_type_timestamp
+                ON conversations(query_type, timestamp);
+        """)
+        conn.commit()
+        # Databases created before auto_vacuum was set need one full VACUUM to switch it on
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("VACUUM")
+
+    def record(self, entry: Dict[str, Any]) -> bool:
+        """Queue a conversation entry for writing; never blocks the caller"""
+        try:
+            self._pending.put_nowait(entry)
+        except queue.Full:
+            self._count('rejected')
+            return False
+        self._count('enqueued')
+        return True
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _to_row(self, entry: Dict[str, Any]) -> tuple:
+        analysis = entry.get('analysis') or {}
+        confidence = analysis.get('confidence')
+        return (
+            float(entry.get('timestamp', time.time())),
+            entry.get('query', ''),
+            entry.get('response'),
+            analysis.get('subject'),
+            analysis.get('query_type'),
+            analysis.get('complexity'),
+            analysis.get('educational_level'),
+            float(confidence) if confidence is not None else None,
+            int(bool(analysis.get('needs_visual'))),
+            int(bool(entry.get('has_visual'))),
+            entry.get('processing_time'),
+            json.dumps(analysis, default=_json_default)
+        )
+
+    def _writer_loop(self):
+        """Drain the queue in batches, one transaction per batch"""
+        conn = self._connect()
+        try:
+            while not self._stop.is_set() or not self._pending.empty():
+                batch = []
+                try:
+                    batch.append(self._pending.get(timeout=self.flush_interval))
+                    while len(batch) < self.batch_size:
+                        batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    pass
+
+                # flush() markers: everything queued before one is written (or failed) once it is reached
+                markers = [item for item in batch if isinstance(item, threading.Event)]
+                batch = [item for item in batch if not isinstance(item, threading.Event)]
+                if batch:
+                    try:
+                        with conn:
+                            conn.executemany("""
+                                INSERT INTO conversations (
+                                    timestamp, query, response, subject, query_type, complexity,
+                                    educational_level, confidence, needs_visual, has_visual,
+                                    processing_time, analysis
+                                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            """, [self._to_row(entry) for entry in batch])
+                        with self._lock:
+                            self._counters['written'] += len(batch)
+                            self._counters['batches'] += 1
+                    except Exception as e:
+                        self._count('failed', len(batch))
+                        print(f"⚠️ Conversation log write failed: {e}")
+                for marker in markers:
+                    marker.set()
+
+                if self._compaction_due():
+                    try:
+                        self._compact(conn)
+                    except Exception as e:
+                        print(f"⚠️ Conversation log compaction failed: {e}")
+        finally:
+            conn.close()
+
+    def _compaction_due(self) -> bool:
+        if self.compaction_interval is None:
+            return False
+        if self._last_compaction is None:
+            self._last_compaction = time.time()
+            return False
+        return time.time() - self._last_compaction >= self.compaction_interval
+
+    def _compact(self, conn: sqlite3.Connection) -> Dict[str, Any]:
+        """Apply retention limits, then return freed pages to the filesystem"""
+        start_time = time.time()
+        deleted = 0
+
+        with conn:
+            if self.retention_days:
+                cutoff = time.time() - self.retention_days * 86400
+                deleted += conn.execute(
+                    "DELETE FROM conversations WHERE timestamp < ?", (cutoff,)
+                ).rowcount
+            if self.max_rows:
+                deleted += conn.execute("""
+                    DELETE FROM conversations WHERE id <= (
+                        SELECT id FROM conversations ORDER BY id DESC LIMIT 1 OFFSET ?
+                    )
+                """, (self.max_rows,)).rowcount
+
+        conn.executescript("PRAGMA incremental_vacuum;")  # execute() would step once and free a single page
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        self._last_compaction = time.time()
+        self._last_compaction_result = {
+            'deleted_rows': deleted,
+            'duration': self._last_compaction - start_time,
+            'timestamp': self._last_compaction
+        }
+        return self._last_compaction_result
+
+    def compact(self) -> Dict[str, Any]:
+        """Run a compaction pass now (outside the writer's schedule)"""
+        self.flush()
+        conn = self._connect()
+        try:
+            return self._compact(conn)
+        finally:
+            conn.close()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued so far has been written (or has failed); False on timeout"""
+        if not self._writer.is_alive():
+            return False
+        deadline = time.time() + timeout
+        marker = threading.Event()
+        try:
+            self._pending.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.wait(max(deadline - time.time(), 0))
+
+    def _where(self, since: Optional[float], until: Optional[float],
+               subject: Optional[str], query_type: Optional[str]):
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if subject is not None:
+            clauses.append("subject = ?")
+            params.append(subject)
+        if query_type is not None:
+            clauses.append("query_type = ?")
+            params.append(query_type)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def query(self, since: Optional[float] = None, until: Optional[float] = None,
+              subject: Optional[str] = None, query_type: Optional[str] = None,
+              limit: int = 100) -> List[Dict[str, Any]]:
+        """Return the newest conversations matching the filters"""
+        where, params = self._where(since, until, subject, query_type)
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT * FROM conversations {where} ORDER BY timestamp DESC LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        finally:
+            conn.close()
+
+        conversations = []
+        for row in rows:
+            conversations.append({
+                'query': row['query'],
+                'response': row['response'],
+                'analysis': json.loads(row['analysis']) if row['analysis'] else {},
+                'timestamp': row['timestamp'],
+                'processing_time': row['processing_time'],
+                'has_visual': bool(row['has_visual'])
+            })
+        return conversations
+
+    def summarize(self, since: Optional[float] = None, until: Optional[float] = None,
+                  subject: Optional[str] = None) -> Dict[str, Any]:
+        """Aggregate counts for /analytics with index-backed range filters"""
+        where, params = self._where(since, until, subject, None)
+        conn = self._connect()
+        try:
+            total, avg_time = conn.execute(
+                f"SELECT COUNT(*), AVG(processing_time) FROM conversations {where}", params
+            ).fetchone()
+            subjects = {
+                row[0] or 'unknown': row[1] for row in conn.execute(
+                    f"SELECT subject, COUNT(*) FROM conversations {where} GROUP BY subject", params
+                )
+            }
+            query_types = {
+                row[0] or 'unknown': row[1] for row in conn.execute(
+                    f"SELECT query_type, COUNT(*) FROM conversations {where} GROUP BY query_type", params
+                )
+            }
+        finally:
+            conn.close()
+
+        return {
+            "total_queries": total,
+            "subjects": subjects,
+            "query_types": query_types,
+            "average_processing_time": avg_time or 0
+        }
+
+    def clear(self):
+        """Delete every stored conversation"""
+        self.flush()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM conversations")
+            conn.executescript("PRAGMA incremental_vacuum;")
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Writer counters and current file size"""
+        with self._lock:
+            counters = dict(self._counters)
+        size = 0
+        for suffix in ("", "-wal"):
+            path = self.db_path + suffix
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return {
+            "db_path": self.db_path,
+            "file_size_bytes": size,
+            "pending": self._pending.qsize(),
+            **counters,
+            "last_compaction": self._last_compaction_result
+        }
+
+    def close(self, timeout: float = 5.0):
+        """Flush pending writes and stop the writer thread"""
+        self._stop.set()
+        self._writer.join(timeout)
+
+
+def _json_default(value):
+    """Serialize numpy scalars and anything else json can't handle"""
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
@@ -0,0 +1,342 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import bisect
+import threading
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Optional, Any
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Very common words carry no retrieval signal for BM25
+STOP_WORDS = {
+    'a', 'an', 'the', 'and', 'or', 'but', 'of', 'to', 'in', 'on', 'at', 'for', 'with', 'by',
+    'is', 'are', 'was', 'were', 'be', 'been', 'it', 'its', 'this', 'that', 'as', 'from',
+    'what', 'which', 'who', 'how', 'why', 'when', 'where', 'do', 'does', 'did', 'can'
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOP_WORDS]
+
+
+def chunk_text(text: str, chunk_words: int = 200, overlap: int = 40) -> List[str]:
+    """Split text into overlapping word windows, preferring paragraph breaks"""
+    if not 0 <= overlap < chunk_words:
+        # Each window must advance by at least one word
+        raise ValueError(f"overlap must be in [0, chunk_words), got overlap={overlap}, chunk_words={chunk_words}")
+    paragraphs = [p.split() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    chunks, current = [], []
+
+    for words in paragraphs:
+        if current and len(current) + len(words) > chunk_words:
+            chunks.append(current)
+            current = current[-overlap:] if overlap else []
+        current = current + words
+        while len(current) > chunk_words:
+            chunks.append(current[:chunk_words])
+            current = current[chunk_words - overlap:]
+
+    if current and (not chunks or len(current) > overlap):
+        chunks.append(current)
+
+    return [' '.join(words) for words in chunks]
+
+
+class IndexSegment:
+    """
+    One immutable, memory-mapped slice of the index: a dense embedding matrix
+    plus a BM25 inverted index stored as flat postings arrays.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+        self.doc_lengths = np.load(os.path.join(path, "doc_lengths.npy"), mmap_mode='r')
+        self.postings_docs = np.load(os.path.join(path, "postings_docs.npy"), mmap_mode='r')
+        self.postings_tf = np.load(os.path.join(path, "postings_tf.npy"), mmap_mode='r')
+        with open(os.path.join(path, "vocab.json")) as f:
+            self.vocab: Dict[str, List[int]] = json.load(f)
+        with open(os.path.join(path, "chunks.jsonl")) as f:
+            self.chunks = [json.loads(line) for line in f]
+
+    @property
+    def size(self) -> int:
+        return len(self.chunks)
+
+    @staticmethod
+    def write(path: str, chunks: List[Dict[str, Any]], embeddings: np.ndarray):
+        """Build the postings for `chunks` and write the segment files"""
+        os.makedirs(path, exist_ok=True)
+
+        postings: Dict[str, List] = {}
+        doc_lengths = np.zeros(len(chunks), dtype=np.int32)
+        for local_id, chunk in enumerate(chunks):
+            tokens = tokenize(chunk['text'])
+            doc_lengths[local_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((local_id, tf))
+
+        vocab, docs, tfs = {}, [], []
+        for term in sorted(postings):
+            entries = postings[term]
+            vocab[term] = [len(docs), len(entries)]
+            docs.extend(doc for doc, _ in entries)
+            tfs.extend(tf for _, tf in entries)
+
+        np.save(os.path.join(path, "embeddings.npy"), embeddings.astype(np.float32))
+        np.save(os.path.join(path, "doc_lengths.npy"), doc_lengths)
+        np.save(os.path.join(path, "postings_docs.npy"), np.array(docs, dtype=np.int32))
+        np.save(os.path.join(path, "postings_tf.npy"), np.array(tfs, dtype=np.float32))
+        with open(os.path.join(path, "vocab.json"), "w") as f:
+            json.dump(vocab, f)
+        with open(os.path.join(path, "chunks.jsonl"), "w") as f:
+            for chunk in chunks:
+                f.write(json.dumps(chunk) + "\n")
+
+
+class CourseMaterialIndex:
+    """
+    Hybrid BM25 + dense retrieval over uploaded course material.
+
+    Each upload is chunked, embedded and written as a new segment, so
+    incremental updates never rewrite existing data; segments are merged
+    once there are more than `max_segments`. Queries score every segment
+    with vectorized NumPy (bincount over postings, one matrix-vector
+    product for the embeddings) and take the top-k with argpartition.
+    """
+
+    def __init__(self, index_dir: str, embedder, chunk_words: int = 200, overlap: int = 40,
+                 max_segments: int = 8, k1: float = 1.5, b: float = 0.75, dense_weight: float = 0.5):
+        chunk_text("", chunk_words, overlap)  # Reject a bad window at startup rather than on every upload
+        self.index_dir = index_dir
+        self.embedder = embedder
+        self.chunk_words = chunk_words
+        self.overlap = overlap
+        self.max_segments = max_segments
+        self.k1 = k1
+        self.b = b
+        self.dense_weight = dense_weight
+
+        self._lock = threading.Lock()
+        self._segments: List[IndexSegment] = []
+        self._documents: Dict[str, Dict[str, Any]] = {}
+        self._deleted: set = set()
+        self._view = ([], [0], np.zeros(0, dtype=bool))
+
+        os.makedirs(index_dir, exist_ok=True)
+        self._load()
+        self._refresh_view()
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.index_dir, "manifest.json")
+
+    def _load(self):
+        if not os.path.exists(self._manifest_path()):
+            return
+        with open(self._manifest_path()) as f:
+            manifest = json.load(f)
+
+        self._documents = manifest.get('documents', {})
+        self._deleted = set(manifest.get('deleted', []))
+        self._segments = self._open_segments(manifest.get('segments', []))
+
+        if manifest.get('embedder') != self.embedder.name:
+            # Embeddings from a different model are not comparable; re-embed from stored text
+            print(f"🔁 Re-embedding course material for {self.embedder.name}...")
+            self._rewrite_segments(self._segments, reembed=True)
+
+    def _open_segments(self, names: List[str]) -> List[IndexSegment]:
+        return [IndexSegment(os.path.join(self.index_dir, name)) for name in names]
+
+    def _save_manifest(self):
+        manifest = {
+            'embedder': self.embedder.name,
+            'segments': [os.path.basename(s.path) for s in self._segments],
+            'documents': self._documents,
+            'deleted': sorted(self._deleted)
+        }
+        tmp_path = self._manifest_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path())
+
+    def _new_segment_path(self) -> str:
+        return os.path.join(self.index_dir, f"seg_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}")
+
+    def add_document(self, title: str, text: str, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Chunk, embed and index one document as a new segment"""
+        start_time = time.time()
+        doc_id = uuid.uuid4().hex
+        chunks = [
+            {'doc_id': doc_id, 'title': title, 'position': i, 'text': chunk}
+            for i, chunk in enumerate(chunk_text(text, self.chunk_words, self.overlap))
+        ]
+        if not chunks:
+            raise ValueError("Document has no text to index")
+
+        embeddings = self.embedder.encode([c['text'] for c in chunks])
+        path = self._new_segment_path()
+        IndexSegment.write(path, chunks, embeddings)
+
+        with self._lock:
+            self._documents[doc_id] = {
+                'doc_id': doc_id,
+                'title': title,
+                'chunks': len(chunks),
+                'added_at': time.time(),
+                'metadata': metadata or {}
+            }
+            self._segments = self._segments + [IndexSegment(path)]
+            if len(self._segments) > self.max_segments:
+                self._merge_segments()
+            self._save_manifest()
+            self._refresh_view()
+
+        return {**self._documents[doc_id], 'indexing_time': time.time() - start_time}
+
+    def remove_document(self, doc_id: str) -> bool:
+        """Tombstone a document; its chunks are dropped at the next merge"""
+        with self._lock:
+            if doc_id not in self._documents:
+                return False
+            del self._documents[doc_id]
+            self._deleted.add(doc_id)
+            self._save_manifest()
+            self._refresh_view()
+            return True
+
+    def _merge_segments(self):
+        """
+        Tiered merge (caller holds the lock): fold the smallest segments into
+        one so large segments are not rewritten on every upload.
+        """
+        by_size = sorted(self._segments, key=lambda segment: segment.size)
+        self._rewrite_segments(by_size[:len(self._segments) - self.max_segments // 2])
+
+    def compact(self):
+        """Merge everything into one segment and drop deleted documents"""
+        with self._lock:
+            self._rewrite_segments(self._segments)
+            self._refresh_view()
+
+    def _rewrite_segments(self, selected: List[IndexSegment], reembed: bool = False):
+        """Replace `selected` segments with one new segment, dropping deleted chunks"""
+        chunks, embeddings = [], []
+        for segment in selected:
+            keep = [i for i, c in enumerate(segment.chunks) if c['doc_id'] not in self._deleted]
+            chunks.extend(segment.chunks[i] for i in keep)
+            if not reembed:
+                embeddings.append(np.asarray(segment.embeddings[keep]))
+
+        if reembed:
+            merged_embeddings = self.embedder.encode([c['text'] for c in chunks])
+        elif embeddings:
+            merged_embeddings = np.concatenate(embeddings)
+        else:
+            merged_embeddings = np.zeros((0, self.embedder.dim), dtype=np.float32)
+
+        remaining = [s for s in self._segments if s not in selected]
+        if chunks:
+            path = self._new_segment_path()
+            IndexSegment.write(path, chunks, merged_embeddings)
+            remaining.append(IndexSegment(path))
+        self._segments = remaining
+
+        # Tombstones can be cleared once no segment holds their chunks
+        live_docs = {c['doc_id'] for s in self._segments for c in s.chunks}
+        self._deleted &= live_docs
+        self._save_manifest()
+
+        # Open memory maps keep the data alive for in-flight readers after removal
+        for segment in selected:
+            shutil.rmtree(segment.path, ignore_errors=True)
+
+    def _refresh_view(self):
+        """Publish segments, their global offsets and the deletion mask together for lock-free reads"""
+        segments = self._segments
+        bases = np.cumsum([0] + [s.size for s in segments]).tolist()
+        mask = np.zeros(bases[-1], dtype=bool)
+        if self._deleted:
+            for segment, base in zip(segments, bases):
+                for i, chunk in enumerate(segment.chunks):
+                    if chunk['doc_id'] in self._deleted:
+                        mask[base + i] = True
+        self._view = (segments, bases, mask)
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Hybrid top-k retrieval: BM25 and cosine scores, each max-normalized, then blended"""
+        segments, bases, deleted_mask = self._view  # Snapshot; updates publish a new view
+        total = bases[-1]
+        if total == 0:
+            return []
+
+        terms = set(tokenize(query))
+        query_vector = self.embedder.encode([query])[0]
+
+        # Global statistics across segments
+        avg_length = max(sum(float(np.sum(s.doc_lengths)) for s in segments) / total, 1.0)
+        df = {t: sum(s.vocab[t][1] for s in segments if t in s.vocab) for t in terms}
+        idf = {t: np.log(1 + (total - n + 0.5) / (n + 0.5)) for t, n in df.items() if n}
+
+        bm25 = np.zeros(total, dtype=np.float32)
+        dense = np.empty(total, dtype=np.float32)
+        for segment, base in zip(segments, bases):
+            lengths = np.asarray(segment.doc_lengths, dtype=np.float32)
+            norm = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+            docs, weights = [], []
+            for term, term_idf in idf.items():
+                if term in segment.vocab:
+                    offset, count = segment.vocab[term]
+                    term_docs = segment.postings_docs[offset:offset + count]
+                    tf = segment.postings_tf[offset:offset + count]
+                    docs.append(term_docs)
+                    weights.append(term_idf * tf * (self.k1 + 1) / (tf + norm[term_docs]))
+            if docs:
+                bm25[base:base + segment.size] = np.bincount(
+                    np.concatenate(docs), weights=np.concatenate(weights), minlength=segment.size
+                )
+            dense[base:base + segment.size] = segment.embeddings @ query_vector
+
+        bm25_max = bm25.max()
+        scores = self.dense_weight * dense + (1 - self.dense_weight) * (bm25 / bm25_max if bm25_max > 0 else bm25)
+
+        scores[deleted_mask] = -np.inf
+
+        k = min(top_k, total)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for global_id in top:
+            if not np.isfinite(scores[global_id]):
+                continue
+            position = bisect.bisect_right(bases, global_id) - 1
+            chunk = segments[position].chunks[global_id - bases[position]]
+            results.append({
+                'doc_id': chunk['doc_id'],
+                'title': chunk['title'],
+                'position': chunk['position'],
+                'text': chunk['text'],
+                'score': float(scores[global_id]),
+                'bm25': float(bm25[global_id]),
+                'dense': float(dense[global_id])
+            })
+        return results
+
+    def documents(self) -> List[Dict[str, Any]]:
+        return list(self._documents.values())
+
+    def stats(self) -> Dict[str, Any]:
+        segments, bases, _ = self._view
+        return {
+            'embedder': self.embedder.name,
+            'documents': len(self._documents),
+            'chunks': bases[-1],
+            'segments': len(segments),
+            'deleted_documents': len(self._deleted)
+        }
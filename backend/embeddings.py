@@ -0,0 +1,96 @@
+import re
+import zlib
+import numpy as np
+from typing import List
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class SentenceEmbedder:
+    """Small CPU sentence-embedding model (mean-pooled transformer, L2-normalized)"""
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, device: str = 'cpu', max_length: int = 256):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
+        self.torch = torch
+        self.name = model_name
+        self.device = device
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name)
+        self.model.to(device)
+        self.model.eval()
+        self.dim = self.model.config.hidden_size
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Embed texts into an (n, dim) float32 matrix of unit vectors"""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+
+        # Length-sorted batches keep padding low; results are put back in input order
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            tokenized = self.tokenizer(
+                [texts[i] for i in batch],
+                return_tensors='pt',
+                max_length=self.max_length,
+                truncation=True,
+                padding=True
+            ).to(self.device)
+
+            with self.torch.no_grad():
+                hidden = self.model(**tokenized).last_hidden_state
+
+            mask = tokenized['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            vectors[batch] = pooled.float().cpu().numpy()
+
+        return _normalize(vectors)
+
+
+class HashingEmbedder:
+    """
+    Model-free stand-in: signed feature hashing of word unigrams and bigrams.
+    Used when the embedding model is unavailable, and for benchmarks.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.name = f"hashing-{dim}"
+        self.dim = dim
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_RE.findall(text.lower())
+            features = tokens + [a + ' ' + b for a, b in zip(tokens, tokens[1:])]
+            if not features:
+                continue
+            hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.dim, signs)
+        return _normalize(vectors)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def load_embedder(model_name: str = DEFAULT_EMBEDDING_MODEL, device: str = 'cpu'):
+    """Load the sentence-embedding model, falling back to the hashing embedder"""
+    if model_name == "hashing":
+        return HashingEmbedder()
+    try:
+        print(f"🧭 Loading sentence embedding model ({model_name})...")
+        embedder = SentenceEmbedder(model_name, device=device)
+        print("✅ Sentence embedding model loaded")
+        return embedder
+    except Exception as e:
+        print(f"⚠️ Sentence embedding model failed: {e}, using hashing embedder")
+        return HashingEmbedder()
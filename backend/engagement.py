@@ -0,0 +1,323 @@
+import threading
+import time
+from typing import Dict, List, Optional, Any, Tuple
+import numpy as np
+
+# Per-student readings sent by the browser's face-api.js monitor (FaceEngagement.tsx), each 0-100
+METRICS = ('score', 'attention', 'participation', 'comprehension')
+
+# Same cut-offs as the student view's engagement level
+HIGH_SCORE = 70
+MEDIUM_SCORE = 40
+
+# Sample time (float64), student index (uint16), the metrics (uint8 each) and the face flag
+BYTES_PER_SAMPLE = 8 + 2 + len(METRICS) + 1
+
+
+def engagement_level(score: float) -> str:
+    if score > HIGH_SCORE:
+        return 'high'
+    if score > MEDIUM_SCORE:
+        return 'medium'
+    return 'low'
+
+
+class ClassroomBuffer:
+    """
+    One classroom's recent samples as fixed-size columnar ring buffers:
+    sample time, student index, the four 0-100 metrics and whether a face
+    was seen, BYTES_PER_SAMPLE bytes a sample. Once full, new samples
+    overwrite the oldest, so memory stays at `capacity` samples whatever
+    the ingest rate.
+    """
+
+    def __init__(self, capacity: int = 32768, max_students: int = 1024):
+        self.capacity = capacity
+        self.max_students = max_students
+        self.t = np.zeros(capacity, dtype=np.float64)
+        self.student = np.zeros(capacity, dtype=np.uint16)
+        self.metrics = np.zeros((len(METRICS), capacity), dtype=np.uint8)
+        self.face = np.zeros(capacity, dtype=bool)
+        self.written = 0  # Total samples ever appended; head is written % capacity
+        self.students: Dict[str, int] = {}
+        self.student_names: List[str] = []
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+        self.cached: Optional[Tuple[float, Dict[str, Any]]] = None  # (computed at, aggregates)
+
+    def student_indices(self, student_ids: List[str]) -> np.ndarray:
+        """Index per student id, registering new ones; -1 once the classroom is full (lock held)"""
+        index = self.students
+        indices = [index.get(student_id) for student_id in student_ids]
+        if None in indices:
+            for i, student_id in enumerate(student_ids):
+                if indices[i] is None:
+                    if student_id not in index and len(self.student_names) < self.max_students:
+                        index[student_id] = len(self.student_names)
+                        self.student_names.append(student_id)
+                    indices[i] = index.get(student_id, -1)
+        return np.asarray(indices, dtype=np.int64)
+
+    def append(self, t: np.ndarray, student: np.ndarray, metrics: np.ndarray, face: np.ndarray):
+        """Write a batch of columns at the head, wrapping around (lock held)"""
+        n = len(t)
+        if n > self.capacity:
+            t, student, metrics, face = t[-self.capacity:], student[-self.capacity:], \
+                metrics[:, -self.capacity:], face[-self.capacity:]
+            self.written += n - self.capacity
+            n = self.capacity
+        head = self.written % self.capacity
+        first = min(n, self.capacity - head)
+        for start, stop, offset in ((head, head + first, 0), (0, n - first, first)):
+            if stop > start:
+                self.t[start:stop] = t[offset:offset + stop - start]
+                self.student[start:stop] = student[offset:offset + stop - start]
+                self.metrics[:, start:stop] = metrics[:, offset:offset + stop - start]
+                self.face[start:stop] = face[offset:offset + stop - start]
+        self.written += n
+        self.updated_at = time.time()
+
+    def aggregate(self, now: float, windows: Tuple[float, ...], attention_threshold: float,
+                  bucket_seconds: float, watchlist: int) -> Dict[str, Any]:
+        """Rolling-window aggregates, the trend over the longest window and the least attentive students (lock held)"""
+        size = min(self.written, self.capacity)
+        students = max(1, len(self.student_names))
+        buckets = max(1, int(np.ceil(max(windows) / bucket_seconds)))
+        metrics = self.metrics[:, :size]
+        face = self.face[:size]
+
+        # One pass over the buffer into (student, bucket) cells, bucket 0 the most recent;
+        # samples older than the longest window land in an extra bucket that is dropped
+        age = np.maximum(now - self.t[:size], 0)
+        bucket = np.minimum((age // bucket_seconds).astype(np.int64), buckets)
+        cell = self.student[:size].astype(np.int64) * (buckets + 1) + bucket
+
+        def per_cell(weights=None) -> np.ndarray:
+            totals = np.bincount(cell, weights, minlength=students * (buckets + 1))
+            return totals.reshape(students, buckets + 1)[:, :buckets]
+
+        counts = per_cell()
+        sums = [per_cell(metrics[i]) for i in range(len(METRICS))]
+        attentive = per_cell(face & (metrics[1] >= attention_threshold))
+        faces = per_cell(face)
+
+        def span(window: float) -> int:
+            """Windows cover whole trend buckets"""
+            return min(buckets, max(1, int(np.ceil(window / bucket_seconds))))
+
+        summaries = []
+        for window in windows:
+            k = span(window)
+            per_student = counts[:, :k].sum(axis=1)
+            count = int(per_student.sum())
+            means = [float(total[:, :k].sum()) / count if count else 0.0 for total in sums]
+            summaries.append({
+                'window_seconds': window,
+                'samples': count,
+                'students_active': int(np.count_nonzero(per_student)),
+                'level': engagement_level(means[0]),
+                'attention_rate': round(float(attentive[:, :k].sum()) / count, 4) if count else 0.0,
+                'face_rate': round(float(faces[:, :k].sum()) / count, 4) if count else 0.0,
+                **{name: round(mean, 1) for name, mean in zip(METRICS, means)}
+            })
+
+        # Trend: per-bucket means over the longest window, oldest bucket first, and a least-squares slope
+        bucket_counts = counts.sum(axis=0)[::-1]
+        bucket_scores = sums[0].sum(axis=0)[::-1]
+        bucket_attentive = attentive.sum(axis=0)[::-1]
+        seen = bucket_counts > 0
+        score_series = np.where(seen, bucket_scores / np.maximum(bucket_counts, 1), np.nan)
+        slope = 0.0
+        if np.count_nonzero(seen) >= 2:
+            minutes = (np.arange(buckets)[seen] - (buckets - 1)) * bucket_seconds / 60
+            slope = float(np.polyfit(minutes, score_series[seen], 1)[0])
+        trend = {
+            'bucket_seconds': bucket_seconds,
+            'score': [None if np.isnan(v) else round(float(v), 1) for v in score_series],
+            'attention_rate': [round(float(a / c), 4) if c else None for a, c in zip(bucket_attentive, bucket_counts)],
+            'slope_per_minute': round(slope, 2),
+            'direction': 'rising' if slope > 1 else 'falling' if slope < -1 else 'steady'
+        }
+
+        # Students whose attention over the shortest window is below the threshold, lowest first
+        k = span(min(windows))
+        per_student = counts[:, :k].sum(axis=1)
+        mean_attention = np.where(per_student > 0, sums[1][:, :k].sum(axis=1) / np.maximum(per_student, 1), np.inf)
+        low = np.flatnonzero(mean_attention < attention_threshold)
+        low = low[np.argsort(mean_attention[low], kind='stable')][:watchlist]
+        needs_attention = [
+            {'student_id': self.student_names[i], 'attention': round(float(mean_attention[i]), 1),
+             'samples': int(per_student[i])}
+            for i in low
+        ]
+
+        return {
+            'students_total': len(self.student_names),
+            'retained_seconds': round(float(age.max()), 1) if size else 0.0,
+            'windows': summaries,
+            'trend': trend,
+            'needs_attention': needs_attention
+        }
+
+
+class ClassroomLimitReached(Exception):
+    """Raised for a new classroom while every classroom buffer belongs to an active classroom"""
+
+
+class EngagementHub:
+    """
+    Engagement telemetry for every classroom: ingests batches of per-student
+    samples into each classroom's ClassroomBuffer and serves rolling-window
+    aggregates for teacher dashboards. Memory is bounded by `max_classrooms`
+    buffers of `capacity` samples; beyond that the least recently updated
+    classroom is dropped, but only once it has sent nothing for
+    `active_seconds` (default: the longest window), so a burst of new
+    classroom ids can't push out live classrooms. Aggregates are cached per
+    classroom for `refresh_seconds`, even while new samples arrive, and are
+    computed under the classroom's lock, so any number of dashboards watching
+    one classroom cost one computation per refresh.
+    """
+
+    def __init__(self, capacity: int = 32768, max_classrooms: int = 200, max_students: int = 1024,
+                 windows: Tuple[float, ...] = (30, 120, 600), attention_threshold: float = 60,
+                 bucket_seconds: float = 30, refresh_seconds: float = 1.0, watchlist: int = 10,
+                 active_seconds: Optional[float] = None):
+        self.capacity = capacity
+        self.max_classrooms = max_classrooms
+        self.max_students = max_students
+        self.windows = tuple(sorted(windows))
+        self.attention_threshold = attention_threshold
+        self.bucket_seconds = bucket_seconds
+        self.refresh_seconds = refresh_seconds
+        self.watchlist = watchlist
+        self.active_seconds = active_seconds if active_seconds is not None else self.windows[-1]
+
+        self._classrooms: Dict[str, ClassroomBuffer] = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            'batches': 0,
+            'accepted': 0,
+            'dropped_stale': 0,
+            'dropped_students': 0,
+            'classrooms_evicted': 0,
+            'classrooms_rejected': 0,
+            'aggregations': 0
+        }
+
+    def _classroom(self, classroom_id: str, create: bool = False) -> Optional[ClassroomBuffer]:
+        with self._lock:
+            room = self._classrooms.get(classroom_id)
+            if room is None and create:
+                if len(self._classrooms) >= self.max_classrooms:
+                    oldest = min(self._classrooms, key=lambda key: self._classrooms[key].updated_at)
+                    if time.time() - self._classrooms[oldest].updated_at < self.active_seconds:
+                        self._counters['classrooms_rejected'] += 1
+                        raise ClassroomLimitReached(f"All {self.max_classrooms} classrooms are active")
+                    del self._classrooms[oldest]
+                    self._counters['classrooms_evicted'] += 1
+                room = ClassroomBuffer(self.capacity, self.max_students)
+                self._classrooms[classroom_id] = room
+            return room
+
+    def ingest(self, classroom_id: str, samples: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Rows as sent by the browser: {"student_id", "score", "attention",
+        "participation", "comprehension", "face", "t"}. Missing metrics count
+        as 0, a missing face flag as seen, a missing time as now.
+        """
+        try:
+            columns = {'student_id': [sample['student_id'] for sample in samples]}
+        except (KeyError, TypeError):
+            raise ValueError("every sample needs a student_id")
+        for name in METRICS:
+            columns[name] = [sample.get(name, 0) for sample in samples]
+        columns['face'] = [sample.get('face', True) for sample in samples]
+        columns['t'] = [sample.get('t') for sample in samples]
+        return self.ingest_columns(classroom_id, columns)
+
+    def ingest_columns(self, classroom_id: str, columns: Dict[str, List[Any]]) -> Dict[str, int]:
+        """Columnar batch: one equal-length list per field (student_id required, the rest optional)"""
+        student_ids = columns.get('student_id')
+        if not classroom_id or not student_ids:
+            raise ValueError("classroom_id and at least one student_id are required")
+        n = len(student_ids)
+        now = time.time()
+
+        def column(name: str, default: float) -> np.ndarray:
+            values = columns.get(name)
+            if values is None:
+                return np.full(n, default, dtype=np.float64)
+            if len(values) != n:
+                raise ValueError(f"column '{name}' has {len(values)} values, expected {n}")
+            try:
+                return np.asarray(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                raise ValueError(f"column '{name}' must be numeric")
+
+        metrics = np.empty((len(METRICS), n), dtype=np.uint8)
+        for i, name in enumerate(METRICS):
+            metrics[i] = np.clip(np.nan_to_num(column(name, 0.0)), 0, 100).round()
+        face = column('face', 1.0) != 0
+
+        # Client clocks: epoch seconds or milliseconds (Date.now()); never ahead of ours,
+        # and samples older than the longest window are of no use to any aggregate
+        t = column('t', np.nan)
+        t = np.where(t > 1e11, t / 1000, t)
+        t = np.where(np.isnan(t) | (t > now), now, t)
+        fresh = t >= now - self.windows[-1]
+
+        room = self._classroom(classroom_id, create=True)
+        with room.lock:
+            student = room.student_indices([str(student_id) for student_id in student_ids])
+            keep = fresh & (student >= 0)
+            kept = int(np.count_nonzero(keep))
+            if kept == n:
+                room.append(t, student.astype(np.uint16), metrics, face)
+            elif kept:
+                room.append(t[keep], student[keep].astype(np.uint16), metrics[:, keep], face[keep])
+
+        with self._lock:
+            self._counters['batches'] += 1
+            self._counters['accepted'] += kept
+            self._counters['dropped_stale'] += int(np.count_nonzero(~fresh))
+            self._counters['dropped_students'] += int(np.count_nonzero(fresh & (student < 0)))
+        return {'accepted': kept, 'dropped': n - kept}
+
+    def aggregate(self, classroom_id: str) -> Optional[Dict[str, Any]]:
+        """The classroom's current aggregates (None if it has sent nothing)"""
+        room = self._classroom(classroom_id)
+        if room is None:
+            return None
+        now = time.time()
+        with room.lock:
+            # Concurrent polls wait here for the one computing, then share its result
+            if room.cached is not None and now - room.cached[0] < self.refresh_seconds:
+                return room.cached[1]
+            result = {
+                'classroom_id': classroom_id,
+                'generated_at': now,
+                **room.aggregate(now, self.windows, self.attention_threshold, self.bucket_seconds, self.watchlist)
+            }
+            room.cached = (now, result)
+        with self._lock:
+            self._counters['aggregations'] += 1
+        return result
+
+    def classrooms(self) -> List[str]:
+        with self._lock:
+            return list(self._classrooms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rooms = list(self._classrooms.values())
+            counters = dict(self._counters)
+        return {
+            **counters,
+            'classrooms': len(rooms),
+            'students': sum(len(room.student_names) for room in rooms),
+            'buffered_samples': sum(min(room.written, room.capacity) for room in rooms),
+            'memory_bytes': len(rooms) * self.capacity * BYTES_PER_SAMPLE,
+            'memory_limit_bytes': self.max_classrooms * self.capacity * BYTES_PER_SAMPLE,
+            'capacity_per_classroom': self.capacity,
+            'windows_seconds': list(self.windows)
+        }
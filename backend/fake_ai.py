@@ -0,0 +1,185 @@
+import os
+import time
+import tempfile
+import numpy as np
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+from PIL import Image, ImageDraw
+from query_analyzer import KEYWORD_ENGINE
+from visual_router import VisualRouter
+from cancellation import CANCELLATION, CancelToken
+from load_governor import FULL, SKIP_ELABORATION, KEYWORD_CLASSIFICATION, GREEDY_DECODING, DEFER_VISUALS, level_name
+
+
+class FakeClassroomAI:
+    """
+    Model-free stand-in for AdvancedClassroomAI (AI_BACKEND=fake), for load
+    tests and development without torch. Same interface; answers are canned
+    and latencies are simulated per query type. In "cpu" mode the latency is
+    spent multiplying matrices, so concurrent requests contend for cores the
+    way real inference does; in "sleep" mode they don't.
+    """
+
+    def __init__(self, device='cpu', save_images=True, display_images=False, conversation_store=None,
+                 text_seconds: Optional[float] = None, visual_seconds: Optional[float] = None,
+                 mode: Optional[str] = None, **kwargs):
+        self.device = device
+        self.conversation_history = []
+        self.conversation_store = conversation_store
+        self.save_images = save_images
+        self.text_seconds = text_seconds if text_seconds is not None else float(os.environ.get("FAKE_AI_TEXT_SECONDS", 0.5))
+        self.visual_seconds = visual_seconds if visual_seconds is not None else float(os.environ.get("FAKE_AI_VISUAL_SECONDS", 3.0))
+        self.mode = mode or os.environ.get("FAKE_AI_MODE", "cpu")
+        self.model_dtypes = {}
+        self.model_memory = {}
+        self.visual_router = VisualRouter(diffusion_estimate_seconds=self.visual_seconds)
+
+        # No real models; attributes the API checks for exist but are empty
+        self.text_tokenizer = None
+        self.text_model = None
+        self.chat_model = None
+        self.summarizer = None
+        self.image_pipeline = None
+        self.image_caption_model = None
+        self.qa_pipeline = None
+
+        if self.save_images:
+            self.images_dir = os.path.join(tempfile.gettempdir(), "generated_images")
+            os.makedirs(self.images_dir, exist_ok=True)
+
+        self._work = np.random.default_rng(0).standard_normal((256, 256)).astype(np.float32)
+        self.models_ready = True
+        print(f"🧪 Fake AI backend ({self.mode}): text {self.text_seconds}s, visual {self.visual_seconds}s")
+
+    # Rough split of a real text answer's time, so degradation levels have a visible effect
+    CLASSIFIER_SHARE = 0.15
+    ELABORATION_SHARE = 0.2
+    GREEDY_SPEEDUP = 0.4
+
+    def _spend(self, seconds: float, cancel_token: Optional[CancelToken] = None):
+        """Simulate inference time, stopping early (like a stopping criterion) if cancelled"""
+        if seconds <= 0:
+            return
+        deadline = time.perf_counter() + seconds
+        work = self._work
+        while time.perf_counter() < deadline:
+            if cancel_token is not None and cancel_token.cancelled:
+                return
+            if self.mode == "sleep":
+                time.sleep(min(0.05, max(0.0, deadline - time.perf_counter())))
+            else:
+                work = np.tanh(work @ self._work)
+
+    def _analysis_from_features(self, features: Dict[str, Any], subject: str, confidence: float) -> Dict[str, Any]:
+        return {
+            'subject': subject,
+            'confidence': confidence,
+            'query_type': features['query_type'],
+            'needs_visual': features['needs_visual'],
+            'complexity': features['complexity'],
+            'educational_level': features['educational_level']
+        }
+
+    def analyze_educational_query(self, query: str, use_classifier: bool = True,
+                                  cancel_token: Optional[CancelToken] = None) -> Dict[str, Any]:
+        if use_classifier:
+            with CANCELLATION.stage("subject_classifier", cancel_token):
+                self._spend(self.text_seconds * self.CLASSIFIER_SHARE, cancel_token)
+        features = KEYWORD_ENGINE.scan(query)
+        return self._analysis_from_features(features, features['subject'], features['subject_confidence'])
+
+    def analyze_educational_queries(self, queries: List[str]) -> List[Dict[str, Any]]:
+        return [self._analysis_from_features(f, f['subject'], f['subject_confidence'])
+                for f in KEYWORD_ENGINE.scan_many(queries)]
+
+    def fallback_analysis(self, query: str) -> Dict[str, Any]:
+        return self.analyze_educational_query(query, use_classifier=False)
+
+    def generation_params(self) -> Dict[str, Any]:
+        return {'backend': 'fake', 'text_seconds': self.text_seconds, 'visual_seconds': self.visual_seconds}
+
+    def generate_educational_response(self, query: str, analysis: Dict[str, Any], degradation: int = FULL,
+                                      cancel_token: Optional[CancelToken] = None) -> str:
+        seconds = self.text_seconds * (1 - self.CLASSIFIER_SHARE)
+        if degradation >= SKIP_ELABORATION:
+            seconds *= 1 - self.ELABORATION_SHARE
+        if degradation >= GREEDY_DECODING:
+            seconds *= self.GREEDY_SPEEDUP
+        with CANCELLATION.stage("text_model.generate", cancel_token):
+            self._spend(seconds, cancel_token)
+        return (f"Here is a {analysis['educational_level']} {analysis['subject']} answer to: {query} "
+                f"This is a simulated response from the fake backend, long enough to look like a real one.")
+
+    def generate_educational_responses(self, queries: List[str], analyses: List[Dict[str, Any]], batch_size: int = 8,
+                                       degradation: int = FULL):
+        for start in range(0, len(queries), batch_size):
+            batch = range(start, min(start + batch_size, len(queries)))
+            # A batch costs a little more than one query, much less than one per query
+            seconds = self.text_seconds * (1 + 0.25 * (len(batch) - 1))
+            if degradation >= SKIP_ELABORATION:
+                seconds *= 1 - self.ELABORATION_SHARE
+            if degradation >= GREEDY_DECODING:
+                seconds *= self.GREEDY_SPEEDUP
+            self._spend(seconds)
+            for i in batch:
+                yield i, f"Here is an answer to: {queries[i]} (simulated)"
+
+    def generate_educational_visual(self, query: str, analysis: Dict[str, Any],
+                                    cancel_token: Optional[CancelToken] = None) -> Optional[Image.Image]:
+        # The fast path is real; only diffusion is simulated
+        image = self.visual_router.render(query, analysis)
+        if image is None:
+            start_time = time.perf_counter()
+            with CANCELLATION.stage("image_pipeline", cancel_token):
+                self._spend(self.visual_seconds, cancel_token)
+            self.visual_router.record_diffusion(time.perf_counter() - start_time)
+            image = Image.new('RGB', (256, 256), 'white')
+            ImageDraw.Draw(image).text((10, 120), query[:40], fill='black')
+        if self.save_images:
+            path = os.path.join(self.images_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_fake.png")
+            image.save(path, "PNG")
+            image.info['saved_path'] = path
+        return image
+
+    def answer_from_passages(self, question: str, passages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        self._spend(self.text_seconds / 2)
+        if not passages:
+            return {'answer': None, 'score': 0.0, 'source': None}
+        best = passages[0]
+        return {'answer': ' '.join(best['text'].split()[:60]), 'score': best.get('score', 0.0), 'source': best}
+
+    def record_conversation(self, query: str, response: str, analysis: Dict[str, Any],
+                            processing_time: float, has_visual: bool):
+        entry = {
+            'query': query,
+            'response': response,
+            'analysis': analysis,
+            'timestamp': time.time(),
+            'processing_time': processing_time,
+            'has_visual': has_visual
+        }
+        self.conversation_history.append(entry)
+        if self.conversation_store is not None:
+            self.conversation_store.record(entry)
+
+    def process_educational_query(self, query: str, context: Optional[str] = None,
+                                  degradation: int = FULL, cancel_token: Optional[CancelToken] = None,
+                                  defer_visuals: bool = False) -> Dict[str, Any]:
+        start_time = time.time()
+        analysis = self.analyze_educational_query(query, degradation < KEYWORD_CLASSIFICATION, cancel_token)
+        text_response = self.generate_educational_response(query, analysis, degradation, cancel_token)
+        visual_deferred = analysis['needs_visual'] and (defer_visuals or degradation >= DEFER_VISUALS)
+        visual_image = None
+        if analysis['needs_visual'] and not visual_deferred:
+            visual_image = self.generate_educational_visual(query, analysis, cancel_token)
+        processing_time = time.time() - start_time
+        self.record_conversation(query, text_response, analysis, processing_time, visual_image is not None)
+        return {
+            'text_response': text_response,
+            'visual_image': visual_image,
+            'visual_deferred': visual_deferred,
+            'analysis': analysis,
+            'processing_time': processing_time,
+            'degradation': level_name(degradation),
+            'success': True
+        }
@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional, Any
+from structured_logging import get_logger, log_event
+
+logger = get_logger("load_governor")
+
+# Degradation levels, cheapest cut first; each level includes the ones before it
+FULL = 0
+SKIP_ELABORATION = 1        # no DialoGPT follow-up on short answers
+KEYWORD_CLASSIFICATION = 2  # keyword subject instead of the zero-shot classifier
+GREEDY_DECODING = 3         # num_beams=1, no sampling
+DEFER_VISUALS = 4           # visuals go to the background job queue
+LEVEL_NAMES = ('full', 'skip_elaboration', 'keyword_classification', 'greedy_decoding', 'defer_visuals')
+
+
+def level_name(level: int) -> str:
+    return LEVEL_NAMES[level]
+
+
+class LoadGovernor:
+    """
+    Steps the answer pipeline down through cheaper degradation levels when
+    the backlog grows, and back up once it drains.
+
+    Pressure is the larger of in-flight model runs over `queue_target` and
+    recent p95 latency over `p95_target_seconds`. Pressure at or above 1
+    raises the level by one step at most every `step_up_seconds`; the level
+    only drops, again one step at a time, after pressure has stayed below
+    `recover_ratio` for `recover_seconds`. The gap between the two thresholds
+    and the dwell times stop it flapping as degraded requests get faster.
+    """
+
+    def __init__(self, queue_target: int = 8, p95_target_seconds: float = 15.0,
+                 window_seconds: float = 60.0, step_up_seconds: float = 5.0,
+                 recover_seconds: float = 30.0, recover_ratio: float = 0.5,
+                 max_level: int = DEFER_VISUALS, enabled: bool = True):
+        self.queue_target = queue_target
+        self.p95_target_seconds = p95_target_seconds
+        self.window_seconds = window_seconds
+        self.step_up_seconds = step_up_seconds
+        self.recover_seconds = recover_seconds
+        self.recover_ratio = recover_ratio
+        self.max_level = min(max_level, len(LEVEL_NAMES) - 1)
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._level = FULL
+        self._in_flight = 0
+        self._latencies = deque()  # (finished_at, seconds)
+        self._changed_at = time.monotonic()
+        self._stepped_at: Optional[float] = None
+        self._calm_since: Optional[float] = None
+        self._time_in_level = [0.0] * len(LEVEL_NAMES)
+        self._requests_at_level = [0] * len(LEVEL_NAMES)
+        self._transitions: deque = deque(maxlen=50)
+
+    @property
+    def level(self) -> int:
+        with self._lock:
+            self._evaluate(time.monotonic())
+            return self._level
+
+    @contextmanager
+    def track(self):
+        """Count one model run as in flight; yields the degradation level it should use"""
+        now = time.monotonic()
+        with self._lock:
+            self._evaluate(now)
+            self._in_flight += 1
+            level = self._level
+            self._requests_at_level[level] += 1
+        try:
+            yield level
+        finally:
+            finished_at = time.monotonic()
+            with self._lock:
+                self._in_flight -= 1
+                self._latencies.append((finished_at, finished_at - now))
+                self._evaluate(finished_at)
+
+    def _p95(self, now: float) -> Optional[float]:
+        cutoff = now - self.window_seconds
+        while self._latencies and self._latencies[0][0] < cutoff:
+            self._latencies.popleft()
+        if not self._latencies:
+            return None
+        ordered = sorted(seconds for _, seconds in self._latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def _pressure(self, now: float) -> float:
+        p95 = self._p95(now) or 0.0
+        return max(self._in_flight / self.queue_target, p95 / self.p95_target_seconds)
+
+    def _set_level(self, level: int, now: float, pressure: float):
+        self._time_in_level[self._level] += now - self._changed_at
+        self._transitions.append({
+            'at': time.time(), 'from': level_name(self._level), 'to': level_name(level),
+            'pressure': round(pressure, 3), 'in_flight': self._in_flight
+        })
+        log_event(logger, "load.level_changed", previous=level_name(self._level), current=level_name(level),
+                  pressure=round(pressure, 3), in_flight=self._in_flight)
+        self._level = level
+        self._changed_at = self._stepped_at = now
+        self._calm_since = None
+
+    def _evaluate(self, now: float):
+        """Move at most one level per call (caller holds the lock)"""
+        if not self.enabled:
+            return
+        pressure = self._pressure(now)
+        if pressure >= 1.0:
+            self._calm_since = None
+            settled = self._stepped_at is None or now - self._stepped_at >= self.step_up_seconds
+            if self._level < self.max_level and settled:
+                self._set_level(self._level + 1, now, pressure)
+        elif pressure < self.recover_ratio:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif self._level > FULL and now - max(self._calm_since, self._changed_at) >= self.recover_seconds:
+                self._set_level(self._level - 1, now, pressure)
+        else:
+            self._calm_since = None
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._evaluate(now)
+            time_in_level = list(self._time_in_level)
+            time_in_level[self._level] += now - self._changed_at
+            p95 = self._p95(now)
+            return {
+                'enabled': self.enabled,
+                'level': self._level,
+                'level_name': level_name(self._level),
+                'in_flight': self._in_flight,
+                'p95_seconds': p95,
+                'pressure': self._pressure(now),
+                'queue_target': self.queue_target,
+                'p95_target_seconds': self.p95_target_seconds,
+                'seconds_in_level': {level_name(i): seconds for i, seconds in enumerate(time_in_level)},
+                'requests_at_level': {level_name(i): count for i, count in enumerate(self._requests_at_level)},
+                'recent_transitions': list(self._transitions)
+            }
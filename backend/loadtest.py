@@ -0,0 +1,388 @@
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+import numpy as np
+import requests
+
+# Question bank for synthetic classroom traffic
+TEXT_QUESTIONS = [
+    "What is photosynthesis?",
+    "Explain Newton's second law of motion",
+    "How do I solve a quadratic equation?",
+    "What caused the French Revolution?",
+    "What is the difference between an atom and a molecule?",
+    "Why is the sky blue?",
+    "What is the Pythagorean theorem?",
+    "How does the heart pump blood?",
+    "Compare mitosis and meiosis",
+    "What is an algorithm?",
+    "Explain supply and demand",
+    "What are prime numbers?",
+]
+VISUAL_QUESTIONS = [
+    "Draw a diagram of the water cycle",
+    "Show a diagram of a plant cell",
+    "Illustrate the structure of an atom",
+    "Draw a graph of y = x^2 - 3x",
+    "Show a chart of the planets by size",
+    "Draw the parts of a flower",
+]
+BOARD_QUESTIONS = [
+    "What is the formula for the area of a circle?",
+    "Explain how volcanoes form",
+    "What is the capital of France and why is it important?",
+    "How does gravity work?",
+]
+
+
+def classroom_schedule(rate: float, duration: float, visual_ratio: float = 0.2, repeat_ratio: float = 0.3,
+                       burst_fraction: float = 0.3, burst_seconds: float = 5.0, classrooms: int = 4,
+                       students: int = 30, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Arrival schedule for one stage at `rate` requests/s on average.
+    A share of the requests lands in a burst at the start of the period (everyone
+    asks at once), the rest arrive as a Poisson stream. Some students repeat the
+    question on the board, with the small variations real typing introduces.
+    """
+    rng = random.Random(seed)
+    total = max(1, int(round(rate * duration)))
+    burst = int(total * burst_fraction)
+    times = sorted(
+        [rng.uniform(0, min(burst_seconds, duration)) for _ in range(burst)] +
+        [rng.uniform(0, duration) for _ in range(total - burst)]
+    )
+    board = {c: rng.choice(BOARD_QUESTIONS) for c in range(classrooms)}
+
+    schedule = []
+    for at in times:
+        classroom = rng.randrange(classrooms)
+        student = rng.randrange(students)
+        roll = rng.random()
+        if roll < repeat_ratio:
+            kind = "repeat"
+            message = board[classroom]
+            if rng.random() < 0.5:
+                message = message.lower().rstrip('?') + rng.choice(['', '?', ' ?', '??'])
+        elif roll < repeat_ratio + visual_ratio:
+            kind, message = "visual", rng.choice(VISUAL_QUESTIONS)
+        else:
+            kind, message = "text", rng.choice(TEXT_QUESTIONS)
+        schedule.append({
+            'at': at,
+            'kind': kind,
+            'message': message,
+            'client_id': f"class{classroom}-student{student}",
+            'classroom_id': f"class{classroom}"
+        })
+    return schedule
+
+
+class LoadRunner:
+    """Open-loop replay: requests are sent at their scheduled time regardless of backlog"""
+
+    def __init__(self, base_url: str, max_workers: int = 256, timeout: float = 120.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _send(self, item: Dict[str, Any], scheduled_at: float) -> Dict[str, Any]:
+        result = {'kind': item['kind'], 'status': None, 'success': False, 'coalesced': False, 'error': None}
+        try:
+            response = self._session().post(
+                f"{self.base_url}/chat",
+                json={"message": item['message'], "subject": "General"},
+                headers={"X-Client-ID": item['client_id'], "X-Classroom-ID": item['classroom_id']},
+                timeout=self.timeout
+            )
+            result['status'] = response.status_code
+            if response.status_code == 200:
+                body = response.json()
+                result['success'] = bool(body.get('success'))
+                result['coalesced'] = bool(body.get('coalesced'))
+                result['degradation'] = body.get('degradation')
+                if not result['success']:
+                    result['error'] = body.get('error')
+        except Exception as e:
+            result['error'] = type(e).__name__
+        # Latency counts from the scheduled send time, so client-side queueing is not hidden
+        result['latency'] = time.perf_counter() - scheduled_at
+        return result
+
+    def run_stage(self, schedule: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            start = time.perf_counter()
+            for item in schedule:
+                scheduled_at = start + item['at']
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(pool.submit(self._send, item, scheduled_at))
+            results = [future.result() for future in futures]
+            wall = time.perf_counter() - start
+        for result in results:
+            result['stage_wall'] = wall
+        return results
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    return float(np.percentile(values, q)) if values else None
+
+
+def summarize_stage(rate: float, duration: float, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    wall = results[0]['stage_wall'] if results else duration
+    ok = [r for r in results if r['success']]
+    # An unsaturated server still needs about one service time after the last arrival
+    drain = percentile([r['latency'] for r in ok], 50) or 0.0
+    throttled = [r for r in results if r['status'] == 429]
+    errors = [r for r in results if not r['success'] and r['status'] != 429]
+    summary = {
+        'offered_rps': rate,
+        'requests': len(results),
+        'completed': len(ok),
+        'throughput_rps': len(ok) / max(wall - drain, duration),
+        'error_rate': len(errors) / len(results) if results else 0.0,
+        'throttled_rate': len(throttled) / len(results) if results else 0.0,
+        'coalesced_rate': sum(r['coalesced'] for r in ok) / len(ok) if ok else 0.0,
+        'degradation_levels': dict(Counter(r.get('degradation') or 'full' for r in ok)),
+        'wall_seconds': wall
+    }
+    for label, subset in [('all', ok)] + [(kind, [r for r in ok if r['kind'] == kind]) for kind in ('text', 'visual', 'repeat')]:
+        latencies = [r['latency'] * 1000 for r in subset]
+        summary[f'latency_ms_{label}'] = {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else None
+        }
+    summary['errors'] = sorted({str(r['error'] or r['status']) for r in errors})
+    return summary
+
+
+def find_saturation(stages: List[Dict[str, Any]], slo_p95_ms: float, max_error_rate: float) -> Dict[str, Any]:
+    """First stage that misses throughput (90% of offered), the p95 SLO, or the error budget"""
+    last_healthy = None
+    for stage in stages:
+        reasons = []
+        if stage['throughput_rps'] < 0.9 * stage['offered_rps']:
+            reasons.append("throughput below offered load")
+        p95 = stage['latency_ms_all']['p95']
+        if p95 is None or p95 > slo_p95_ms:
+            reasons.append(f"p95 above {slo_p95_ms:.0f} ms")
+        if stage['error_rate'] > max_error_rate:
+            reasons.append(f"error rate above {max_error_rate:.0%}")
+        if reasons:
+            return {
+                'saturated_at_rps': stage['offered_rps'],
+                'max_healthy_rps': last_healthy,
+                'reasons': reasons
+            }
+        last_healthy = stage['offered_rps']
+    return {'saturated_at_rps': None, 'max_healthy_rps': last_healthy, 'reasons': []}
+
+
+def render_html(report: Dict[str, Any]) -> str:
+    """HTML report with throughput/latency/error curves (matplotlib, off-screen)"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    stages = report['stages']
+    offered = [s['offered_rps'] for s in stages]
+    fig, axes = plt.subplots(1, 3, figsize=(15, 4))
+
+    axes[0].plot(offered, [s['throughput_rps'] for s in stages], 'o-', label='achieved')
+    axes[0].plot(offered, offered, '--', color='grey', label='offered')
+    axes[0].set_title('Throughput (req/s)')
+    axes[0].legend()
+
+    for q in ('p50', 'p95', 'p99'):
+        axes[1].plot(offered, [s['latency_ms_all'][q] or np.nan for s in stages], 'o-', label=q)
+    axes[1].axhline(report['config']['slo_p95_ms'], color='red', linestyle=':', label='p95 SLO')
+    axes[1].set_yscale('log')
+    axes[1].set_title('Latency (ms)')
+    axes[1].legend()
+
+    axes[2].plot(offered, [s['error_rate'] * 100 for s in stages], 'o-', label='errors')
+    axes[2].plot(offered, [s['throttled_rate'] * 100 for s in stages], 'o-', label='429s')
+    axes[2].set_title('Errors (%)')
+    axes[2].legend()
+
+    saturation = report['saturation']
+    for ax in axes:
+        ax.set_xlabel('offered load (req/s)')
+        if saturation['saturated_at_rps'] is not None:
+            ax.axvline(saturation['saturated_at_rps'], color='orange', alpha=0.5)
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=100)
+    plt.close(fig)
+    chart = base64.b64encode(buffer.getvalue()).decode('ascii')
+
+    rows = ''.join(
+        f"<tr><td>{s['offered_rps']:g}</td><td>{s['throughput_rps']:.2f}</td>"
+        f"<td>{s['latency_ms_all']['p50'] or 0:.0f}</td><td>{s['latency_ms_all']['p95'] or 0:.0f}</td>"
+        f"<td>{s['latency_ms_all']['p99'] or 0:.0f}</td><td>{s['error_rate']:.1%}</td>"
+        f"<td>{s['throttled_rate']:.1%}</td><td>{s['coalesced_rate']:.1%}</td></tr>"
+        for s in stages
+    )
+    if saturation['saturated_at_rps'] is not None:
+        verdict = (f"Saturates at {saturation['saturated_at_rps']:g} req/s ({', '.join(saturation['reasons'])}); "
+                   f"last healthy load {saturation['max_healthy_rps']} req/s")
+    else:
+        verdict = f"No saturation up to {offered[-1]:g} req/s"
+
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Classroom AI load test</title>
+<style>body{{font-family:sans-serif;margin:2em}}table{{border-collapse:collapse}}td,th{{border:1px solid #ccc;padding:4px 10px;text-align:right}}</style>
+</head><body>
+<h1>Classroom AI load test</h1>
+<p>{report['started_at']} &middot; target {report['config']['target']} &middot; {report['config']['stage_seconds']:g} s per stage</p>
+<h2>{verdict}</h2>
+<img src="data:image/png;base64,{chart}">
+<table><tr><th>offered req/s</th><th>achieved req/s</th><th>p50 ms</th><th>p95 ms</th><th>p99 ms</th><th>errors</th><th>429s</th><th>coalesced</th></tr>
+{rows}</table>
+<h3>Configuration</h3><pre>{json.dumps(report['config'], indent=2)}</pre>
+</body></html>
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_in_process_server(args) -> str:
+    """Run the API on localhost in this process with the fake backend"""
+    scratch = tempfile.mkdtemp(prefix="loadtest_")
+    os.environ.setdefault("AI_BACKEND", args.backend)
+    os.environ.setdefault("FAKE_AI_TEXT_SECONDS", str(args.text_seconds))
+    os.environ.setdefault("FAKE_AI_VISUAL_SECONDS", str(args.visual_seconds))
+    os.environ.setdefault("FAKE_AI_MODE", args.fake_mode)
+    os.environ.setdefault("CONVERSATION_DB_PATH", os.path.join(scratch, "conversations.db"))
+    os.environ.setdefault("COURSE_INDEX_DIR", os.path.join(scratch, "course_index"))
+    os.environ.setdefault("EMBEDDING_MODEL", "hashing")
+    if not args.keep_rate_limits:
+        os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    if not args.semantic_cache:
+        # The fixed question pool would be served from the cache after the first stage
+        os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+
+    import uvicorn
+    import app as api
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/health", timeout=2).json().get('ai_models_ready'):
+                return base_url
+        except Exception:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("In-process server did not become ready")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay classroom traffic against /chat and find the saturation point")
+    parser.add_argument("--url", help="Target a running server instead of starting one in-process")
+    parser.add_argument("--backend", default="fake", help="AI_BACKEND for the in-process server ('fake' or 'models')")
+    parser.add_argument("--fake-mode", default="cpu", choices=["cpu", "sleep"])
+    parser.add_argument("--text-seconds", type=float, default=0.3, help="Fake backend latency for a text answer")
+    parser.add_argument("--visual-seconds", type=float, default=2.0, help="Fake backend latency for a visual")
+    parser.add_argument("--rates", default="0.5,1,2,4,8,16", help="Offered loads (req/s), one stage each")
+    parser.add_argument("--stage-seconds", type=float, default=20)
+    parser.add_argument("--visual-ratio", type=float, default=0.2)
+    parser.add_argument("--repeat-ratio", type=float, default=0.3)
+    parser.add_argument("--burst-fraction", type=float, default=0.3)
+    parser.add_argument("--burst-seconds", type=float, default=5)
+    parser.add_argument("--classrooms", type=int, default=4)
+    parser.add_argument("--slo-p95-ms", type=float, default=5000)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--keep-rate-limits", action="store_true", help="Leave admission control on (429s are reported)")
+    parser.add_argument("--semantic-cache", action="store_true", help="Leave the semantic answer cache on")
+    parser.add_argument("--continue-after-saturation", action="store_true")
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--report-dir", default="loadtest_reports")
+    args = parser.parse_args()
+
+    base_url = args.url or start_in_process_server(args)
+    rates = [float(r) for r in args.rates.split(',')]
+    runner = LoadRunner(base_url)
+    report = {
+        'started_at': datetime.now().isoformat(),
+        'config': {**vars(args), 'target': base_url},
+        'stages': []
+    }
+
+    print(f"🚦 Load test against {base_url}: {len(rates)} stages of {args.stage_seconds:g} s")
+    for stage_index, rate in enumerate(rates):
+        schedule = classroom_schedule(
+            rate, args.stage_seconds, args.visual_ratio, args.repeat_ratio,
+            args.burst_fraction, args.burst_seconds, args.classrooms, seed=stage_index
+        )
+        stage = summarize_stage(rate, args.stage_seconds, runner.run_stage(schedule))
+        report['stages'].append(stage)
+        latency = stage['latency_ms_all']
+        print(f"   {rate:6g} req/s offered -> {stage['throughput_rps']:6.2f} achieved, "
+              f"p50 {latency['p50'] or 0:7.0f} ms, p95 {latency['p95'] or 0:7.0f} ms, "
+              f"errors {stage['error_rate']:.1%}, 429s {stage['throttled_rate']:.1%}, "
+              f"coalesced {stage['coalesced_rate']:.1%}")
+
+        saturation = find_saturation(report['stages'], args.slo_p95_ms, args.max_error_rate)
+        if saturation['saturated_at_rps'] is not None and not args.continue_after_saturation:
+            break
+
+    report['saturation'] = find_saturation(report['stages'], args.slo_p95_ms, args.max_error_rate)
+    try:
+        report['server'] = {
+            'coalescing': requests.get(f"{base_url}/debug/coalescing", timeout=5).json(),
+            'memory': requests.get(f"{base_url}/debug/memory", timeout=5).json()
+        }
+    except Exception:
+        pass
+
+    os.makedirs(args.report_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    json_path = os.path.join(args.report_dir, f"loadtest_{stamp}.json")
+    html_path = os.path.join(args.report_dir, f"loadtest_{stamp}.html")
+    with open(json_path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    with open(html_path, 'w') as f:
+        f.write(render_html(report))
+
+    saturation = report['saturation']
+    if saturation['saturated_at_rps'] is not None:
+        print(f"📉 Saturation at {saturation['saturated_at_rps']:g} req/s ({', '.join(saturation['reasons'])}); "
+              f"max healthy {saturation['max_healthy_rps']} req/s")
+    else:
+        print(f"✅ No saturation up to {rates[-1]:g} req/s")
+    print(f"📄 Reports: {json_path}, {html_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Any
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Model keys used in MODEL_DTYPES, e.g. "default=auto,summarizer=float32,image=float32"
+MODEL_KEYS = ('text', 'chat', 'classifier', 'qa', 'summarizer', 'image', 'caption')
+DTYPE_NAMES = ('float32', 'bfloat16', 'float16', 'auto')
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process, from /proc/self/statm (0 where unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def cpu_supports_bf16() -> bool:
+    """True if the CPU has native bfloat16 arithmetic (AVX512-BF16 or AMX)"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    flags = set(line.split(':', 1)[1].split())
+                    return bool(flags & {'avx512_bf16', 'amx_bf16'})
+    except OSError:
+        pass
+    return False
+
+
+def resolve_model_dtypes(spec: Optional[str] = None) -> Dict[str, str]:
+    """
+    Parse a "model=dtype" list into a dtype name per model key.
+    'auto' means bfloat16 on CPUs that support it and float32 elsewhere.
+    """
+    spec = spec if spec is not None else os.environ.get("MODEL_DTYPES", "")
+    requested = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        key, _, dtype = item.partition('=')
+        key, dtype = key.strip(), dtype.strip().lower()
+        if dtype not in DTYPE_NAMES or (key not in MODEL_KEYS and key != 'default'):
+            print(f"⚠️ Ignoring MODEL_DTYPES entry '{item.strip()}'")
+            continue
+        requested[key] = dtype
+
+    auto_dtype = 'bfloat16' if cpu_supports_bf16() else 'float32'
+    default = requested.get('default', 'auto')
+    resolved = {}
+    for key in MODEL_KEYS:
+        dtype = requested.get(key, default)
+        resolved[key] = auto_dtype if dtype == 'auto' else dtype
+    return resolved
+
+
+def module_memory(model) -> Dict[str, int]:
+    """Parameter and buffer bytes of a torch module, pipeline or diffusion pipeline"""
+    modules = []
+    if hasattr(model, 'parameters'):
+        modules.append(model)
+    elif hasattr(model, 'model') and hasattr(model.model, 'parameters'):
+        modules.append(model.model)  # transformers pipeline
+    elif hasattr(model, 'components'):
+        modules.extend(c for c in model.components.values() if hasattr(c, 'parameters'))  # diffusers
+
+    parameter_bytes = sum(p.numel() * p.element_size() for m in modules for p in m.parameters())
+    buffer_bytes = sum(b.numel() * b.element_size() for m in modules for b in m.buffers())
+    dtypes = sorted({str(p.dtype).replace('torch.', '') for m in modules for p in m.parameters()})
+    return {'parameter_bytes': parameter_bytes, 'buffer_bytes': buffer_bytes, 'dtypes': dtypes}
+
+
+class MemoryMonitor:
+    """
+    Peak activation memory per request type. While any tracked request is
+    running, a sampling thread polls RSS; each request's peak above its
+    starting RSS is attributed to its type. Concurrent requests overlap, so
+    the figures are upper bounds under load and exact when run alone.
+    """
+
+    def __init__(self, interval_ms: float = 5):
+        self.interval = interval_ms / 1000
+        self._lock = threading.Lock()
+        self._active: Dict[int, Dict[str, Any]] = {}
+        self._next_id = 0
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._sampler = None
+
+    @contextmanager
+    def track(self, request_type: str):
+        with self._lock:
+            token = self._next_id
+            self._next_id += 1
+            baseline = rss_bytes()
+            self._active[token] = {'baseline': baseline, 'peak': baseline}
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name="memory-monitor", daemon=True)
+                self._sampler.start()
+        try:
+            yield
+        finally:
+            current = rss_bytes()
+            with self._lock:
+                entry = self._active.pop(token)
+                peak = max(entry['peak'], current) - entry['baseline']
+                stats = self._stats.setdefault(request_type, {'requests': 0, 'peak_bytes': 0, 'total_bytes': 0, 'last_bytes': 0})
+                stats['requests'] += 1
+                stats['peak_bytes'] = max(stats['peak_bytes'], peak)
+                stats['total_bytes'] += peak
+                stats['last_bytes'] = peak
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            current = rss_bytes()
+            with self._lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+                for entry in self._active.values():
+                    entry['peak'] = max(entry['peak'], current)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                request_type: {
+                    'requests': s['requests'],
+                    'peak_activation_bytes': s['peak_bytes'],
+                    'mean_activation_bytes': s['total_bytes'] / s['requests'],
+                    'last_activation_bytes': s['last_bytes']
+                }
+                for request_type, s in self._stats.items()
+            }
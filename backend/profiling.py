@@ -0,0 +1,251 @@
+import sys
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional, Any
+
+_NULL_CONTEXT = nullcontext()
+
+# Innermost frames of threads parked in a queue, selector or pool; not sampled
+IDLE_FRAMES = ('wait (threading.py', '_wait_for_tstate_lock (threading.py', 'select (selectors.py', '_worker (thread.py', 'run (_asyncio.py')
+
+
+class LiveProfiler:
+    """
+    Time-boxed profiling of live traffic.
+
+    Nothing is recorded outside a capture window: `request()` and `section()`
+    return a shared no-op context after a single attribute check. During a
+    capture, requests are run under a torch profiler one at a time (the torch
+    profiler is per thread and backed by a process-wide tracer, so concurrent
+    requests are not profiled in parallel; they still get spans), model calls
+    wrapped in `section()` become labelled record_function ranges, and a
+    sampler thread walks `sys._current_frames()` for a Python-level view of
+    where request threads spend time. The result is one Chrome trace.
+    Consecutive samples of a thread in the same stack merge into one event,
+    and at most `max_sample_events` are kept (the hot stack counts see all).
+    """
+
+    def __init__(self, max_sample_events: int = 20000):
+        self.max_sample_events = max_sample_events
+        self._capture: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()
+        self._torch_slot = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def active(self) -> bool:
+        return self._capture is not None
+
+    def section(self, label: str):
+        """Label a model call (generate, pipeline, ...) in the trace"""
+        if self._capture is None:
+            return _NULL_CONTEXT
+        return self._section(label)
+
+    def request(self, label: str):
+        """Profile one request's model work (outermost scope in a worker thread)"""
+        if self._capture is None or getattr(self._local, 'profiling', False):
+            return _NULL_CONTEXT
+        return self._request(label)
+
+    @contextmanager
+    def _section(self, label: str):
+        capture = self._capture
+        start = time.perf_counter()
+        record = None
+        if capture is not None and capture['torch'] is not None:
+            record = capture['torch'].profiler.record_function(label)
+            record.__enter__()
+        try:
+            yield
+        finally:
+            if record is not None:
+                record.__exit__(None, None, None)
+            if capture is not None:
+                self._add_span(capture, label, "model", start, time.perf_counter())
+
+    @contextmanager
+    def _request(self, label: str):
+        capture = self._capture
+        torch = capture['torch']
+        profiler = None
+        if torch is not None and self._torch_slot.acquire(blocking=False):
+            profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+        with self._lock:
+            capture['active_requests'] += 1
+
+        self._local.profiling = True
+        started_at = time.perf_counter()
+        try:
+            if profiler is None:
+                yield
+            else:
+                with profiler, torch.profiler.record_function(label):
+                    yield
+        finally:
+            self._local.profiling = False
+            ended_at = time.perf_counter()
+            self._add_span(capture, label, "request", started_at, ended_at)
+            if profiler is not None:
+                self._torch_slot.release()
+                self._add_torch_events(capture, profiler, started_at)
+            with self._lock:
+                capture['active_requests'] -= 1
+                counts = capture['requests'].setdefault(label, {'requests': 0, 'torch_profiled': 0})
+                counts['requests'] += 1
+                counts['torch_profiled'] += profiler is not None
+
+    def _add_span(self, capture: Dict[str, Any], name: str, category: str, start: float, end: float):
+        event = {
+            'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+            'ts': (start - capture['started_at']) * 1e6, 'dur': (end - start) * 1e6
+        }
+        with self._lock:
+            capture['events'].append(event)
+
+    def _add_torch_events(self, capture: Dict[str, Any], profiler, started_at: float):
+        """Fold a finished per-request torch profile into the capture"""
+        offset = (started_at - capture['started_at']) * 1e6
+        events, operators = [], capture['operators']
+        try:
+            for event in profiler.events():
+                events.append({
+                    'name': event.name, 'cat': 'torch_op', 'ph': 'X', 'pid': os.getpid(),
+                    'tid': event.thread,
+                    'ts': offset + event.time_range.start, 'dur': event.time_range.elapsed_us()
+                })
+            averages = profiler.key_averages()
+        except Exception as e:
+            print(f"⚠️ Could not read torch profile: {e}")
+            return
+        with self._lock:
+            capture['events'].extend(events)
+            for average in averages:
+                op = operators.setdefault(average.key, {'count': 0, 'cpu_time_total_us': 0.0, 'self_cpu_time_total_us': 0.0})
+                op['count'] += average.count
+                op['cpu_time_total_us'] += average.cpu_time_total
+                op['self_cpu_time_total_us'] += average.self_cpu_time_total
+
+    def _sample(self, capture: Dict[str, Any], interval: float, deadline: float):
+        """Python stack sampler for request threads (everything except this thread and idle ones)"""
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        while time.perf_counter() < deadline:
+            now = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < 64:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                # Threads parked in a queue or selector are idle, not interesting
+                if stack and any(idle in stack[-1] for idle in IDLE_FRAMES):
+                    continue
+                key = (names.get(thread_id, str(thread_id)),) + tuple(stack)
+                capture['stacks'][key] += 1
+                self._add_sample(capture, thread_id, key, now, interval)
+            capture['sample_count'] += 1
+            time.sleep(interval)
+
+    def _add_sample(self, capture: Dict[str, Any], thread_id: int, key: tuple, now: float, interval: float):
+        """Extend the thread's last sample event if it was in the same stack one round ago, else start one"""
+        ts = (now - capture['started_at']) * 1e6
+        rounds = capture['sample_count']
+        last = capture['last_samples'].get(thread_id)
+        if last is not None and last[0] == key and last[1] == rounds - 1:
+            event = last[2]
+            event['dur'] = ts + interval * 1e6 - event['ts']
+            event['args']['samples'] += 1
+        elif len(capture['samples']) < self.max_sample_events:
+            stack = list(key[1:])
+            event = {
+                'name': stack[-1] if stack else '?', 'cat': 'python_sample', 'ph': 'X', 'pid': os.getpid(),
+                'tid': f"py-{key[0]}", 'ts': ts, 'dur': interval * 1e6,
+                'args': {'stack': stack[-12:], 'samples': 1}
+            }
+            capture['samples'].append(event)
+        else:
+            capture['samples_dropped'] += 1
+            capture['last_samples'].pop(thread_id, None)
+            return
+        capture['last_samples'][thread_id] = (key, rounds, event)
+
+    def capture(self, seconds: float, sample_interval_ms: float = 10, grace_seconds: float = 5) -> Dict[str, Any]:
+        """Profile live traffic for `seconds`; blocks and returns a Chrome trace dict"""
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("A profile capture is already running")
+        try:
+            try:
+                import torch
+            except ImportError:
+                torch = None
+
+            started_at = time.perf_counter()
+            capture = {
+                'torch': torch,
+                'started_at': started_at,
+                'events': [],
+                'samples': [],
+                'last_samples': {},
+                'samples_dropped': 0,
+                'stacks': Counter(),
+                'sample_count': 0,
+                'operators': {},
+                'requests': {},
+                'active_requests': 0
+            }
+            self._capture = capture
+            try:
+                self._sample(capture, sample_interval_ms / 1000, started_at + seconds)
+            finally:
+                self._capture = None
+
+            # Requests that began inside the window finish and report their operators
+            grace_deadline = time.perf_counter() + grace_seconds
+            while capture['active_requests'] and time.perf_counter() < grace_deadline:
+                time.sleep(0.05)
+
+            return self._trace(capture, seconds, sample_interval_ms)
+        finally:
+            self._busy.release()
+
+    def _trace(self, capture: Dict[str, Any], seconds: float, sample_interval_ms: float) -> Dict[str, Any]:
+        with self._lock:
+            operators = sorted(
+                ({'name': name, **stats} for name, stats in capture['operators'].items()),
+                key=lambda op: op['self_cpu_time_total_us'], reverse=True
+            )
+            events = list(capture['events'])
+            requests = dict(capture['requests'])
+        total_samples = max(1, capture['sample_count'])
+        hot_stacks = [
+            {'thread': stack[0], 'stack': list(stack[1:])[-12:], 'samples': count,
+             'share': count / total_samples}
+            for stack, count in capture['stacks'].most_common(20)
+        ]
+        return {
+            'traceEvents': events + capture['samples'],
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'duration_seconds': seconds,
+                'sample_interval_ms': sample_interval_ms,
+                'python_samples': capture['sample_count'],
+                'python_sample_events': len(capture['samples']),
+                'python_sample_events_dropped': capture['samples_dropped'],
+                'torch_profiler': capture['torch'] is not None,
+                'requests': requests,
+                'operators': operators[:100],
+                'hot_python_stacks': hot_stacks
+            }
+        }
+
+
+# Shared by the API and the model code
+PROFILER = LiveProfiler()
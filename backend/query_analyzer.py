@@ -0,0 +1,225 @@
+import re
+import numpy as np
+from typing import Dict, List, Tuple, Any
+
+# Query-type keywords, in priority order (the first category with a hit wins)
+QUERY_TYPE_KEYWORDS = [
+    ('explanation', ['explain', 'what is', 'define', 'describe', 'tell me about']),
+    ('problem_solving', ['solve', 'calculate', 'find', 'compute']),
+    ('comparison', ['compare', 'difference', 'versus', 'vs', 'contrast']),
+    ('visualization', ['show', 'draw', 'create', 'generate', 'visualize']),
+    ('tutorial', ['how to', 'steps', 'procedure', 'process']),
+]
+
+# Keywords that make a query request a generated visual
+VISUAL_KEYWORDS = [
+    'show', 'draw', 'diagram', 'chart', 'graph', 'plot', 'visual', 'picture',
+    'image', 'illustrate', 'create image', 'generate picture'
+]
+
+# Reduced visual check used by the fallback analysis
+FALLBACK_VISUAL_KEYWORDS = ['visual', 'show']
+
+# Complexity keywords, in priority order (default: basic)
+COMPLEXITY_KEYWORDS = [
+    ('advanced', ['theorem', 'hypothesis', 'methodology', 'analysis', 'synthesis', 'evaluation']),
+    ('intermediate', ['process', 'relationship', 'comparison', 'function', 'structure']),
+]
+
+# Educational level keywords, in priority order (default: general)
+LEVEL_KEYWORDS = [
+    ('university', ['university', 'college', 'advanced', 'research']),
+    ('high_school', ['high school', 'secondary', 'algebra', 'calculus']),
+    ('middle_school', ['middle school', 'junior', 'basic']),
+]
+
+# Keyword-based subject classification (used when the zero-shot classifier is unavailable)
+SUBJECT_KEYWORDS = {
+    'mathematics': ['math', 'equation', 'number', 'calculate', 'algebra', 'geometry', 'calculus'],
+    'physics': ['force', 'energy', 'motion', 'wave', 'particle', 'gravity', 'physics'],
+    'chemistry': ['chemical', 'molecule', 'atom', 'reaction', 'compound', 'element'],
+    'biology': ['cell', 'organism', 'dna', 'genetics', 'evolution', 'biology'],
+    'history': ['historical', 'past', 'ancient', 'war', 'civilization', 'century'],
+    'geography': ['country', 'continent', 'climate', 'map', 'location', 'geography'],
+    'literature': ['poem', 'story', 'novel', 'author', 'literature', 'writing'],
+    'computer science': ['code', 'program', 'algorithm', 'computer', 'software', 'data']
+}
+
+# Keywords that only match as whole words (plus -s/-ed/-ing). Every other single-word keyword is a
+# stem that also matches longer words ("math" in "mathematics", "program" in "programming"), as the
+# old substring scan did; these are the ones whose longer words mean something else
+# ("showcase", "warthog", "computer", "elementary", "creature", "solvent", "maple", "pasta").
+WHOLE_WORD_KEYWORDS = {'vs', 'show', 'draw', 'create', 'compute', 'solve', 'war', 'past', 'map', 'element'}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _inflections(word: str) -> List[str]:
+    """Surface forms of a keyword: plural, past tense and -ing forms"""
+    forms = [word, word + 's']
+    if word.endswith(('s', 'x', 'z', 'ch', 'sh')):
+        forms.append(word + 'es')
+    if word.endswith('e'):
+        forms += [word + 'd', word[:-1] + 'ing']
+    else:
+        forms += [word + 'ed', word + 'ing']
+    return forms
+
+
+class QueryKeywordEngine:
+    """
+    Precompiled multi-pattern keyword matcher for query analysis.
+
+    Every keyword list above is compiled into one table of word-token
+    sequences (including plural/-ed/-ing forms of the last word). A query is
+    lowercased and tokenized once, and each token position is looked up for
+    phrases of up to `max_phrase_length` tokens, so all analysis features come
+    out of a single pass. Keywords match at the start of a word, so `vs` no
+    longer fires inside "Slavs" nor `graph` inside "geography", while stems
+    still match longer words ("mathematics", "visualization");
+    WHOLE_WORD_KEYWORDS are matched as whole words only.
+    """
+
+    def __init__(self):
+        self.query_types = [name for name, _ in QUERY_TYPE_KEYWORDS]
+        self.complexities = [name for name, _ in COMPLEXITY_KEYWORDS]
+        self.levels = [name for name, _ in LEVEL_KEYWORDS]
+        self.subjects = list(SUBJECT_KEYWORDS)
+
+        # Feature groups; each becomes one column of the keyword/feature membership matrix
+        groups = []
+        groups += [('query_type', name, words) for name, words in QUERY_TYPE_KEYWORDS]
+        groups += [('visual', 'visual', VISUAL_KEYWORDS)]
+        groups += [('fallback_visual', 'fallback_visual', FALLBACK_VISUAL_KEYWORDS)]
+        groups += [('complexity', name, words) for name, words in COMPLEXITY_KEYWORDS]
+        groups += [('level', name, words) for name, words in LEVEL_KEYWORDS]
+        groups += [('subject', name, words) for name, words in SUBJECT_KEYWORDS.items()]
+        self.groups = [(kind, name) for kind, name, _ in groups]
+
+        self.keywords: List[str] = []
+        keyword_index: Dict[str, int] = {}
+        for _, _, words in groups:
+            for word in words:
+                if word not in keyword_index:
+                    keyword_index[word] = len(self.keywords)
+                    self.keywords.append(word)
+
+        # Keyword -> feature-group membership (0/1), from which the per-keyword lookups below are built
+        self.membership = np.zeros((len(self.keywords), len(groups)), dtype=np.float32)
+        for column, (_, _, words) in enumerate(groups):
+            for word in words:
+                self.membership[keyword_index[word], column] = 1.0
+
+        self._columns = {kind: [] for kind, _ in self.groups}
+        for column, (kind, _) in enumerate(self.groups):
+            self._columns[kind].append(column)
+        self._subject_sizes = np.array(
+            [len(words) for words in SUBJECT_KEYWORDS.values()], dtype=np.float32
+        )
+
+        # Token-sequence table keyed by space-joined tokens; a matched phrase
+        # also implies the shorter keywords it contains ("create image" -> "create")
+        self.phrase_table: Dict[str, Tuple[int, ...]] = {}
+        self.phrase_starts = set()
+        self.max_phrase_length = 1
+        for word in keyword_index:
+            tokens = word.split()
+            implied = tuple(sorted(
+                keyword_index[other] for other in self.keywords
+                if self._contains_phrase(tokens, other.split())
+            ))
+            if len(tokens) > 1:
+                self.phrase_starts.add(tokens[0])
+                self.max_phrase_length = max(self.max_phrase_length, len(tokens))
+            for last in _inflections(tokens[-1]):
+                key = ' '.join(tokens[:-1] + [last])
+                self.phrase_table[key] = tuple(sorted(set(self.phrase_table.get(key, ())) | set(implied)))
+        self.prefix_table = {
+            word: self.phrase_table[word] for word in keyword_index
+            if ' ' not in word and word not in WHOLE_WORD_KEYWORDS
+        }
+        self._prefix_lengths = sorted({len(word) for word in self.prefix_table})
+
+        # Per-keyword feature lookups for the scalar path (priority rank, or None)
+        def rank_of(kind):
+            ranks = []
+            for row in self.membership:
+                columns = [rank for rank, column in enumerate(self._columns[kind]) if row[column]]
+                ranks.append(min(columns) if columns else None)
+            return ranks
+
+        self._query_type_rank = rank_of('query_type')
+        self._complexity_rank = rank_of('complexity')
+        self._level_rank = rank_of('level')
+        self._is_visual = [rank == 0 for rank in rank_of('visual')]
+        self._is_fallback_visual = [rank == 0 for rank in rank_of('fallback_visual')]
+        self._subject_of = [
+            [rank for rank, column in enumerate(self._columns['subject']) if row[column]]
+            for row in self.membership
+        ]
+
+    @staticmethod
+    def _contains_phrase(tokens: List[str], phrase: List[str]) -> bool:
+        n = len(phrase)
+        return any(tokens[i:i + n] == phrase for i in range(len(tokens) - n + 1))
+
+    def match(self, query: str) -> List[int]:
+        """Indices of all keywords present in the query (single tokenization pass)"""
+        tokens = _TOKEN_RE.findall(query.lower())
+        table, prefixes = self.phrase_table, self.prefix_table
+        hits = set()
+        for i, token in enumerate(tokens):
+            implied = table.get(token)
+            if implied:
+                hits.update(implied)
+            for n in self._prefix_lengths:
+                if n >= len(token):
+                    break
+                implied = prefixes.get(token[:n])
+                if implied:
+                    hits.update(implied)
+            if token in self.phrase_starts:
+                for n in range(2, min(self.max_phrase_length, len(tokens) - i) + 1):
+                    implied = table.get(' '.join(tokens[i:i + n]))
+                    if implied:
+                        hits.update(implied)
+        return sorted(hits)
+
+    def scan(self, query: str) -> Dict[str, Any]:
+        """Compute every keyword-derived analysis feature for one query"""
+        hits = self.match(query)
+
+        def first(ranks, names, default):
+            found = [ranks[i] for i in hits if ranks[i] is not None]
+            return names[min(found)] if found else default
+
+        subject_counts = [0] * len(self.subjects)
+        for i in hits:
+            for subject in self._subject_of[i]:
+                subject_counts[subject] += 1
+        subject_scores = [count / size for count, size in zip(subject_counts, self._subject_sizes.tolist())]
+        best = max(range(len(subject_scores)), key=subject_scores.__getitem__)  # first subject wins ties
+        has_subject = subject_scores[best] > 0
+
+        return {
+            'query_type': first(self._query_type_rank, self.query_types, 'general'),
+            'needs_visual': any(self._is_visual[i] for i in hits),
+            'fallback_needs_visual': any(self._is_fallback_visual[i] for i in hits),
+            'complexity': first(self._complexity_rank, self.complexities, 'basic'),
+            'educational_level': first(self._level_rank, self.levels, 'general'),
+            'subject': self.subjects[best] if has_subject else 'general',
+            'subject_confidence': subject_scores[best] if has_subject else 0.5,
+            'keywords': [self.keywords[i] for i in hits]
+        }
+
+    def scan_many(self, queries: List[str]) -> List[Dict[str, Any]]:
+        """`scan` for each query (matching is per-query Python either way, so there is no batch speedup)"""
+        return [self.scan(query) for query in queries]
+
+    def needs_visual(self, query: str) -> bool:
+        """Cheap visual check for admission control and routing"""
+        return self.scan(query)['needs_visual']
+
+
+# Shared engine; compiling the tables once per process is enough
+KEYWORD_ENGINE = QueryKeywordEngine()
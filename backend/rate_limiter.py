@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Any
+
+
+class TokenBucket:
+    """Classic token bucket: refills continuously at `rate` tokens/second up to `capacity`"""
+
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated')
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def wait_time(self, cost: float) -> float:
+        """Seconds until `cost` tokens are available (0 if available now)"""
+        if self.tokens >= cost:
+            return 0.0
+        if self.rate <= 0:
+            return float('inf')
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Per-client and per-classroom admission control for the inference endpoints.
+    A request is admitted only if every bucket it draws from can pay its cost,
+    so a single client cannot drain its classroom's shared budget either.
+    """
+
+    def __init__(self, client_rate: float = 0.5, client_burst: float = 10,
+                 classroom_rate: float = 5.0, classroom_burst: float = 60,
+                 max_buckets: int = 10000, idle_ttl: float = 600):
+        self.limits = {
+            'client': (client_burst, client_rate),
+            'classroom': (classroom_burst, classroom_rate),
+        }
+        self.max_buckets = max_buckets
+        self.idle_ttl = idle_ttl
+
+        self._buckets: 'OrderedDict[Tuple[str, str], TokenBucket]' = OrderedDict()  # Least recently used first
+        self._lock = threading.Lock()
+        self._counters = {
+            'admitted': 0,
+            'limited': 0,
+            'admitted_cost': 0.0,
+            'limited_by': {'client': 0, 'classroom': 0},
+            'evicted': 0,
+            'by_endpoint': {}
+        }
+
+    def _bucket(self, scope: str, key: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get((scope, key))
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._evict(now)
+            capacity, rate = self.limits[scope]
+            bucket = TokenBucket(capacity, rate, now)
+            self._buckets[(scope, key)] = bucket
+        else:
+            bucket.refill(now)
+            self._buckets.move_to_end((scope, key))
+        return bucket
+
+    def _evict(self, now: float):
+        """Drop buckets idle long enough to be full again; if none are, the least recently used one"""
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if now - bucket.updated <= self.idle_ttl and len(self._buckets) < self.max_buckets:
+                break
+            del self._buckets[key]
+            self._counters['evicted'] += 1
+
+    def admit(self, client_id: str, classroom_id: Optional[str], cost: float = 1.0,
+              endpoint: str = "chat") -> Tuple[bool, float, Optional[str]]:
+        """
+        Try to charge `cost` tokens to the client (and classroom) buckets.
+        Returns (admitted, retry_after_seconds, limiting_scope).
+        """
+        now = time.monotonic()
+        with self._lock:
+            buckets = [('client', self._bucket('client', client_id, now))]
+            if classroom_id:
+                buckets.append(('classroom', self._bucket('classroom', classroom_id, now)))
+
+            endpoint_counters = self._counters['by_endpoint'].setdefault(
+                endpoint, {'admitted': 0, 'limited': 0}
+            )
+
+            # A request never costs more than a full bucket, or it could never be admitted
+            for scope, bucket in buckets:
+                wait = bucket.wait_time(min(cost, bucket.capacity))
+                if wait > 0:
+                    self._counters['limited'] += 1
+                    self._counters['limited_by'][scope] += 1
+                    endpoint_counters['limited'] += 1
+                    return False, wait, scope
+
+            for _, bucket in buckets:
+                bucket.tokens -= min(cost, bucket.capacity)
+
+            self._counters['admitted'] += 1
+            self._counters['admitted_cost'] += cost
+            endpoint_counters['admitted'] += 1
+            return True, 0.0, None
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of admission counters and limiter configuration"""
+        with self._lock:
+            return {
+                'admitted': self._counters['admitted'],
+                'limited': self._counters['limited'],
+                'admitted_cost': self._counters['admitted_cost'],
+                'limited_by': dict(self._counters['limited_by']),
+                'by_endpoint': {k: dict(v) for k, v in self._counters['by_endpoint'].items()},
+                'active_buckets': len(self._buckets),
+                'evicted_buckets': self._counters['evicted'],
+                'limits': {
+                    scope: {'burst': burst, 'rate_per_second': rate}
+                    for scope, (burst, rate) in self.limits.items()
+                }
+            }
@@ -0,0 +1,463 @@
+import abc
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import time
+from concurrent.futures import Future, as_completed
+from typing import Dict, List, Optional, Any
+from cancellation import CANCELLATION, CancelToken, RequestCancelled
+from load_governor import FULL
+
+# Thread pools every BLAS/OpenMP runtime in the stack reads at import time
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_replicas(replicas: int, threads_per_replica: Optional[int] = None,
+                  cores: Optional[List[int]] = None) -> List[List[int]]:
+    """
+    Split the usable cores into `replicas` disjoint blocks of consecutive core
+    ids (neighbouring ids usually share a cache and NUMA node). By default the
+    cores are shared out evenly; leftovers stay free for the API process.
+    """
+    cores = sorted(cores if cores is not None else available_cores())
+    if replicas < 1:
+        raise ValueError("replicas must be at least 1")
+    threads = threads_per_replica or max(1, len(cores) // replicas)
+    if replicas * threads > len(cores):
+        raise ValueError(f"{replicas} replicas x {threads} threads needs {replicas * threads} cores, "
+                         f"{len(cores)} available")
+    return [cores[i * threads:(i + 1) * threads] for i in range(replicas)]
+
+
+# Replica side (runs in the worker process; worker.py reuses these)
+
+def load_backend(backend: str, threads: int, backend_kwargs: Dict[str, Any]):
+    """The assistant for a worker process; `threads` is the size of its core set"""
+    if backend == "fake":
+        from fake_ai import FakeClassroomAI
+        return FakeClassroomAI(display_images=False, **backend_kwargs)
+    import torch
+    torch.set_num_interop_threads(1)  # One request at a time per replica; only intra-op parallelism helps
+    from ai_models import AdvancedClassroomAI
+    return AdvancedClassroomAI(device='cpu', display_images=False, num_threads=threads, **backend_kwargs)
+
+
+def backend_info(ai) -> Dict[str, Any]:
+    """What the API process needs to stand in for the assistant"""
+    models = {
+        'caption': getattr(ai, 'image_caption_model', None) is not None,
+        'summarizer': getattr(ai, 'summarizer', None) is not None
+    }
+    return {
+        'pid': os.getpid(),
+        'models': models,
+        'generation_params': ai.generation_params(),
+        'caption_preprocess_config': ai.caption_preprocess_config() if models['caption'] else None,
+        # Tokenizers pickle; the summarizer chunks text in the API process
+        'summarizer_tokenizer': ai.summarizer.tokenizer if models['summarizer'] else None,
+        'model_dtypes': getattr(ai, 'model_dtypes', {}),
+        'model_memory': getattr(ai, 'model_memory', {})
+    }
+
+
+def backend_stats(ai) -> Dict[str, Any]:
+    from model_memory import rss_bytes
+    return {
+        'rss_bytes': rss_bytes(),
+        'visuals': ai.visual_router.stats(),
+        'cancellation': CANCELLATION.stats()
+    }
+
+
+# Methods the API process may call on a replica: (ai, cancel_token, *args) -> picklable result
+HANDLERS = {
+    'process_educational_query': lambda ai, token, query, context=None, degradation=FULL, defer_visuals=False:
+        ai.process_educational_query(query, context, degradation, cancel_token=token, defer_visuals=defer_visuals),
+    'generate_educational_visual': lambda ai, token, query, analysis:
+        ai.generate_educational_visual(query, analysis, token),
+    'analyze_educational_queries': lambda ai, token, queries: ai.analyze_educational_queries(queries),
+    'generate_educational_responses': lambda ai, token, queries, analyses, batch_size, degradation=FULL:
+        list(ai.generate_educational_responses(queries, analyses, batch_size=batch_size, degradation=degradation)),
+    'fallback_analysis': lambda ai, token, query: ai.fallback_analysis(query),
+    'answer_from_passages': lambda ai, token, question, passages: ai.answer_from_passages(question, passages),
+    'caption_images': lambda ai, token, pixel_values: ai.caption_images(pixel_values),
+    'summarize': lambda ai, token, args, kwargs: ai.summarizer(*args, **kwargs)
+}
+
+
+def _reply(responses: "multiprocessing.Queue", index: int, request_id: Optional[str], status: str, payload: Any):
+    """Pickle here: a Queue pickles in a feeder thread, where a failure would be silent and the caller would hang"""
+    try:
+        data = pickle.dumps(payload)
+    except Exception as e:
+        status, data = 'error', pickle.dumps(f"unpicklable result: {e}")
+    responses.put((index, request_id, status, data))
+
+
+def _replica_main(index: int, cores: List[int], threads: int, backend: str, backend_kwargs: Dict[str, Any],
+                  requests: "multiprocessing.Queue", responses: "multiprocessing.Queue"):
+    """Worker process: pin to `cores`, load the models, serve one request at a time"""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    else:
+        print(f"⚠️ Replica {index}: CPU pinning not supported on this platform")
+
+    try:
+        ai = load_backend(backend, threads, backend_kwargs)
+        if not getattr(ai, 'models_ready', False):
+            raise RuntimeError("models failed to load")
+        _reply(responses, index, None, 'ready', backend_info(ai))
+    except Exception as e:
+        _reply(responses, index, None, 'error', f"{type(e).__name__}: {e}")
+        return
+
+    tokens: Dict[str, CancelToken] = {}
+    work = queue.Queue()
+
+    # Cancels and stats are answered at once, not queued behind model work
+    def read_requests():
+        while True:
+            message = requests.get()
+            if message is None:
+                work.put(None)
+                return
+            kind, request_id = message[0], message[1]
+            if kind == 'cancel':
+                token = tokens.get(request_id)
+                if token is not None:
+                    token.cancel(message[2])
+            elif kind == 'stats':
+                _reply(responses, index, request_id, 'ok', backend_stats(ai))
+            else:
+                tokens[request_id] = CancelToken()
+                work.put(message)
+
+    threading.Thread(target=read_requests, name=f"replica-{index}-reader", daemon=True).start()
+
+    while True:
+        message = work.get()
+        if message is None:
+            return
+        _, request_id, method, args = message
+        token = tokens[request_id]
+        try:
+            if token.cancelled:
+                CANCELLATION.skip(method)
+                raise RequestCancelled(token.reason)
+            wall_start, cpu_start = time.perf_counter(), time.thread_time()
+            result = HANDLERS[method](ai, token, *args)
+            CANCELLATION.observe(method, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+        except RequestCancelled as e:
+            _reply(responses, index, request_id, 'cancelled', str(e))
+        except Exception as e:
+            _reply(responses, index, request_id, 'error', f"{type(e).__name__}: {e}")
+        else:
+            _reply(responses, index, request_id, 'ok', result)
+        finally:
+            tokens.pop(request_id, None)
+
+
+# API side
+
+class RemoteSummarizer:
+    """Summarization pipeline stand-in: tokenizes locally, generates on a worker"""
+
+    def __init__(self, pool: "RemoteAssistant", tokenizer):
+        self.pool = pool
+        self.tokenizer = tokenizer
+
+    def __call__(self, *args, **kwargs):
+        return self.pool.call('summarize', args, kwargs)
+
+
+class ReplicaVisualStats:
+    def __init__(self, pool: "RemoteAssistant"):
+        self.pool = pool
+
+    def stats(self) -> Dict[str, Any]:
+        return {'replicas': [stats.get('visuals') for stats in self.pool.replica_stats()]}
+
+
+class RemoteAssistant(abc.ABC):
+    """
+    The AdvancedClassroomAI interface the API uses, forwarded to models in
+    other processes. Subclasses provide `call(method, *args, cancel_token)`
+    (a HANDLERS entry run remotely) and set `backend_info` from a worker.
+    """
+
+    always_defer_visuals = False
+
+    def __init__(self, conversation_store=None):
+        self.conversation_history = []
+        self.conversation_store = conversation_store
+        self.models_ready = False
+        self.backend_info: Dict[str, Any] = {}
+
+    @abc.abstractmethod
+    def call(self, method: str, *args, cancel_token: Optional[CancelToken] = None):
+        """Run HANDLERS[method](*args) on a model process and return its result"""
+
+    def _adopt(self, info: Dict[str, Any]):
+        """Mirror what the in-process assistant exposes, from a worker's backend_info()"""
+        self.backend_info = info
+        self.model_dtypes = info['model_dtypes']
+        self.image_caption_model = True if info['models']['caption'] else None
+        self.summarizer = RemoteSummarizer(self, info['summarizer_tokenizer']) if info['models']['summarizer'] else None
+        self.visual_router = ReplicaVisualStats(self)
+
+    def generation_params(self) -> Dict[str, Any]:
+        return self.backend_info['generation_params']
+
+    def caption_preprocess_config(self) -> Dict[str, Any]:
+        return self.backend_info['caption_preprocess_config']
+
+    def record_conversation(self, query: str, response: str, analysis: Dict[str, Any],
+                            processing_time: float, has_visual: bool):
+        entry = {
+            'query': query,
+            'response': response,
+            'analysis': analysis,
+            'timestamp': time.time(),
+            'processing_time': processing_time,
+            'has_visual': has_visual
+        }
+        self.conversation_history.append(entry)
+        if self.conversation_store is not None:
+            self.conversation_store.record(entry)
+
+    def process_educational_query(self, query: str, context: Optional[str] = None,
+                                  degradation: int = FULL, cancel_token: Optional[CancelToken] = None,
+                                  defer_visuals: bool = False) -> Dict[str, Any]:
+        result = self.call('process_educational_query', query, context, degradation,
+                           defer_visuals or self.always_defer_visuals, cancel_token=cancel_token)
+        # Workers keep no log; the conversation is recorded here like the in-process assistant does
+        if result.get('success'):
+            self.record_conversation(query, result['text_response'], result['analysis'],
+                                     result['processing_time'], result.get('visual_image') is not None)
+        return result
+
+    def generate_educational_visual(self, query: str, analysis: Dict[str, Any],
+                                    cancel_token: Optional[CancelToken] = None):
+        return self.call('generate_educational_visual', query, analysis, cancel_token=cancel_token)
+
+    def analyze_educational_queries(self, queries: List[str]) -> List[Dict[str, Any]]:
+        return self.call('analyze_educational_queries', queries)
+
+    def fallback_analysis(self, query: str) -> Dict[str, Any]:
+        return self.call('fallback_analysis', query)
+
+    def answer_from_passages(self, question: str, passages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return self.call('answer_from_passages', question, passages)
+
+    def caption_images(self, pixel_values) -> List[str]:
+        return self.call('caption_images', pixel_values)
+
+
+class ReplicaPool(RemoteAssistant):
+    """
+    Stand-in for AdvancedClassroomAI that runs the models in N worker
+    processes, each pinned to its own block of cores with torch/OpenMP
+    thread counts to match. Small-batch decoding scales poorly with threads,
+    so several narrow replicas answer more questions per second than one wide
+    one. Each call goes to the replica with the fewest outstanding requests.
+    Every replica holds its own copy of the weights.
+    """
+
+    def __init__(self, replicas: int, threads_per_replica: Optional[int] = None, backend: str = "models",
+                 cores: Optional[List[int]] = None, conversation_store=None,
+                 start_timeout: float = 1800, backend_kwargs: Optional[Dict[str, Any]] = None):
+        super().__init__(conversation_store)
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._ids = itertools.count()
+        self._next = 0
+        self._closed = False
+
+        context = multiprocessing.get_context("spawn")  # torch and fork don't mix
+        self._responses = context.Queue()
+        self._replicas = []
+        for index, replica_cores in enumerate(plan_replicas(replicas, threads_per_replica, cores)):
+            requests = context.Queue()
+            process = context.Process(
+                target=_replica_main, name=f"replica-{index}", daemon=True,
+                args=(index, replica_cores, len(replica_cores), backend, backend_kwargs or {}, requests, self._responses)
+            )
+            process.start()
+            self._replicas.append({
+                'index': index, 'cores': replica_cores, 'threads': len(replica_cores),
+                'process': process, 'requests': requests, 'alive': True, 'info': None,
+                'outstanding': 0, 'served': 0, 'failed': 0, 'busy_seconds': 0.0
+            })
+            print(f"🧩 Replica {index}: cores {replica_cores[0]}-{replica_cores[-1]} ({len(replica_cores)} threads)")
+
+        self._wait_ready(start_timeout)
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="replica-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+        self._adopt(self._replicas[0]['info'])
+        # Per replica: every replica holds its own copy of the weights
+        self.model_memory = {
+            f"{key}@replica{replica['index']}": usage
+            for replica in self._replicas for key, usage in replica['info']['model_memory'].items()
+        }
+        self.models_ready = True
+
+    def _wait_ready(self, timeout: float):
+        deadline = time.time() + timeout
+        waiting = {replica['index'] for replica in self._replicas}
+        while waiting:
+            try:
+                index, _, status, data = self._responses.get(timeout=max(0.1, deadline - time.time()))
+            except queue.Empty:
+                self.close()
+                raise RuntimeError(f"Replicas {sorted(waiting)} not ready after {timeout:.0f}s")
+            payload = pickle.loads(data)
+            if status != 'ready':
+                self.close()
+                raise RuntimeError(f"Replica {index} failed to start: {payload}")
+            self._replicas[index]['info'] = payload
+            waiting.discard(index)
+            print(f"✅ Replica {index} ready (pid {payload['pid']})")
+
+    def _pick(self) -> Dict[str, Any]:
+        """Fewest outstanding requests; ties rotate so idle replicas share the work"""
+        live = [replica for replica in self._replicas if replica['alive']]
+        if not live:
+            raise RuntimeError("No live inference replicas")
+        self._next = (self._next + 1) % len(live)
+        rotated = live[self._next:] + live[:self._next]
+        return min(rotated, key=lambda replica: replica['outstanding'])
+
+    def submit(self, method: str, *args, cancel_token: Optional[CancelToken] = None,
+               replica: Optional[int] = None) -> Future:
+        future = Future()
+        request_id = str(next(self._ids))
+        with self._lock:
+            target = self._replicas[replica] if replica is not None else self._pick()
+            target['outstanding'] += 1
+            self._pending[request_id] = {
+                'future': future, 'replica': target, 'token': cancel_token,
+                'sent_at': time.perf_counter(), 'cancel_sent': False, 'counted': method != 'stats'
+            }
+        if method == 'stats':
+            target['requests'].put(('stats', request_id))
+        else:
+            target['requests'].put(('call', request_id, method, args))
+        return future
+
+    def call(self, method: str, *args, cancel_token: Optional[CancelToken] = None):
+        return self.submit(method, *args, cancel_token=cancel_token).result()
+
+    def _dispatch_loop(self):
+        while not self._closed:
+            try:
+                index, request_id, status, data = self._responses.get(timeout=0.2)
+            except queue.Empty:
+                pass
+            except (EOFError, OSError):
+                return
+            else:
+                self._resolve(request_id, status, pickle.loads(data))
+            self._forward_cancellations()
+            self._check_replicas()
+
+    def _resolve(self, request_id: str, status: str, payload: Any):
+        with self._lock:
+            pending = self._pending.pop(request_id, None)
+            if pending is None:
+                return
+            replica = pending['replica']
+            replica['outstanding'] -= 1
+            if pending['counted']:
+                replica['served'] += 1
+                replica['busy_seconds'] += time.perf_counter() - pending['sent_at']
+                replica['failed'] += status == 'error'
+        if status == 'ok':
+            pending['future'].set_result(payload)
+        elif status == 'cancelled':
+            pending['future'].set_exception(RequestCancelled(payload))
+        else:
+            pending['future'].set_exception(RuntimeError(f"Replica {replica['index']}: {payload}"))
+
+    def _forward_cancellations(self):
+        with self._lock:
+            cancelled = [
+                (request_id, pending) for request_id, pending in self._pending.items()
+                if pending['token'] is not None and not pending['cancel_sent'] and pending['token'].cancelled
+            ]
+            for _, pending in cancelled:
+                pending['cancel_sent'] = True
+        for request_id, pending in cancelled:
+            pending['replica']['requests'].put(('cancel', request_id, pending['token'].reason))
+
+    def _check_replicas(self):
+        """A replica that died takes its outstanding requests with it; stop routing to it"""
+        for replica in self._replicas:
+            if not replica['alive'] or replica['process'].is_alive():
+                continue
+            replica['alive'] = False
+            print(f"❌ Replica {replica['index']} exited (code {replica['process'].exitcode})")
+            with self._lock:
+                lost = [request_id for request_id, pending in self._pending.items() if pending['replica'] is replica]
+            for request_id in lost:
+                self._resolve(request_id, 'error', "replica process exited")
+
+    def generate_educational_responses(self, queries: List[str], analyses: List[Dict[str, Any]],
+                                       batch_size: int = 8, degradation: int = FULL):
+        """Batches are spread over the replicas and yielded as each one finishes"""
+        futures = [
+            (start, self.submit('generate_educational_responses', queries[start:start + batch_size],
+                                analyses[start:start + batch_size], batch_size, degradation))
+            for start in range(0, len(queries), batch_size)
+        ]
+        offsets = {future: start for start, future in futures}
+        for future in as_completed(offsets):
+            for i, response in future.result():
+                yield offsets[future] + i, response
+
+    def replica_stats(self) -> List[Dict[str, Any]]:
+        """Model-side stats from every live replica (answered ahead of queued work)"""
+        futures = [self.submit('stats', replica=replica['index']) for replica in self._replicas if replica['alive']]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(timeout=5))
+            except Exception as e:
+                results.append({'error': str(e)})
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            replicas = [
+                {
+                    'index': replica['index'], 'pid': replica['info']['pid'] if replica['info'] else None,
+                    'cores': replica['cores'], 'threads': replica['threads'], 'alive': replica['alive'],
+                    'outstanding': replica['outstanding'], 'served': replica['served'], 'failed': replica['failed'],
+                    'mean_latency_ms': replica['busy_seconds'] / replica['served'] * 1000 if replica['served'] else None
+                }
+                for replica in self._replicas
+            ]
+        return {'replicas': replicas, 'outstanding': sum(r['outstanding'] for r in replicas)}
+
+    def close(self):
+        self._closed = True
+        for replica in self._replicas:
+            try:
+                replica['requests'].put(None)
+            except (ValueError, OSError):
+                pass
+        for replica in self._replicas:
+            replica['process'].join(timeout=10)
+            if replica['process'].is_alive():
+                replica['process'].terminate()
@@ -0,0 +1,248 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Any, Tuple
+from cancellation import CANCELLATION, CancelToken, RequestCancelled
+
+# Set per request from the X-Priority-Class header; copied into threadpool work and visual jobs
+REQUEST_CLASS: ContextVar[Optional[str]] = ContextVar("request_class", default=None)
+
+# Rough answer length by complexity, relative to an average answer (scales the text stage prior)
+EXPECTED_TOKENS = {'basic': 150, 'intermediate': 250, 'advanced': 350}
+AVERAGE_TOKENS = 250
+
+# Stage costs used before anything has been measured
+DEFAULT_STAGE_SECONDS = {
+    'subject_classifier': 0.5,
+    'text_model.generate': 3.0,
+    'image_pipeline': 60.0
+}
+PLOT_SECONDS = 0.3  # Agg fast path (visual_router.py)
+# Priors for model work outside the chat pipeline: speech-to-text, BLIP captions,
+# a map-reduce summary and the extractive reader over course material
+JOB_SECONDS = {'speech': 3.0, 'caption': 1.0, 'summary': 10.0, 'reader': 0.5}
+
+
+def parse_priority_classes(text: str) -> Dict[str, float]:
+    """'teacher=0,student=20' -> head start (seconds of expected work) per class, best class first"""
+    classes = {}
+    for item in text.split(","):
+        if "=" in item:
+            name, offset = item.split("=", 1)
+            classes[name.strip().lower()] = float(offset)
+    return dict(sorted(classes.items(), key=lambda item: item[1]))
+
+
+class CostModel:
+    """
+    Expected service seconds for a request shape: its kind ('text',
+    'text+diffusion', 'text+plot', 'diffusion', 'plot', or one of
+    JOB_SECONDS), query type and complexity. Learned per shape as an EWMA
+    of measured runs; until a shape has been seen, the prior is the sum of
+    its stages' typical times from the per-stage history (CANCELLATION),
+    the text stage scaled by the expected answer length.
+    """
+
+    def __init__(self, smoothing: float = 0.2):
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._learned: Dict[str, Dict[str, float]] = {}
+
+    @staticmethod
+    def shape(analysis: Dict[str, Any], kind: str) -> str:
+        return f"{kind}:{analysis.get('query_type', 'general')}:{analysis.get('complexity', 'basic')}"
+
+    def prior(self, analysis: Dict[str, Any], kind: str) -> float:
+        typical = CANCELLATION.stats()['typical_seconds']
+
+        def stage(label: str) -> float:
+            return typical[label]['wall'] if label in typical else DEFAULT_STAGE_SECONDS[label]
+
+        parts = kind.split('+')
+        seconds = 0.0
+        if 'text' in parts:
+            tokens = EXPECTED_TOKENS.get(analysis.get('complexity'), AVERAGE_TOKENS)
+            seconds += stage('subject_classifier') + stage('text_model.generate') * tokens / AVERAGE_TOKENS
+        if 'diffusion' in parts:
+            seconds += stage('image_pipeline')
+        if 'plot' in parts:
+            seconds += PLOT_SECONDS
+        return seconds + sum(JOB_SECONDS.get(part, 0.0) for part in parts)
+
+    def estimate(self, analysis: Dict[str, Any], kind: str) -> Tuple[str, float]:
+        """(shape, expected seconds)"""
+        shape = self.shape(analysis, kind)
+        with self._lock:
+            learned = self._learned.get(shape)
+        if learned is not None:
+            return shape, learned['seconds']
+        return shape, self.prior(analysis, kind)
+
+    def observe(self, shape: str, seconds: float):
+        with self._lock:
+            learned = self._learned.get(shape)
+            if learned is None:
+                self._learned[shape] = {'seconds': seconds, 'runs': 1}
+            else:
+                learned['seconds'] += self.smoothing * (seconds - learned['seconds'])
+                learned['runs'] += 1
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {shape: dict(learned) for shape, learned in self._learned.items()}
+
+
+class _Waiter:
+    __slots__ = ('request_class', 'shape', 'cost', 'enqueued_at', 'event', 'granted', 'abandoned')
+
+    def __init__(self, request_class: str, shape: str, cost: float):
+        self.request_class = request_class
+        self.shape = shape
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+        self.event = threading.Event()
+        self.granted = False
+        self.abandoned = False
+
+
+class CostScheduler:
+    """
+    Admission for model work: `slots` runs at a time, the rest wait in order
+    of priority class, then shortest expected job first. A waiting request's
+    cost counts down by `aging` seconds per second waited, so nothing
+    starves: a job waits at most about (its cost - a newcomer's cost) / aging
+    seconds for newer, cheaper work, plus its class's head-start gap.
+    With policy='fifo' classes still apply but cost and aging don't.
+    """
+
+    def __init__(self, slots: int = 1, aging: float = 0.5, classes: Optional[Dict[str, float]] = None,
+                 policy: str = "sjf", cost_model: Optional[CostModel] = None, enabled: bool = True,
+                 history: int = 1000):
+        self.slots = max(1, slots)
+        self.aging = aging
+        self.classes = classes or {'teacher': 0.0, 'student': 20.0}
+        self.default_class = list(self.classes)[-1]
+        self.policy = policy
+        self.cost_model = cost_model or CostModel()
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._waits = {name: deque(maxlen=history) for name in self.classes}
+        self._counters = {name: {'served': 0, 'abandoned': 0} for name in self.classes}
+        self._estimate_errors = deque(maxlen=history)
+
+    def resolve_class(self, request_class: Optional[str]) -> str:
+        """Unknown or missing classes get the lowest priority"""
+        request_class = (request_class or '').lower()
+        return request_class if request_class in self.classes else self.default_class
+
+    def _key(self, waiter: _Waiter) -> float:
+        offset = self.classes[waiter.request_class]
+        if self.policy == "fifo":
+            return offset + waiter.enqueued_at
+        # cost + offset - aging * (now - enqueued): `now` is common to all waiters, so it drops out
+        return waiter.cost + offset + self.aging * waiter.enqueued_at
+
+    def _grant_next(self):
+        """Hand a free slot to the best waiter (lock held)"""
+        while self._heap and self._running < self.slots:
+            _, _, waiter = heapq.heappop(self._heap)
+            if waiter.abandoned:
+                continue
+            waiter.granted = True
+            self._running += 1
+            waiter.event.set()
+
+    def _release(self):
+        with self._lock:
+            self._running -= 1
+            self._grant_next()
+
+    @contextmanager
+    def slot(self, analysis: Dict[str, Any], kind: str, request_class: Optional[str] = None,
+             cancel_token: Optional[CancelToken] = None, label: str = "request"):
+        """
+        Wait for a model slot, then run the body in it. Raises RequestCancelled
+        if the token trips while waiting (credited to CANCELLATION as a skipped
+        `label`); the run's time trains the cost model.
+        """
+        if not self.enabled:
+            yield
+            return
+        shape, cost = self.cost_model.estimate(analysis, kind)
+        waiter = _Waiter(self.resolve_class(request_class), shape, cost)
+        with self._lock:
+            heapq.heappush(self._heap, (self._key(waiter), next(self._sequence), waiter))
+            self._grant_next()
+
+        # The slot grant and a cancel both set the waiter's event; the token's deadline bounds the wait
+        if cancel_token is not None:
+            cancel_token.watch(waiter.event)
+        try:
+            while not waiter.granted:
+                waiter.event.wait(cancel_token.remaining() if cancel_token is not None else None)
+                if cancel_token is not None and cancel_token.cancelled:
+                    with self._lock:
+                        if not waiter.granted:
+                            waiter.abandoned = True
+                            self._counters[waiter.request_class]['abandoned'] += 1
+                    if not waiter.granted:
+                        CANCELLATION.skip(label)
+                        raise RequestCancelled(cancel_token.reason)
+                    break  # Granted meanwhile; the model call itself will notice the token
+        finally:
+            if cancel_token is not None:
+                cancel_token.unwatch(waiter.event)
+
+        started_at = time.monotonic()
+        with self._lock:
+            self._waits[waiter.request_class].append(started_at - waiter.enqueued_at)
+            self._counters[waiter.request_class]['served'] += 1
+        try:
+            yield
+        except RequestCancelled:
+            raise  # A cut-short run says nothing about the cost
+        else:
+            seconds = time.monotonic() - started_at
+            self.cost_model.observe(shape, seconds)
+            with self._lock:
+                self._estimate_errors.append(abs(seconds - cost) / max(seconds, 1e-3))
+        finally:
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waiting = {name: 0 for name in self.classes}
+            for _, _, waiter in self._heap:
+                if not waiter.abandoned:
+                    waiting[waiter.request_class] += 1
+            classes = {}
+            for name, waits in self._waits.items():
+                ordered = sorted(waits)
+                classes[name] = {
+                    **self._counters[name],
+                    'waiting': waiting[name],
+                    'head_start_seconds': self.classes[name],
+                    'wait_p50_seconds': ordered[len(ordered) // 2] if ordered else 0.0,
+                    'wait_p95_seconds': ordered[int(len(ordered) * 0.95)] if ordered else 0.0,
+                    'wait_max_seconds': ordered[-1] if ordered else 0.0
+                }
+            errors = sorted(self._estimate_errors)
+            running = self._running
+        return {
+            'enabled': self.enabled,
+            'policy': self.policy,
+            'slots': self.slots,
+            'running': running,
+            'aging': self.aging,
+            'classes': classes,
+            'learned_seconds': self.cost_model.stats(),
+            'estimate_error_p50': errors[len(errors) // 2] if errors else None
+        }
@@ -0,0 +1,259 @@
+import copy
+import re
+import threading
+import time
+import numpy as np
+from typing import Dict, List, Optional, Any, Tuple
+from query_analyzer import KEYWORD_ENGINE
+from single_flight import normalize_query
+
+# Leading question framing that doesn't change what is being asked about
+_FRAME_RE = re.compile(
+    r"^(?:(?:can|could|would|will) you |please |(?:what|who|where) (?:is|are|was|were) |what's |whats |"
+    r"(?:explain|describe|tell me) (?:about |what )?|define |give (?:me )?(?:a |an )?|"
+    r"(?:the )?(?:definition|meaning|explanation|description) of |what do you mean by |"
+    r"i (?:want|would like) to (?:know|learn) (?:about )?|(?:an?|the) )+"
+)
+
+# Cosine thresholds per embedding model, tuned with bench_semantic_cache.py's labeled paraphrase set.
+# Scores from different models are not on the same scale, so a threshold only holds for the model it was
+# tuned on; all-MiniLM-L6-v2 gets a precision-first value until it is tuned the same way.
+DEFAULT_THRESHOLDS = {
+    'hashing': 0.85,
+    'sentence-transformers/all-MiniLM-L6-v2': 0.9
+}
+FALLBACK_THRESHOLD = 0.9
+
+
+def default_threshold(embedder_name: str) -> float:
+    """The tuned threshold for an embedder ('hashing-384' uses the 'hashing' entry)"""
+    if embedder_name in DEFAULT_THRESHOLDS:
+        return DEFAULT_THRESHOLDS[embedder_name]
+    return DEFAULT_THRESHOLDS.get(embedder_name.split('-')[0], FALLBACK_THRESHOLD)
+
+
+def cache_text(query: str) -> str:
+    """'Can you explain what photosynthesis is?' and 'define photosynthesis' both embed as 'photosynthesis ...'"""
+    text = normalize_query(query)
+    stripped = _FRAME_RE.sub('', text).strip()
+    stripped = re.sub(r"(?: please)? (?:is|are|means?)$| please$", '', stripped).strip()
+    return stripped or text
+
+
+class IVFIndex:
+    """
+    Approximate search over the cache's vector matrix: k-means cells, each
+    with an inverted list of its rows, and a query scans only the rows in its
+    `n_probe` nearest cells. A row written again (the cache's ring buffer
+    wrapping) moves cells; its old list entry is skipped at query time.
+    """
+
+    def __init__(self, n_lists: int, n_probe: int, iterations: int = 8, seed: int = 0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.iterations = iterations
+        self.rng = np.random.default_rng(seed)
+        self.centroids: Optional[np.ndarray] = None
+        self.cells: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+        self._pending: List[List[int]] = []
+        self._moved = False
+
+    def train(self, vectors: np.ndarray):
+        """Spherical k-means on the rows (unit vectors, so nearest = largest dot product)"""
+        n_lists = min(self.n_lists, len(vectors))
+        centroids = vectors[self.rng.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in range(self.iterations):
+            cells = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, cells, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            centroids = np.where(empty[:, None], centroids, sums / np.maximum(norms, 1e-12))
+        self.centroids = centroids.astype(np.float32)
+        self.cells = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+        order = np.argsort(self.cells, kind='stable')
+        bounds = np.searchsorted(self.cells[order], np.arange(n_lists + 1))
+        self.lists = [order[bounds[cell]:bounds[cell + 1]] for cell in range(n_lists)]
+        self._pending = [[] for _ in range(n_lists)]
+        self._moved = False
+
+    def assign(self, row: int, vector: np.ndarray):
+        if row >= len(self.cells):
+            self.cells = np.concatenate([self.cells, np.full(max(row + 1, 2 * len(self.cells)) - len(self.cells), -1,
+                                                             dtype=np.int32)])
+        cell = int(np.argmax(self.centroids @ vector))
+        self._moved |= self.cells[row] != -1
+        self.cells[row] = cell
+        self._pending[cell].append(row)
+
+    def candidates(self, vector: np.ndarray) -> np.ndarray:
+        """Rows in the cells nearest to the query"""
+        n_probe = min(self.n_probe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ vector), n_probe - 1)[:n_probe]
+        for cell in probe:
+            if self._pending[cell]:
+                self.lists[cell] = np.concatenate([self.lists[cell], self._pending[cell]])
+                self._pending[cell] = []
+        rows = np.concatenate([self.lists[cell] for cell in probe])
+        if self._moved:
+            rows = np.unique(rows[np.isin(self.cells[rows], probe)])  # Drop rows that have since moved cells
+        return rows
+
+
+# Gate labels: namespace, subject, educational level, query type, needs visual
+LABELS = 5
+
+
+class SemanticCache:
+    """
+    Answers for paraphrased questions. Queries are embedded (after dropping
+    question framing like "what is" / "explain"), and a new query reuses a
+    cached answer when the nearest cached query is at least `threshold`
+    cosine-similar AND was asked with the same generation settings and
+    context AND the keyword engine gives both the same subject, educational
+    level, query type and need for a visual. The threshold defaults to the
+    one tuned for the embedder (see DEFAULT_THRESHOLDS). Search is a
+    brute-force matrix product up to `ann_min_entries`, then an IVF index;
+    entries expire after `ttl_seconds` and the oldest is overwritten once
+    `max_entries` are cached.
+    """
+
+    def __init__(self, embedder, threshold: Optional[float] = None, max_entries: int = 10000,
+                 ttl_seconds: float = 86400, ann_min_entries: int = 4096, n_probe: int = 8):
+        self.embedder = embedder
+        self.threshold = threshold if threshold is not None else default_threshold(embedder.name)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.ann_min_entries = ann_min_entries
+        self.n_probe = n_probe
+
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((min(max_entries, 1024), embedder.dim), dtype=np.float32)
+        self._created = np.zeros(len(self._vectors), dtype=np.float64)
+        self._labels = np.zeros((len(self._vectors), LABELS), dtype=np.int32)  # Codes of _labels_for's values
+        self._entries: List[Optional[Dict[str, Any]]] = [None] * len(self._vectors)
+        self._codes: Dict[str, int] = {}
+        self._size = 0
+        self._next = 0
+        self._index: Optional[IVFIndex] = None
+        self._trained_at = 0
+        self._counters = {
+            'lookups': 0,
+            'hits': 0,
+            'misses': 0,
+            'gated_out': 0,
+            'stores': 0,
+            'lookup_seconds': 0.0
+        }
+
+    def _code(self, label: str) -> int:
+        code = self._codes.get(label)
+        if code is None:
+            code = self._codes[label] = len(self._codes)
+        return code
+
+    def _labels_for(self, text: str, namespace: str) -> Tuple[str, ...]:
+        """A cached answer is only reused when all of these match"""
+        features = KEYWORD_ENGINE.scan(text)
+        return (namespace, features['subject'], features['educational_level'], features['query_type'],
+                f"visual={features['needs_visual']}")
+
+    def lookup(self, query: str, namespace: str = "") -> Optional[Dict[str, Any]]:
+        """The cached entry {'query', 'result', 'similarity', ...} for a paraphrase of `query`, or None"""
+        start_time = time.perf_counter()
+        vector = self.embedder.encode([cache_text(query)])[0]
+        labels = self._labels_for(query, namespace)
+        with self._lock:
+            match, gated_out = self._search(vector, labels)
+            if match is not None:
+                entry = self._entries[match[0]]
+                entry['hits'] += 1
+                # Callers may modify the answer they get; the cached one must stay as stored
+                entry = copy.deepcopy(entry)
+            self._counters['lookups'] += 1
+            self._counters['hits' if match is not None else 'misses'] += 1
+            self._counters['gated_out'] += gated_out
+            self._counters['lookup_seconds'] += time.perf_counter() - start_time
+        if match is None:
+            return None
+        return {**entry, 'similarity': match[1]}
+
+    def _search(self, vector: np.ndarray, labels: Tuple[str, ...]) -> Tuple[Optional[Tuple[int, float]], bool]:
+        """Best row passing threshold and gates, and whether a row above threshold was gated out"""
+        if self._size == 0:
+            return None, False
+        if self._index is not None:
+            rows = self._index.candidates(vector)
+            scores = self._vectors[rows] @ vector
+        else:
+            rows = np.arange(self._size)
+            scores = self._vectors[:self._size] @ vector
+
+        close = scores >= self.threshold
+        if not close.any():
+            return None, False
+        codes = np.array([self._codes.get(label, -1) for label in labels], dtype=np.int32)
+        valid = close & (self._labels[rows] == codes).all(axis=1)
+        valid &= self._created[rows] >= time.time() - self.ttl_seconds
+        if not valid.any():
+            return None, True
+        best = int(np.argmax(np.where(valid, scores, -np.inf)))
+        return (int(rows[best]), float(scores[best])), False
+
+    def store(self, query: str, result: Dict[str, Any], namespace: str = ""):
+        vector = self.embedder.encode([cache_text(query)])[0]
+        labels = self._labels_for(query, namespace)
+        result = copy.deepcopy(result)
+        with self._lock:
+            row = self._next
+            if row >= len(self._vectors):
+                self._grow()
+            self._vectors[row] = vector
+            self._created[row] = time.time()
+            self._labels[row] = [self._code(label) for label in labels]
+            self._entries[row] = {'query': query, 'result': result, 'subject': labels[1],
+                                  'educational_level': labels[2], 'query_type': labels[3], 'hits': 0}
+            self._size = max(self._size, row + 1)
+            self._next = (row + 1) % self.max_entries
+            self._counters['stores'] += 1
+            if self._index is not None:
+                self._index.assign(row, vector)
+            # (Re)train the IVF cells when the cache first gets large, then each time it doubles
+            if self._size >= self.ann_min_entries and self._counters['stores'] >= 2 * self._trained_at:
+                self._index = IVFIndex(n_lists=int(np.sqrt(self._size)), n_probe=self.n_probe)
+                self._index.train(self._vectors[:self._size])
+                self._trained_at = self._counters['stores']
+
+    def _grow(self):
+        capacity = min(self.max_entries, 2 * len(self._vectors))
+        extra = capacity - len(self._vectors)
+        self._vectors = np.concatenate([self._vectors, np.zeros((extra, self._vectors.shape[1]), dtype=np.float32)])
+        self._created = np.concatenate([self._created, np.zeros(extra)])
+        self._labels = np.concatenate([self._labels, np.zeros((extra, LABELS), dtype=np.int32)])
+        self._entries.extend([None] * extra)
+
+    def clear(self):
+        with self._lock:
+            self._size = self._next = self._trained_at = 0
+            self._entries = [None] * len(self._entries)
+            self._index = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            size = self._size
+            index = 'ivf' if self._index is not None else 'brute_force'
+        lookups = counters.pop('lookups')
+        lookup_seconds = counters.pop('lookup_seconds')
+        return {
+            'embedder': self.embedder.name,
+            'entries': size,
+            'max_entries': self.max_entries,
+            'threshold': self.threshold,
+            'index': index,
+            'lookups': lookups,
+            **counters,
+            'hit_rate': counters['hits'] / lookups if lookups else 0.0,
+            'avg_lookup_ms': lookup_seconds / lookups * 1000 if lookups else 0.0
+        }
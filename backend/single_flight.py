@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional, Any, Callable, Awaitable, Tuple
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Case, spacing and trailing punctuation don't change the answer; everything else does"""
+    return _WHITESPACE_RE.sub(' ', query.lower()).strip().rstrip('?!. ').strip()
+
+
+def query_key(query: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Coalescing key: normalized query plus a digest of the generation parameters"""
+    digest = hashlib.sha1(json.dumps(params or {}, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return f"{digest[:16]}:{normalize_query(query)}"
+
+
+class SingleFlight:
+    """
+    In-flight request coalescing. The first caller for a key runs the work;
+    callers arriving with the same key while it runs wait on the same future
+    and get the same result. Nothing is kept after the leader finishes, so
+    this is not a cache: later requests always recompute.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._counters = {
+            'leaders': 0,
+            'followers': 0,
+            'failures': 0,
+            'handoffs': 0,
+            'saved_seconds': 0.0,
+            'max_followers': 0
+        }
+        self._followers: Dict[str, int] = {}
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._counters['followers'] += 1
+                self._followers[key] += 1
+                self._counters['max_followers'] = max(self._counters['max_followers'], self._followers[key])
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            self._followers[key] = 0
+            self._counters['leaders'] += 1
+            return future, True
+
+    def _complete(self, key: str, future: Future, start_time: float, result: Any = None,
+                  error: Optional[BaseException] = None):
+        elapsed = time.time() - start_time
+        with self._lock:
+            del self._inflight[key]
+            followers = self._followers.pop(key)
+            if error is None:
+                self._counters['saved_seconds'] += elapsed * followers
+            else:
+                self._counters['failures'] += 1
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def do(self, key: str, fn: Callable[..., Any], *args) -> Tuple[Any, bool]:
+        """Run fn(*args) once per key in flight; returns (result, shared)"""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result(), True
+
+        start_time = time.time()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self._complete(key, future, start_time, error=e)
+            raise
+        self._complete(key, future, start_time, result=result)
+        return result, False
+
+    async def do_async(self, key: str, work: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Async variant: followers await the leader without holding a worker thread.
+        A cancelled leader task doesn't fail its followers: the run moves to a task of its own.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            try:
+                # Shielded so a cancelled follower doesn't cancel the shared future
+                return await asyncio.shield(asyncio.wrap_future(future)), True
+            except asyncio.CancelledError:
+                with self._lock:
+                    if self._inflight.get(key) is future:
+                        self._followers[key] -= 1
+                raise
+
+        return await self._lead(key, future, work, time.time()), False
+
+    async def _lead(self, key: str, future: Future, work: Callable[[], Awaitable[Any]], start_time: float) -> Any:
+        try:
+            result = await work()
+        except asyncio.CancelledError:
+            self._hand_off(key, future, work, start_time)
+            raise
+        except BaseException as e:
+            # Includes the work giving up on its own (a tripped cancel token): re-running
+            # the same work would only give up again, so followers get the error to retry with
+            self._complete(key, future, start_time, error=e)
+            raise
+        self._complete(key, future, start_time, result=result)
+        return result
+
+    def _hand_off(self, key: str, future: Future, work: Callable[[], Awaitable[Any]], start_time: float):
+        """The leader task was cancelled: re-run the work for its followers, or drop the flight if there are none"""
+        with self._lock:
+            if self._followers[key] == 0:
+                del self._inflight[key]
+                del self._followers[key]
+                future.cancel()
+                return
+            self._counters['handoffs'] += 1
+        task = asyncio.ensure_future(self._lead(key, future, work, start_time))
+        # Followers get the outcome through the future; retrieve it here so it isn't logged
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._inflight)
+        total = stats['leaders'] + stats['followers']
+        stats['coalesced_ratio'] = stats['followers'] / total if total else 0.0
+        return stats
@@ -0,0 +1,342 @@
+import io
+import os
+import time
+import wave
+import shutil
+import threading
+import subprocess
+import numpy as np
+from typing import Dict, List, Optional, Any, Iterator, BinaryIO
+from profiling import PROFILER
+
+SAMPLE_RATE = 16000  # Every recognizer consumes 16 kHz mono float32
+
+
+def pcm16_to_float(data: bytes, channels: int = 1) -> np.ndarray:
+    """Little-endian signed 16-bit PCM bytes to mono float32 in [-1, 1]"""
+    samples = np.frombuffer(data[:len(data) - len(data) % (2 * channels)], dtype='<i2')
+    audio = samples.astype(np.float32) / 32768.0
+    if channels > 1:
+        audio = audio.reshape(-1, channels).mean(axis=1)
+    return audio
+
+
+class StreamResampler:
+    """Linear-interpolation resampler that keeps its phase across chunks"""
+
+    def __init__(self, source_rate: int, target_rate: int = SAMPLE_RATE):
+        self.step = source_rate / target_rate
+        self.position = 0.0  # Next output sample, in source-sample units relative to `tail`
+        self.tail = np.zeros(0, dtype=np.float32)
+
+    def process(self, audio: np.ndarray) -> np.ndarray:
+        if self.step == 1.0:
+            return audio
+        buffer = np.concatenate([self.tail, audio])
+        if len(buffer) < 2:
+            self.tail = buffer
+            return np.zeros(0, dtype=np.float32)
+        positions = np.arange(self.position, len(buffer) - 1, self.step)
+        output = np.interp(positions, np.arange(len(buffer)), buffer).astype(np.float32)
+        next_position = self.position + len(positions) * self.step
+        keep_from = min(int(next_position), len(buffer))
+        self.tail = buffer[keep_from:]
+        self.position = next_position - keep_from
+        return output
+
+
+def iter_wav_chunks(fileobj: BinaryIO, chunk_seconds: float = 0.5) -> Iterator[np.ndarray]:
+    """Decode a WAV stream chunk by chunk (16-bit PCM), resampled to 16 kHz mono"""
+    with wave.open(fileobj, 'rb') as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError("Only 16-bit PCM WAV is supported without ffmpeg")
+        channels = wav.getnchannels()
+        resampler = StreamResampler(wav.getframerate())
+        frames_per_chunk = max(1, int(wav.getframerate() * chunk_seconds))
+        while True:
+            data = wav.readframes(frames_per_chunk)
+            if not data:
+                break
+            yield resampler.process(pcm16_to_float(data, channels))
+
+
+def iter_ffmpeg_chunks(fileobj: BinaryIO, chunk_seconds: float = 0.5,
+                       read_size: int = 64 * 1024) -> Iterator[np.ndarray]:
+    """Decode any ffmpeg-supported format by piping it through ffmpeg as it is read"""
+    if shutil.which("ffmpeg") is None:
+        raise ValueError("ffmpeg is required to decode this audio format")
+
+    process = subprocess.Popen(
+        ["ffmpeg", "-loglevel", "error", "-i", "pipe:0", "-f", "s16le", "-ac", "1",
+         "-ar", str(SAMPLE_RATE), "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+
+    def feed():
+        try:
+            while True:
+                data = fileobj.read(read_size)
+                if not data:
+                    break
+                process.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        bytes_per_chunk = int(SAMPLE_RATE * chunk_seconds) * 2
+        while True:
+            data = process.stdout.read(bytes_per_chunk)
+            if not data:
+                break
+            yield pcm16_to_float(data)
+    finally:
+        process.stdout.close()
+        process.wait()
+        feeder.join(timeout=1)
+
+
+def iter_audio_chunks(fileobj: BinaryIO, chunk_seconds: float = 0.5) -> Iterator[np.ndarray]:
+    """Pick the WAV fast path when the stream starts with a RIFF header, else use ffmpeg"""
+    header = fileobj.read(4)
+    if hasattr(fileobj, 'seek') and fileobj.seekable():
+        fileobj.seek(-len(header), io.SEEK_CUR)
+    else:
+        fileobj = _PrefixedReader(header, fileobj)
+
+    if header == b'RIFF':
+        return iter_wav_chunks(fileobj, chunk_seconds)
+    return iter_ffmpeg_chunks(fileobj, chunk_seconds)
+
+
+class _PrefixedReader(io.RawIOBase):
+    """Re-attach bytes already consumed from a non-seekable stream"""
+
+    def __init__(self, prefix: bytes, stream: BinaryIO):
+        self.prefix = prefix
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.prefix = self.prefix, b''
+            return data + self.stream.read()
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        return data
+
+
+class EnergyVAD:
+    """
+    Streaming energy-based voice-activity detection.
+    Frames louder than an adaptive noise floor open a segment; a segment closes
+    after `hangover_ms` of silence or at `max_segment_seconds`, and leading and
+    trailing silence is trimmed.
+    """
+
+    def __init__(self, frame_ms: int = 30, hangover_ms: int = 400, min_speech_ms: int = 150,
+                 max_segment_seconds: float = 15.0, threshold_ratio: float = 3.0,
+                 min_threshold: float = 0.01, padding_ms: int = 90):
+        self.frame = int(SAMPLE_RATE * frame_ms / 1000)
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.max_segment_frames = int(max_segment_seconds * 1000 / frame_ms)
+        self.padding_frames = padding_ms // frame_ms
+        self.threshold_ratio = threshold_ratio
+        self.min_threshold = min_threshold
+
+        self.noise_floor = min_threshold / threshold_ratio
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._recent: List[np.ndarray] = []  # Pre-speech padding
+        self._segment: List[np.ndarray] = []
+        self._speech_frames = 0
+        self._silent_run = 0
+        self.total_frames = 0
+        self.speech_frames_total = 0
+
+    def _is_speech(self, rms: float) -> bool:
+        threshold = max(self.min_threshold, self.noise_floor * self.threshold_ratio)
+        speech = rms > threshold
+        if not speech:
+            # Track the floor slowly so it follows background noise but not speech
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * rms
+        return speech
+
+    def process(self, audio: np.ndarray) -> List[np.ndarray]:
+        """Feed audio; returns any speech segments that closed during this chunk"""
+        buffer = np.concatenate([self._pending, audio])
+        n_frames = len(buffer) // self.frame
+        self._pending = buffer[n_frames * self.frame:]
+        if n_frames == 0:
+            return []
+
+        frames = buffer[:n_frames * self.frame].reshape(n_frames, self.frame)
+        energies = np.sqrt(np.mean(frames * frames, axis=1))  # Vectorized per-frame RMS
+
+        closed = []
+        for frame, rms in zip(frames, energies):
+            self.total_frames += 1
+            speech = self._is_speech(float(rms))
+            if self._segment:
+                self._segment.append(frame)
+                if speech:
+                    self._speech_frames += 1
+                    self._silent_run = 0
+                else:
+                    self._silent_run += 1
+                if self._silent_run >= self.hangover_frames or len(self._segment) >= self.max_segment_frames:
+                    segment = self._close()
+                    if segment is not None:
+                        closed.append(segment)
+            elif speech:
+                self._segment = self._recent + [frame]
+                self._recent = []
+                self._speech_frames = 1
+                self._silent_run = 0
+            else:
+                self._recent = (self._recent + [frame])[-self.padding_frames:] if self.padding_frames else []
+        return closed
+
+    def _close(self) -> Optional[np.ndarray]:
+        # Trim trailing silence, keeping a little padding
+        keep = len(self._segment) - max(0, self._silent_run - self.padding_frames)
+        frames = self._segment[:keep]
+        speech_frames = self._speech_frames
+        self._segment, self._speech_frames, self._silent_run = [], 0, 0
+        if speech_frames < self.min_speech_frames:
+            return None
+        self.speech_frames_total += len(frames)
+        return np.concatenate(frames)
+
+    def flush(self) -> List[np.ndarray]:
+        """End of stream: close any open segment"""
+        if self._segment:
+            if len(self._pending):
+                self._segment.append(self._pending)
+            self._pending = np.zeros(0, dtype=np.float32)
+            segment = self._close()
+            return [segment] if segment is not None else []
+        return []
+
+
+class WhisperRecognizer:
+    """Speech recognition with a small Whisper checkpoint on CPU"""
+
+    def __init__(self, model_name: str = "openai/whisper-tiny.en", device: str = 'cpu'):
+        from transformers import pipeline
+        self.name = model_name
+        self.pipeline = pipeline("automatic-speech-recognition", model=model_name, device=-1 if device == 'cpu' else 0)
+
+    def transcribe(self, audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> str:
+        result = self.pipeline({"raw": audio, "sampling_rate": sample_rate})
+        return result.get('text', '').strip()
+
+
+class StandInRecognizer:
+    """
+    Local stand-in model for tests and load runs: returns scripted phrases
+    (one per speech segment) and can simulate a real-time factor.
+    """
+
+    def __init__(self, phrases: Optional[List[str]] = None, real_time_factor: float = 0.0):
+        self.name = "standin"
+        self.phrases = phrases or ["What is photosynthesis?"]
+        self.real_time_factor = real_time_factor
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def transcribe(self, audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> str:
+        if self.real_time_factor:
+            time.sleep(len(audio) / sample_rate * self.real_time_factor)
+        with self._lock:
+            phrase = self.phrases[self._next % len(self.phrases)]
+            self._next += 1
+        return phrase
+
+
+def load_recognizer(model_name: Optional[str] = None):
+    """Load the configured speech model ('standin' selects the local stand-in)"""
+    model_name = model_name or os.environ.get("SPEECH_MODEL", "openai/whisper-tiny.en")
+    if model_name == "standin":
+        return StandInRecognizer()
+    print(f"🎙 Loading speech recognition model ({model_name})...")
+    recognizer = WhisperRecognizer(model_name)
+    print("✅ Speech recognition model loaded")
+    return recognizer
+
+
+class StreamingTranscriber:
+    """
+    Incremental speech-to-text: audio chunks go through VAD as they arrive and
+    each closed speech segment is transcribed immediately, so only the last
+    segment is left to transcribe when the speaker stops.
+    """
+
+    def __init__(self, recognizer, vad: Optional[EnergyVAD] = None):
+        self.recognizer = recognizer
+        self.vad = vad or EnergyVAD()
+        self.segments: List[str] = []
+        self.audio_seconds = 0.0
+        self.speech_seconds = 0.0
+        self.compute_seconds = 0.0
+        self.started_at = time.time()
+        self.last_speech_end = None  # Wall time when the latest segment closed
+        self.finished_at = None
+
+    def _transcribe(self, segments: List[np.ndarray]) -> List[str]:
+        texts = []
+        for segment in segments:
+            self.last_speech_end = time.time()
+            self.speech_seconds += len(segment) / SAMPLE_RATE
+            start_time = time.time()
+            with PROFILER.section("speech_recognizer"):
+                text = self.recognizer.transcribe(segment, SAMPLE_RATE)
+            self.compute_seconds += time.time() - start_time
+            if text:
+                self.segments.append(text)
+                texts.append(text)
+        return texts
+
+    def feed(self, audio: np.ndarray) -> List[str]:
+        """Add audio; returns transcripts of any segments completed by it"""
+        self.audio_seconds += len(audio) / SAMPLE_RATE
+        return self._transcribe(self.vad.process(audio))
+
+    def finish(self) -> str:
+        """End of input: transcribe the last open segment and return the full transcript"""
+        end_of_input = time.time()
+        texts = self._transcribe(self.vad.flush())
+        if not texts and self.last_speech_end is None:
+            self.last_speech_end = end_of_input
+        self.finished_at = time.time()
+        return self.transcript
+
+    @property
+    def transcript(self) -> str:
+        return ' '.join(self.segments).strip()
+
+    def metrics(self, response_ready_at: Optional[float] = None) -> Dict[str, Any]:
+        """Real-time factor and end-of-speech latencies (ms)"""
+        metrics = {
+            'audio_seconds': self.audio_seconds,
+            'speech_seconds': self.speech_seconds,
+            'silence_trimmed_seconds': max(0.0, self.audio_seconds - self.speech_seconds),
+            'recognition_seconds': self.compute_seconds,
+            'real_time_factor': self.compute_seconds / self.speech_seconds if self.speech_seconds else 0.0,
+            'segments': len(self.segments),
+            'recognizer': getattr(self.recognizer, 'name', type(self.recognizer).__name__)
+        }
+        if self.last_speech_end is not None and self.finished_at is not None:
+            metrics['end_of_speech_to_transcript_ms'] = (self.finished_at - self.last_speech_end) * 1000
+        if self.last_speech_end is not None and response_ready_at is not None:
+            metrics['end_of_speech_to_first_token_ms'] = (response_ready_at - self.last_speech_end) * 1000
+        return metrics
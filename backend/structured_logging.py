@@ -0,0 +1,265 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+import zlib
+from contextvars import ContextVar
+from typing import Dict, Optional, Any, TextIO
+
+# Set per HTTP request by the API middleware (and per job by worker.py); copied into threadpool work
+REQUEST_ID: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+ROOT_LOGGER = "classroom"
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def parse_sample_rates(text: str) -> Dict[str, float]:
+    """'query.processed=0.1,health.check=0' -> {'query.processed': 0.1, 'health.check': 0.0}"""
+    rates = {}
+    for item in text.split(","):
+        if "=" in item:
+            event, rate = item.split("=", 1)
+            rates[event.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class EventSampler:
+    """
+    Per-event sampling. The decision is a hash of the request id, so a
+    sampled request keeps all of its events at the same rate and can still
+    be followed end to end. Warnings and errors are never sampled out.
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        self.rates = rates or {}
+        self.dropped: Dict[str, int] = {}
+
+    def keep(self, event: str, level: int, request_id: Optional[str]) -> bool:
+        rate = self.rates.get(event, 1.0)
+        if rate >= 1.0 or level >= logging.WARNING:
+            return True
+        if request_id is not None:
+            kept = zlib.crc32(request_id.encode()) / 0xFFFFFFFF < rate
+        else:
+            kept = random.random() < rate
+        if not kept:
+            self.dropped[event] = self.dropped.get(event, 0) + 1
+        return kept
+
+
+SAMPLER = EventSampler()
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, exc_info=None, **fields):
+    """
+    One structured event. Cheap when filtered out: the level and sampling
+    checks run before a record is built, and formatting happens on the
+    listener thread. Pass values that won't be mutated later (copies of dicts).
+    """
+    if not logger.isEnabledFor(level):
+        return
+    request_id = REQUEST_ID.get()
+    if not SAMPLER.keep(event, level, request_id):
+        return
+    if exc_info is True:
+        exc_info = sys.exc_info()
+    # makeRecord directly: logger.log() would walk the stack for a source line nobody reads
+    record = logger.makeRecord(logger.name, level, "", 0, event, None, exc_info,
+                               extra={'event': event, 'fields': fields, 'request_id': request_id})
+    logger.handle(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event, request_id, then the event's fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': getattr(record, 'event', None) or record.getMessage(),
+            'request_id': getattr(record, 'request_id', None)
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Readable single-line form for local development (LOG_FORMAT=text)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, 'fields', None) or {}
+        line = " ".join([
+            time.strftime("%H:%M:%S", time.localtime(record.created)),
+            f"{record.levelname:<7}",
+            getattr(record, 'event', None) or record.getMessage(),
+            *(f"{key}={value}" for key, value in fields.items())
+        ])
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            line += f" [{request_id[:12]}]"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without formatting them and never
+    blocks the caller: when the queue is full the record is dropped and
+    counted. Records from plain logging calls get the current request id here,
+    on the caller's thread, where the context is still set.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not hasattr(record, 'request_id'):
+            record.request_id = REQUEST_ID.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """
+    The queue handler on the 'classroom' logger and the background thread
+    that formats its records and writes them out, a batch per write and flush.
+
+    The writer competes with request threads for the GIL, so it wakes at most
+    once per `flush_interval` under load (records pile up meanwhile) and
+    formats in slices of `slice_size`, yielding the GIL between slices so a
+    request thread never waits a whole switch interval behind it.
+    """
+
+    def __init__(self, level: str = "INFO", fmt: str = "json", sample_rates: Optional[Dict[str, float]] = None,
+                 queue_size: int = 10000, stream: Optional[TextIO] = None, batch_size: int = 4096,
+                 flush_interval: float = 0.05, slice_size: int = 16):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.handler = NonBlockingQueueHandler(self._queue)
+        self.formatter = JsonFormatter() if fmt == "json" else TextFormatter()
+        self.stream = stream or sys.stdout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.slice_size = slice_size
+        self._written = 0
+        self._wakeups = 0
+        self._write_errors = 0
+
+        SAMPLER.rates = sample_rates or {}
+        self.logger = logging.getLogger(ROOT_LOGGER)
+        self.logger.setLevel(level.upper())
+        self.logger.propagate = False
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+        self.logger.addHandler(self.handler)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._writer = threading.Thread(target=self._writer_loop, name="log-writer", daemon=True)
+        self._writer.start()
+
+    def _writer_loop(self):
+        """Drain the queue in batches; None (from close) ends the loop after the batch it's in"""
+        while True:
+            records = [self._queue.get()]  # Idle: block until a record arrives
+            self._wakeups += 1
+            if records[0] is not None and self.flush_interval:
+                time.sleep(self.flush_interval)
+            while len(records) < self.batch_size:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for start in range(0, len(records), self.slice_size):
+                if start:
+                    time.sleep(0)  # Hand the GIL to any waiting request thread
+                for record in records[start:start + self.slice_size]:
+                    if record is None:
+                        continue
+                    try:
+                        lines.append(self.formatter.format(record))
+                    except Exception:
+                        self._write_errors += 1
+            if lines:
+                try:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+                    self._written += len(lines)
+                except Exception:
+                    self._write_errors += len(lines)
+            if None in records:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'level': logging.getLevelName(self.logger.level),
+            'queued': self._queue.qsize(),
+            'written': self._written,
+            'writer_wakeups': self._wakeups,
+            'write_errors': self._write_errors,
+            'dropped_queue_full': self.handler.dropped,
+            'sampled_out': dict(SAMPLER.dropped),
+            'sample_rates': dict(SAMPLER.rates)
+        }
+
+    def close(self, timeout: float = 5.0):
+        """Write out everything still queued, then stop the writer"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.logger.removeHandler(self.handler)
+        self._queue.put(None)  # Blocks only if the queue is full; the writer is draining it
+        self._writer.join(timeout)
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware: every HTTP request and WebSocket gets a request id (the
+    client's X-Request-ID if sent, else a new one) in REQUEST_ID for its log
+    events, echoed back in the response headers. Plain ASGI rather than
+    BaseHTTPMiddleware so request.is_disconnected() keeps working.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket'):
+            return await self.app(scope, receive, send)
+        sent = dict(scope.get('headers') or []).get(b'x-request-id', b'').decode('latin-1')[:64]
+        request_id = sent or uuid.uuid4().hex
+        token = REQUEST_ID.set(request_id)
+
+        async def send_with_request_id(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = [*message.get('headers', []), (b'x-request-id', request_id.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            REQUEST_ID.reset(token)
+
+
+def setup_logging(level: str = "INFO", fmt: str = "json", sample_rates: Optional[Dict[str, float]] = None,
+                  queue_size: int = 10000, stream: Optional[TextIO] = None, flush_interval: float = 0.05) -> LogPipeline:
+    """Route the 'classroom' loggers through a new pipeline (replacing any earlier one's handler)"""
+    return LogPipeline(level, fmt, sample_rates, queue_size, stream, flush_interval=flush_interval)
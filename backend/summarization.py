@@ -0,0 +1,220 @@
+import re
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Any, Iterator
+from profiling import PROFILER
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+
+class DocumentSummarizer:
+    """
+    Map-reduce summarization of long texts with a seq2seq summarization pipeline.
+
+    The text is split into sentence-aligned chunks of at most `max_chunk_tokens`
+    (BART takes about 1024 tokens). Chunk boundaries are content-defined: a
+    chunk may end after a sentence whose hash hits a divisor, so an edit only
+    moves the boundaries around it and unchanged chunks keep hitting the
+    summary cache. Chunks are summarized in batches across a worker pool, and
+    the partial summaries are merged level by level until they fit in one pass.
+    """
+
+    def __init__(self, summarizer, max_chunk_tokens: int = 900, min_chunk_tokens: int = 300,
+                 overlap_tokens: int = 64, summary_max_length: int = 150, summary_min_length: int = 30,
+                 workers: int = 2, batch_size: int = 4, cache_size: int = 4096, boundary_divisor: int = 4):
+        self.summarizer = summarizer
+        self.tokenizer = summarizer.tokenizer
+        self.max_chunk_tokens = max_chunk_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.summary_max_length = summary_max_length
+        self.summary_min_length = summary_min_length
+        self.batch_size = batch_size
+        self.boundary_divisor = boundary_divisor
+        self.cache_size = cache_size
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summarizer")
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    def _sentences(self, text: str) -> List[str]:
+        return [s.strip() for s in _SENTENCE_RE.split(text) if s and s.strip()]
+
+    def _token_counts(self, pieces: List[str]) -> List[int]:
+        if not pieces:
+            return []
+        encoded = self.tokenizer(pieces, add_special_tokens=False)['input_ids']
+        return [len(ids) for ids in encoded]
+
+    def _is_boundary(self, sentence: str) -> bool:
+        digest = hashlib.md5(sentence.encode('utf-8')).digest()
+        return digest[0] % self.boundary_divisor == 0
+
+    def split(self, text: str) -> List[str]:
+        """Split text into sentence-aligned, content-defined chunks with a small overlap"""
+        sentences = self._sentences(text)
+        counts = self._token_counts(sentences)
+
+        # Sentences longer than a whole chunk are cut into token windows
+        pieces, piece_counts = [], []
+        for sentence, count in zip(sentences, counts):
+            if count <= self.max_chunk_tokens:
+                pieces.append(sentence)
+                piece_counts.append(count)
+                continue
+            ids = self.tokenizer(sentence, add_special_tokens=False)['input_ids']
+            for start in range(0, len(ids), self.max_chunk_tokens):
+                window = ids[start:start + self.max_chunk_tokens]
+                pieces.append(self.tokenizer.decode(window, skip_special_tokens=True))
+                piece_counts.append(len(window))
+
+        chunks, current, current_tokens, carried = [], [], 0, 0
+        for piece, count in zip(pieces, piece_counts):
+            if len(current) > carried and current_tokens + count > self.max_chunk_tokens:
+                chunks.append(current)
+                current, current_tokens = self._overlap(current)
+                carried = len(current)
+            current.append((piece, count))
+            current_tokens += count
+            if current_tokens >= self.min_chunk_tokens and self._is_boundary(piece):
+                chunks.append(current)
+                current, current_tokens = self._overlap(current)
+                carried = len(current)
+
+        # The tail only becomes a chunk if it has more than the carried-over overlap
+        if len(current) > carried:
+            chunks.append(current)
+
+        return [' '.join(piece for piece, _ in chunk) for chunk in chunks]
+
+    def _overlap(self, chunk):
+        """Trailing sentences of a chunk (up to overlap_tokens) that start the next one"""
+        tail, tokens = [], 0
+        for piece, count in reversed(chunk):
+            if tokens + count > self.overlap_tokens:
+                break
+            tail.insert(0, (piece, count))
+            tokens += count
+        return tail, tokens
+
+    def _cache_key(self, text: str) -> str:
+        params = f"{self.summary_max_length}:{self.summary_min_length}"
+        return hashlib.sha256(f"{params}\n{text}".encode('utf-8')).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[str]:
+        with self._cache_lock:
+            summary = self._cache.get(key)
+            if summary is not None:
+                self._cache.move_to_end(key)
+                self._cache_hits += 1
+            else:
+                self._cache_misses += 1
+            return summary
+
+    def _cache_put(self, key: str, summary: str):
+        with self._cache_lock:
+            self._cache[key] = summary
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _summarize_batch(self, texts: List[str]) -> List[str]:
+        with PROFILER.section("summarizer"):
+            results = self.summarizer(
+                texts,
+                max_length=self.summary_max_length,
+                min_length=self.summary_min_length,
+                truncation=True,
+                do_sample=False,
+                batch_size=len(texts)
+            )
+        return [r['summary_text'].strip() for r in results]
+
+    def _map(self, chunks: List[str], level: int) -> Iterator[Dict[str, Any]]:
+        """Summarize chunks (cache first, misses in parallel batches); yields as they finish"""
+        keys = [self._cache_key(chunk) for chunk in chunks]
+        misses = []
+        for index, (chunk, key) in enumerate(zip(chunks, keys)):
+            summary = self._cache_get(key)
+            if summary is not None:
+                yield {'type': 'chunk', 'level': level, 'index': index, 'summary': summary, 'cached': True}
+            else:
+                misses.append(index)
+
+        futures = {}
+        for start in range(0, len(misses), self.batch_size):
+            batch = misses[start:start + self.batch_size]
+            futures[self._executor.submit(self._summarize_batch, [chunks[i] for i in batch])] = batch
+
+        for future in as_completed(futures):
+            batch = futures[future]
+            for index, summary in zip(batch, future.result()):
+                self._cache_put(keys[index], summary)
+                yield {'type': 'chunk', 'level': level, 'index': index, 'summary': summary, 'cached': False}
+
+    def summarize_stream(self, text: str) -> Iterator[Dict[str, Any]]:
+        """
+        Yield partial summaries as they complete, then one 'final' event.
+        Level 0 events are chunk summaries of the input; higher levels are reduce steps.
+        """
+        start_time = time.time()
+        chunks = self.split(text)
+        stats = {'chunks': len(chunks), 'cached': 0, 'computed': 0, 'levels': 0}
+
+        if not chunks:
+            yield {'type': 'final', 'summary': '', 'stats': {**stats, 'processing_time': 0.0}}
+            return
+
+        level = 0
+        while True:
+            summaries = [None] * len(chunks)
+            for event in self._map(chunks, level):
+                summaries[event['index']] = event['summary']
+                stats['cached' if event['cached'] else 'computed'] += 1
+                yield event
+            stats['levels'] = level + 1
+
+            if len(summaries) == 1:
+                summary = summaries[0]
+                break
+
+            merged = ' '.join(summaries)
+            if sum(self._token_counts([merged])) <= self.max_chunk_tokens:
+                # Fits in one pass: the final summary is a summary of the summaries
+                level += 1
+                chunks = [merged]
+                continue
+
+            level += 1
+            chunks = self.split(merged)
+            if len(chunks) >= len(summaries):
+                # No progress possible (summaries as long as inputs); stop reducing
+                summary = merged
+                break
+
+        yield {
+            'type': 'final',
+            'summary': summary,
+            'stats': {**stats, 'processing_time': time.time() - start_time}
+        }
+
+    def summarize(self, text: str) -> Dict[str, Any]:
+        """Non-streaming convenience wrapper"""
+        final = None
+        for event in self.summarize_stream(text):
+            if event['type'] == 'final':
+                final = event
+        return final
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cache_lock:
+            return {
+                'cache_entries': len(self._cache),
+                'cache_hits': self._cache_hits,
+                'cache_misses': self._cache_misses
+            }
@@ -54,5 +54,31 @@ def test_api():
     except Exception as e:
         print(f"❌ Chat endpoint failed: {e}")
 
+    # Test batch chat endpoint (NDJSON stream, one line per answered question)
+    try:
+        batch_data = {
+            "messages": ["What is gravity?", "Define photosynthesis", "Solve 2x + 3 = 7"],
+            "subject": "General"
+        }
+        response = requests.post(f"{base_url}/chat/batch", json=batch_data, stream=True)
+        print(f"✅ Batch chat endpoint: {response.status_code}")
+        for line in response.iter_lines():
+            if line:
+                item = json.loads(line)
+                if item.get("type") == "item":
+                    print(f"   [{item.get('index')}] {item.get('response', '')[:60]}...")
+    except Exception as e:
+        print(f"❌ Batch chat endpoint failed: {e}")
+    
+    # Test analytics endpoint (served from the durable conversation log)
+    try:
+        response = requests.get(f"{base_url}/analytics", params={"since_seconds": 3600})
+        print(f"✅ Analytics endpoint: {response.status_code}")
+        analytics_data = response.json()
+        print(f"   Queries in last hour: {analytics_data.get('total_queries')}")
+        print(f"   Subjects: {analytics_data.get('subjects')}")
+    except Exception as e:
+        print(f"❌ Analytics endpoint failed: {e}")
+
 if __name__ == "__main__":
     test_api()
\ No newline at end of file
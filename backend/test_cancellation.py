@@ -0,0 +1,194 @@
+import asyncio
+import importlib
+import tempfile
+import threading
+import time
+from cancellation import CancellationTracker, CancelToken, RequestCancelled
+from visual_jobs import VisualJobQueue
+
+
+def expect_cancelled(fn, *args):
+    try:
+        fn(*args)
+    except RequestCancelled as e:
+        return str(e)
+    raise AssertionError("expected RequestCancelled")
+
+
+def test_token_and_timeout():
+    token = CancelToken()
+    token.check()
+    assert token.diffusion_callback(None, 0, 999, {'latents': 1}) == {'latents': 1}
+    token.cancel("client disconnected")
+    token.cancel("later reason")
+    assert expect_cancelled(token.diffusion_callback, None, 1, 998, {}) == "client disconnected"
+
+    token = CancelToken(timeout_seconds=0.05)
+    assert not token.cancelled
+    time.sleep(0.06)
+    assert expect_cancelled(token.check) == "timeout"
+
+    # Threads blocked on a watched event wake when the token is cancelled
+    token, woken = CancelToken(), threading.Event()
+    token.watch(woken)
+    token.cancel("client disconnected")
+    assert woken.is_set()
+    late = threading.Event()
+    token.watch(late)
+    assert late.is_set()
+
+    # Not an Exception, so the pipeline's fallbacks don't swallow it
+    assert not issubclass(RequestCancelled, Exception)
+
+
+def test_cancelled_only_when_every_waiter_leaves():
+    tracker = CancellationTracker()
+    leader = tracker.join("what is gravity")
+    follower = tracker.join("what is gravity")
+    assert leader is follower and leader.waiters == 2
+
+    tracker.leave("what is gravity", leader, abandoned=True)
+    assert not leader.cancelled
+    tracker.leave("what is gravity", follower, abandoned=True)
+    assert leader.reason == "client disconnected"
+
+    # A finished run is never cancelled, and a new join gets a fresh token
+    token = tracker.join("what is gravity")
+    assert token is not leader
+    tracker.leave("what is gravity", token)
+    assert not token.cancelled
+    stats = tracker.stats()
+    assert stats['cancelled_requests'] == 1 and stats['waiting_tokens'] == 0
+
+    # A newcomer's deadline extends the shared run instead of inheriting the first waiter's
+    first = tracker.join("slow question", 0.05)
+    time.sleep(0.03)
+    newcomer = tracker.join("slow question", 0.2)
+    assert newcomer is first
+    time.sleep(0.04)
+    assert not newcomer.cancelled
+    tracker.leave("slow question", first, abandoned=True, reason="timeout")  # The first waiter gives up alone
+    assert not newcomer.cancelled
+    tracker.leave("slow question", newcomer, abandoned=True, reason="timeout")
+    assert newcomer.reason == "timeout"
+    tracker.join("patient question", 0.01)
+    assert tracker.join("patient question").deadline is None  # A waiter without a limit lifts it
+
+
+def test_reclaimed_time_is_credited():
+    tracker = CancellationTracker()
+    for _ in range(2):
+        with tracker.stage("text_model.generate"):
+            time.sleep(0.2)
+
+    token = CancelToken()
+    threading.Timer(0.05, token.cancel, args=("client disconnected",)).start()
+
+    def generate():
+        # Stops at the next step like generate() with the stopping criterion
+        with tracker.stage("text_model.generate", token):
+            while not token.cancelled:
+                time.sleep(0.005)
+
+    expect_cancelled(generate)
+    stats = tracker.stats()
+    assert stats['aborted_calls'] == {'text_model.generate': 1}
+    assert 0.1 < stats['reclaimed_wall_seconds'] < 0.2
+
+    # Work not yet started is credited with a whole typical run
+    def next_call():
+        with tracker.stage("text_model.generate", token):
+            raise AssertionError("should not start")
+
+    expect_cancelled(next_call)
+    assert tracker.stats()['skipped'] == {'text_model.generate': 1}
+    assert tracker.stats()['reclaimed_wall_seconds'] > 0.3
+
+
+def test_cpu_time_is_the_calling_threads():
+    tracker = CancellationTracker()
+    stop = threading.Event()
+
+    def busy():
+        while not stop.is_set():
+            sum(range(1000))
+
+    # Another request burning CPU meanwhile isn't credited to this call
+    other = threading.Thread(target=busy)
+    other.start()
+    try:
+        with tracker.stage("text_model.generate"):
+            time.sleep(0.2)
+    finally:
+        stop.set()
+        other.join()
+    assert tracker.stats()['typical_seconds']['text_model.generate']['cpu'] < 0.05
+
+
+def test_visual_jobs_cancel_queued_and_running():
+    started = threading.Event()
+    generated = []
+
+    def generate(query, analysis, cancel_token):
+        started.set()
+        for _ in range(200):
+            cancel_token.check()
+            time.sleep(0.01)
+        generated.append(query)
+        return None
+
+    jobs = VisualJobQueue(generate)
+    running = jobs.submit("heart diagram", {}, batch_id="b1")
+    queued = jobs.submit("lungs diagram", {}, batch_id="b1")
+    started.wait(1)
+    assert jobs.status(running)['status'] == 'running'
+
+    assert jobs.cancel_batch("b1") == 2
+    assert jobs.status(queued)['status'] == 'cancelled'
+    for _ in range(100):
+        if jobs.status(running)['status'] == 'cancelled':
+            break
+        time.sleep(0.01)
+    assert jobs.status(running)['status'] == 'cancelled'
+    assert not jobs.cancel(running) and generated == []
+
+
+def test_follower_of_an_abandoned_run_starts_a_fresh_one(monkeypatch):
+    directory = tempfile.mkdtemp()
+    for name, value in {'AI_BACKEND': 'fake', 'EMBEDDING_MODEL': 'hashing', 'RATE_LIMIT_ENABLED': 'false',
+                        'SEMANTIC_CACHE_ENABLED': 'false', 'CONVERSATION_DB_PATH': f"{directory}/conversations.db",
+                        'COURSE_INDEX_DIR': f"{directory}/course_index"}.items():
+        monkeypatch.setenv(name, value)
+    app = importlib.import_module("app")
+    for _ in range(100):
+        if app.ai_assistant is not None and app.ai_assistant.models_ready:
+            break
+        time.sleep(0.05)
+
+    tokens = []
+
+    def answer(query, context=None, cancel_token=None):
+        # Notices a tripped token only when it finishes, like generate() with the stopping criterion
+        tokens.append(cancel_token)
+        time.sleep(0.3)
+        cancel_token.check()
+        return {'text_response': f"answer to {query}", 'success': True}
+
+    monkeypatch.setattr(app, "governed_answer", answer)
+
+    class Disconnected:
+        async def is_disconnected(self):
+            return True
+
+    async def main():
+        # The leader's client is gone at once; the follower joins the run before it notices
+        leader = asyncio.ensure_future(app.answer_query("What is inertia?", "chat", http_request=Disconnected()))
+        await asyncio.sleep(0.1)
+        follower = asyncio.ensure_future(app.answer_query("What is inertia?", "chat"))
+        outcome, = await asyncio.gather(leader, return_exceptions=True)
+        assert str(outcome) == "client disconnected"
+        return await asyncio.wait_for(follower, timeout=2)
+
+    result, shared = asyncio.run(main())
+    assert result['text_response'] == "answer to What is inertia?" and not shared
+    assert len(tokens) == 2 and tokens[0].cancelled and not tokens[1].cancelled
@@ -0,0 +1,91 @@
+import io
+import threading
+import time
+import numpy as np
+from PIL import Image
+from captioning import ImageCaptioner, preprocess_image, BLIP_MEAN, BLIP_STD
+
+
+def image_bytes(color, size=(640, 480), fmt='PNG') -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class FakeCaptionModel:
+    """Records batch sizes; captions an image by its mean red value"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.batch_sizes = []
+
+    def __call__(self, pixel_values):
+        self.batch_sizes.append(len(pixel_values))
+        time.sleep(self.delay)
+        return [f"red level {pixels[0].mean():.2f}" for pixels in pixel_values]
+
+
+def test_preprocess_matches_reference():
+    """Single-copy normalization equals the textbook rescale-then-normalize"""
+    data = image_bytes((200, 30, 90))
+    pixels = preprocess_image(data, size=64)
+
+    reference = np.array(Image.open(io.BytesIO(data)).convert('RGB').resize((64, 64), Image.BICUBIC)) / 255.0
+    reference = ((reference - np.array(BLIP_MEAN)) / np.array(BLIP_STD)).transpose(2, 0, 1)
+
+    assert pixels.shape == (3, 64, 64) and pixels.dtype == np.float32
+    assert np.allclose(pixels, reference, atol=1e-4)
+
+    # Large JPEGs go through draft-mode decoding and still come out at the target size
+    assert preprocess_image(image_bytes((10, 20, 30), size=(3000, 2000), fmt='JPEG'), size=64).shape == (3, 64, 64)
+
+
+def test_concurrent_requests_share_batches():
+    model = FakeCaptionModel()
+    captioner = ImageCaptioner(model, image_size=64, max_batch_size=8, max_wait_ms=30)
+    images = [image_bytes((i * 20, 0, 0)) for i in range(8)]
+
+    results = [None] * len(images)
+
+    def request(i):
+        results[i] = captioner.caption([images[i]])[0]
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(len(images))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(result and result['caption'].startswith("red level") for result in results)
+    assert len(model.batch_sizes) < len(images), model.batch_sizes  # Requests were captioned together
+    assert sum(model.batch_sizes) == len(images)
+
+    # Same content again is served from the cache without touching the model
+    calls = len(model.batch_sizes)
+    again = captioner.caption(images[:3])
+    assert all(result['cached'] for result in again)
+    assert len(model.batch_sizes) == calls
+    assert [r['caption'] for r in again] == [r['caption'] for r in results[:3]]
+
+
+def test_duplicate_images_in_flight_are_coalesced():
+    model = FakeCaptionModel(delay=0.1)
+    captioner = ImageCaptioner(model, image_size=32, max_wait_ms=10)
+    data = image_bytes((0, 255, 0))
+
+    results = captioner.caption([data, data, data])
+    assert len({r['caption'] for r in results}) == 1
+    assert sum(model.batch_sizes) == 1
+    assert captioner.stats()['coalesced'] == 2
+
+
+def test_bad_image_fails_only_its_request():
+    captioner = ImageCaptioner(FakeCaptionModel(delay=0), image_size=32)
+    try:
+        captioner.caption([b"not an image"])
+        raise AssertionError("expected a decode error")
+    except AssertionError:
+        raise
+    except Exception:
+        pass
+    assert captioner.caption([image_bytes((1, 2, 3))])[0]['caption']
@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from conversation_store import ConversationStore
+
+
+def entry(query, subject, query_type="explanation", timestamp=None, response="x"):
+    return {
+        'query': query,
+        'response': response,
+        'analysis': {'subject': subject, 'query_type': query_type, 'confidence': 0.9},
+        'timestamp': timestamp if timestamp is not None else time.time(),
+        'processing_time': 0.5,
+        'has_visual': False
+    }
+
+
+def test_record_query_and_summarize():
+    with tempfile.TemporaryDirectory() as directory:
+        store = ConversationStore(os.path.join(directory, "log.db"), compaction_interval=None)
+        now = time.time()
+        store.record(entry("What is gravity?", "Physics", timestamp=now - 3600))
+        store.record(entry("What is a cell?", "Biology", timestamp=now - 10))
+        store.record(entry("Solve 2x = 4", "Mathematics", "problem_solving", timestamp=now - 5))
+        assert store.flush()
+
+        recent = store.query(since=now - 60)
+        assert [c['query'] for c in recent] == ["Solve 2x = 4", "What is a cell?"]  # Newest first
+        assert recent[0]['analysis']['query_type'] == "problem_solving"
+        assert [c['query'] for c in store.query(subject="Physics")] == ["What is gravity?"]
+        assert len(store.query(limit=1)) == 1
+
+        summary = store.summarize()
+        assert summary['total_queries'] == 3 and summary['subjects']['Biology'] == 1
+        assert store.summarize(since=now - 60)['query_types'] == {'explanation': 1, 'problem_solving': 1}
+        store.close()
+
+        # Survives a restart
+        reopened = ConversationStore(os.path.join(directory, "log.db"), compaction_interval=None)
+        assert reopened.summarize()['total_queries'] == 3
+        reopened.close()
+
+
+def test_retention_compaction_shrinks_file():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "log.db")
+        store = ConversationStore(path, retention_days=1, max_rows=50, compaction_interval=None)
+        conn = sqlite3.connect(path)
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2  # INCREMENTAL on a fresh database
+        conn.close()
+
+        old = time.time() - 3 * 86400
+        for i in range(400):
+            store.record(entry(f"old question {i}", "History", timestamp=old, response="y" * 2000))
+        for i in range(100):
+            store.record(entry(f"new question {i}", "History", response="y" * 2000))
+        assert store.flush()
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        size_before = os.path.getsize(path)
+
+        result = store.compact()
+        assert result['deleted_rows'] == 450 and store.summarize()['total_queries'] == 50
+        # Freed pages go back to the filesystem
+        assert os.path.getsize(path) < size_before / 4
+        store.close()
+
+
+def test_existing_database_gets_incremental_vacuum():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "log.db")
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE conversations (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp REAL NOT NULL, "
+                     "query TEXT NOT NULL, response TEXT, subject TEXT, query_type TEXT, complexity TEXT, "
+                     "educational_level TEXT, confidence REAL, needs_visual INTEGER, has_visual INTEGER, "
+                     "processing_time REAL, analysis TEXT)")
+        conn.commit()
+        conn.close()
+
+        store = ConversationStore(path, compaction_interval=None)
+        conn = sqlite3.connect(path)
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        conn.close()
+        store.close()
+
+
+def test_full_queue_drops_instead_of_blocking():
+    with tempfile.TemporaryDirectory() as directory:
+        store = ConversationStore(os.path.join(directory, "log.db"), max_pending=1, flush_interval=5,
+                                  compaction_interval=None)
+        accepted = [store.record(entry(f"q{i}", "General")) for i in range(500)]
+        assert not all(accepted) and store.stats()['rejected'] == accepted.count(False)
+        store.close()
+
+
+def test_flush_waits_for_every_queued_row():
+    with tempfile.TemporaryDirectory() as directory:
+        store = ConversationStore(os.path.join(directory, "log.db"), batch_size=8, compaction_interval=None)
+
+        def record_many(worker):
+            for i in range(200):
+                store.record(entry(f"q{worker}-{i}", "General"))
+
+        threads = [threading.Thread(target=record_many, args=(worker,)) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert store.flush()
+        stats = store.stats()
+        assert stats['enqueued'] == stats['written'] == 1600 and stats['rejected'] == stats['failed'] == 0
+        assert store.summarize()['total_queries'] == 1600
+        store.close()
+        assert not store.flush(timeout=0.1)  # Nothing is writing any more
+
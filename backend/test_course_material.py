@@ -0,0 +1,88 @@
+import os
+import json
+import tempfile
+from course_material import CourseMaterialIndex, chunk_text, tokenize
+from embeddings import HashingEmbedder
+
+PHOTOSYNTHESIS = """Photosynthesis turns light energy into chemical energy in the chloroplasts of plant cells.
+
+Chlorophyll absorbs red and blue light and reflects green light, which is why leaves look green."""
+
+GRAVITY = "Gravity pulls masses toward each other. Newton described it with an inverse square law of distance."
+
+VOLCANOES = "Volcanoes erupt when magma from the mantle rises through cracks in the crust of the Earth."
+
+
+def test_chunk_text_windows_and_validation():
+    words = [f"w{i}" for i in range(25)]
+    chunks = [c.split() for c in chunk_text(' '.join(words), chunk_words=10, overlap=3)]
+    assert [len(c) for c in chunks] == [10, 10, 10, 4]
+    assert chunks[1][:3] == chunks[0][-3:] and chunks[-1][-1] == "w24"  # Overlapping, nothing lost
+
+    # Paragraphs that fit stay together; the next paragraph starts a new window
+    chunks = chunk_text("a b c d\n\ne f g h\n\ni j", chunk_words=9, overlap=0)
+    assert chunks == ["a b c d e f g h", "i j"]
+    assert chunk_text("   \n\n  ") == []
+
+    for chunk_words, overlap in ((10, 10), (10, 12), (10, -1), (0, 0)):
+        try:
+            chunk_text("some words here", chunk_words, overlap)
+            raise AssertionError(f"accepted overlap={overlap}, chunk_words={chunk_words}")
+        except ValueError:
+            pass
+    assert tokenize("What is THE speed of light?") == ["speed", "light"]
+
+
+def test_add_search_and_remove():
+    with tempfile.TemporaryDirectory() as directory:
+        index = CourseMaterialIndex(directory, HashingEmbedder())
+        leaves = index.add_document("Leaves", PHOTOSYNTHESIS, {"filename": "leaves.txt"})
+        index.add_document("Gravity", GRAVITY)
+        index.add_document("Volcanoes", VOLCANOES)
+        assert leaves['chunks'] == 1 and leaves['metadata'] == {"filename": "leaves.txt"}
+
+        results = index.search("why are leaves green chlorophyll", top_k=2)
+        assert results[0]['title'] == "Leaves" and len(results) == 2
+        assert results[0]['score'] >= results[1]['score'] and results[0]['bm25'] > 0
+        assert index.search("inverse square law")[0]['title'] == "Gravity"
+        assert len(index.search("magma", top_k=50)) == 3
+
+        assert index.remove_document(leaves['doc_id']) and not index.remove_document(leaves['doc_id'])
+        assert all(r['title'] != "Leaves" for r in index.search("chlorophyll leaves", top_k=5))
+        assert index.stats()['deleted_documents'] == 1 and index.stats()['documents'] == 2
+
+        try:
+            index.add_document("Empty", "   ")
+            raise AssertionError("indexed an empty document")
+        except ValueError:
+            pass
+
+        try:
+            CourseMaterialIndex(directory, HashingEmbedder(), chunk_words=10, overlap=10)
+            raise AssertionError("accepted an overlap that never advances")
+        except ValueError:
+            pass
+
+
+def test_merge_compact_and_reload():
+    with tempfile.TemporaryDirectory() as directory:
+        index = CourseMaterialIndex(directory, HashingEmbedder(), max_segments=2)
+        doc_ids = [index.add_document(f"Note {i}", f"{VOLCANOES} Note number {i}.")['doc_id'] for i in range(5)]
+        assert index.stats()['segments'] <= 2 and index.stats()['chunks'] == 5
+
+        index.remove_document(doc_ids[0])
+        index.compact()
+        stats = index.stats()
+        assert stats == {'embedder': 'hashing-384', 'documents': 4, 'chunks': 4, 'segments': 1, 'deleted_documents': 0}
+        assert len([name for name in os.listdir(directory) if name.startswith("seg_")]) == 1
+
+        # Reopening serves the same results from disk
+        before = [r['doc_id'] for r in index.search("magma crust", top_k=4)]
+        reopened = CourseMaterialIndex(directory, HashingEmbedder())
+        assert [r['doc_id'] for r in reopened.search("magma crust", top_k=4)] == before
+
+        # A different embedding model re-embeds the stored text
+        reembedded = CourseMaterialIndex(directory, HashingEmbedder(dim=64))
+        assert reembedded.search("magma", top_k=1)[0]['title'].startswith("Note")
+        with open(os.path.join(directory, "manifest.json")) as f:
+            assert json.load(f)['embedder'] == "hashing-64"
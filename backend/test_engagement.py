@@ -0,0 +1,86 @@
+import time
+import numpy as np
+from engagement import EngagementHub, ClassroomBuffer, ClassroomLimitReached
+
+
+def test_ring_buffer_wraps_in_order():
+    room = ClassroomBuffer(capacity=5)
+    for start in (0, 3, 6):
+        t = np.arange(start, start + 3, dtype=np.float64)
+        room.append(t, np.zeros(3, dtype=np.uint16), np.zeros((4, 3), dtype=np.uint8), np.ones(3, dtype=bool))
+    # Nine written into five slots: the last five survive, oldest overwritten first
+    assert room.written == 9 and sorted(room.t.tolist()) == [4, 5, 6, 7, 8]
+    room.append(np.arange(100, 112, dtype=np.float64), np.zeros(12, dtype=np.uint16),
+                np.zeros((4, 12), dtype=np.uint8), np.ones(12, dtype=bool))
+    assert sorted(room.t.tolist()) == [107, 108, 109, 110, 111]
+
+
+def test_windows_trend_and_watchlist():
+    hub = EngagementHub(windows=(30, 600), attention_threshold=60, bucket_seconds=30, refresh_seconds=0.1)
+    now = time.time()
+    # Attention fading over ten minutes; "dana" has looked away for the last half minute
+    for minute in range(10):
+        t = now - 600 + minute * 60 + 1
+        hub.ingest("7A", [{'student_id': name, 'score': 90 - minute * 5, 'attention': 80, 't': t}
+                          for name in ("ali", "bea", "cy")])
+    hub.ingest("7A", [
+        {'student_id': "ali", 'score': 80, 'attention': 90, 't': now * 1000},  # Date.now() milliseconds
+        {'student_id': "bea", 'score': 70, 'attention': 70},
+        {'student_id': "dana", 'score': 10, 'attention': 5, 'face': False},
+        {'student_id': "cy", 'score': 50, 'attention': 40, 't': now + 3600}  # Clock ahead of ours
+    ])
+    result = hub.aggregate("7A")
+    recent, overall = result['windows']
+    assert recent['samples'] == 4 and recent['students_active'] == 4 and result['students_total'] == 4
+    assert recent['attention_rate'] == 0.5 and recent['face_rate'] == 0.75
+    assert recent['score'] == 52.5 and recent['level'] == 'medium'
+    assert overall['samples'] == 34
+    assert result['trend']['direction'] == 'falling' and len(result['trend']['score']) == 20
+    assert [s['student_id'] for s in result['needs_attention']] == ["dana", "cy"]
+
+    # Cached for refresh_seconds, however many samples arrive meanwhile
+    hub.ingest_columns("7A", {'student_id': ["ali"], 'score': [100]})
+    assert hub.aggregate("7A") is result
+    time.sleep(0.1)
+    assert hub.aggregate("7A")['windows'][0]['samples'] == 5
+    assert hub.stats()['aggregations'] == 2
+    assert hub.aggregate("missing") is None
+
+
+def test_bounds_and_validation():
+    hub = EngagementHub(capacity=100, max_classrooms=2, max_students=2, windows=(60,), active_seconds=0.05)
+    result = hub.ingest_columns("room1", {
+        'student_id': ["a", "b", "c", "a"],
+        'score': [50, 150, 20, float('nan')],  # Clipped to 0-100
+        't': [time.time(), time.time(), time.time(), time.time() - 3600]
+    })
+    assert result == {'accepted': 2, 'dropped': 2}  # "c" over the student limit, the last one stale
+    assert hub.aggregate("room1")['windows'][0]['score'] == 75.0
+
+    hub.ingest("room2", [{'student_id': "a"}])
+    # A new classroom never pushes out one that is still sending
+    try:
+        hub.ingest("room3", [{'student_id': "a"}])
+        raise AssertionError("evicted an active classroom")
+    except ClassroomLimitReached:
+        pass
+    time.sleep(0.06)
+    hub.ingest("room2", [{'student_id': "a"}])
+    hub.ingest("room3", [{'student_id': "a"}])
+    stats = hub.stats()
+    assert stats['classrooms'] == 2 and stats['classrooms_evicted'] == 1 and hub.aggregate("room1") is None
+    assert stats['classrooms_rejected'] == 1
+    assert stats['memory_bytes'] <= stats['memory_limit_bytes']
+    assert (stats['dropped_students'], stats['dropped_stale']) == (1, 1)
+
+    for bad in ([{'score': 1}], [1, 2]):
+        try:
+            hub.ingest("room2", bad)
+            raise AssertionError("accepted a malformed batch")
+        except ValueError:
+            pass
+    try:
+        hub.ingest_columns("room2", {'student_id': ["a", "b"], 'score': [1]})
+        raise AssertionError("accepted ragged columns")
+    except ValueError as e:
+        assert "expected 2" in str(e)
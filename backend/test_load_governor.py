@@ -0,0 +1,100 @@
+import threading
+import time
+from fake_ai import FakeClassroomAI
+from load_governor import LoadGovernor, FULL, SKIP_ELABORATION, GREEDY_DECODING, DEFER_VISUALS
+
+
+def hold(governor, count, release):
+    """Keep `count` model runs in flight until `release` is set"""
+    started = threading.Barrier(count + 1)
+
+    def run():
+        with governor.track():
+            started.wait()
+            release.wait()
+
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    return threads
+
+
+def test_steps_down_one_level_at_a_time_under_backlog():
+    governor = LoadGovernor(queue_target=4, p95_target_seconds=100, step_up_seconds=0.05, recover_seconds=0.2)
+    release = threading.Event()
+    threads = hold(governor, 6, release)
+    try:
+        assert governor.level == SKIP_ELABORATION
+        # The dwell time limits how fast it steps
+        assert governor.level == SKIP_ELABORATION
+        for _ in range(10):
+            time.sleep(0.06)
+            governor.level
+        assert governor.level == DEFER_VISUALS
+        with governor.track() as level:
+            assert level == DEFER_VISUALS
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    stats = governor.stats()
+    assert stats['level_name'] == 'defer_visuals' and stats['in_flight'] == 0
+    assert [t['to'] for t in stats['recent_transitions']] == [
+        'skip_elaboration', 'keyword_classification', 'greedy_decoding', 'defer_visuals'
+    ]
+
+
+def test_recovers_with_hysteresis():
+    governor = LoadGovernor(queue_target=4, p95_target_seconds=100, step_up_seconds=0, recover_seconds=0.2)
+    release = threading.Event()
+    threads = hold(governor, 4, release)
+    assert governor.level == SKIP_ELABORATION
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    # Pressure between recover_ratio and 1 holds the level
+    release = threading.Event()
+    threads = hold(governor, 3, release)
+    time.sleep(0.3)
+    assert governor.level == SKIP_ELABORATION
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    # Calm must last recover_seconds before stepping back up
+    assert governor.level == SKIP_ELABORATION
+    time.sleep(0.25)
+    assert governor.level == FULL
+
+
+def test_slow_requests_raise_pressure():
+    governor = LoadGovernor(queue_target=100, p95_target_seconds=0.05, step_up_seconds=0)
+    for _ in range(3):
+        with governor.track():
+            time.sleep(0.06)
+    stats = governor.stats()
+    assert stats['p95_seconds'] >= 0.06 and stats['level'] > FULL
+    assert stats['requests_at_level']['full'] >= 1
+
+    disabled = LoadGovernor(queue_target=1, enabled=False)
+    with disabled.track() as level, disabled.track():
+        assert level == FULL and disabled.level == FULL
+
+
+def test_batch_generation_follows_the_level():
+    ai = FakeClassroomAI(save_images=False, text_seconds=0.1, mode="sleep")
+    queries = [f"What is force {i}?" for i in range(4)]
+    analyses = [ai.fallback_analysis(query) for query in queries]
+
+    def batch_seconds(level):
+        start_time = time.perf_counter()
+        answers = dict(ai.generate_educational_responses(queries, analyses, batch_size=4, degradation=level))
+        assert sorted(answers) == [0, 1, 2, 3]
+        return time.perf_counter() - start_time
+
+    # Greedy decoding without elaboration: 0.8 * 0.4 of a full-quality batch
+    full, greedy = batch_seconds(FULL), batch_seconds(GREEDY_DECODING)
+    assert greedy < full * 0.5, (full, greedy)
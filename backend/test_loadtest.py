@@ -0,0 +1,47 @@
+from loadtest import classroom_schedule, find_saturation, summarize_stage
+
+
+def stage(rate, throughput, p95, error_rate=0.0):
+    return {
+        'offered_rps': rate,
+        'throughput_rps': throughput,
+        'error_rate': error_rate,
+        'latency_ms_all': {'p50': p95 / 2, 'p95': p95, 'p99': p95}
+    }
+
+
+def test_schedule_shape():
+    schedule = classroom_schedule(rate=10, duration=20, burst_fraction=0.5, burst_seconds=2, repeat_ratio=0.3, seed=1)
+    assert len(schedule) == 200
+    assert [item['at'] for item in schedule] == sorted(item['at'] for item in schedule)
+
+    # Half the traffic arrives in the opening burst
+    in_burst = sum(item['at'] < 2 for item in schedule)
+    assert in_burst >= 100
+
+    kinds = {item['kind'] for item in schedule}
+    assert kinds == {'text', 'visual', 'repeat'}
+    assert classroom_schedule(rate=10, duration=20, seed=1) == classroom_schedule(rate=10, duration=20, seed=1)
+
+
+def test_saturation_detection():
+    stages = [stage(1, 1.0, 300), stage(2, 2.0, 400), stage(4, 3.1, 2000), stage(8, 3.0, 9000)]
+    saturation = find_saturation(stages, slo_p95_ms=5000, max_error_rate=0.01)
+    assert saturation['saturated_at_rps'] == 4 and saturation['max_healthy_rps'] == 2
+
+    saturation = find_saturation([stage(1, 1.0, 300), stage(2, 2.0, 6000)], slo_p95_ms=5000, max_error_rate=0.01)
+    assert saturation['saturated_at_rps'] == 2 and "p95" in saturation['reasons'][0]
+
+    assert find_saturation([stage(1, 1.0, 300)], 5000, 0.01)['saturated_at_rps'] is None
+
+
+def test_stage_summary_separates_throttling():
+    results = (
+        [{'kind': 'text', 'status': 200, 'success': True, 'coalesced': False, 'error': None, 'latency': 0.2, 'stage_wall': 10}] * 8 +
+        [{'kind': 'text', 'status': 429, 'success': False, 'coalesced': False, 'error': None, 'latency': 0.01, 'stage_wall': 10}] +
+        [{'kind': 'visual', 'status': None, 'success': False, 'coalesced': False, 'error': 'ReadTimeout', 'latency': 5, 'stage_wall': 10}]
+    )
+    summary = summarize_stage(1, 10, results)
+    assert summary['throttled_rate'] == 0.1 and summary['error_rate'] == 0.1
+    assert summary['errors'] == ['ReadTimeout']
+    assert summary['latency_ms_visual']['p50'] is None
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+import model_memory
+from model_memory import MemoryMonitor, resolve_model_dtypes, rss_bytes, MODEL_KEYS
+
+
+def test_resolve_model_dtypes():
+    original = model_memory.cpu_supports_bf16
+    try:
+        model_memory.cpu_supports_bf16 = lambda: True
+        dtypes = resolve_model_dtypes("default=auto, qa=float32, bogus=bfloat16, chat=int3")
+        assert dtypes['qa'] == 'float32'
+        assert dtypes['text'] == 'bfloat16' and dtypes['chat'] == 'bfloat16'
+        assert set(dtypes) == set(MODEL_KEYS)
+
+        model_memory.cpu_supports_bf16 = lambda: False
+        assert set(resolve_model_dtypes("").values()) == {'float32'}  # auto falls back without bf16
+        assert resolve_model_dtypes("image=bfloat16")['image'] == 'bfloat16'  # Explicit choice is kept
+    finally:
+        model_memory.cpu_supports_bf16 = original
+
+
+def test_monitor_records_peak_activation():
+    if not rss_bytes():
+        pytest.skip("/proc/self/statm unavailable")
+
+    monitor = MemoryMonitor(interval_ms=1)
+    size = 64 * 1024 * 1024
+    with monitor.track("chat"):
+        scratch = np.ones(size // 8)  # Touched, so it is resident
+        del scratch
+    with monitor.track("chat"):
+        pass
+
+    stats = monitor.stats()['chat']
+    assert stats['requests'] == 2
+    assert stats['peak_activation_bytes'] >= size * 0.9, stats
+    assert stats['last_activation_bytes'] < size * 0.5, stats
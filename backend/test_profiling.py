@@ -0,0 +1,100 @@
+import threading
+import time
+from profiling import LiveProfiler
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(1000))
+    return total
+
+
+def test_off_is_a_no_op():
+    profiler = LiveProfiler()
+    assert profiler.section("text_model.generate") is profiler.section("qa_pipeline")
+    assert profiler.request("chat") is profiler.section("x")
+
+    start = time.perf_counter()
+    for _ in range(100000):
+        with profiler.section("text_model.generate"):
+            pass
+    per_call_us = (time.perf_counter() - start) / 100000 * 1e6
+    assert per_call_us < 5, per_call_us
+
+
+def test_capture_records_requests_sections_and_samples():
+    profiler = LiveProfiler()
+    stop = threading.Event()
+
+    def traffic():
+        while not stop.is_set():
+            with profiler.request("chat"):
+                with profiler.section("text_model.generate"):
+                    busy(0.05)
+
+    worker = threading.Thread(target=traffic, name="request-worker")
+    worker.start()
+    try:
+        trace = profiler.capture(0.5, sample_interval_ms=5)
+    finally:
+        stop.set()
+        worker.join()
+
+    names = {event['name'] for event in trace['traceEvents']}
+    assert {"chat", "text_model.generate"} <= names
+    other = trace['otherData']
+    assert other['requests']['chat']['requests'] >= 3
+    assert other['python_samples'] > 20
+    hottest = other['hot_python_stacks'][0]
+    assert hottest['thread'] == "request-worker" and any("busy" in frame for frame in hottest['stack'])
+
+    # Nothing is recorded once the window has closed
+    with profiler.request("chat"):
+        pass
+    assert not profiler.active
+
+
+def test_one_capture_at_a_time():
+    profiler = LiveProfiler()
+    first = threading.Thread(target=profiler.capture, args=(0.3,))
+    first.start()
+    time.sleep(0.05)
+    try:
+        profiler.capture(0.1)
+        raise AssertionError("expected the second capture to be refused")
+    except RuntimeError:
+        pass
+    first.join()
+
+
+def test_sample_events_are_bounded():
+    profiler = LiveProfiler(max_sample_events=5)
+    stop = threading.Event()
+
+    def idle_request():
+        while not stop.is_set():
+            time.sleep(0.001)  # Same stack on every sample
+
+    def churn():
+        while not stop.is_set():
+            busy(0.001)
+
+    workers = [threading.Thread(target=idle_request, name="sleeper"), threading.Thread(target=churn, name="churn")]
+    for worker in workers:
+        worker.start()
+    try:
+        trace = profiler.capture(0.3, sample_interval_ms=2)
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+    other = trace['otherData']
+    samples = [e for e in trace['traceEvents'] if e['cat'] == 'python_sample']
+    assert len(samples) == other['python_sample_events'] <= 5
+    assert other['python_sample_events_dropped'] > 0 or any(e['args']['samples'] > 1 for e in samples)
+    # An unchanged stack is one long event rather than one per sample
+    sleeper = [e for e in samples if e['tid'] == "py-sleeper"]
+    assert sleeper and sleeper[0]['args']['samples'] > 10 and sleeper[0]['dur'] > 10 * 2000
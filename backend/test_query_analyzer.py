@@ -0,0 +1,133 @@
+from query_analyzer import (
+    KEYWORD_ENGINE, QUERY_TYPE_KEYWORDS, VISUAL_KEYWORDS, COMPLEXITY_KEYWORDS,
+    LEVEL_KEYWORDS, SUBJECT_KEYWORDS
+)
+
+# Representative classroom queries; none of them trips a substring misfire
+QUERIES = [
+    "What is gravity?",
+    "Explain Newton's second law of motion",
+    "Solve the equation 2x + 3 = 7",
+    "Calculate the kinetic energy of a 2 kg ball",
+    "Compare mitosis and meiosis",
+    "Difference between a virus and a cell",
+    "Draw a diagram of the water cycle",
+    "Show me a graph of population growth",
+    "How to balance a chemical reaction",
+    "What are the steps of the scientific method",
+    "Describe the causes of the first world war",
+    "Tell me about ancient civilization in Egypt",
+    "Define an algorithm in computer science",
+    "Prove the Pythagorean theorem for high school students",
+    "What is the relationship between force and acceleration",
+    "Research methodology for university students",
+    "Basic facts about each continent",
+    "Write a poem about the climate",
+    "Illustrate the structure of an atom",
+    "Generate picture of a DNA molecule",
+    "Who was the author of this novel",
+    "Give me a hypothesis about gravity",
+    "Help with middle school algebra",
+    "Find the area of a circle",
+    "Visualize the data from the experiment",
+    "Create image of a volcano",
+    "Why is the sky blue",
+    # Stems match longer words, as the substring scan did
+    "Solve this mathematics problem",
+    "Explain mathematical induction",
+    "Introduction to programming",
+    "Data visualization of rainfall",
+    "Why are atomic bombs so powerful",
+    "",
+]
+
+# Queries where the old substring scan misfired and whole-word matching must not
+MISFIRES = {
+    "What is photosynthesis?": {'complexity': 'basic'},                  # synthesis
+    "How did the Slavs migrate?": {'query_type': 'general'},             # vs
+    "Basic geography of each continent": {'needs_visual': False},       # graph
+    "Is a warthog a mammal?": {'subject': 'general'},                    # war
+    "How many numbers showcase the pattern": {'query_type': 'general'},  # show
+    "Which computers are fastest?": {'query_type': 'general'},           # compute
+    "Is water a good solvent?": {'query_type': 'general'},               # solve
+    "Tips for elementary school": {'subject': 'general'},                # element
+}
+
+# Longer words that must still count for their stem
+STEMS = {
+    "Solve this mathematics problem": {'subject': 'mathematics', 'query_type': 'problem_solving'},
+    "Explain mathematical induction": {'subject': 'mathematics'},
+    "Introduction to programming": {'subject': 'computer science'},
+    "Data visualization of rainfall": {'needs_visual': True},
+    "How do I visualize a vector?": {'needs_visual': True, 'query_type': 'visualization'},
+    "Explain cellular respiration": {'subject': 'biology'},
+}
+
+
+def legacy_analysis(query: str) -> dict:
+    """The substring-based analysis this engine replaces (kept here as the reference)"""
+    query_lower = query.lower()
+
+    query_type = 'general'
+    for name, words in QUERY_TYPE_KEYWORDS:
+        if any(word in query_lower for word in words):
+            query_type = name
+            break
+
+    complexity = 'basic'
+    for name, words in COMPLEXITY_KEYWORDS:
+        if any(term in query_lower for term in words):
+            complexity = name
+            break
+
+    level = 'general'
+    for name, words in LEVEL_KEYWORDS:
+        if any(term in query_lower for term in words):
+            level = name
+            break
+
+    scores = {}
+    for subject, keywords in SUBJECT_KEYWORDS.items():
+        score = sum(1 for keyword in keywords if keyword in query_lower)
+        if score > 0:
+            scores[subject] = score / len(keywords)
+    if scores:
+        subject = max(scores, key=scores.get)
+        confidence = scores[subject]
+    else:
+        subject, confidence = 'general', 0.5
+
+    return {
+        'query_type': query_type,
+        'needs_visual': any(word in query_lower for word in VISUAL_KEYWORDS),
+        'complexity': complexity,
+        'educational_level': level,
+        'subject': subject,
+        'subject_confidence': confidence
+    }
+
+
+def _comparable(features: dict) -> dict:
+    result = {k: v for k, v in features.items() if k not in ('keywords', 'fallback_needs_visual')}
+    result['subject_confidence'] = round(result['subject_confidence'], 6)
+    return result
+
+
+def test_matches_legacy_behaviour():
+    for query in QUERIES:
+        expected = _comparable(legacy_analysis(query))
+        actual = _comparable(KEYWORD_ENGINE.scan(query))
+        assert actual == expected, f"{query!r}: {actual} != {expected}"
+
+
+def test_whole_word_matching():
+    for query, expected in {**MISFIRES, **STEMS}.items():
+        features = KEYWORD_ENGINE.scan(query)
+        for key, value in expected.items():
+            assert features[key] == value, f"{query!r}: {key}={features[key]!r}, expected {value!r}"
+
+
+def test_batch_matches_single():
+    queries = QUERIES + list(MISFIRES) + list(STEMS)
+    for query, batch_features in zip(queries, KEYWORD_ENGINE.scan_many(queries)):
+        assert _comparable(batch_features) == _comparable(KEYWORD_ENGINE.scan(query)), query
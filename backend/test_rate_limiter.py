@@ -0,0 +1,53 @@
+import time
+from rate_limiter import RateLimiter, TokenBucket
+
+
+def test_token_bucket_refills():
+    bucket = TokenBucket(capacity=2, rate=1.0, now=0.0)
+    bucket.tokens = 0
+    assert bucket.wait_time(1) == 1.0
+    bucket.refill(0.5)
+    assert bucket.tokens == 0.5
+    bucket.refill(10)
+    assert bucket.tokens == 2  # Never above capacity
+
+
+def test_client_and_classroom_budgets():
+    limiter = RateLimiter(client_rate=0.0, client_burst=3, classroom_rate=0.0, classroom_burst=5)
+    assert [limiter.admit("10.0.0.1/a", "10.0.0.1")[0] for _ in range(4)] == [True, True, True, False]
+    admitted, retry_after, scope = limiter.admit("10.0.0.1/a", "10.0.0.1")
+    assert not admitted and scope == "client" and retry_after == float('inf')
+
+    # A fresh client id gets its own share, but the address's budget still caps them all
+    assert [limiter.admit("10.0.0.1/b", "10.0.0.1")[0] for _ in range(3)] == [True, True, False]
+    assert limiter.admit("10.0.0.1/c", "10.0.0.1")[2] == "classroom"
+    assert limiter.admit("10.0.0.2/a", "10.0.0.2")[0]
+
+    # Expensive requests are charged more, but never more than a full bucket
+    assert limiter.admit("10.0.0.3/a", "10.0.0.3", cost=100)[0]
+    stats = limiter.stats()
+    assert stats['limited_by'] == {'client': 2, 'classroom': 2} and stats['admitted'] == 7
+
+
+def test_bucket_table_is_bounded():
+    limiter = RateLimiter(max_buckets=10, idle_ttl=600)
+    for i in range(100):
+        limiter.admit(f"10.0.{i}.1/x", f"10.0.{i}.1")
+    stats = limiter.stats()
+    assert stats['active_buckets'] <= 10 and stats['evicted_buckets'] >= 190
+
+    # Least recently used goes first: a client that keeps coming back keeps its bucket
+    limiter = RateLimiter(client_rate=0.0, client_burst=2, max_buckets=4)
+    limiter.admit("regular", None)
+    for i in range(10):
+        limiter.admit("regular", None)
+        limiter.admit(f"drive-by-{i}", None)
+    assert not limiter.admit("regular", None)[0]  # Still drained, not reset by eviction
+
+    # Idle buckets are full again anyway, so they are dropped before busy ones
+    limiter = RateLimiter(max_buckets=2, idle_ttl=0.01)
+    limiter.admit("old", None)
+    limiter.admit("older", None)
+    time.sleep(0.02)
+    limiter.admit("new", None)
+    assert limiter.stats()['active_buckets'] == 1
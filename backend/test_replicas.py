@@ -0,0 +1,57 @@
+import threading
+import time
+from cancellation import CancelToken, RequestCancelled
+from replicas import ReplicaPool, plan_replicas
+
+
+def test_plan_splits_cores_into_contiguous_blocks():
+    assert plan_replicas(4, cores=list(range(8))) == [[0, 1], [2, 3], [4, 5], [6, 7]]
+    # Leftover cores stay free for the API process
+    assert plan_replicas(2, 3, cores=list(range(8))) == [[0, 1, 2], [3, 4, 5]]
+    assert plan_replicas(3, cores=[5, 1, 3]) == [[1], [3], [5]]
+    for replicas, threads in ((3, 3), (0, None)):
+        try:
+            plan_replicas(replicas, threads, cores=list(range(8)))
+        except ValueError:
+            continue
+        raise AssertionError("expected ValueError")
+
+
+def test_pool_routes_to_least_loaded_replica():
+    # Both replicas share core 0 here; only the routing is under test
+    pool = ReplicaPool(2, 1, backend="fake", cores=[0, 0],
+                       backend_kwargs={'text_seconds': 0.3, 'visual_seconds': 0.3, 'mode': 'sleep'})
+    try:
+        assert pool.models_ready and pool.generation_params()
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda q=q: results.append(pool.process_educational_query(q)))
+            for q in ("What is photosynthesis?", "Explain gravity", "What is an atom?", "Define velocity")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert all(result['success'] for result in results)
+        stats = pool.stats()
+        assert [replica['served'] for replica in stats['replicas']] == [2, 2]
+        assert stats['outstanding'] == 0
+        # Replicas keep no log; the API process records the conversation
+        assert len(pool.conversation_history) == 4
+
+        token = CancelToken()
+        future = pool.submit('process_educational_query', "What is a cell?", cancel_token=token)
+        time.sleep(0.1)
+        token.cancel("client disconnected")
+        try:
+            future.result(timeout=5)
+        except RequestCancelled as e:
+            assert str(e) == "client disconnected"
+        else:
+            raise AssertionError("expected RequestCancelled")
+
+        replica_stats = pool.replica_stats()
+        assert len(replica_stats) == 2 and all('rss_bytes' in stats for stats in replica_stats)
+    finally:
+        pool.close()
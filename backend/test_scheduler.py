@@ -0,0 +1,102 @@
+import threading
+import time
+from cancellation import CancelToken, RequestCancelled
+from scheduler import CostModel, CostScheduler, parse_priority_classes
+
+TEXT = {'query_type': 'explanation', 'complexity': 'basic'}
+
+
+def run_all(scheduler, jobs, busy_seconds=0.1):
+    """Hold the only slot, queue `jobs` (name, kind, class, seconds) in order, record the run order"""
+    order = []
+    started = threading.Event()
+
+    def occupy():
+        with scheduler.slot(TEXT, 'text'):
+            started.set()
+            time.sleep(busy_seconds)
+
+    def job(name, kind, request_class, seconds):
+        with scheduler.slot(TEXT, kind, request_class):
+            order.append(name)
+            time.sleep(seconds)
+
+    threads = [threading.Thread(target=occupy)]
+    threads[0].start()
+    started.wait()
+    for spec in jobs:
+        threads.append(threading.Thread(target=job, args=spec))
+        threads[-1].start()
+        time.sleep(0.005)  # Arrival order
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_shortest_job_first_and_classes():
+    assert parse_priority_classes("student=20, teacher=0") == {'teacher': 0.0, 'student': 20.0}
+    model = CostModel()
+    model.observe('text+diffusion:explanation:basic', 30.0)
+    model.observe('text:explanation:basic', 1.0)
+
+    # The visual arrived first, but the texts behind it go ahead; the teacher's question goes first
+    scheduler = CostScheduler(slots=1, aging=0.5, cost_model=model)
+    jobs = [("visual", 'text+diffusion', 'student', 0.0)] + \
+           [(f"text{i}", 'text', 'student', 0.0) for i in range(3)] + [("teacher", 'text', 'teacher', 0.0)]
+    assert run_all(scheduler, jobs) == ["teacher", "text0", "text1", "text2", "visual"]
+
+    fifo = CostScheduler(slots=1, policy="fifo", classes={'student': 0.0}, cost_model=model)
+    assert run_all(fifo, jobs)[:2] == ["visual", "text0"]
+
+    stats = scheduler.stats()
+    assert stats['classes']['student']['served'] == 5 and stats['classes']['teacher']['served'] == 1
+    assert stats['classes']['student']['wait_max_seconds'] >= stats['classes']['teacher']['wait_max_seconds']
+
+
+def test_aging_prevents_starvation():
+    model = CostModel()
+    model.observe('text+diffusion:explanation:basic', 1.0)
+    model.observe('text:explanation:basic', 0.1)
+    # Aging 100/s: the visual (1.0) beats a new text (0.1) once it has waited ~9 ms
+    scheduler = CostScheduler(slots=1, aging=100.0, cost_model=model)
+    jobs = [("visual", 'text+diffusion', 'student', 0.0)] + [(f"text{i}", 'text', 'student', 0.0) for i in range(5)]
+    order = run_all(scheduler, jobs)
+    assert order.index("visual") < 3
+
+
+def test_cancelled_while_waiting_and_learning():
+    scheduler = CostScheduler(slots=1)
+    token = CancelToken()
+    release = threading.Event()
+
+    def occupy():
+        with scheduler.slot(TEXT, 'text'):
+            release.wait()
+
+    holder = threading.Thread(target=occupy)
+    holder.start()
+    time.sleep(0.02)
+    threading.Timer(0.05, token.cancel, args=("client disconnected",)).start()
+    start = time.monotonic()
+    try:
+        with scheduler.slot(TEXT, 'text', cancel_token=token):
+            raise AssertionError("should not get a slot")
+    except RequestCancelled as e:
+        assert str(e) == "client disconnected"
+    assert time.monotonic() - start < 0.1  # Woken by the cancel itself, not a polling interval
+
+    # A deadline passing while queued abandons the wait just as promptly
+    start = time.monotonic()
+    try:
+        with scheduler.slot(TEXT, 'text', cancel_token=CancelToken(timeout_seconds=0.03)):
+            raise AssertionError("should not get a slot")
+    except RequestCancelled as e:
+        assert str(e) == "timeout" and time.monotonic() - start < 0.1
+    release.set()
+    holder.join()
+
+    stats = scheduler.stats()
+    assert stats['classes']['student']['abandoned'] == 2 and stats['running'] == 0
+    assert stats['learned_seconds']['text:explanation:basic']['runs'] == 1
+    # Unknown class falls back to the lowest priority
+    assert scheduler.resolve_class("Principal") == "student" and scheduler.resolve_class("TEACHER") == "teacher"
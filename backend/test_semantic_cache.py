@@ -0,0 +1,73 @@
+import time
+import numpy as np
+from embeddings import HashingEmbedder
+from semantic_cache import SemanticCache, cache_text, default_threshold
+
+
+def test_paraphrases_hit_and_gates_hold():
+    assert cache_text("Can you explain what photosynthesis is?") == cache_text("define photosynthesis") == "photosynthesis"
+
+    cache = SemanticCache(HashingEmbedder(), threshold=0.85)
+    cache.store("What is photosynthesis?", {'text_response': "Plants turn light into glucose"}, namespace="params-a")
+    hit = cache.lookup("explain photosynthesis", namespace="params-a")
+    assert hit['result']['text_response'] == "Plants turn light into glucose"
+    assert hit['query'] == "What is photosynthesis?" and hit['similarity'] > 0.99
+
+    # Different generation settings / context, different question, different educational level
+    assert cache.lookup("explain photosynthesis", namespace="params-b") is None
+    assert cache.lookup("What is cellular respiration?", namespace="params-a") is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['gated_out']) == (1, 2, 1)
+
+    # Close enough at a loose threshold, but asked at another educational level
+    loose = SemanticCache(HashingEmbedder(), threshold=0.3)
+    loose.store("What is a cell?", {'text_response': "general"})
+    assert loose.lookup("Explain a cell for university students") is None
+    assert loose.lookup("Explain a cell")['query'] == "What is a cell?"
+    assert loose.stats()['gated_out'] == 1  # A level no cached answer has
+
+    # A request for a diagram, or a comparison, never gets a plain explanation back
+    loose.store("What is photosynthesis?", {'text_response': "no diagram"})
+    assert loose.lookup("Draw a diagram of photosynthesis") is None
+    assert loose.lookup("Compare photosynthesis and respiration") is None
+    assert loose.stats()['gated_out'] == 3
+
+
+def test_lookup_returns_a_private_copy_and_thresholds_follow_the_embedder():
+    cache = SemanticCache(HashingEmbedder())
+    assert cache.threshold == default_threshold("hashing-384") == 0.85
+    assert default_threshold("sentence-transformers/all-MiniLM-L6-v2") == 0.9
+    assert default_threshold("some-other-model") == 0.9
+
+    cache.store("What is gravity?", {'text_response': "A pull", 'analysis': {'subject': "Physics"}})
+    hit = cache.lookup("define gravity")
+    hit['result']['analysis']['subject'] = "changed by the caller"
+    hit['result']['text_response'] += "!"
+    again = cache.lookup("define gravity")
+    assert again['result'] == {'text_response': "A pull", 'analysis': {'subject': "Physics"}}
+
+
+def test_ttl_and_ring_eviction():
+    cache = SemanticCache(HashingEmbedder(), threshold=0.85, max_entries=2, ttl_seconds=0.05)
+    for question in ["What is gravity?", "What is an atom?", "What is DNA?"]:
+        cache.store(question, {'text_response': question})
+    assert cache.lookup("explain gravity") is None  # Overwritten by the third entry
+    assert cache.lookup("define DNA")['query'] == "What is DNA?"
+    time.sleep(0.06)
+    assert cache.lookup("define DNA") is None
+    assert cache.stats()['entries'] == 2
+
+
+def test_ivf_index_finds_the_same_answers():
+    rng = np.random.default_rng(0)
+    words = "force energy cell atom equation climate poem algorithm reaction wave river planet protein".split()
+    filler = [f"{' '.join(rng.choice(words, 4))} {i}" for i in range(600)]
+    questions = ["What is photosynthesis?", "What is gravity?", "What is an algorithm?"]
+
+    caches = [SemanticCache(HashingEmbedder(), threshold=0.85, ann_min_entries=n) for n in (10000, 256)]
+    for cache in caches:
+        for question in filler + questions:
+            cache.store(question, {'text_response': question})
+    assert [cache.stats()['index'] for cache in caches] == ['brute_force', 'ivf']
+    for query in ["explain photosynthesis", "define gravity", "Explain what an algorithm is"]:
+        assert caches[0].lookup(query)['query'] == caches[1].lookup(query)['query']
@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+from cancellation import CancelToken, RequestCancelled
+from single_flight import SingleFlight, normalize_query, query_key
+
+
+def test_query_key():
+    assert normalize_query("  What is   Gravity?! ") == "what is gravity"
+    assert query_key("What is gravity?") == query_key("what is gravity")
+    assert query_key("What is 2+2?") != query_key("What is 2-2?")
+    assert query_key("What is gravity?", {'num_beams': 4}) != query_key("What is gravity?", {'num_beams': 1})
+
+
+def test_concurrent_duplicates_run_once():
+    flights = SingleFlight()
+    calls = []
+
+    def work(query):
+        calls.append(query)
+        time.sleep(0.2)
+        return {'text_response': f"answer to {query}"}
+
+    results = []
+
+    def request():
+        results.append(flights.do(query_key("What is gravity?"), work, "What is gravity?"))
+
+    threads = [threading.Thread(target=request) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len({id(result) for result, _ in results}) == 1  # Everyone got the very same result
+    assert sorted(shared for _, shared in results) == [False] + [True] * 9
+
+    stats = flights.stats()
+    assert stats['leaders'] == 1 and stats['followers'] == 9 and stats['in_flight'] == 0
+    assert stats['saved_seconds'] >= 9 * 0.2 * 0.9
+
+    # Finished work is not cached: the next request recomputes
+    flights.do(query_key("What is gravity?"), work, "What is gravity?")
+    assert len(calls) == 2
+
+
+def test_failure_reaches_every_waiter():
+    flights = SingleFlight()
+    errors = []
+
+    def work():
+        time.sleep(0.1)
+        raise RuntimeError("model crashed")
+
+    def request():
+        try:
+            flights.do("key", work)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == ["model crashed"] * 4
+    assert flights.stats()['failures'] == 1
+
+
+def test_async_followers():
+    flights = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(flights.do_async("key", work) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["answer"] * 5
+    assert [shared for _, shared in results].count(True) == 4
+
+
+def test_async_leader_cancelled():
+    flights = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "answer"
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise ValueError("bad input")
+
+    async def main():
+        # The leader's cancellation is not the followers' outcome: the run is handed over
+        leader = asyncio.ensure_future(flights.do_async("key", work))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.ensure_future(flights.do_async("key", work)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        # A follower that gives up doesn't cancel the answer for the others
+        followers[0].cancel()
+        results = await asyncio.gather(*followers[1:])
+        assert leader.cancelled() and followers[0].cancelled()
+        assert results == [("answer", True)] * 2 and len(calls) == 2
+
+        # With nobody waiting the flight is dropped, and the next caller starts afresh
+        lone = asyncio.ensure_future(flights.do_async("other", work))
+        await asyncio.sleep(0.01)
+        lone.cancel()
+        await asyncio.sleep(0)
+        assert flights.stats()['in_flight'] == 0
+        assert await flights.do_async("other", work) == ("answer", False)
+
+        # Ordinary errors still reach every waiter
+        outcomes = await asyncio.gather(*(flights.do_async("bad", failing) for _ in range(3)), return_exceptions=True)
+        assert [str(e) for e in outcomes] == ["bad input"] * 3
+
+    asyncio.run(main())
+    stats = flights.stats()
+    assert stats['handoffs'] == 1 and stats['failures'] == 1 and stats['in_flight'] == 0
+
+
+def test_async_work_that_gives_up_fails_its_followers():
+    flights = SingleFlight()
+    calls = []
+
+    def work_for(token):
+        async def work():
+            calls.append(token)
+            await asyncio.sleep(0.1)
+            token.check()
+            return "answer"
+        return work
+
+    async def main():
+        # The leader's client left and tripped its token; a follower joins before the work notices
+        token = CancelToken()
+        leader = asyncio.ensure_future(flights.do_async("key", work_for(token)))
+        await asyncio.sleep(0.01)
+        token.cancel("client disconnected")
+        follower = asyncio.ensure_future(flights.do_async("key", work_for(CancelToken())))
+        outcomes = await asyncio.wait_for(asyncio.gather(leader, follower, return_exceptions=True), timeout=1)
+        assert [type(e) for e in outcomes] == [RequestCancelled] * 2
+        assert str(outcomes[1]) == "client disconnected"
+
+        # The abandoned work ran once and was not re-run; the follower can start a run of its own
+        assert len(calls) == 1 and flights.stats()['in_flight'] == 0
+        assert await flights.do_async("key", work_for(CancelToken())) == ("answer", False)
+
+    asyncio.run(main())
+    stats = flights.stats()
+    assert stats['handoffs'] == 0 and stats['failures'] == 1
@@ -0,0 +1,78 @@
+import io
+import time
+import wave
+import numpy as np
+from speech import (
+    SAMPLE_RATE, EnergyVAD, StandInRecognizer, StreamingTranscriber, StreamResampler, iter_audio_chunks
+)
+
+
+def synthetic_speech(pattern, sample_rate=SAMPLE_RATE, seed=0):
+    """Tone bursts (speech stand-in) separated by low-level noise (silence)"""
+    rng = np.random.default_rng(seed)
+    parts = []
+    for kind, seconds in pattern:
+        n = int(seconds * sample_rate)
+        noise = rng.normal(0, 0.002, n)
+        if kind == 'speech':
+            t = np.arange(n) / sample_rate
+            parts.append(0.3 * np.sin(2 * np.pi * 220 * t) + noise)
+        else:
+            parts.append(noise)
+    return np.concatenate(parts).astype(np.float32)
+
+
+def wav_bytes(audio, sample_rate, channels=1):
+    pcm = (np.clip(audio, -1, 1) * 32767).astype('<i2')
+    if channels > 1:
+        pcm = np.repeat(pcm[:, None], channels, axis=1).reshape(-1)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.tobytes())
+    buffer.seek(0)
+    return buffer
+
+
+PATTERN = [('silence', 0.5), ('speech', 1.0), ('silence', 1.0), ('speech', 0.8), ('silence', 0.6)]
+
+
+def test_vad_trims_silence():
+    vad = EnergyVAD()
+    audio = synthetic_speech(PATTERN)
+    segments = []
+    for start in range(0, len(audio), 8000):  # Half-second chunks, as they would arrive
+        segments += vad.process(audio[start:start + 8000])
+    segments += vad.flush()
+
+    assert len(segments) == 2, len(segments)
+    speech_seconds = sum(len(s) for s in segments) / SAMPLE_RATE
+    assert 1.8 <= speech_seconds < 2.6, speech_seconds
+
+
+def test_resampler_preserves_duration():
+    resampler = StreamResampler(44100)
+    audio = np.zeros(44100 * 2, dtype=np.float32)
+    output = np.concatenate([resampler.process(audio[i:i + 1000]) for i in range(0, len(audio), 1000)])
+    assert abs(len(output) - 2 * SAMPLE_RATE) <= 2, len(output)
+
+
+def test_streaming_transcription_from_wav():
+    audio = synthetic_speech(PATTERN, sample_rate=44100)
+    recognizer = StandInRecognizer(["What is photosynthesis?", "Explain it simply."], real_time_factor=0.05)
+    transcriber = StreamingTranscriber(recognizer)
+
+    partials = []
+    for chunk in iter_audio_chunks(wav_bytes(audio, 44100, channels=2), chunk_seconds=0.25):
+        partials += transcriber.feed(chunk)
+    transcript = transcriber.finish()
+    metrics = transcriber.metrics(response_ready_at=time.time())
+
+    # Both segments close on trailing silence while audio is still arriving
+    assert partials == ["What is photosynthesis?", "Explain it simply."], partials
+    assert transcript == "What is photosynthesis? Explain it simply.", transcript
+    assert metrics['silence_trimmed_seconds'] > 1.0, metrics
+    assert 0 < metrics['real_time_factor'] < 0.5, metrics
+    assert metrics['end_of_speech_to_first_token_ms'] >= 0, metrics
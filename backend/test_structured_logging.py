@@ -0,0 +1,83 @@
+import io
+import json
+import logging
+import queue
+import time
+from structured_logging import (REQUEST_ID, EventSampler, NonBlockingQueueHandler, RequestIdMiddleware,
+                                get_logger, log_event, parse_sample_rates, setup_logging)
+
+
+def test_events_are_json_lines_with_request_id():
+    stream = io.StringIO()
+    pipeline = setup_logging(level="INFO", fmt="json", stream=stream)
+    logger = get_logger("test")
+    token = REQUEST_ID.set("req-1")
+    try:
+        log_event(logger, "chat.answered", processing_time=1.5, success=True)
+        log_event(logger, "query.analyzing", logging.DEBUG, query="below the level")
+        logger.warning("plain call")
+    finally:
+        REQUEST_ID.reset(token)
+    pipeline.close()
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line['event'] for line in lines] == ["chat.answered", "plain call"]
+    assert lines[0]['request_id'] == lines[1]['request_id'] == "req-1"
+    assert lines[0]['processing_time'] == 1.5 and lines[0]['level'] == "INFO"
+    assert pipeline.stats()['written'] == 2
+
+
+def test_sampling_keeps_whole_requests_and_all_warnings():
+    assert parse_sample_rates("query.processed=0.1, health.check=0,bad") == {'query.processed': 0.1, 'health.check': 0.0}
+    sampler = EventSampler({'query.processed': 0.5})
+    decisions = [sampler.keep("query.processed", logging.INFO, f"req-{i}") for i in range(1000)]
+    assert 350 < sum(decisions) < 650
+    # Same request, same decision
+    assert decisions == [sampler.keep("query.processed", logging.INFO, f"req-{i}") for i in range(1000)]
+    assert all(sampler.keep("query.processed", logging.WARNING, f"req-{i}") for i in range(1000))
+    assert sampler.dropped['query.processed'] == 2 * (1000 - sum(decisions))
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=2))
+    logger = logging.getLogger("test_full_queue")
+    logger.propagate = False
+    logger.addHandler(handler)
+    start_time = time.perf_counter()
+    for i in range(10):
+        logger.warning("event %d", i)
+    assert time.perf_counter() - start_time < 0.5
+    assert handler.queue.qsize() == 2 and handler.dropped == 8
+
+
+def test_writer_wakes_once_per_interval_under_load():
+    stream = io.StringIO()
+    pipeline = setup_logging(level="INFO", fmt="json", stream=stream, flush_interval=0.1)
+    logger = get_logger("test")
+    deadline = time.perf_counter() + 0.35
+    sent = 0
+    while time.perf_counter() < deadline:
+        log_event(logger, "chat.answered", success=True)
+        sent += 1
+        time.sleep(0.0005)
+    pipeline.close()
+    stats = pipeline.stats()
+    assert stats['written'] == sent and stats['writer_wakeups'] <= 6, stats
+
+
+def test_middleware_echoes_request_id():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    app = FastAPI()
+    app.add_middleware(RequestIdMiddleware)
+
+    @app.get("/whoami")
+    def whoami():
+        return {'request_id': REQUEST_ID.get()}
+
+    client = TestClient(app)
+    response = client.get("/whoami", headers={"X-Request-ID": "abc123"})
+    assert response.headers["x-request-id"] == "abc123" == response.json()['request_id']
+    response = client.get("/whoami")
+    assert len(response.headers["x-request-id"]) == 32 == len(response.json()['request_id'])
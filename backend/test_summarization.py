@@ -0,0 +1,100 @@
+import threading
+from summarization import DocumentSummarizer
+
+
+class WordTokenizer:
+    """One token per word"""
+
+    def __init__(self):
+        self.words = []
+        self.ids = {}
+
+    def encode(self, text):
+        ids = []
+        for word in text.split():
+            if word not in self.ids:
+                self.ids[word] = len(self.words)
+                self.words.append(word)
+            ids.append(self.ids[word])
+        return ids
+
+    def __call__(self, texts, add_special_tokens=False):
+        if isinstance(texts, str):
+            return {'input_ids': self.encode(texts)}
+        return {'input_ids': [self.encode(text) for text in texts]}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return ' '.join(self.words[i] for i in ids)
+
+
+class FakeSummarizer:
+    """Keeps the first eight words of each input; counts how many texts it was given"""
+
+    def __init__(self):
+        self.tokenizer = WordTokenizer()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, texts, **kwargs):
+        with self._lock:
+            self.calls += len(texts)
+        return [{'summary_text': ' '.join(text.split()[:8])} for text in texts]
+
+
+def lesson(sentences=120, edit=None):
+    lines = [f"Sentence {i} explains one more idea about the water cycle and clouds." for i in range(sentences)]
+    if edit is not None:
+        lines[edit] = "This sentence was rewritten by the teacher after class today."
+    return ' '.join(lines)
+
+
+def test_split_is_sentence_aligned_and_bounded():
+    summarizer = DocumentSummarizer(FakeSummarizer(), max_chunk_tokens=100, min_chunk_tokens=40, overlap_tokens=12)
+    text = lesson()
+    chunks = summarizer.split(text)
+    assert len(chunks) > 1
+    assert all(len(chunk.split()) <= 100 for chunk in chunks)
+    assert all(chunk.startswith("Sentence") and chunk.endswith(".") for chunk in chunks)
+    # Each chunk after the first repeats the last sentence of the one before
+    assert all(b.startswith(a.rsplit(". ", 1)[-1]) for a, b in zip(chunks, chunks[1:]))
+    assert summarizer.split("") == []
+
+    # A sentence longer than a whole chunk is cut into token windows
+    long_sentence = ' '.join(["word"] * 250) + "."
+    assert [len(c.split()) for c in summarizer.split(long_sentence)] == [100, 100, 50]
+
+
+def test_edit_reuses_cached_chunk_summaries():
+    model = FakeSummarizer()
+    summarizer = DocumentSummarizer(model, max_chunk_tokens=100, min_chunk_tokens=40, overlap_tokens=12)
+    first = summarizer.summarize(lesson())
+    assert first['stats']['cached'] == 0 and first['stats']['levels'] >= 2 and first['summary']
+
+    # Content-defined boundaries: a one-sentence edit only changes the chunks around it
+    calls = model.calls
+    edited = summarizer.summarize(lesson(edit=60))
+    assert edited['stats']['cached'] > edited['stats']['chunks'] // 2
+    assert model.calls - calls == edited['stats']['computed']
+
+    # The same text again is served entirely from the cache
+    calls = model.calls
+    again = summarizer.summarize(lesson(edit=60))
+    assert model.calls == calls and again['summary'] == edited['summary']
+    stats = summarizer.stats()
+    assert stats['cache_hits'] >= again['stats']['cached'] and stats['cache_misses'] == model.calls
+
+    # Cache keys include the length settings, so other settings recompute
+    shorter = DocumentSummarizer(model, max_chunk_tokens=100, min_chunk_tokens=40, summary_max_length=50)
+    shorter._cache = summarizer._cache
+    assert shorter.summarize(lesson())['stats']['cached'] == 0
+
+
+def test_stream_yields_chunks_then_final():
+    summarizer = DocumentSummarizer(FakeSummarizer(), max_chunk_tokens=100, min_chunk_tokens=40)
+    events = list(summarizer.summarize_stream(lesson(60)))
+    assert events[-1]['type'] == 'final' and all(e['type'] == 'chunk' for e in events[:-1])
+    assert {e['index'] for e in events[:-1] if e['level'] == 0} == set(range(events[-1]['stats']['chunks']))
+    assert list(summarizer.summarize_stream("  ")) == [
+        {'type': 'final', 'summary': '', 'stats': {'chunks': 0, 'cached': 0, 'computed': 0, 'levels': 0,
+                                                   'processing_time': 0.0}}
+    ]
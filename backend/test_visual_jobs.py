@@ -0,0 +1,34 @@
+import threading
+import time
+from visual_jobs import VisualJobQueue, VisualQueueFull
+
+
+def test_visual_jobs_are_bounded():
+    release = threading.Event()
+
+    def generate(query, analysis, cancel_token):
+        release.wait(5)
+        return None
+
+    jobs = VisualJobQueue(generate, max_jobs=3, max_queued=2)
+    first = jobs.submit("q0", {})
+    for _ in range(100):
+        if jobs.status(first)['status'] == 'running':
+            break
+        time.sleep(0.01)
+    queued = [jobs.submit(f"q{i}", {}) for i in (1, 2)]
+    assert jobs.full()
+    try:
+        jobs.submit("q3", {})
+        raise AssertionError("accepted a job past max_queued")
+    except VisualQueueFull:
+        pass
+    assert jobs.rejected == 1 and len(jobs._jobs) == 3
+
+    # Once they finish, the oldest finished jobs make room in the table
+    release.set()
+    for i in range(4, 8):
+        while jobs.full():
+            time.sleep(0.01)
+        latest = jobs.submit(f"q{i}", {})
+    assert len(jobs._jobs) <= 3 and jobs.status(first) is None and jobs.status(latest) is not None
@@ -0,0 +1,60 @@
+import numpy as np
+from visual_router import VisualRouter, parse_expression, evaluate_expression
+
+
+def test_expression_parsing():
+    x = np.array([0.0, 1.0, 2.0])
+    assert np.allclose(evaluate_expression(parse_expression("x^2 - 3x + 2"), x), [2, 0, 0])
+    assert np.allclose(evaluate_expression(parse_expression("2sin x"), x), 2 * np.sin(x))
+    assert np.allclose(evaluate_expression(parse_expression("exp(x)"), x), np.exp(x))
+
+    # Only arithmetic on x with whitelisted functions is accepted
+    for unsafe in ("__import__('os').system('ls')", "x.real", "open(x)", "m*x + b", "(lambda: x)()", "[x]"):
+        assert parse_expression(unsafe) is None, unsafe
+
+
+def test_routing():
+    router = VisualRouter()
+    kind, spec = router.route("Plot y = x^2 - 3x from -2 to 5")
+    assert kind == 'function' and spec['x_range'] == (-2.0, 5.0)
+
+    kind, spec = router.route("Show a graph of y = 1/x and y = tan(x)")
+    assert kind == 'function' and [text for text, _ in spec['functions']] == ['1/x', 'tan(x)']
+
+    kind, spec = router.route("Make a pie chart: apples 30, bananas 50, cherries 20")
+    assert kind == 'chart' and spec['chart'] == 'pie' and spec['values'] == [30, 50, 20]
+
+    kind, spec = router.route("Draw a right triangle with legs 3 and 4")
+    assert kind == 'geometry' and spec['sides'] == (3, 4, 5)
+
+    kind, spec = router.route("Draw a rectangle 4 cm by 3 cm")
+    assert (spec['width'], spec['height'], spec['dimensioned']) == (4, 3, True)
+    assert not router.route("Draw a rectangle of width 6")[1]['dimensioned']  # Height made up
+    assert router.route("Draw a triangle with 3 sides", "mathematics")[1]['dimensioned'] is False
+
+    # Counts of things are not dimensions, and several shapes are not one drawing
+    assert router.route("Draw a triangle of forces with 3 forces", "physics") is None
+    assert router.route("Draw 2 squares and a circle", "mathematics") is None
+
+    # Conceptual visuals still go to diffusion
+    assert router.route("Explain the water cycle with a diagram", "geography") is None
+    assert router.route("What is the circle of life?", "biology") is None
+    assert router.route("Draw a triangle with sides 1, 2 and 10") is None
+
+
+def test_render_and_stats():
+    router = VisualRouter(diffusion_estimate_seconds=30)
+    image = router.render("graph of sin x from -pi to pi", {'subject': 'mathematics'})
+    assert image.size == (800, 600) and image.info['visual_route'] == 'function'
+    assert image.info['render_ms'] < 2000
+
+    assert router.render("bar chart of 3, 5, 7") is not None
+    assert router.render("Illustrate photosynthesis in a leaf", {'subject': 'biology'}) is None
+
+    router.record_diffusion(40)
+    stats = router.stats()
+    assert stats['requests'] == 3 and stats['misses'] == 1
+    assert stats['hits'] == {'function': 1, 'chart': 1}
+    assert abs(stats['hit_rate'] - 2 / 3) < 1e-9
+    assert stats['diffusion_estimate_seconds'] == 32
+    assert 60 < stats['latency_saved_seconds'] < 64
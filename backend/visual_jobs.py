@@ -0,0 +1,142 @@
+import contextvars
+import logging
+import threading
+import queue
+import uuid
+import time
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Any, Callable
+from cancellation import CANCELLATION, CancelToken, RequestCancelled
+from structured_logging import get_logger, log_event
+
+logger = get_logger("visual_jobs")
+
+
+class VisualQueueFull(Exception):
+    """Raised by submit when max_queued visuals are already waiting"""
+
+
+class VisualJobQueue:
+    """
+    Background queue for visual generation.
+    Visuals are slow (diffusion), so batch answers are returned first and
+    their visuals are produced here one at a time; clients poll by job id.
+    Cancelled jobs are skipped if still queued and aborted between diffusion
+    steps if running. More than one worker only helps when `generate` hands
+    the work to another process (e.g. remote visual workers). At most
+    max_queued jobs wait at once; beyond that submit raises VisualQueueFull.
+    """
+
+    def __init__(self, generate: Callable[[str, Dict[str, Any], CancelToken], Any], max_jobs: int = 1000,
+                 workers: int = 1, max_queued: int = 100):
+        self.generate = generate
+        self.max_jobs = max_jobs
+        self.max_queued = max_queued
+        self._queue = queue.Queue(maxsize=max_queued)
+        self.rejected = 0
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._tokens: Dict[str, CancelToken] = {}
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._worker_loop, name=f"visual-jobs-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, query: str, analysis: Dict[str, Any], batch_id: Optional[str] = None) -> str:
+        """Queue a visual and return its job id; raises VisualQueueFull if too many are waiting"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'batch_id': batch_id,
+                'query': query,
+                'status': 'queued',
+                'image_url': None,
+                'error': None,
+                'submitted_at': time.time(),
+                'completed_at': None
+            }
+            self._tokens[job_id] = CancelToken()
+            try:
+                # The job runs in the submitting request's context (request id for log events, priority class)
+                self._queue.put_nowait((job_id, query, analysis, contextvars.copy_context()))
+            except queue.Full:
+                del self._jobs[job_id]
+                del self._tokens[job_id]
+                self.rejected += 1
+                raise VisualQueueFull(f"{self.max_queued} visuals already queued")
+            # Forget the oldest finished jobs once the table is full; unfinished ones are
+            # skipped, and there are at most max_queued + workers of those
+            excess = len(self._jobs) - self.max_jobs
+            if excess > 0:
+                finished = [old_id for old_id, old in self._jobs.items() if old['status'] not in ('queued', 'running')]
+                for old_id in finished[:excess]:
+                    del self._jobs[old_id]
+                    self._tokens.pop(old_id, None)
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def full(self) -> bool:
+        return self._queue.full()
+
+    def cancel(self, job_id: str, reason: str = "cancelled") -> bool:
+        """Drop a queued job or abort a running one; False if it already finished"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] not in ('queued', 'running'):
+                return False
+            self._tokens[job_id].cancel(reason)
+            if job['status'] == 'queued':
+                job.update(status='cancelled', error=reason, completed_at=time.time())
+                CANCELLATION.skip("image_pipeline")
+            return True
+
+    def cancel_batch(self, batch_id: str, reason: str = "client disconnected") -> int:
+        """Cancel every unfinished visual of a batch whose client has gone"""
+        with self._lock:
+            job_ids = [job_id for job_id, job in self._jobs.items() if job['batch_id'] == batch_id]
+        return sum(self.cancel(job_id, reason) for job_id in job_ids)
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _worker_loop(self):
+        while True:
+            job_id, query, analysis, context = self._queue.get()
+            context.run(self._run_job, job_id, query, analysis)
+
+    def _run_job(self, job_id: str, query: str, analysis: Dict[str, Any]):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] == 'cancelled':
+                return
+            job['status'] = 'running'
+            token = self._tokens[job_id]
+        try:
+            image = self.generate(query, analysis, token)
+            saved_path = image.info.get('saved_path') if image is not None else None
+            self._update(
+                job_id,
+                status='done' if image is not None else 'failed',
+                image_url=f"/images/{os.path.basename(saved_path)}" if saved_path else None,
+                error=None if image is not None else "No visual generated",
+                completed_at=time.time()
+            )
+        except RequestCancelled as e:
+            log_event(logger, "visual_job.cancelled", job_id=job_id, reason=str(e))
+            self._update(job_id, status='cancelled', error=str(e), completed_at=time.time())
+        except Exception as e:
+            log_event(logger, "visual_job.failed", logging.ERROR, job_id=job_id, error=str(e))
+            self._update(job_id, status='failed', error=str(e), completed_at=time.time())
@@ -0,0 +1,405 @@
+import ast
+import logging
+import math
+import re
+import threading
+import time
+from typing import Dict, Optional, Any, Tuple
+import numpy as np
+from PIL import Image
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib import patches
+from structured_logging import get_logger, log_event
+
+logger = get_logger("visual_router")
+
+# Functions and constants a plotted expression may use
+PLOT_FUNCTIONS = {
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan,
+    'asin': np.arcsin, 'acos': np.arccos, 'atan': np.arctan,
+    'sinh': np.sinh, 'cosh': np.cosh, 'tanh': np.tanh,
+    'exp': np.exp, 'log': np.log, 'ln': np.log, 'log10': np.log10, 'log2': np.log2,
+    'sqrt': np.sqrt, 'abs': np.abs
+}
+PLOT_CONSTANTS = {'pi': np.pi, 'e': np.e}
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Constant, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd
+)
+
+_FUNCTION_NAMES = '|'.join(sorted(PLOT_FUNCTIONS, key=len, reverse=True))
+_EQUATION_RE = re.compile(r"(?:\by|\bf\s*\(\s*x\s*\))\s*=\s*((?:(?!\band\s+(?:y|f\s*\(\s*x\s*\))\s*=)[^=,;?])+)", re.IGNORECASE)
+_PLOT_OF_RE = re.compile(r"\b(?:graph|plot)\s+(?:(?:of|the|function|graph|plot)\s+)*([^=,;?]*\bx\b[^=,;?]*)", re.IGNORECASE)
+_EXPRESSION_STOP_RE = re.compile(r"\s+(?:from|for|between|over|on|where|when|in|with|and then)\s+.*$", re.IGNORECASE)
+_RANGE_RE = re.compile(
+    r"(?:from|between|x\s*(?:in|=)\s*\[?)\s*(-?\d+(?:\.\d+)?|-?pi)\s*(?:to|and|,|\.\.)\s*(-?\d+(?:\.\d+)?|-?pi)",
+    re.IGNORECASE
+)
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+_CHART_RE = re.compile(r"\b(bar|column|pie)\s+(?:chart|graph|diagram)\b", re.IGNORECASE)
+_CHART_PAIR_RE = re.compile(r"([A-Za-z][A-Za-z \-']{0,30}?)\s*(?:[:=]|\bwith\b|\bhas\b|\bis\b|\bof\b)?\s*(-?\d+(?:\.\d+)?)\s*%?")
+_LABEL_NOISE_RE = re.compile(r"^(?:and|of|for|with|showing|show|the|a|an)\s+|\s+(?:and|with|has|is|of)$", re.IGNORECASE)
+
+SHAPES = ('circle', 'square', 'rectangle', 'triangle', 'pentagon', 'hexagon', 'heptagon', 'octagon')
+_POLYGON_SIDES = {'pentagon': 5, 'hexagon': 6, 'heptagon': 7, 'octagon': 8}
+# A number is a dimension only if nothing but a unit or a list word follows it ("3 cm", "3 and 4"),
+# not a count of something ("3 forces", "2 squares")
+_DIMENSION_RE = re.compile(r"(?<![\w.])(\d+(?:\.\d+)?)(?:\s*([a-z]+))?")
+_DIMENSION_FOLLOWERS = {
+    'mm', 'cm', 'm', 'km', 'in', 'inch', 'inches', 'ft', 'feet', 'foot', 'unit', 'units',
+    'metre', 'metres', 'meter', 'meters', 'centimetre', 'centimetres', 'centimeter', 'centimeters',
+    'and', 'by', 'x', 'each', 'long', 'wide', 'high', 'tall'
+}
+
+
+def parse_expression(text: str):
+    """
+    Turn a typed math expression ("x^2 - 3x", "2sin x") into a validated AST.
+    Only arithmetic, x, pi, e and the whitelisted functions are accepted;
+    anything else returns None (the expression is never eval'd unchecked).
+    """
+    expression = text.strip().lower().rstrip('.').replace('^', '**').replace('×', '*').replace('−', '-')
+    expression = expression.replace('²', '**2').replace('³', '**3')
+    if not expression or len(expression) > 120 or 'x' not in re.sub(_FUNCTION_NAMES, '', expression):
+        return None
+
+    # Implicit multiplication and function application without parentheses
+    expression = re.sub(rf"(?<![a-z])({_FUNCTION_NAMES})\s+(x|\d+(?:\.\d+)?)\b", r"\1(\2)", expression)
+    expression = re.sub(r"\b(\d+(?:\.\d+)?)\s*(?=[a-z(])", r"\1*", expression)
+    expression = re.sub(r"\)\s*(?=[a-z0-9(])", ")*", expression)
+    expression = re.sub(r"\bx\s*(?=[a-z0-9(])", "x*", expression)
+    expression = re.sub(r"\b(pi|e)\s*(?=x\b|\()", r"\1*", expression)
+
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError:
+        return None
+
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            return None
+        if isinstance(node, ast.Name) and node.id != 'x' and node.id not in PLOT_FUNCTIONS and node.id not in PLOT_CONSTANTS:
+            return None
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in PLOT_FUNCTIONS or node.keywords or len(node.args) != 1:
+                return None
+        if isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)) or isinstance(node.value, bool):
+                return None
+            node.value = float(node.value)  # Float powers overflow instead of building huge integers
+    return tree
+
+
+def evaluate_expression(tree, x: np.ndarray) -> np.ndarray:
+    """Vectorized evaluation of a validated expression over an x grid"""
+    namespace = {'x': x, **PLOT_FUNCTIONS, **PLOT_CONSTANTS}
+    with np.errstate(all='ignore'):
+        y = eval(compile(tree, '<expression>', 'eval'), {'__builtins__': {}}, namespace)
+    y = np.broadcast_to(np.asarray(y, dtype=np.float64), x.shape).copy()
+    y[~np.isfinite(y)] = np.nan
+    return y
+
+
+def _number(token: str) -> float:
+    token = token.lower()
+    if token.endswith('pi'):
+        return -np.pi if token.startswith('-') else np.pi
+    return float(token)
+
+
+class VisualRouter:
+    """
+    Routes visual requests that have an exact answer (function plots, bar/pie
+    charts of given numbers, simple geometry) to deterministic renderers that
+    draw with NumPy and an off-screen Agg canvas in milliseconds. Everything
+    else returns None and goes to Stable Diffusion as before.
+    """
+
+    def __init__(self, width: int = 800, height: int = 600, dpi: int = 100, samples: int = 1000,
+                 diffusion_estimate_seconds: float = 60.0):
+        self.width = width
+        self.height = height
+        self.dpi = dpi
+        self.samples = samples
+        self._lock = threading.Lock()
+        self._counters = {
+            'requests': 0,
+            'misses': 0,
+            'render_errors': 0,
+            'render_seconds': 0.0,
+            'diffusion_runs': 0
+        }
+        self._hits: Dict[str, int] = {}
+        # Seeded with a typical CPU diffusion time, then tracks measured runs (EWMA)
+        self._diffusion_seconds = diffusion_estimate_seconds
+
+    def route(self, query: str, subject: str = '') -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(kind, spec) for queries a renderer can draw exactly, else None"""
+        for kind, parse in (('chart', self._parse_chart), ('function', self._parse_function)):
+            spec = parse(query)
+            if spec is not None:
+                return kind, spec
+        spec = self._parse_geometry(query, subject)
+        return ('geometry', spec) if spec is not None else None
+
+    def render(self, query: str, analysis: Optional[Dict[str, Any]] = None) -> Optional[Image.Image]:
+        """Render the query if it has a fast path; None means 'use diffusion'"""
+        start_time = time.perf_counter()
+        routed = self.route(query, (analysis or {}).get('subject', ''))
+        image, kind = None, None
+        if routed is not None:
+            kind, spec = routed
+            try:
+                image = getattr(self, f"_render_{kind}")(spec)
+            except Exception as e:
+                log_event(logger, "visual.render_failed", logging.WARNING, route=kind, error=str(e))
+                image = None
+        elapsed = time.perf_counter() - start_time
+
+        with self._lock:
+            self._counters['requests'] += 1
+            if image is not None:
+                self._hits[kind] = self._hits.get(kind, 0) + 1
+                self._counters['render_seconds'] += elapsed
+            elif routed is not None:
+                self._counters['render_errors'] += 1
+                self._counters['misses'] += 1
+            else:
+                self._counters['misses'] += 1
+        if image is not None:
+            image.info['visual_route'] = kind
+            image.info['render_ms'] = elapsed * 1000
+        return image
+
+    def record_diffusion(self, seconds: float):
+        """Feed measured diffusion times into the latency-saved estimate"""
+        with self._lock:
+            self._counters['diffusion_runs'] += 1
+            self._diffusion_seconds += 0.2 * (seconds - self._diffusion_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = sum(self._hits.values())
+            requests = self._counters['requests']
+            mean_render = self._counters['render_seconds'] / hits if hits else 0.0
+            return {
+                **self._counters,
+                'hits': dict(self._hits),
+                'hit_rate': hits / requests if requests else 0.0,
+                'mean_render_ms': mean_render * 1000,
+                'diffusion_estimate_seconds': self._diffusion_seconds,
+                'latency_saved_seconds': max(0.0, hits * self._diffusion_seconds - self._counters['render_seconds'])
+            }
+
+    # Parsers
+
+    def _parse_function(self, query: str) -> Optional[Dict[str, Any]]:
+        candidates = _EQUATION_RE.findall(query) or _PLOT_OF_RE.findall(query)
+        functions = []
+        for candidate in candidates:
+            for part in re.split(r"\s+and\s+(?:y\s*=\s*)?", candidate):
+                text = _EXPRESSION_STOP_RE.sub('', part).strip()
+                tree = parse_expression(text)
+                if tree is not None:
+                    functions.append((text, tree))
+        if not functions:
+            return None
+
+        x_min, x_max = -10.0, 10.0
+        match = _RANGE_RE.search(query)
+        if match:
+            x_min, x_max = sorted((_number(match.group(1)), _number(match.group(2))))
+            if x_min == x_max:
+                x_min, x_max = x_min - 1, x_max + 1
+        return {'functions': functions[:4], 'x_range': (x_min, x_max)}
+
+    def _parse_chart(self, query: str) -> Optional[Dict[str, Any]]:
+        match = _CHART_RE.search(query)
+        if not match:
+            return None
+        tail = query[match.end():]
+        if ':' in tail:
+            tail = tail.split(':', 1)[1]
+
+        labels, values = [], []
+        for label, value in _CHART_PAIR_RE.findall(tail):
+            label = _LABEL_NOISE_RE.sub('', label.strip()).strip()
+            labels.append(label or f"Item {len(labels) + 1}")
+            values.append(float(value))
+        if len(values) < 2:
+            # Bare numbers ("bar chart of 3, 5, 7")
+            values = [float(v) for v in _NUMBER_RE.findall(tail)]
+            labels = [f"Item {i + 1}" for i in range(len(values))]
+        if len(values) < 2 or len(values) > 24:
+            return None
+
+        chart = 'pie' if match.group(1).lower() == 'pie' else 'bar'
+        if chart == 'pie' and (min(values) < 0 or sum(values) <= 0):
+            return None
+        return {'chart': chart, 'labels': labels, 'values': values}
+
+    def _parse_geometry(self, query: str, subject: str = '') -> Optional[Dict[str, Any]]:
+        lowered = query.lower()
+        mentioned = [m for m in (re.search(rf"\b{s}(s?)\b", lowered) for s in SHAPES) if m is not None]
+        # One shape, once: "2 squares and a circle" is not something to draw exactly
+        if len(mentioned) != 1 or mentioned[0].group(1):
+            return None
+        shape = mentioned[0].group(0)
+        numbers = [float(n) for n, follower in _DIMENSION_RE.findall(lowered)
+                   if float(n) > 0 and (not follower or follower in _DIMENSION_FOLLOWERS)]
+        # "the circle of life" is not geometry: need dimensions or a maths question
+        if not numbers and 'math' not in subject.lower() and 'geometry' not in lowered:
+            return None
+        spec = {'shape': shape, 'right': bool(re.search(r"\bright[- ]?(?:angled?\s+)?triangle", lowered))}
+
+        used = 0
+        if shape == 'circle':
+            used = min(len(numbers), 1)
+            radius = numbers[0] if numbers else 1.0
+            if 'diameter' in lowered and numbers:
+                radius = numbers[0] / 2
+            spec['radius'] = radius
+        elif shape == 'square':
+            used = min(len(numbers), 1)
+            spec['side'] = numbers[0] if numbers else 1.0
+        elif shape == 'rectangle':
+            if len(numbers) >= 2:
+                used = 2
+                spec['width'], spec['height'] = numbers[0], numbers[1]
+            else:
+                # One number gives the width; the height is made up
+                spec['width'], spec['height'] = (numbers[0], numbers[0] / 2) if numbers else (2.0, 1.0)
+        elif shape == 'triangle':
+            if spec['right'] and len(numbers) >= 2:
+                used = 2
+                a, b = numbers[:2]
+                spec['sides'] = (a, b, math.hypot(a, b))
+            elif len(numbers) >= 3:
+                used = 3
+                a, b, c = sorted(numbers[:3])
+                if a + b <= c:
+                    return None
+                spec['sides'] = (a, b, c)
+            elif len(numbers) == 1 and not spec['right']:
+                used = 1
+                spec['sides'] = (numbers[0],) * 3
+            elif numbers:
+                # Some lengths given but not enough to fix the triangle
+                return None
+            else:
+                spec['sides'] = (1.0, 1.0, 1.0)
+        else:
+            used = min(len(numbers), 1)
+            spec['sides_count'] = _POLYGON_SIDES[shape]
+            spec['side'] = numbers[0] if numbers else 1.0
+        spec['dimensioned'] = used > 0
+        return spec
+
+    # Renderers
+
+    def _figure(self):
+        figure = Figure(figsize=(self.width / self.dpi, self.height / self.dpi), dpi=self.dpi)
+        FigureCanvasAgg(figure)
+        return figure
+
+    def _to_image(self, figure) -> Image.Image:
+        figure.tight_layout()
+        figure.canvas.draw()
+        rgba = np.asarray(figure.canvas.buffer_rgba())
+        return Image.fromarray(rgba[..., :3].copy())
+
+    def _render_function(self, spec: Dict[str, Any]) -> Image.Image:
+        x_min, x_max = spec['x_range']
+        x = np.linspace(x_min, x_max, self.samples)
+        figure = self._figure()
+        ax = figure.add_subplot(1, 1, 1)
+
+        visible = []
+        for text, tree in spec['functions']:
+            y = evaluate_expression(tree, x)
+            # Break the line at poles (tan, 1/x) instead of drawing a vertical spike
+            jumps = np.abs(np.diff(y)) > 50 * (np.nanstd(y) + 1e-9) if np.isfinite(y).sum() > 2 else np.zeros(len(y) - 1, bool)
+            y[1:][jumps] = np.nan
+            ax.plot(x, y, linewidth=2, label=f"y = {text}")
+            visible.append(y[np.isfinite(y)])
+
+        values = np.concatenate(visible) if visible else np.array([])
+        if values.size:
+            low, high = np.percentile(values, [2, 98])
+            pad = (high - low) * 0.1 or 1.0
+            ax.set_ylim(low - pad, high + pad)
+        ax.axhline(0, color='black', linewidth=0.8)
+        if x_min < 0 < x_max:
+            ax.axvline(0, color='black', linewidth=0.8)
+        ax.grid(True, alpha=0.3)
+        ax.set_xlabel('x')
+        ax.set_ylabel('y')
+        ax.legend(loc='best')
+        ax.set_title(', '.join(f"y = {text}" for text, _ in spec['functions']))
+        return self._to_image(figure)
+
+    def _render_chart(self, spec: Dict[str, Any]) -> Image.Image:
+        figure = self._figure()
+        ax = figure.add_subplot(1, 1, 1)
+        labels, values = spec['labels'], spec['values']
+        if spec['chart'] == 'pie':
+            ax.pie(values, labels=labels, autopct='%1.1f%%', startangle=90)
+            ax.axis('equal')
+        else:
+            bars = ax.bar(labels, values, color='steelblue')
+            ax.bar_label(bars, labels=[f"{v:g}" for v in values])
+            ax.grid(True, axis='y', alpha=0.3)
+            if len(labels) > 6:
+                ax.tick_params(axis='x', labelrotation=45)
+        ax.set_title(f"{spec['chart'].title()} chart")
+        return self._to_image(figure)
+
+    def _render_geometry(self, spec: Dict[str, Any]) -> Image.Image:
+        figure = self._figure()
+        ax = figure.add_subplot(1, 1, 1)
+        style = dict(fill=False, linewidth=2, edgecolor='navy')
+        shape = spec['shape']
+        unit = '' if spec['dimensioned'] else ' (units)'
+
+        if shape == 'circle':
+            r = spec['radius']
+            ax.add_patch(patches.Circle((0, 0), r, **style))
+            ax.plot([0, r], [0, 0], color='crimson')
+            ax.text(r / 2, r * 0.05, f"r = {r:g}", ha='center', va='bottom')
+            title = f"Circle: r = {r:g}, area = {math.pi * r * r:.2f}, circumference = {2 * math.pi * r:.2f}"
+        elif shape in ('square', 'rectangle'):
+            w, h = (spec['side'], spec['side']) if shape == 'square' else (spec['width'], spec['height'])
+            ax.add_patch(patches.Rectangle((0, 0), w, h, **style))
+            ax.text(w / 2, -0.05 * max(w, h), f"{w:g}", ha='center', va='top')
+            ax.text(-0.05 * max(w, h), h / 2, f"{h:g}", ha='right', va='center')
+            title = f"{shape.title()}: {w:g} × {h:g}, area = {w * h:g}, perimeter = {2 * (w + h):g}"
+        elif shape == 'triangle':
+            a, b, c = spec['sides']
+            # Place side c on the x axis; the apex comes from the law of cosines
+            apex_x = (b * b + c * c - a * a) / (2 * c)
+            apex_y = math.sqrt(max(b * b - apex_x * apex_x, 0.0))
+            points = np.array([[0, 0], [c, 0], [apex_x, apex_y]])
+            ax.add_patch(patches.Polygon(points, closed=True, **style))
+            for (p, q), length in zip([(points[1], points[2]), (points[2], points[0]), (points[0], points[1])], (a, b, c)):
+                mid = (p + q) / 2
+                ax.text(mid[0], mid[1], f" {length:g}", ha='center', va='bottom', color='crimson')
+            s = (a + b + c) / 2
+            area = math.sqrt(max(s * (s - a) * (s - b) * (s - c), 0.0))
+            kind = "Right triangle" if spec['right'] else "Triangle"
+            title = f"{kind}: sides {a:g}, {b:g}, {c:.3g}, area = {area:.2f}"
+        else:
+            n, side = spec['sides_count'], spec['side']
+            radius = side / (2 * math.sin(math.pi / n))
+            angles = np.pi / 2 + 2 * np.pi * np.arange(n) / n
+            points = np.column_stack([radius * np.cos(angles), radius * np.sin(angles)])
+            ax.add_patch(patches.Polygon(points, closed=True, **style))
+            area = n * side * side / (4 * math.tan(math.pi / n))
+            title = f"Regular {shape}: side = {side:g}, area = {area:.2f}, interior angle = {180 * (n - 2) / n:g}°"
+
+        ax.set_aspect('equal')
+        ax.autoscale_view()
+        ax.margins(0.2)
+        ax.axis('off')
+        ax.set_title(title + unit)
+        return self._to_image(figure)
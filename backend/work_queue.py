@@ -0,0 +1,592 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple, Any, Iterator
+from cancellation import CancelToken, RequestCancelled
+from load_governor import FULL
+from replicas import RemoteAssistant
+from structured_logging import REQUEST_ID
+
+# Visuals (diffusion) and everything else scale on separate worker pools
+TEXT_QUEUE = "text"
+VISUAL_QUEUE = "visual"
+QUEUES = (TEXT_QUEUE, VISUAL_QUEUE)
+
+
+def queue_for(method: str) -> str:
+    return VISUAL_QUEUE if method == 'generate_educational_visual' else TEXT_QUEUE
+
+
+def open_broker(url: str, **kwargs):
+    """redis://host:6379/0 (or rediss://) for multi-node, sqlite:///path/queue.db (or a bare path) on one host"""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url, **kwargs)
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return SQLiteBroker(url, **kwargs)
+
+
+class SQLiteBroker:
+    """
+    Work queue in a SQLite file (WAL mode) for API and worker processes on
+    one host. Delivery is at-least-once: a claimed job carries a lease that
+    the worker's heartbeat renews; a job whose lease runs out (worker died or
+    hung) goes back to the front of its queue, and after `max_attempts`
+    deliveries it fails with an error result instead. Results are an
+    append-only stream per job, so partial results reach the API as they
+    are produced. Payloads are opaque bytes (pickles from trusted nodes).
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3, result_ttl: float = 3600, poll_seconds: float = 0.05):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self.poll_seconds = poll_seconds
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        self._counters = {'redelivered': 0, 'dead_lettered': 0}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                queue TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_until REAL,
+                enqueued_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_queue_lease ON jobs(queue, lease_until, enqueued_at);
+            CREATE TABLE IF NOT EXISTS results (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                payload BLOB,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            );
+            CREATE TABLE IF NOT EXISTS cancels (
+                job_id TEXT PRIMARY KEY,
+                reason TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS workers (
+                id TEXT PRIMARY KEY,
+                info BLOB,
+                stats BLOB,
+                heartbeat_at REAL NOT NULL
+            );
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; autocommit, with explicit transactions where it matters"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def describe(self) -> str:
+        return f"sqlite:///{self.path}"
+
+    def enqueue(self, queue: str, job_id: str, payload: bytes):
+        self._conn().execute(
+            "INSERT INTO jobs (id, queue, payload, enqueued_at) VALUES (?, ?, ?, ?)",
+            (job_id, queue, payload, time.time())
+        )
+
+    def _reap(self, conn: sqlite3.Connection, now: float):
+        """Expired leases go back to the front of their queue; too many attempts fail the job"""
+        dead = [row[0] for row in conn.execute(
+            "SELECT id FROM jobs WHERE lease_until < ? AND attempts >= ?", (now, self.max_attempts)
+        )]
+        for job_id in dead:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._append(conn, job_id, 'error', pickle.dumps(f"gave up after {self.max_attempts} attempts"))
+        conn.execute("UPDATE jobs SET lease_until = NULL, worker = NULL, enqueued_at = 0 WHERE lease_until < ?", (now,))
+        self._counters['dead_lettered'] += len(dead)
+
+    def claim(self, queues: List[str], worker_id: str, lease_seconds: float) -> Optional[Tuple[str, str, bytes, int]]:
+        """Lease the oldest queued job from the first non-empty queue: (job_id, queue, payload, attempt)"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._reap(conn, now)
+            for queue in queues:
+                row = conn.execute(
+                    "SELECT id, payload, attempts FROM jobs WHERE queue = ? AND lease_until IS NULL "
+                    "ORDER BY enqueued_at LIMIT 1", (queue,)
+                ).fetchone()
+                if row is None:
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET lease_until = ?, worker = ?, attempts = attempts + 1 WHERE id = ?",
+                    (now + lease_seconds, worker_id, row[0])
+                )
+                conn.execute("COMMIT")
+                if row[2] > 0:
+                    self._counters['redelivered'] += 1
+                return row[0], queue, row[1], row[2] + 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._sweep(now)
+        return None
+
+    def extend(self, job_ids: List[str], worker_id: str, lease_seconds: float):
+        until = time.time() + lease_seconds
+        self._conn().executemany(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ?",
+            [(until, job_id, worker_id) for job_id in job_ids]
+        )
+
+    def ack(self, job_id: str):
+        self._conn().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _append(self, conn: sqlite3.Connection, job_id: str, kind: str, payload: bytes):
+        conn.execute(
+            "INSERT INTO results (job_id, seq, kind, payload, created_at) "
+            "SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ?, ? FROM results WHERE job_id = ?",
+            (job_id, kind, payload, time.time(), job_id)
+        )
+
+    def publish(self, job_id: str, kind: str, payload: bytes):
+        """Append to the job's result stream: 'chunk' entries, then one of 'ok', 'error' or 'cancelled'"""
+        self._append(self._conn(), job_id, kind, payload)
+
+    def read(self, job_id: str, cursor: Optional[int] = None,
+             timeout: float = 0) -> Tuple[List[Tuple[str, bytes]], Optional[int]]:
+        """Result entries after `cursor`, waiting up to `timeout` seconds for the first one"""
+        conn = self._conn()
+        deadline = time.time() + timeout
+        while True:
+            rows = conn.execute(
+                "SELECT seq, kind, payload FROM results WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, cursor or 0)
+            ).fetchall()
+            if rows:
+                return [(kind, payload) for _, kind, payload in rows], rows[-1][0]
+            if time.time() >= deadline:
+                return [], cursor
+            time.sleep(self.poll_seconds)
+
+    def forget(self, job_id: str):
+        """Drop a finished job's results once the API has read them"""
+        conn = self._conn()
+        conn.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+        conn.execute("DELETE FROM cancels WHERE job_id = ?", (job_id,))
+
+    def cancel(self, job_id: str, reason: str):
+        self._conn().execute(
+            "INSERT OR IGNORE INTO cancels (job_id, reason, created_at) VALUES (?, ?, ?)",
+            (job_id, reason, time.time())
+        )
+
+    def cancel_reasons(self, job_ids: List[str]) -> Dict[str, str]:
+        if not job_ids:
+            return {}
+        rows = self._conn().execute(
+            f"SELECT job_id, reason FROM cancels WHERE job_id IN ({','.join('?' * len(job_ids))})", job_ids
+        )
+        return dict(rows.fetchall())
+
+    def register(self, worker_id: str, info: bytes):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO workers (id, info, stats, heartbeat_at) VALUES (?, ?, NULL, ?)",
+            (worker_id, info, time.time())
+        )
+
+    def heartbeat(self, worker_id: str, stats: bytes):
+        self._conn().execute(
+            "UPDATE workers SET stats = ?, heartbeat_at = ? WHERE id = ?", (stats, time.time(), worker_id)
+        )
+
+    def unregister(self, worker_id: str):
+        self._conn().execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+    def workers(self, max_age: float) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT id, heartbeat_at, stats FROM workers WHERE heartbeat_at >= ? ORDER BY id", (time.time() - max_age,)
+        )
+        return [{'worker_id': row[0], 'last_seen': row[1], 'stats': row[2]} for row in rows]
+
+    def worker_info(self, worker_id: str) -> Optional[bytes]:
+        row = self._conn().execute("SELECT info FROM workers WHERE id = ?", (worker_id,)).fetchone()
+        return row[0] if row else None
+
+    def depths(self) -> Dict[str, Dict[str, int]]:
+        depths = {queue: {'queued': 0, 'leased': 0} for queue in QUEUES}
+        for queue, leased, count in self._conn().execute(
+            "SELECT queue, lease_until IS NOT NULL, COUNT(*) FROM jobs GROUP BY queue, lease_until IS NOT NULL"
+        ):
+            depths.setdefault(queue, {'queued': 0, 'leased': 0})['leased' if leased else 'queued'] = count
+        return depths
+
+    def counters(self) -> Dict[str, int]:
+        """Redeliveries and dead letters seen by this process's claims (workers report theirs)"""
+        return dict(self._counters)
+
+    def _sweep(self, now: float):
+        """Results nobody collected, old cancel flags and long-gone workers (at most once a minute)"""
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        conn = self._conn()
+        conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.result_ttl,))
+        conn.execute("DELETE FROM cancels WHERE created_at < ?", (now - self.result_ttl,))
+        conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - self.result_ttl,))
+
+
+# Atomic claim: pop from the queue's tail into its leased list, lease it, count the attempt
+_CLAIM_SCRIPT = """
+local job_id = redis.call('RPOPLPUSH', KEYS[1], KEYS[2])
+if not job_id then return nil end
+redis.call('ZADD', KEYS[3], ARGV[1], job_id)
+local job = ARGV[2] .. job_id
+redis.call('HSET', job, 'worker', ARGV[3])
+local attempts = redis.call('HINCRBY', job, 'attempts', 1)
+return {job_id, redis.call('HGET', job, 'payload'), attempts}
+"""
+
+# Expired leases back to the queue's tail (next to be claimed); returns jobs out of attempts
+_REAP_SCRIPT = """
+local dead = {}
+for _, job_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])) do
+    redis.call('ZREM', KEYS[1], job_id)
+    local job = ARGV[2] .. job_id
+    local queue = redis.call('HGET', job, 'queue')
+    if queue then
+        redis.call('LREM', ARGV[3] .. queue, 1, job_id)
+        if tonumber(redis.call('HGET', job, 'attempts')) >= tonumber(ARGV[5]) then
+            redis.call('DEL', job)
+            table.insert(dead, job_id)
+        else
+            redis.call('RPUSH', ARGV[4] .. queue, job_id)
+        end
+    end
+end
+return dead
+"""
+
+
+class RedisBroker:
+    """
+    The same work queue on a Redis server, for API and worker nodes on
+    different hosts. Queues are lists (a claimed job moves to a per-queue
+    leased list and a lease sorted set, atomically), results are streams
+    read with XREAD BLOCK, and cancel flags are expiring keys.
+    """
+
+    def __init__(self, url: str, max_attempts: int = 3, result_ttl: float = 3600,
+                 prefix: str = "classroom:wq:", client=None, **kwargs):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("RedisBroker needs the redis package (pip install redis)")
+            client = redis.Redis.from_url(url)
+        self.url = url
+        self.max_attempts = max_attempts
+        self.result_ttl = int(result_ttl)
+        self.prefix = prefix
+        self.client = client  # Any redis-py compatible client (e.g. fakeredis in tests)
+        self._claim = self.client.register_script(_CLAIM_SCRIPT)
+        self._reap_expired = self.client.register_script(_REAP_SCRIPT)
+        self._counters = {'redelivered': 0, 'dead_lettered': 0}
+
+    def _key(self, *parts: str) -> str:
+        return self.prefix + ":".join(parts)
+
+    def describe(self) -> str:
+        return self.url.split("@")[-1]  # No credentials in /debug output
+
+    def enqueue(self, queue: str, job_id: str, payload: bytes):
+        pipe = self.client.pipeline()
+        pipe.hset(self._key("job", job_id), mapping={'queue': queue, 'payload': payload, 'attempts': 0})
+        pipe.lpush(self._key("queue", queue), job_id)
+        pipe.execute()
+
+    def _reap(self):
+        dead = self._reap_expired(
+            keys=[self._key("leases")],
+            args=[time.time(), self._key("job", ""), self._key("leased", ""), self._key("queue", ""), self.max_attempts]
+        )
+        for job_id in dead:
+            self.publish(job_id.decode(), 'error', pickle.dumps(f"gave up after {self.max_attempts} attempts"))
+        self._counters['dead_lettered'] += len(dead)
+
+    def claim(self, queues: List[str], worker_id: str, lease_seconds: float) -> Optional[Tuple[str, str, bytes, int]]:
+        self._reap()
+        for queue in queues:
+            claimed = self._claim(
+                keys=[self._key("queue", queue), self._key("leased", queue), self._key("leases")],
+                args=[time.time() + lease_seconds, self._key("job", ""), worker_id]
+            )
+            if claimed:
+                job_id, payload, attempts = claimed
+                if attempts > 1:
+                    self._counters['redelivered'] += 1
+                return job_id.decode(), queue, payload, int(attempts)
+        return None
+
+    def extend(self, job_ids: List[str], worker_id: str, lease_seconds: float):
+        if job_ids:
+            self.client.zadd(self._key("leases"), {job_id: time.time() + lease_seconds for job_id in job_ids}, xx=True)
+
+    def ack(self, job_id: str):
+        queue = self.client.hget(self._key("job", job_id), 'queue')
+        pipe = self.client.pipeline()
+        pipe.zrem(self._key("leases"), job_id)
+        if queue is not None:
+            pipe.lrem(self._key("leased", queue.decode()), 1, job_id)
+        pipe.delete(self._key("job", job_id))
+        pipe.execute()
+
+    def publish(self, job_id: str, kind: str, payload: bytes):
+        key = self._key("results", job_id)
+        pipe = self.client.pipeline()
+        pipe.xadd(key, {'kind': kind, 'payload': payload})
+        pipe.expire(key, self.result_ttl)
+        pipe.execute()
+
+    def read(self, job_id: str, cursor: Optional[str] = None,
+             timeout: float = 0) -> Tuple[List[Tuple[str, bytes]], Optional[str]]:
+        block = int(timeout * 1000) or None
+        streams = self.client.xread({self._key("results", job_id): cursor or "0"}, block=block)
+        if not streams:
+            return [], cursor
+        entries = streams[0][1]
+        return [(fields[b'kind'].decode(), fields[b'payload']) for _, fields in entries], entries[-1][0]
+
+    def forget(self, job_id: str):
+        self.client.delete(self._key("results", job_id), self._key("cancel", job_id))
+
+    def cancel(self, job_id: str, reason: str):
+        self.client.set(self._key("cancel", job_id), reason, ex=self.result_ttl, nx=True)
+
+    def cancel_reasons(self, job_ids: List[str]) -> Dict[str, str]:
+        if not job_ids:
+            return {}
+        reasons = self.client.mget([self._key("cancel", job_id) for job_id in job_ids])
+        return {job_id: reason.decode() for job_id, reason in zip(job_ids, reasons) if reason is not None}
+
+    def register(self, worker_id: str, info: bytes):
+        pipe = self.client.pipeline()
+        pipe.hset(self._key("workers", "info"), worker_id, info)
+        pipe.hset(self._key("workers", "heartbeat"), worker_id, pickle.dumps((time.time(), None)))
+        pipe.execute()
+
+    def heartbeat(self, worker_id: str, stats: bytes):
+        self.client.hset(self._key("workers", "heartbeat"), worker_id, pickle.dumps((time.time(), stats)))
+
+    def unregister(self, worker_id: str):
+        pipe = self.client.pipeline()
+        pipe.hdel(self._key("workers", "info"), worker_id)
+        pipe.hdel(self._key("workers", "heartbeat"), worker_id)
+        pipe.execute()
+
+    def workers(self, max_age: float) -> List[Dict[str, Any]]:
+        now = time.time()
+        workers, gone = [], []
+        for worker_id, beat in sorted(self.client.hgetall(self._key("workers", "heartbeat")).items()):
+            last_seen, stats = pickle.loads(beat)
+            if now - last_seen <= max_age:
+                workers.append({'worker_id': worker_id.decode(), 'last_seen': last_seen, 'stats': stats})
+            elif now - last_seen > self.result_ttl:
+                gone.append(worker_id)
+        if gone:
+            self.client.hdel(self._key("workers", "heartbeat"), *gone)
+            self.client.hdel(self._key("workers", "info"), *gone)
+        return workers
+
+    def worker_info(self, worker_id: str) -> Optional[bytes]:
+        return self.client.hget(self._key("workers", "info"), worker_id)
+
+    def depths(self) -> Dict[str, Dict[str, int]]:
+        pipe = self.client.pipeline()
+        for queue in QUEUES:
+            pipe.llen(self._key("queue", queue))
+            pipe.llen(self._key("leased", queue))
+        counts = pipe.execute()
+        return {queue: {'queued': counts[2 * i], 'leased': counts[2 * i + 1]} for i, queue in enumerate(QUEUES)}
+
+    def counters(self) -> Dict[str, int]:
+        return dict(self._counters)
+
+
+class QueueClient(RemoteAssistant):
+    """
+    Stand-in for AdvancedClassroomAI on a stateless API node (DEPLOY_MODE=api):
+    every model call becomes a job on the broker, run by whichever worker
+    (worker.py) serves its queue. Visuals are always deferred to the visual
+    queue, so text and visual capacity are scaled by adding workers of
+    either kind. Cancelling a request flags its job; a worker drops it if
+    still queued and stops it between steps if running.
+    """
+
+    always_defer_visuals = True
+
+    def __init__(self, broker, conversation_store=None, start_timeout: float = 1800,
+                 result_timeout: float = 600, worker_timeout: float = 30):
+        super().__init__(conversation_store)
+        self.broker = broker
+        self.result_timeout = result_timeout
+        self.worker_timeout = worker_timeout
+        self.images_dir = os.path.join(tempfile.gettempdir(), "generated_images")
+        self._lock = threading.Lock()
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'timed_out': 0}
+
+        # The API mirrors the model settings (generation params, tokenizer) of the first worker up
+        deadline = time.time() + start_timeout
+        print(f"⏳ Waiting for inference workers on {broker.describe()}...")
+        while True:
+            workers = broker.workers(worker_timeout)
+            info = broker.worker_info(workers[0]['worker_id']) if workers else None
+            if info is not None:
+                break
+            if time.time() >= deadline:
+                raise RuntimeError(f"No inference worker registered after {start_timeout:.0f}s")
+            time.sleep(1)
+        self._adopt(pickle.loads(info))
+        self.model_memory = {}  # Held by the workers; see /debug/queue
+        self.models_ready = True
+        print(f"✅ Inference workers available: {[worker['worker_id'] for worker in workers]}")
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def submit(self, method: str, *args) -> str:
+        job_id = uuid.uuid4().hex
+        self.broker.enqueue(queue_for(method), job_id, pickle.dumps((method, args, REQUEST_ID.get())))
+        self._count('submitted')
+        return job_id
+
+    def _results(self, job_ids: List[str], cancel_token: Optional[CancelToken] = None,
+                 poll_seconds: float = 0.2) -> Iterator[Tuple[str, str, Any]]:
+        """(job_id, kind, value) from the jobs' result streams as they arrive, until each one finishes"""
+        cursors: Dict[str, Any] = {job_id: None for job_id in job_ids}
+        heard_at = time.time()
+        try:
+            while cursors:
+                if cancel_token is not None and cancel_token.cancelled:
+                    for job_id in cursors:
+                        self.broker.cancel(job_id, cancel_token.reason)
+                    self._count('cancelled')
+                    raise RequestCancelled(cancel_token.reason)
+                if time.time() - heard_at > self.result_timeout:
+                    for job_id in cursors:
+                        self.broker.cancel(job_id, "timeout")
+                    self._count('timed_out')
+                    raise RuntimeError(f"No result after {self.result_timeout:.0f}s; are workers running?")
+                # One job: wait on its stream; several: poll each in turn
+                wait = poll_seconds if len(cursors) == 1 else 0
+                for job_id in list(cursors):
+                    entries, cursors[job_id] = self.broker.read(job_id, cursors[job_id], wait)
+                    for kind, payload in entries:
+                        heard_at = time.time()
+                        value = pickle.loads(payload)
+                        if kind == 'chunk':
+                            yield job_id, kind, value
+                            continue
+                        del cursors[job_id]
+                        self.broker.forget(job_id)
+                        if kind == 'ok':
+                            self._count('completed')
+                            yield job_id, kind, value
+                        elif kind == 'cancelled':
+                            self._count('cancelled')
+                            raise RequestCancelled(value)
+                        else:
+                            self._count('failed')
+                            raise RuntimeError(f"Worker: {value}")
+                        break
+                if len(cursors) > 1:
+                    time.sleep(poll_seconds)
+        finally:
+            # Stop the rest of the work when the caller gives up (error, cancel, closed stream)
+            for job_id in cursors:
+                self.broker.cancel(job_id, "abandoned")
+
+    def call(self, method: str, *args, cancel_token: Optional[CancelToken] = None):
+        job_id = self.submit(method, *args)
+        for _, kind, value in self._results([job_id], cancel_token):
+            if kind == 'ok':
+                return value
+
+    def _localize(self, image):
+        """Visuals are saved on the worker's disk; keep a copy where this node serves /images"""
+        saved_path = image.info.get('saved_path') if image is not None else None
+        if saved_path:
+            os.makedirs(self.images_dir, exist_ok=True)
+            path = os.path.join(self.images_dir, os.path.basename(saved_path))
+            image.save(path)
+            image.info['saved_path'] = path
+        return image
+
+    def process_educational_query(self, *args, **kwargs) -> Dict[str, Any]:
+        result = super().process_educational_query(*args, **kwargs)
+        self._localize(result.get('visual_image'))
+        return result
+
+    def generate_educational_visual(self, query: str, analysis: Dict[str, Any],
+                                    cancel_token: Optional[CancelToken] = None):
+        return self._localize(super().generate_educational_visual(query, analysis, cancel_token))
+
+    def generate_educational_responses(self, queries: List[str], analyses: List[Dict[str, Any]],
+                                       batch_size: int = 8, degradation: int = FULL):
+        """One job per batch, so several text workers share a large request; answers stream as produced"""
+        offsets = {
+            self.submit('generate_educational_responses', queries[start:start + batch_size],
+                        analyses[start:start + batch_size], batch_size, degradation): start
+            for start in range(0, len(queries), batch_size)
+        }
+        # A redelivered batch may repeat answers already streamed
+        seen = set()
+        for job_id, kind, value in self._results(list(offsets)):
+            if kind != 'chunk':
+                continue
+            i, response = value
+            if offsets[job_id] + i not in seen:
+                seen.add(offsets[job_id] + i)
+                yield offsets[job_id] + i, response
+
+    def replica_stats(self) -> List[Dict[str, Any]]:
+        """Model-side stats each live worker sent with its last heartbeat"""
+        return [
+            pickle.loads(worker['stats']) if worker['stats'] else {}
+            for worker in self.broker.workers(self.worker_timeout)
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        workers, delivery = [], {'redelivered': 0, 'dead_lettered': 0}
+        for worker in self.broker.workers(self.worker_timeout):
+            stats = pickle.loads(worker['stats']) if worker['stats'] else {}
+            workers.append({
+                'worker_id': worker['worker_id'],
+                'seconds_since_heartbeat': now - worker['last_seen'],
+                **{key: stats.get(key) for key in ('queues', 'served', 'failed', 'cancelled', 'current_jobs', 'rss_bytes')}
+            })
+            for key in delivery:
+                delivery[key] += stats.get('delivery', {}).get(key, 0)
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            'broker': self.broker.describe(),
+            'queues': self.broker.depths(),
+            'workers': workers,
+            'requests': counters,
+            'delivery': delivery
+        }
+
+    def close(self):
+        pass
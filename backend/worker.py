@@ -0,0 +1,187 @@
+import argparse
+import logging
+import os
+import pickle
+import signal
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Any
+from cancellation import CANCELLATION, CancelToken, RequestCancelled
+from load_governor import FULL
+from replicas import HANDLERS, available_cores, backend_info, backend_stats, load_backend
+from work_queue import QUEUES, open_broker
+from structured_logging import REQUEST_ID, setup_logging, parse_sample_rates, get_logger, log_event
+
+logger = get_logger("worker")
+
+# Methods whose results are published piece by piece as the model produces them
+STREAMING_HANDLERS = {
+    'generate_educational_responses': lambda ai, token, queries, analyses, batch_size, degradation=FULL:
+        ai.generate_educational_responses(queries, analyses, batch_size=batch_size, degradation=degradation)
+}
+
+
+class InferenceWorker:
+    """
+    Inference node for split deployments (DEPLOY_MODE=api on the API nodes).
+    Claims jobs from its queues one at a time, runs them on the local models
+    and publishes the results to the broker. A heartbeat thread renews the
+    leases of the running job, so a crashed worker's job is redelivered to
+    another one, reports stats, and trips the cancel token of a job the API
+    has cancelled.
+    """
+
+    def __init__(self, broker, ai, queues: List[str], worker_id: Optional[str] = None,
+                 lease_seconds: float = 30, heartbeat_seconds: float = 5, poll_seconds: float = 0.2):
+        self.broker = broker
+        self.ai = ai
+        self.queues = queues
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._current: Dict[str, CancelToken] = {}
+        self._lock = threading.Lock()
+        self._counters = {'served': 0, 'failed': 0, 'cancelled': 0, 'busy_seconds': 0.0}
+
+    def _stats(self) -> Dict[str, Any]:
+        with self._lock:
+            current = list(self._current)
+            counters = dict(self._counters)
+        return {
+            **backend_stats(self.ai),
+            **counters,
+            'queues': self.queues,
+            'current_jobs': current,
+            'delivery': self.broker.counters()
+        }
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                log_event(logger, "worker.heartbeat_failed", logging.WARNING, error=str(e))
+
+    def heartbeat(self):
+        """Renew leases, publish stats, pick up cancellations of running jobs"""
+        with self._lock:
+            current = dict(self._current)
+        self.broker.extend(list(current), self.worker_id, self.lease_seconds)
+        self.broker.heartbeat(self.worker_id, pickle.dumps(self._stats()))
+        for job_id, reason in self.broker.cancel_reasons(list(current)).items():
+            current[job_id].cancel(reason)
+
+    def _run(self, job_id: str, method: str, args: tuple, token: CancelToken):
+        if method in STREAMING_HANDLERS:
+            for item in STREAMING_HANDLERS[method](self.ai, token, *args):
+                token.check()
+                self.broker.publish(job_id, 'chunk', pickle.dumps(item))
+            return None
+        return HANDLERS[method](self.ai, token, *args)
+
+    def process(self, job_id: str, payload: bytes, attempt: int):
+        method, args, request_id = pickle.loads(payload)
+        REQUEST_ID.set(request_id)  # Correlates the worker's log events with the API request
+        token = CancelToken()
+        reason = self.broker.cancel_reasons([job_id]).get(job_id)
+        if reason is not None:
+            token.cancel(reason)
+        with self._lock:
+            self._current[job_id] = token
+
+        start_time = time.perf_counter()
+        try:
+            if token.cancelled:
+                # Abandoned while it waited in the queue
+                CANCELLATION.skip(method)
+                raise RequestCancelled(token.reason)
+            cpu_start = time.thread_time()
+            result = self._run(job_id, method, args, token)
+            CANCELLATION.observe(method, time.perf_counter() - start_time, time.thread_time() - cpu_start)
+            kind, data = 'ok', pickle.dumps(result)
+        except RequestCancelled as e:
+            kind, data = 'cancelled', pickle.dumps(str(e))
+        except Exception as e:
+            log_event(logger, "job.failed", logging.ERROR, job_id=job_id, method=method, attempt=attempt,
+                      error=str(e), exc_info=True)
+            kind, data = 'error', pickle.dumps(f"{type(e).__name__}: {e}")
+
+        # Publish before ack: a crash in between redelivers the job rather than losing it
+        self.broker.publish(job_id, kind, data)
+        self.broker.ack(job_id)
+        with self._lock:
+            del self._current[job_id]
+            self._counters['served'] += 1
+            self._counters['failed'] += kind == 'error'
+            self._counters['cancelled'] += kind == 'cancelled'
+            self._counters['busy_seconds'] += time.perf_counter() - start_time
+
+    def run(self):
+        """Serve jobs until stop() (or SIGTERM via main())"""
+        self.broker.register(self.worker_id, pickle.dumps(backend_info(self.ai)))
+        self.heartbeat()
+        threading.Thread(target=self._heartbeat_loop, name="worker-heartbeat", daemon=True).start()
+        print(f"👷 Worker {self.worker_id} serving {', '.join(self.queues)} on {self.broker.describe()}")
+        try:
+            while not self._stop.is_set():
+                try:
+                    job = self.broker.claim(self.queues, self.worker_id, self.lease_seconds)
+                except Exception as e:
+                    log_event(logger, "job.claim_failed", logging.WARNING, error=str(e))
+                    job = None
+                if job is None:
+                    self._stop.wait(self.poll_seconds)
+                    continue
+                job_id, _, payload, attempt = job
+                self.process(job_id, payload, attempt)
+        finally:
+            self.broker.unregister(self.worker_id)
+            print(f"👋 Worker {self.worker_id} stopped")
+
+    def stop(self):
+        """Finish the running job, then exit run()"""
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference worker: runs queued model jobs for the API nodes")
+    parser.add_argument("--broker", default=os.environ.get(
+        "BROKER_URL", "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "work_queue.db")
+    ))
+    parser.add_argument("--queues", default=os.environ.get("WORKER_QUEUES", ",".join(QUEUES)),
+                        help="Comma-separated, in priority order: text, visual")
+    parser.add_argument("--backend", choices=("models", "fake"),
+                        default="fake" if os.environ.get("AI_BACKEND") == "fake" else "models")
+    parser.add_argument("--threads", type=int, default=len(available_cores()), help="torch/OpenMP threads")
+    parser.add_argument("--lease-seconds", type=float, default=float(os.environ.get("WORKER_LEASE_SECONDS", 30)))
+    parser.add_argument("--heartbeat-seconds", type=float, default=float(os.environ.get("WORKER_HEARTBEAT_SECONDS", 5)))
+    args = parser.parse_args()
+
+    log_pipeline = setup_logging(
+        level=os.environ.get("LOG_LEVEL", "INFO"),
+        fmt=os.environ.get("LOG_FORMAT", "json"),
+        sample_rates=parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", "query.processed=0.1,visual.rendered=0.1")),
+        flush_interval=float(os.environ.get("LOG_FLUSH_INTERVAL_MS", 50)) / 1000
+    )
+    ai = load_backend(args.backend, args.threads, {})
+    if not getattr(ai, 'models_ready', False):
+        raise SystemExit("❌ Models failed to load")
+
+    worker = InferenceWorker(
+        open_broker(args.broker), ai, [queue.strip() for queue in args.queues.split(",") if queue.strip()],
+        lease_seconds=args.lease_seconds, heartbeat_seconds=args.heartbeat_seconds
+    )
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    try:
+        worker.run()
+    finally:
+        log_pipeline.close()
+
+
+if __name__ == "__main__":
+    main()